@@ -134,7 +134,14 @@ if __name__ == '__main__':
         nccl_algo = args.nccl_algo,
         update_barrier = args.update_barrier,
         profile_start_step = args.profile_start_step,
-        profile_duration = args.profile_duration
+        profile_duration = args.profile_duration,
+        export_trace_json = args.export_trace_json,
+        export_graph_gml = args.export_graph_gml,
+        steps = args.steps,
+        time_window = args.time_window,
+        rank_cache = not args.disable_rank_cache,
+        dag_workers = args.dag_workers,
+        dag_worker_mem_limit = args.dag_worker_mem_limit
     )
     iter_time = clct.init(args.force)
 
@@ -161,7 +168,11 @@ if __name__ == '__main__':
                 comm_backend=clct.comm_backend,
                 byteps_graph=clct.byteps_graph,
                 show_queue=args.show_queue,
-                infi_para_update=args.update_infi_para)
+                infi_para_update=args.update_infi_para,
+                stream_traces=True,
+                trace_format=args.trace_format,
+                rank_symmetry=args.rank_symmetry,
+                symmetry_rtol=args.symmetry_rtol)
         
         def replay_with_delay(idx_, rst, node_name=None):
             logger.info(node_name)
@@ -175,9 +186,18 @@ if __name__ == '__main__':
         if args.sub_option is None:
             ''' Directly replay '''
             SingleLogger().info(bcolors.CGREEN + "="*10 + " Replayer " + "="*10 + bcolors.ENDC)
-            replayer.replay(verbose=True)
-            cal_edge_cost(replayer.exct_dag)
-            critical_path = dag_longest_path(replayer.exct_dag, clct.pm, weight="cost", default_weight=0, _debug_level=1)
+            if args.steady_state:
+                replayer.replay_steady(max_step_num=args.steady_max_step_num, tol=args.steady_tol, _output=True, verbose=True)
+            else:
+                replayer.replay(verbose=True)
+            critical_path = replayer.exct_record.critical_path(clct.pm, _debug_level=1)
+            if args.rank_symmetry:
+                report = replayer.symmetry_error()
+                SingleLogger().info("Rank symmetry: {} ranks in {} classes, iteration time {:.3f} ms vs {:.3f} ms "
+                    "of the full replay, error {:.2%} (max rank error {:.2%}), replay time {:.3f} s vs {:.3f} s".format(
+                    report["rank_num"], report["class_num"], report["reduced"]["iter_time"], report["full"]["iter_time"],
+                    report["iter_time_error"], report["max_rank_error"],
+                    report["reduced"]["wall_time"], report["full"]["wall_time"]))
             # replayer.dump_critical_path("critical_path.json", [n for (n, e) in critical_path])
             # nx.write_gml(replayer.exct_dag, 'exct.gml')
             SingleLogger().info(bcolors.CGREEN + "="*10 + " Daydream " + "="*10 + bcolors.ENDC)
@@ -211,24 +231,28 @@ if __name__ == '__main__':
             ''' Replay and add delays to some of the node on the critical path respectively.'''
             ### Get the execution graph first
             replayer.replay()
-            cal_edge_cost(replayer.exct_dag)
-            
-            critical_path = dag_longest_path(replayer.exct_dag, clct.pm, weight="cost", default_weight=0, _debug_level=2)
+            critical_path = replayer.exct_record.critical_path(clct.pm, _debug_level=2)
             critical_path = sorted(critical_path, key=lambda x: x[1], reverse=True)
             total_len = len(critical_path)
-            pgsbar = tqdm(total=total_len)
             idx = 0
             max_diff = 0
             bottleneckt_ = None
 
+            candidates = []
             while idx < total_len:
                 nodename, node_len = critical_path[idx]
                 if node_len == 0:
                     idx += 1
                     continue
-                ### TODO (huhanpeng): change the value 10
-                delay_dict = {nodename: {"delay": -5, "ratio": 1}}
-                step_end_time_ms = [t / 1000 for t in replayer.replayAndDelay(delay_dict, _ouput=False).values()]
+                candidates.append(nodename)
+                ### TODO (huhanpeng): how to pick these nodes
+                idx += 10
+
+            ### TODO (huhanpeng): change the value 10
+            delay_dicts = [{nodename: {"delay": -5, "ratio": 1}} for nodename in candidates]
+            batch_rst = replayer.replay_batch(delay_dicts, workers=args.replay_workers)
+            for nodename, (step_end_time, _) in zip(candidates, batch_rst):
+                step_end_time_ms = [t / 1000 for t in step_end_time.values()]
                 cur_iter_time_ = sum(step_end_time_ms)/len(step_end_time_ms)
                 diff_ = cur_iter_time_ - iter_time if cur_iter_time_ > iter_time else iter_time - cur_iter_time_
                 logger.info("Delay %s ==> %f ms" % (nodename, cur_iter_time_))
@@ -236,11 +260,7 @@ if __name__ == '__main__':
                 if diff_ > max_diff:
                     max_diff = diff_
                     bottleneckt_ = nodename
-                pgsbar.update(idx)
-                ### TODO (huhanpeng): how to pick these nodes
-                idx += 10
             logger.info("bottleneckt: %s" % bottleneckt_)
-            pgsbar.close()
         elif args.sub_option == "compare":
             rst = []
             idx = 0
@@ -485,7 +505,14 @@ if __name__ == '__main__':
                 nccl_algo = args.nccl_algo,
                 update_barrier = args.update_barrier,
                 profile_start_step = args.profile_start_step,
-                profile_duration = args.profile_duration
+                profile_duration = args.profile_duration,
+                export_trace_json = args.export_trace_json,
+                export_graph_gml = args.export_graph_gml,
+                steps = args.steps,
+                time_window = args.time_window,
+                rank_cache = not args.disable_rank_cache,
+                dag_workers = args.dag_workers,
+                dag_worker_mem_limit = args.dag_worker_mem_limit
             )
             clct.init(args.force)
             for trace in clct.traceM.traces:
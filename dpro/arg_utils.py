@@ -27,6 +27,13 @@ group_clct.add_argument("--nccl_algo", type=str, default=None, help="NCCL algori
 group_clct.add_argument("--trace_level", type=str, choices=["debug", "info"], default="info", help="if set to debug, show some trival traces")
 group_clct.add_argument("--disable_revise", action="store_true", help="By default, revise traces according to SEND-RECV dependency, set to disable this argument to disable")
 group_clct.add_argument("--force", action="store_true", help="Force to re-generate traces, graphs")
+group_clct.add_argument("--export_trace_json", action="store_true", help="Besides the columnar trace store, export the collected traces to bps_trace_final.json")
+group_clct.add_argument("--export_graph_gml", action="store_true", help="Besides the binary graph store, export trail_dag and local_dfg to GML files")
+group_clct.add_argument("--steps", type=str, default=None, help="Only collect steps [a, b) of each rank, in the form of a:b, steps are counted from the first profiled step")
+group_clct.add_argument("--time_window", type=str, default=None, help="Only collect events starting in [a, b) ms after the first computation event of the trial (after clock alignment), in the form of a:b")
+group_clct.add_argument("--disable_rank_cache", action="store_true", help="Disable the per-rank cache of traces and DAGs. By default, only ranks whose source files changed are re-collected")
+group_clct.add_argument("--dag_workers", type=int, default=None, help="Number of processes used to build the local DAG of each rank, default: the number of CPUs")
+group_clct.add_argument("--dag_worker_mem_limit", type=float, default=None, help="Memory limit (in GB) of each process building local DAGs. A rank whose DAG exceeds the limit is rebuilt in the main process")
 group_clct.add_argument("--update_infi_para", action="store_true", help="Tensorflow timeline display UPDATE traces in parallel, set `update_infi_para` to True to keep all UPDATE traces")
 
 ### Used for BytePS traces collection
@@ -49,9 +56,19 @@ group_replay = parser.add_argument_group('Replayer')
 group_replay.add_argument("--update_barrier", action="store_true", default=False, help="If true, add a barrier before all UPDATE ops.")
 group_replay.add_argument("--update_clip_overlapping", action="store_true", help="If true, clip overlapping UPDATE nodes in the timeline.")
 group_replay.add_argument("--step_num", type=int, default="1", help="Default step numbers to replay.")
+group_replay.add_argument("--steady_state", action="store_true", help="If this arg is set, pipeline consecutive steps until the iteration time"
+	" and per-device offsets converge, instead of replaying `--step_num` steps")
+group_replay.add_argument("--steady_tol", type=float, default=0.01, help="Relative tolerance used to detect the steady state")
+group_replay.add_argument("--steady_max_step_num", type=int, default=20, help="Maximum number of steps to replay to reach the steady state")
 group_replay.add_argument("--delay_ratio", type=float, default=1.1, help="delay ratio")
 group_replay.add_argument("--full_trace", action="store_true", help="If this arg is set, simulate traces with detailed dependency info.")
 group_replay.add_argument("--show_queue", action="store_true", help="If this arg is set, record the queue status of each device during replaying.")
+group_replay.add_argument("--trace_format", type=str, default="json", choices=["json", "json.gz", "columnar"], help="Format of replayed traces,"
+	" columnar traces are saved as a directory of .npy columns in the layout of the trace store, see dpro/trace_writer.py")
+group_replay.add_argument("--rank_symmetry", action="store_true", help="If this arg is set, only simulate computation of one representative"
+	" of each class of equivalent ranks, detected from trace statistics, and report the error against a full replay")
+group_replay.add_argument("--symmetry_rtol", type=float, default=0.05, help="Relative tolerance of durations and gaps of equivalent ranks")
+group_replay.add_argument("--replay_workers", type=int, default=1, help="Number of processes used to replay multiple delay scenarios, 0 means the number of CPUs")
 
 ### Optimize
 group_opt = parser.add_argument_group('Optimal Strategies Search')
@@ -59,15 +76,31 @@ group_opt.add_argument("--optimizer", type=str, default="MCMC", choices=["MCTS",
 group_opt.add_argument("--ucb_type", type=str, default="AVG", choices=["MAX", "AVG"], help="The type of quanlity value used in the UCB euqation")
 group_opt.add_argument("--no_mutation", action="store_true", help="If this arg is set, the default policy of MCTS will not rollout")
 group_opt.add_argument("--ucb_gamma", type=float, default=0.1, help="Hyper Parameter used in UCB to control the exploration rate.")
-group_opt.add_argument("--ucb_visual", action="store_true", help="If this arg is set, visualize the MCTS search process")
+group_opt.add_argument("--ucb_visual", action="store_true", help="If this arg is set, visualize the MCTS search tree in mcts_tree.txt"
+	" of the workspace, which is rewritten once a rollout finishes")
+group_opt.add_argument("--mcts_workers", type=int, default=1, help="Number of rollouts MCTS runs in parallel, 0 means the number of CPUs")
+group_opt.add_argument("--virtual_loss", type=float, default=1, help="Loss added to the quality of a state in UCB for each rollout in flight passing it")
+group_opt.add_argument("--mcts_time_budget", type=float, default=None, help="Wall-clock budget (in seconds) of MCTS, no new rollout starts after it")
 group_opt.add_argument("--no_crit", action="store_true", help="If this arg is set, relax the critical path constaint")
 
 group_opt.add_argument("--mcmc_beta", type=float, default=10, help="Hyper Parameter used in MCMC/SA to control the exploration rate")
 group_opt.add_argument("--step_size", type=int, default=1, help="Step size used in MCMC optimizer.")
+group_opt.add_argument("--mcmc_speculation", type=int, default=1, help="Number of strategies MCMC draws and evaluates in parallel"
+	" in each round, results are consumed in the order of the chain")
+group_opt.add_argument("--search_seed", type=int, default=None, help="Random seed of the search, a search is reproducible given the seed")
+group_opt.add_argument("--incremental_replay", action="store_true", help="If this arg is set, only re-simulate the part of the DAG changed since the last evaluation")
+group_opt.add_argument("--lean_replay", action="store_true", help="If this arg is set, do not generate traces or execution graphs when evaluating strategies")
+
+group_opt.add_argument("--eval_cache_size", type=int, default=0, help="Maximum number of evaluation results cached by the optimizer"
+	", keyed by the fingerprint of the evaluated graph. Fingerprinting costs a pass over the whole graph per evaluation"
+	", which only pays off when equivalent graphs are evaluated repeatedly, so the cache is disabled (0) by default")
+group_opt.add_argument("--eval_cache_persist", action="store_true", help="If this arg is set, persist the evaluation cache in the workspace of the optimizer")
 
 group_opt.add_argument("--heat_window_size", type=int, default=5, help="Window size for the heat based search heuristic.")
 group_opt.add_argument("--relabel", action="store_true", help="If this arg is set, relabel the dag with indexes.")
 group_opt.add_argument("--ckpt", action="store_true", help="If this arg is set, start search from checkpoint")
+group_opt.add_argument("--ckpt_snapshot_interval", type=int, default=50, help="Number of checkpoints journaled between two snapshots"
+	" of the whole search state, which are written in the background")
 group_opt.add_argument("--workspace", type=str, default=None, help="Workerspace of the optimizer")
 group_opt.add_argument("--memory_budget", type=float, default=16, help="GPU Memory budget")
 
@@ -22,6 +22,11 @@ class PS_COMP_OPS():
     SUM = "SUM"
     COPY_MERGED = "COPY_MERGED"
 
+### Default window of steps of BytePS comm traces, the step before the first profiled one
+#   and the number of profiled steps, shared with `Collector` to narrow the window
+DEFAULT_PROFILE_START_STEP = 9
+DEFAULT_PROFILE_DURATION = 10
+
 COMM_DEL = "::"
 PART_DEL = "~PART"
 
@@ -112,13 +117,13 @@ class bytepsGraph:
     """
     def __init__(self, profile_start_step, profile_duration):
         if profile_start_step is None:
-            self.PROFILE_ITER_START = 10
+            self.PROFILE_ITER_START = DEFAULT_PROFILE_START_STEP + 1
             SingleLogger().warn("[BYTEPS] profile_start_step UNSET. USING DEFAULT VALUE {}.".format(self.PROFILE_ITER_START))
         else:
             self.PROFILE_ITER_START = profile_start_step + 1
             SingleLogger().info("[BYTEPS] Using profile_start_step = {}.".format(self.PROFILE_ITER_START-1))
         if profile_duration is None:
-            self.PROFILE_ITER_DURATION = 10
+            self.PROFILE_ITER_DURATION = DEFAULT_PROFILE_DURATION
             SingleLogger().warn("[BYTEPS] profile_duration UNSET. USING DEFAULT VALUE {}.".format(self.PROFILE_ITER_DURATION))
         else:
             self.PROFILE_ITER_DURATION = profile_duration
@@ -988,6 +993,17 @@ class bytepsGraph:
                 return True
         return False
 
+    def ret_state_str(self):
+        ''' Return the string representation of the state per-worker DAGs are built from, i.e., the
+        comm graph and the mappings from tensors/partitions to groups and servers, used for fingerprinting '''
+        self._check_inited()
+        ### Partitions are kept in sets, sort them so that the string does not depend on hash seeds
+        str_ = str(sorted(self.graph.edges)) + "\n"
+        str_ += str(sorted([(tensor_name, sorted(parts)) for tensor_name, parts in self.partition_dict.items()])) + "\n"
+        str_ += str(sorted(self.tensor_part2server.items())) + "\n"
+        str_ += str(self.tensor_id2grp)
+        return str_
+
     def get_comm_graph(self):
         self._check_inited()
         return self.graph
@@ -11,12 +11,17 @@ from .dag_utils import *
 from .parameter import *
 
 from .bps_helper.preprocess import preprocess_comm_timestamp, parse_server_logs
+from .bps_helper.graph import bytepsGraph, DEFAULT_PROFILE_START_STEP, DEFAULT_PROFILE_DURATION
 from .base import bcolors
+from .rank_cache import RankCache, digest_of
+from .graph_store import graph_store_exists, dump_graph, read_graph
+from .event_list import EventList
 
 try:
     from hvd.graph import *
 except:
-    pass
+    ### Imported as the `dpro` package
+    from .hvd.graph import *
 try:
     from bps_helper.graph import *
 except:
@@ -74,6 +79,111 @@ class RunningSpan:
         self.end = 0
 
 
+def _parse_range(range_str, _type):
+    ''' Parse `a:b` to (a, b), either side can be omitted '''
+    if range_str is None:
+        return None
+    if ":" not in range_str:
+        raise ValueError("Invalid range {}, should be in the form of a:b".format(range_str))
+    start, end = range_str.split(":")
+    return (_type(start) if len(start) > 0 else None, _type(end) if len(end) > 0 else None)
+
+def _in_range(value, _range):
+    return (_range[0] is None or value >= _range[0]) and (_range[1] is None or value < _range[1])
+
+def _intersect_range(range1, range2):
+    start = range1[0] if range2[0] is None else (range2[0] if range1[0] is None else max(range1[0], range2[0]))
+    end = range1[1] if range2[1] is None else (range2[1] if range1[1] is None else min(range1[1], range2[1]))
+    return (start, end)
+
+### A range containing nothing
+EMPTY_RANGE = (0, 0)
+
+class RankWindow:
+    ''' The window of traces kept for one rank, in the clock of the rank, see `TraceWindow.resolve`
+    Parameters
+    ----------
+    ts_range: tuple
+        (start, end) in us, events starting in [start, end) are kept, either side can be None
+    step_range: tuple
+        (start, end) of step ids given by the profiler, events with steps are kept
+        only if their steps are in [start, end). None if steps are not given by the profiler
+    '''
+    def __init__(self, ts_range=(None, None), step_range=None):
+        self.ts_range = tuple(ts_range)
+        self.step_range = None if step_range is None else tuple(step_range)
+
+    def keep(self, ts, step=None):
+        if not _in_range(ts, self.ts_range):
+            return False
+        return step is None or self.step_range is None or _in_range(step, self.step_range)
+
+    def to_dict(self):
+        return {"ts_range": list(self.ts_range),
+            "step_range": None if self.step_range is None else list(self.step_range)}
+
+class TraceWindow:
+    ''' Selective collection of a window of traces.
+    Parameters
+    ----------
+    steps: str
+        `a:b`, collect the steps [a, b) of each rank, steps are 0-based and counted from
+        the first profiled step
+    time_window: str
+        `a:b` in ms, collect the events starting in [a, b) relative to the first
+        computation event of the trial, after clock alignment
+    '''
+    def __init__(self, steps=None, time_window=None):
+        self.steps = _parse_range(steps, int)
+        self.time_window = _parse_range(time_window, float)
+
+    def is_set(self):
+        return self.steps is not None or self.time_window is not None
+
+    def to_dict(self):
+        return {
+            "steps": None if self.steps is None else list(self.steps),
+            "time_window": None if self.time_window is None else list(self.time_window)}
+
+    def resolve(self, scans, biases):
+        ''' Return the `RankWindow` of each rank
+        Parameters
+        ----------
+        scans: list
+            The scan of each rank, see `Collector._scan_rank_window`
+        biases: list
+            The time (in us) added to the traces of each rank by the clock alignment
+        '''
+        windows = [RankWindow() for _ in scans]
+        if self.steps is not None:
+            for window, scan in zip(windows, scans):
+                window.ts_range, window.step_range = self._resolve_steps(scan["steps"])
+        if self.time_window is not None:
+            ### The origin is the first computation event of all ranks, after alignment
+            starts = [scan["comp_start"] + bias for scan, bias in zip(scans, biases) if scan["comp_start"] is not None]
+            origin = min(starts) if len(starts) > 0 else 0
+            for window, bias in zip(windows, biases):
+                window.ts_range = _intersect_range(window.ts_range, tuple(
+                    None if bound is None else origin + bound * 1000.0 - bias for bound in self.time_window))
+        return windows
+
+    def _resolve_steps(self, steps):
+        ''' Return the ts range and the step range of the steps [a, b) of one rank,
+        steps are a list of (step id, start, end) sorted by steps, the step id is None
+        if steps are not given by the profiler '''
+        start, end = self.steps
+        selected = steps[start:end]
+        if len(selected) == 0:
+            return EMPTY_RANGE, None
+        if selected[0][0] is None:
+            ### A step covers the events until the start of the next step
+            return (selected[0][1] if start is not None and start > 0 else None,
+                steps[end][1] if end is not None and end < len(steps) else None), None
+        ### Events without steps are kept if they fall in the time span of the selected steps
+        ts_range = (min(_step[1] for _step in selected), max(_step[2] for _step in selected))
+        step_range = (selected[0][0], steps[end][0] if end is not None and end < len(steps) else None)
+        return ts_range, step_range
+
 class Collector(object):
     #! class used to walk through the trace directory and collect info
     def __init__(self, root_path, 
@@ -89,7 +199,14 @@ class Collector(object):
             nccl_algo = None,
             update_barrier = False,
             profile_start_step = None,
-            profile_duration = None
+            profile_duration = None,
+            export_trace_json = False,
+            export_graph_gml = False,
+            steps = None,
+            time_window = None,
+            rank_cache = True,
+            dag_workers = None,
+            dag_worker_mem_limit = None
         ):
         self.pm = PathManager(root_path)
         self.traceM = None
@@ -100,12 +217,30 @@ class Collector(object):
             raise RuntimeError("Unsupported communication backend {}. Must use NCCL or BytePS.".format(self.comm_backend))
         if self.platform not in ["MXNET", "TENSORFLOW"]:
             raise RuntimeError("Unsupported platform {}. Must be one of MXNET or TENSORFLOW.".format(self.platform))
+        ### Only collect a window of steps/time of each rank
+        self.trace_window = TraceWindow(steps, time_window)
         self.nccl_graph = None
         self.byteps_graph = None
         if self.comm_backend == "NCCL":
             self.nccl_graph = ncclGraph()
         elif self.comm_backend == "BYTEPS":
             # BYTEPS
+            if self.trace_window.steps is not None:
+                ### BytePS comm traces are truncated by steps, narrow it to the window
+                first_step = self.trace_window.steps[0] or 0
+                if profile_start_step is None:
+                    profile_start_step = DEFAULT_PROFILE_START_STEP
+                if profile_duration is None:
+                    profile_duration = DEFAULT_PROFILE_DURATION
+                if self.trace_window.steps[1] is not None:
+                    profile_duration = self.trace_window.steps[1] - first_step
+                else:
+                    ### Open-ended windows end with the profiled steps
+                    if profile_duration <= first_step:
+                        raise RuntimeError("Step window {} is out of the {} profiled steps of BytePS".format(
+                            self.trace_window.steps, profile_duration))
+                    profile_duration -= first_step
+                profile_start_step += first_step
             self.byteps_graph = bytepsGraph(profile_start_step, profile_duration)
 
         self.time_dict = None
@@ -128,9 +263,22 @@ class Collector(object):
 
         self.nccl_algo = nccl_algo
         self.update_barrier = update_barrier
+        self.export_trace_json = export_trace_json
+        self.export_graph_gml = export_graph_gml
+        ### Cache parsed traces and local DAG edges of each rank
+        self.rank_cache = RankCache(self.pm.path) if rank_cache else None
+        self._rank_cache_extra_files = None
+        ### Number of processes used to build local DAGs, default: number of CPUs
+        self.dag_workers = dag_workers
+        ### Memory limit of each DAG worker in GB
+        self.dag_worker_mem_limit = dag_worker_mem_limit
+        ### The window of the rank being collected, and rank_id --> `RankWindow` of all ranks
+        self.rank_window = None
+        self._rank_window_dict = None
+        self._rank_window_scans = None
 
     def _collect_rank_traces(self, *args):
-        tmp_pm, pid, host_id = args[0]
+        tmp_pm, pid, host_id, self.rank_window = args[0]
         SingleLogger().info("Collect traces for {} ...".format(tmp_pm.path))
         self.rst_traces = []
         self.raw_name2IDnum = {}
@@ -144,8 +292,60 @@ class Collector(object):
         if self.comm_backend != "NONE":
             add_trace_safe(self._collect_rank_comm_detail(tmp_pm, pid, host_id))
             add_trace_safe(self._collect_rank_comm(tmp_pm, pid, host_id))
-        return self.rst_traces, self.ref_name, self.ref_time, self.raw_name2IDnum
+        ### Events are sent back to the main process and cached in the compact format
+        return EventList.from_dicts(self.rst_traces), self.ref_name, self.ref_time, self.raw_name2IDnum
     
+    def _scan_rank_window(self, *args):
+        ''' Scan the computation traces of a rank without keeping events, return
+        the start time of the computation traces, the (step id, start, end) of each step
+        and the reference time used to align clocks, see `TraceWindow.resolve`
+        '''
+        tmp_pm, pid, host_id = args[0]
+        SingleLogger().info("Scan traces for {} ...".format(tmp_pm.path))
+        comp_path = tmp_pm.search_comp()
+        scan = {"comp_start": None, "steps": [], "ref_time": None}
+        if comp_path is None:
+            return scan
+        comp_end = None
+        if self.platform == "TENSORFLOW":
+            step2span = {}
+            for trace in self._iter_rank_comp_tf(comp_path, pid):
+                if trace["cat"] != "operator":
+                    continue
+                scan["comp_start"] = trace["ts"] if scan["comp_start"] is None else min(scan["comp_start"], trace["ts"])
+                comp_end = trace["ts"] + trace["dur"] if comp_end is None else max(comp_end, trace["ts"] + trace["dur"])
+                if "step" in trace["args"]:
+                    span = step2span.setdefault(trace["args"]["step"], [trace["ts"], trace["ts"] + trace["dur"]])
+                    span[0], span[1] = min(span[0], trace["ts"]), max(span[1], trace["ts"] + trace["dur"])
+            scan["steps"] = [[step, span[0], span[1]] for step, span in sorted(step2span.items())]
+        else:
+            ### MXNet traces have no steps, a new step starts with the first FW op after BW ops
+            op_traces = []
+            for trace in self._iter_rank_comp_mx(comp_path):
+                comp_end = trace["ts"] + trace["dur"] if comp_end is None else max(comp_end, trace["ts"] + trace["dur"])
+                name = self.para_dict.standard_name(trace["name"])
+                if name in self.dag.nodes:
+                    op_traces.append((trace["ts"], "FW" in name, "BW" in name))
+            op_traces.sort()
+            in_bw = False
+            for ts, is_fw, is_bw in op_traces:
+                if len(scan["steps"]) == 0 or (is_fw and in_bw):
+                    scan["steps"].append([None, ts, ts])
+                    in_bw = False
+                elif is_bw:
+                    in_bw = True
+            scan["comp_start"] = op_traces[0][0] if len(op_traces) > 0 else None
+        if self.comm_backend == "NCCL" and scan["comp_start"] is not None:
+            ### The reference time is taken in the running span of the whole rank
+            wk_prefix, _ = PathManager("/".join(comp_path.split('/')[:-1])).ret_prefix()
+            self.run_span[wk_prefix] = RunningSpan()
+            self.run_span[wk_prefix].init_start(scan["comp_start"])
+            self.run_span[wk_prefix].init_end(comp_end)
+            self.ref_name = self.ref_time = None
+            self._collect_rank_comm(tmp_pm, pid, host_id, ref_only=True)
+            scan["ref_time"] = self.ref_time
+        return scan
+
     def _collect_rank_comp(self, *args, **kwargs):
         if self.platform == "MXNET":
             return self._collect_rank_comp_mx(*args, **kwargs)
@@ -154,41 +354,11 @@ class Collector(object):
         else:
             raise NotImplementedError("Unsupported platform {}.".format(self.platform))
         
-    def _collect_rank_comp_tf(self, tmp_pm=None, pid=None, host_id=None):
-        '''Collect Computation Traces
-
-        Parameters
-        ----------
-        _path : dict
-            if _path is not given, use the `pm` of the object
-            or, if _path is given, it should be the computation_path.
-
-        Returns
-        ----------
-        rst_traces : dict
-            A dict containing MXNet trace results combined with dependency info.
+    def _iter_rank_comp_tf(self, comp_path, pid=None):
+        ''' Decompress and parse the computation traces of TensorFlow in a streaming manner,
+        yield the events of operators in the dag, and other events if `trace_level` is debug.
+        Steps given by the profiler are kept in `args.step`
         '''
-        # debug_utils.DebugRecorder().debug_event_start()
-        comp_path = tmp_pm.search(FileName.COMP)
-        if comp_path is None:
-            return
-        if comp_path.endswith(".gz"):
-            os.system("gzip -fdk {}".format(comp_path))
-            json_path = comp_path.replace(".gz", "")
-            with open(json_path, 'r') as fp:
-                raw_traces = json.load(fp)["traceEvents"]
-            os.system("rm {}".format(json_path))
-        else:
-            with open(comp_path, 'r') as fp:
-                raw_traces = json.load(fp)["traceEvents"]
-
-        ### Consider mulptiprocessing, each GPU will read its own dag
-        dag_node_names_std = list(self.dag.nodes)
-
-        wk_prefix, _ = PathManager("/".join(comp_path.split('/')[:-1])).ret_prefix()
-        if wk_prefix not in self.run_span:
-            self.run_span[wk_prefix] = RunningSpan()
-
         ### collect traces of FW + BP OPs and UPDATE OPs
         tid_hub = []
         def _ret_operator_tid(tid_):
@@ -198,9 +368,8 @@ class Collector(object):
                 tid_hub.append(tid_)
                 return "operator%d"%(len(tid_hub) - 1)
 
-        rst_traces = []
         pid_dict = {}
-        for trace in raw_traces:
+        for trace in iter_trace_events(comp_path):
             if "ph" not in trace:
                 continue
             if trace["ph"] == "M":
@@ -228,13 +397,13 @@ class Collector(object):
                         
                         ### Only collect nodes in the dag
                         ### TODO (huhanpeng): some trvial nodes may also be useful
-                        if name not in dag_node_names_std or "Comm" in name:
+                        if name not in self.dag.nodes or "Comm" in name:
                             if self.trace_level == "debug":
                                 trace["name"] = "%s" % (trace["name"])
                                 trace["tid"] = trace["cat"] = "debug"
                                 if pid is not None:
                                     trace["pid"] = pid
-                                rst_traces.append(trace)
+                                yield trace
                             continue
                         
                         ### Record dependency info to traces
@@ -251,7 +420,7 @@ class Collector(object):
                         for i, _n in enumerate(innodes):
                             _args["input%d"%i] = _n
 
-                        rst_traces.append({
+                        yield {
                             "name": name,
                             "ph": "X",
                             "ts": trace["ts"],
@@ -260,12 +429,40 @@ class Collector(object):
                             "tid": _ret_operator_tid(tid_name),
                             "cat": "operator",
                             "args": _args
-                        })
+                        }
 
-                        self.run_span[wk_prefix].init_start(trace["ts"])
-                        self.run_span[wk_prefix].init_end(trace["ts"] + trace["dur"])
+    def _collect_rank_comp_tf(self, tmp_pm=None, pid=None, host_id=None):
+        '''Collect Computation Traces
 
+        Parameters
+        ----------
+        _path : dict
+            if _path is not given, use the `pm` of the object
+            or, if _path is given, it should be the computation_path.
+
+        Returns
+        ----------
+        rst_traces : dict
+            A dict containing MXNet trace results combined with dependency info.
+        '''
+        # debug_utils.DebugRecorder().debug_event_start()
+        comp_path = tmp_pm.search_comp()
+        if comp_path is None:
+            return
+
+        wk_prefix, _ = PathManager("/".join(comp_path.split('/')[:-1])).ret_prefix()
+        if wk_prefix not in self.run_span:
+            self.run_span[wk_prefix] = RunningSpan()
+
+        ### Events are parsed in a streaming manner, only those in the window are kept
+        rank_window = self.rank_window
+        rst_traces = [trace for trace in self._iter_rank_comp_tf(comp_path, pid)
+            if rank_window is None or rank_window.keep(trace["ts"], trace.get("args", {}).get("step"))]
         rst_traces = sorted(rst_traces, key=lambda x: x["ts"], reverse=False)
+        for trace in rst_traces:
+            if trace["cat"] == "operator":
+                self.run_span[wk_prefix].init_start(trace["ts"])
+                self.run_span[wk_prefix].init_end(trace["ts"] + trace["dur"])
         
         if self.update_clip_overlapping:
             # trim the overlapping parts of update nodes
@@ -289,6 +486,30 @@ class Collector(object):
         SingleLogger().debug("Comp traces length: {}".format(len(rst_traces)))
         return rst_traces
 
+    def _iter_rank_comp_mx(self, comp_path):
+        ''' Decompress and parse the computation traces of MXNet in a streaming manner,
+        yield `X` events in the order of the file, `B`/`E` pairs are converted to `X` events
+        '''
+        ### TODO(huhanpeng): delete this, since it is only for Tensorflow ???
+        begin_trace = None
+        for trace in iter_trace_events(comp_path):
+            if begin_trace is not None:
+                ### `trace` is the end of `begin_trace`
+                assert begin_trace["name"] == trace["name"]
+                begin_trace["dur"] = trace['ts'] - begin_trace['ts']
+                begin_trace["ph"] = "X"
+                yield begin_trace
+                begin_trace = None
+                continue
+            if "ts" not in trace:
+                continue
+            if trace["cat"] == "Op":
+                trace["cat"] = "operator"
+            if trace["ph"] == 'B' or trace["ph"] == 'b':
+                begin_trace = trace
+            elif trace["ph"] == "X":
+                yield trace
+
     def _collect_rank_comp_mx(self, tmp_pm=None, pid=None, host_id=None):
         '''Collect Computation Traces
 
@@ -304,13 +525,11 @@ class Collector(object):
             A dict containing MXNet trace results combined with dependency info.
         '''
         # debug_utils.DebugRecorder().debug_event_start()
-        comp_path = tmp_pm.search(FileName.COMP)
+        comp_path = tmp_pm.search_comp()
         if comp_path is None:
             return
-        with open(comp_path, 'r') as fp:
-            raw_traces = json.load(fp)["traceEvents"]
 
-        dag_node_names_std = list(self.dag.nodes)
+        dag_node_names_std = self.dag.nodes
 
         wk_prefix, _ = PathManager("/".join(comp_path.split('/')[:-1])).ret_prefix()
         if wk_prefix not in self.run_span:
@@ -330,29 +549,10 @@ class Collector(object):
                 tid_hub.append(tid_)
                 return "operator%d"%(len(tid_hub) - 1)
 
-        ### convert the ph from B/E to X
-        ### TODO(huhanpeng): delete this, since it is only for Tensorflow ???
-        index = 0
-        traces = []
-        while index < len(raw_traces["traceEvents"]):
-            if "ts" not in raw_traces["traceEvents"][index]:
-                index += 1
-                continue
-            trace = raw_traces["traceEvents"][index]
-            if trace["cat"] == "Op":
-                trace["cat"] = "operator"
-            if trace["ph"] == 'B' or trace["ph"] == 'b':
-                next_trace = raw_traces["traceEvents"][index+1]
-                assert trace["name"] == next_trace["name"]
-                trace["dur"] = next_trace['ts'] - trace['ts']
-                trace["ph"] = "X"
-                traces.append(trace)
-                index += 2
-            elif trace["ph"] == "X":
-                traces.append(trace)
-                index += 1
-            else:
-                index += 1  
+        ### Events are parsed in a streaming manner, only those in the window are kept
+        rank_window = self.rank_window
+        traces = [trace for trace in self._iter_rank_comp_mx(comp_path)
+            if rank_window is None or rank_window.keep(trace["ts"])]
 
         ### At this point, traces are unsorted
         # debug_utils.DebugRecorder().debug_event_start()
@@ -389,6 +589,7 @@ class Collector(object):
                     return last_fw, first_bw, last_bw
         # debug_utils.DebugRecorder().debug_event_start()          
         last_fw, first_bw, last_bw = real_last_bw_name()
+
         # debug_utils.DebugRecorder().debug_event_end("collect_" + pid+"_comp.real_last_bw_name", "Collct", "0")
 
         def is_update_op(_trace):
@@ -572,25 +773,17 @@ class Collector(object):
 
         wk_prefix, _ = PathManager("/".join(io_path.split('/')[:-1])).ret_prefix()
 
+        ### Events are parsed in a streaming manner, only those in the running span are kept
         rst_traces = []
-        with open(io_path, 'r') as f:
-            io_traces = json.load(f)
-
-        if isinstance(io_traces, dict):
-            io_traces = io_traces["traceEvents"]
-
-        io_traces = sorted(io_traces, key=lambda x: x["ts"], reverse=False)
-        for trace in io_traces:
-            if "ts" in trace and not self.run_span[wk_prefix].if_start(trace["ts"]):
+        for trace in iter_trace_events(io_path):
+            if not self.run_span[wk_prefix].if_start(trace["ts"]) or self.run_span[wk_prefix].if_end(trace["ts"]):
                 continue
-            elif "ts" in trace and self.run_span[wk_prefix].if_end(trace["ts"]):
-                break
-            else:
-                if pid is not None:
-                    trace["pid"] = pid
-                if "tid" not in trace:
-                    trace["tid"] = "I/O"
-                rst_traces.append(trace)
+            if pid is not None:
+                trace["pid"] = pid
+            if "tid" not in trace:
+                trace["tid"] = "I/O"
+            rst_traces.append(trace)
+        rst_traces = sorted(rst_traces, key=lambda x: x["ts"], reverse=False)
 
         # debug_utils.DebugRecorder().debug_event_end("collect_" + pid+"_io", "Collct", "0")
         return rst_traces
@@ -606,74 +799,18 @@ class Collector(object):
 
         wk_prefix, _ = PathManager("/".join(comm_d_path.split('/')[:-1])).ret_prefix()
         rst_traces = []
-        # debug_utils.DebugRecorder().debug_event_start()
-        try:
-            with open(comm_d_path, 'r') as f:
-                traces = json.load(f)
-        except ValueError:
+        if os.path.getsize(comm_d_path) == 0:
             ### in case some comm_detail trace files are empty
             return
-        # debug_utils.DebugRecorder().debug_event_end("collect_" + pid+"_comm_detail.jsonload", "Collct", "0")
-
-        if isinstance(traces, dict): 
+        try:
+            ### Events are parsed in a streaming manner, only those in the running span are kept
+            for trace in iter_trace_events(comm_d_path):
+                self._add_comm_detail_trace(rst_traces, trace, wk_prefix, pid)
+        except ValueError as e:
             ### there may be no NCCL traces for intro-machien GPUs
-            traces = traces.get("traceEvents", [])
-
-        traces = sorted(traces, key=lambda x: x["ts"], reverse=False)
-        for trace in traces:
-            ### ignore digit
-            if "<<" in trace["name"] and ">>" in trace["name"]:
-                tmp = trace["name"].split("<<")
-                trace["name"] = tmp[0] + tmp[1].split(">>")[1]
-                trace["args"]["name"] = trace["name"]
-            
-            if re.match("[^.]+\.[0-9+]+\.(SEND|RECV)", trace["name"]) is None:
-                continue
-
-            ### Only check the time range for the first communication operator, 
-            ### then the following communication traces should be added to the final traces
-            if "ts" in trace and not self.run_span[wk_prefix].if_start(trace["ts"]):
-                continue
-            elif "ts" in trace and self.run_span[wk_prefix].if_end(trace["ts"]):
-                break
-
-            if trace["ph"].lower() == "i":
-                continue
-
-            ### If this is a communication event and fuse multiple tensors, **sort** these tensor
-            _, op_name, sub_op = trace["name"].split(".")
-            tensor_list = re.findall("[0-9]+", op_name)
-            tensor_list = sorted([int(e) for e in tensor_list])
-            trace["name"] = "{}.{}.{}".format("Comm", "+".join([str(e) for e in tensor_list]), sub_op)
-            trace["args"]["name"] = gen_long_name(None, trace["name"], suffix=("%d_%d_%d_%d"%(
-                                    int(trace["args"]["loopId"]),
-                                    int(trace["args"]["channelId"]),
-                                    int(trace["args"]["chunkId"]), 
-                                    int(trace["args"]["sliceId"]))))
-            if self.trace_level == "debug":
-                for _id, tensor_id in enumerate(tensor_list):
-                    trace["args"]["tensor%d"%_id] = self.para_dict.tensor_id_to_tensor_name(tensor_id)
-
-            if pid is not None:
-                trace["tid"] = trace["pid"]
-                trace["pid"] = pid
-
-            ### parse the trace to get the maximum number of chunks, slices, channels, loops for each raw_name
-            ### Get the rawname withoud RECV/SEND
-            if ".RECV" in trace["name"]:
-                raw_name = trace["name"].split(".RECV")[0]
-            elif ".SEND" in trace["name"]:
-                raw_name = trace["name"].split(".SEND")[0]
-            else:
-                raw_name = trace["name"]
-            if raw_name not in self.raw_name2IDnum:
-                    self.raw_name2IDnum[raw_name] = {"chunkNum": 0, "sliceNum": 0, "channelNum": 0, "loopNum": 0}
-            self.raw_name2IDnum[raw_name]["chunkNum"] = max(int(trace["args"]["chunkId"]) + 1, self.raw_name2IDnum[raw_name]["chunkNum"])
-            self.raw_name2IDnum[raw_name]["sliceNum"] = max(int(trace["args"]["sliceId"]) + 1, self.raw_name2IDnum[raw_name]["sliceNum"])
-            self.raw_name2IDnum[raw_name]["channelNum"] = max(int(trace["args"]["channelId"]) + 1, self.raw_name2IDnum[raw_name]["channelNum"])
-            self.raw_name2IDnum[raw_name]["loopNum"] = max(int(trace["args"]["loopId"]) + 1, self.raw_name2IDnum[raw_name]["loopNum"])
-
-            rst_traces.append(trace)
+            SingleLogger().warn("Fail to parse {}: {}".format(comm_d_path, e))
+            return
+        rst_traces = sorted(rst_traces, key=lambda x: x["ts"], reverse=False)
 
         # self.tensor2group = np.array(self.tensor2group)
         # print(self.tensor2group)
@@ -685,7 +822,62 @@ class Collector(object):
         # debug_utils.DebugRecorder().debug_event_end("collect_" + pid+"_comm_detail", "Collct", "0")
         return rst_traces
 
-    def _collect_rank_comm(self, tmp_pm=None, pid=None, host_id=None):
+    def _add_comm_detail_trace(self, rst_traces, trace, wk_prefix, pid=None):
+        ''' Normalize a NCCL comm_detail event and append it to `rst_traces`
+        if it is in the running span of the rank '''
+        ### ignore digit
+        if "<<" in trace["name"] and ">>" in trace["name"]:
+            tmp = trace["name"].split("<<")
+            trace["name"] = tmp[0] + tmp[1].split(">>")[1]
+            trace["args"]["name"] = trace["name"]
+        
+        if re.match("[^.]+\.[0-9+]+\.(SEND|RECV)", trace["name"]) is None:
+            return
+
+        if "ts" in trace and (not self.run_span[wk_prefix].if_start(trace["ts"]) or self.run_span[wk_prefix].if_end(trace["ts"])):
+            return
+
+        if trace["ph"].lower() == "i":
+            return
+
+        ### If this is a communication event and fuse multiple tensors, **sort** these tensor
+        _, op_name, sub_op = trace["name"].split(".")
+        tensor_list = re.findall("[0-9]+", op_name)
+        tensor_list = sorted([int(e) for e in tensor_list])
+        trace["name"] = "{}.{}.{}".format("Comm", "+".join([str(e) for e in tensor_list]), sub_op)
+        trace["args"]["name"] = gen_long_name(None, trace["name"], suffix=("%d_%d_%d_%d"%(
+                                int(trace["args"]["loopId"]),
+                                int(trace["args"]["channelId"]),
+                                int(trace["args"]["chunkId"]), 
+                                int(trace["args"]["sliceId"]))))
+        if self.trace_level == "debug":
+            for _id, tensor_id in enumerate(tensor_list):
+                trace["args"]["tensor%d"%_id] = self.para_dict.tensor_id_to_tensor_name(tensor_id)
+
+        if pid is not None:
+            trace["tid"] = trace["pid"]
+            trace["pid"] = pid
+
+        ### parse the trace to get the maximum number of chunks, slices, channels, loops for each raw_name
+        ### Get the rawname withoud RECV/SEND
+        if ".RECV" in trace["name"]:
+            raw_name = trace["name"].split(".RECV")[0]
+        elif ".SEND" in trace["name"]:
+            raw_name = trace["name"].split(".SEND")[0]
+        else:
+            raw_name = trace["name"]
+        if raw_name not in self.raw_name2IDnum:
+                self.raw_name2IDnum[raw_name] = {"chunkNum": 0, "sliceNum": 0, "channelNum": 0, "loopNum": 0}
+        self.raw_name2IDnum[raw_name]["chunkNum"] = max(int(trace["args"]["chunkId"]) + 1, self.raw_name2IDnum[raw_name]["chunkNum"])
+        self.raw_name2IDnum[raw_name]["sliceNum"] = max(int(trace["args"]["sliceId"]) + 1, self.raw_name2IDnum[raw_name]["sliceNum"])
+        self.raw_name2IDnum[raw_name]["channelNum"] = max(int(trace["args"]["channelId"]) + 1, self.raw_name2IDnum[raw_name]["channelNum"])
+        self.raw_name2IDnum[raw_name]["loopNum"] = max(int(trace["args"]["loopId"]) + 1, self.raw_name2IDnum[raw_name]["loopNum"])
+
+        rst_traces.append(trace)
+
+    def _collect_rank_comm(self, tmp_pm=None, pid=None, host_id=None, ref_only=False):
+        ''' Collect the communication traces of Horovod, if `ref_only` is set,
+        only find the reference time for clock alignment and keep no traces '''
         # debug_utils.DebugRecorder().debug_event_start()
         comm_path = self.pm.search(FileName.COMM) if tmp_pm is None else tmp_pm.search(FileName.COMM)
         if comm_path is None:   
@@ -696,18 +888,13 @@ class Collector(object):
         ### **NOTE** that this requires the computation traces have been collected
         wk_prefix, _ = PathManager("/".join(comm_path.split('/')[:-1])).ret_prefix()
 
-        ### read communication traces offline
-        # debug_utils.DebugRecorder().debug_event_start()
-        with open(comm_path, 'r') as f:
-            comm_traces = json.load(f)
-        # debug_utils.DebugRecorder().debug_event_end("collect_" + pid+"_comm.read_traces", "Collct", "0")
-
-        if isinstance(comm_traces, dict):
-            comm_traces = comm_traces["traceEvents"]
-        # debug_utils.DebugRecorder().debug_event_end("collect_" + pid+"_comm.load_string", "Collct", "0")
+        ### read communication traces offline, events are parsed in a streaming manner
+        comm_traces = iter_trace_events(comm_path)
 
         ret = []
         def _append_trace(ret, name, ts, dur, tid, cat, input0):
+            if ref_only:
+                return
             ret.append({
                     "name": name,
                     "ts": ts,
@@ -757,7 +944,7 @@ class Collector(object):
                 continue
             elif "ts" in trace and self.run_span[wk_prefix].if_end(trace["ts"]):
                 break
-            elif trace["ph"] == "i" and self.trace_level == "debug":
+            elif trace["ph"] == "i" and self.trace_level == "debug" and not ref_only:
                 trace["pid"] = trace["tid"] = "mark"
                 ret.append(trace)
             elif trace["pid"] in self.gradient_name_table and trace["ph"] == "B":
@@ -939,50 +1126,73 @@ class Collector(object):
                 van_type=self.van_type,
                 align_trace=(SYNC_MODE >= 0))
 
-    def clock_align(self, traces_list, host_ids=None, fix_bias=None):
-        SingleLogger().info("Combine and align traces ...")
+    def _base_host_id(self):
         if self.byteps_graph is not None:
-            base_host_id = self.byteps_graph.master_host_id
+            return self.byteps_graph.master_host_id
         elif self.nccl_graph is not None:
-            base_host_id = self.nccl_graph.master_host_id
+            return self.nccl_graph.master_host_id
         else:
-            base_host_id = 0
-        
+            return 0
+
+    def _host_bias(self, host_id, fix_bias=None):
+        ''' The time (in us) added to the traces of `host_id` to align clocks '''
+        if host_id == self._base_host_id():
+            return 0
+        elif fix_bias is not None:
+            return fix_bias
+        elif self.byteps_graph is not None:
+            return self.byteps_graph.time_drift.get(host_id, 0)
+        elif self.nccl_graph is not None:
+            return self.nccl_graph.time_drift[host_id]
+        else:
+            return 0
+
+    def _host_ids(self, host_id_strs, ref_time_list=None):
+        ''' Return the host id of each rank, for NCCL, clock drifts are initialized with the
+        reference times of ranks '''
+        if self.comm_backend == "NONE":
+            return [0]
+        elif self.comm_backend == "NCCL":
+            host_ids = [self.nccl_graph.host_prefix2id[host_id_str] for host_id_str in host_id_strs]
+            self.nccl_graph.init_host_drift(zip(host_ids, ref_time_list))
+            return host_ids
+        else:
+            return [int(host_id_str.split(".rank")[0].split("_")[-1]) for host_id_str in host_id_strs]
+
+    def clock_align(self, traces_list, host_ids=None, fix_bias=None):
+        SingleLogger().info("Combine and align traces ...")
+        base_host_id = self._base_host_id()
+
         if isinstance(traces_list, TraceManager):
             traceM = traces_list
-            for trace in traceM.traces:
+            def bias_of(trace):
                 name = traceM.ret_unique_name(trace)
                 host_id = self.nccl_graph.ret_hostid(name)
                 if self.byteps_graph is not None:
-                    bias = self.byteps_graph.time_drift[host_id]
+                    return self.byteps_graph.time_drift[host_id]
                 elif self.nccl_graph is not None:
-                    bias = self.nccl_graph.time_drift[host_id]
+                    return self.nccl_graph.time_drift[host_id]
                 else:
-                    bias = 0
-                trace["ts"] += bias
+                    return 0
+            traceM.shift_ts(bias_of)
             traceM.ret_stat()
             return
-        elif isinstance(traces_list[0], list):
+        elif isinstance(traces_list[0], (list, EventList)):
+            ### Rank caches of old versions keep lists of events
+            traces_list = [traces if isinstance(traces, EventList) else EventList.from_dicts(traces)
+                for traces in traces_list]
             if self.comm_backend == "NONE":
                 assert len(traces_list) == 1
                 return traces_list[0]
-            rst = []
+            rst = EventList()
             for idx in range(len(traces_list)):
                 host_id = host_ids[idx]
                 if host_id == base_host_id:
                     pass
                 else:
-                    if fix_bias is not None:
-                        bias = fix_bias
-                    elif self.byteps_graph is not None:
-                        bias = self.byteps_graph.time_drift.get(host_id, 0)
-                    elif self.nccl_graph is not None:
-                        bias = self.nccl_graph.time_drift[host_id]
-                    else:
-                        bias = 0
+                    bias = self._host_bias(host_id, fix_bias)
                     SingleLogger().info("Align - add {} us to host {}".format(bias, host_id))    
-                    for trace in traces_list[idx]:
-                        trace["ts"] += bias
+                    traces_list[idx].shift_ts(bias)
                 rst += traces_list[idx]
             return rst
         else:
@@ -1012,17 +1222,34 @@ class Collector(object):
                 arg_list.append([tmp_pm, pid, host_id_str])
                 if self.comm_backend == "NCCL":
                     self._collect_nccl_graph(tmp_pm, pid, host_id_str)
-        with multiprocessing.Pool(len(arg_list)) as p:
-            rst = p.map(self._collect_rank_traces, arg_list)
+        ### Only keep the events in the window of each rank while parsing
+        rank_windows = self._rank_windows() if self.trace_window.is_set() else {}
+        for args in arg_list:
+            args.append(rank_windows.get(self._rank_id(args[0].path)))
+        ### Only re-collect ranks whose source files or configurations changed
+        rst = [None] * len(arg_list)
+        rank_keys = [None] * len(arg_list)
+        if self.rank_cache is not None:
+            for idx, (tmp_pm, pid, _, rank_window) in enumerate(arg_list):
+                rank_keys[idx] = self._rank_trace_key(tmp_pm.path, pid, rank_window)
+                rst[idx] = self.rank_cache.load(self._rank_id(tmp_pm.path), "traces", rank_keys[idx])
+        stale_idxs = [idx for idx in range(len(arg_list)) if rst[idx] is None]
+        SingleLogger().info("Collect traces of {} rank(s), reuse cached traces of {} rank(s)".format(
+            len(stale_idxs), len(arg_list) - len(stale_idxs)))
+        if len(stale_idxs) > 0:
+            with multiprocessing.Pool(len(stale_idxs)) as p:
+                stale_rst = p.map(self._collect_rank_traces, [arg_list[idx] for idx in stale_idxs])
+            for idx, _rst in zip(stale_idxs, stale_rst):
+                rst[idx] = _rst
+                if self.rank_cache is not None:
+                    self.rank_cache.dump(self._rank_id(arg_list[idx][0].path), "traces", rank_keys[idx], _rst)
         traces_list, ref_name_list, ref_time_list, raw_name2IDnum_list = zip(*rst)
 
-        host_ids = None
-        if self.comm_backend == "NONE":
-            host_ids = [0]
-        elif self.comm_backend == "NCCL":
-            host_ids = [self.nccl_graph.host_prefix2id[host_id_str] for _, _, host_id_str in arg_list]
-            print(host_ids, ref_time_list)
-            self.nccl_graph.init_host_drift(zip(host_ids, ref_time_list))
+        if self.trace_window.is_set():
+            ### Align clocks as assumed by the windows, reference times in windows may differ
+            ref_time_list = [self._rank_window_scans[self._rank_id(args[0].path)]["ref_time"] for args in arg_list]
+        host_ids = self._host_ids([args[2] for args in arg_list], ref_time_list)
+        if self.comm_backend == "NCCL":
             ### Since some GPU may have no comm detailed traces, select the first non-empty file to parse chunk num...
             raw_name2IDnum = None
             for e in raw_name2IDnum_list:
@@ -1031,11 +1258,6 @@ class Collector(object):
                     break
             assert raw_name2IDnum is not None
             self.nccl_graph.parse_traces(raw_name2IDnum)
-        else:
-            host_ids = [int(host_id_str.split(".rank")[0].split("_")[-1]) for _, _, host_id_str in arg_list]
-            for host_id in host_ids:
-                pass
-                # assert host_id in self.byteps_graph.time_drift, (host_id, self.byteps_graph.time_drift)
         ### align the time
         rst_traces = self.clock_align(traces_list, host_ids, fix_bias=(None if ALIGN_BASED_SYNC else 0))
 
@@ -1050,10 +1272,113 @@ class Collector(object):
         #     json.dump(rst_traces, f)
         # raise
         self.traceM = TraceManager(rst_traces, self.pm.dir_level, check=True)
+        self.traceM.trace_window = self.trace_window.to_dict()
 
     def collect_para_dict(self):
         self.para_dict = ParameterDict(self.pm, self.platform)
 
+    def _rank_id(self, gpu_path):
+        return os.path.relpath(gpu_path, self.pm.path)
+
+    def _iter_rank_dirs(self):
+        ''' Yield (worker_dir, gpu_dir, gpu_path) of each rank in the trial '''
+        for _dir in self.pm.dirs:
+            worker_path = os.path.join(self.pm.path, _dir)
+            worker_root, worker_dirs, _ = list(os.walk(worker_path))[0]
+            for __dir in sorted([_d for _d in worker_dirs if not _d.startswith(".")]):
+                yield _dir, __dir, os.path.join(worker_root, __dir)
+
+    def _rank_trace_key(self, gpu_path, pid, rank_window=None, kind="traces"):
+        ''' The key of per-rank traces, which depend on the rank's source files,
+            the trial-level DFG and metadata, and the collection configurations
+        '''
+        config = {
+            "pid": pid,
+            "platform": self.platform,
+            "comm_backend": self.comm_backend,
+            "trace_level": self.trace_level,
+            "update_clip_overlapping": self.update_clip_overlapping,
+            "trace_window": self.trace_window.to_dict()
+        }
+        if kind != "traces":
+            ### e.g., window scans, which do not depend on the window
+            config["kind"] = kind
+            config["trace_window"] = None
+        if rank_window is not None:
+            ### The window of a rank also depends on the traces of other ranks
+            config["rank_window"] = rank_window.to_dict()
+        if self._rank_cache_extra_files is None:
+            self._rank_cache_extra_files = [self.pm.search(FileName.DAG), self.pm.search(FileName.METADATA)]
+        return self.rank_cache.key(self._rank_id(gpu_path), gpu_path, config,
+            extra_files=self._rank_cache_extra_files)
+
+    def _rank_dag_key(self, gpu_path):
+        ''' The key of per-rank DAG edges, besides the rank's traces, local DAGs
+            also depend on the trial-level step chosen and the communication topology.
+        '''
+        _dir, __dir = os.path.split(self._rank_id(gpu_path))
+        context = {
+            "trace_key": self._rank_trace_key(gpu_path, gen_pid_name(self.comm_backend, _dir, __dir),
+                self._rank_windows().get(self._rank_id(gpu_path)) if self.trace_window.is_set() else None),
+            "opt_step": int(self.traceM.opt_step),
+            "pretty": self.pretty,
+            "update_barrier": self.update_barrier
+        }
+        if self.comm_backend == "NCCL":
+            context["nccl_graph"] = digest_of(self.nccl_graph.ret_state_str())
+        elif self.comm_backend == "BYTEPS":
+            context["byteps_graph"] = digest_of(self.byteps_graph.ret_state_str())
+        return digest_of(context)
+
+    def stale_ranks(self):
+        ''' Return the ids of ranks whose cached traces are outdated '''
+        if self.rank_cache is None:
+            return []
+        stale = []
+        rank_windows = self._rank_windows() if self.trace_window.is_set() else {}
+        for _dir, __dir, gpu_path in self._iter_rank_dirs():
+            pid = gen_pid_name(self.comm_backend, _dir, __dir)
+            if not self.rank_cache.is_valid(self._rank_id(gpu_path), "traces",
+                    self._rank_trace_key(gpu_path, pid, rank_windows.get(self._rank_id(gpu_path)))):
+                stale.append(self._rank_id(gpu_path))
+        return stale
+
+    def _rank_windows(self):
+        ''' Return rank_id --> `RankWindow` of all ranks. The time window is relative to the
+            whole trial, so all ranks are scanned first, scans are cached per rank
+        '''
+        if self._rank_window_dict is not None:
+            return self._rank_window_dict
+        arg_list = []
+        for _dir, __dir, gpu_path in self._iter_rank_dirs():
+            arg_list.append([PathManager(gpu_path), gen_pid_name(self.comm_backend, _dir, __dir), _dir])
+        scans = [None] * len(arg_list)
+        scan_keys = [None] * len(arg_list)
+        if self.rank_cache is not None:
+            for idx, (tmp_pm, pid, _) in enumerate(arg_list):
+                ### Scans do not depend on the window
+                scan_keys[idx] = self._rank_trace_key(tmp_pm.path, pid, kind="window_scan")
+                scans[idx] = self.rank_cache.load(self._rank_id(tmp_pm.path), "window_scan", scan_keys[idx])
+        stale_idxs = [idx for idx in range(len(arg_list)) if scans[idx] is None]
+        if len(stale_idxs) > 0:
+            with multiprocessing.Pool(len(stale_idxs)) as p:
+                stale_scans = p.map(self._scan_rank_window, [arg_list[idx] for idx in stale_idxs])
+            for idx, scan in zip(stale_idxs, stale_scans):
+                scans[idx] = scan
+                if self.rank_cache is not None:
+                    self.rank_cache.dump(self._rank_id(arg_list[idx][0].path), "window_scan", scan_keys[idx], scan)
+
+        if self.comm_backend == "NCCL":
+            self.nccl_graph.map_host_prefix_id(self.pm.dirs)
+        host_ids = self._host_ids([args[2] for args in arg_list], [scan["ref_time"] for scan in scans])
+        fix_bias = None if ALIGN_BASED_SYNC else 0
+        biases = [self._host_bias(host_id, fix_bias) for host_id in host_ids] \
+            if self.comm_backend != "NONE" else [0] * len(scans)
+        self._rank_window_scans = dict((self._rank_id(args[0].path), scan) for args, scan in zip(arg_list, scans))
+        self._rank_window_dict = dict((self._rank_id(args[0].path), window)
+            for args, window in zip(arg_list, self.trace_window.resolve(scans, biases)))
+        return self._rank_window_dict
+
     def _collect_rank_dag(self, gpu_path, worker_dag_list, critical_path, index):
         SingleLogger().info("Collect DAG in %s ..." % (gpu_path))
         dagmanager = DAGManager(gpu_path, self.traceM, self.nccl_graph, self.byteps_graph,
@@ -1065,6 +1390,41 @@ class Collector(object):
         worker_dag_list[index] = dagmanager.dag
         critical_path[index] = _critical_path
 
+    def _collect_rank_dags_parallel(self, gpu_paths, stale_idxs, worker_dag_list, critical_path):
+        ''' Build local DAGs of ranks in `stale_idxs` with a process pool. Each worker only
+            receives the statistic of its own rank and returns compact edge arrays
+        '''
+        worker_num = min(len(stale_idxs), self.dag_workers or os.cpu_count() or 1)
+        if worker_num <= 1:
+            for index in stale_idxs:
+                self._collect_rank_dag(gpu_paths[index], worker_dag_list, critical_path, index)
+            return
+        shared = {
+            "dag": self.dag,
+            "nccl_graph": self.nccl_graph,
+            "byteps_graph": self.byteps_graph,
+            "para_dict": self.para_dict,
+            "platform": self.platform,
+            "update_barrier": self.update_barrier,
+            "pretty": self.pretty
+        }
+        tasks = []
+        for index in stale_idxs:
+            wk_prefix, local_rank = PathManager(gpu_paths[index]).ret_prefix()
+            pid = gen_pid_name(self.comm_backend, wk_prefix, local_rank)
+            tasks.append((index, gpu_paths[index], self.traceM.rank_slice(pid)))
+        SingleLogger().info("Build DAGs of {} rank(s) with {} processes".format(len(tasks), worker_num))
+        with multiprocessing.Pool(worker_num, initializer=init_rank_dag_worker,
+                initargs=(shared, self.dag_worker_mem_limit)) as p:
+            for index, rst in p.imap_unordered(build_rank_dag, tasks):
+                if rst is None:
+                    SingleLogger().warn("Run out of memory when building the DAG of {}, retry in the main process".format(
+                        gpu_paths[index]))
+                    self._collect_rank_dag(gpu_paths[index], worker_dag_list, critical_path, index)
+                    continue
+                names, edge_array, critical_path[index] = rst
+                worker_dag_list[index] = decode_edges(names, edge_array)
+
     def collect_trial_dag(self):
         assert self.pm.dir_level == DirLevel.TRIAL
         SingleLogger().info(bcolors.CGREEN + "Collecting DAG ..." + bcolors.ENDC)
@@ -1093,24 +1453,41 @@ class Collector(object):
 
         if self.comm_backend == "NONE":
             worker_path = os.path.join(self.pm.path, self.pm.dirs[0])
-            gpu_path = os.path.join(worker_path, first_valid_dir(worker_path))
+            gpu_paths = [os.path.join(worker_path, first_valid_dir(worker_path))]
             worker_dag_list = [None]
             critical_path = [None]
-            self._collect_rank_dag(gpu_path, worker_dag_list, critical_path, 0)
         else:
-            threads = []
+            gpu_paths = []
             for _dir in self.pm.dirs:
                 worker_path = os.path.join(self.pm.path, _dir)
                 worker_root, worker_dirs, _ = list(os.walk(worker_path))[0]
                 for worker_dir in sorted(worker_dirs):
-                    gpu_path = os.path.join(worker_root, worker_dir)
-                    # self._collect_rank_dag(gpu_path, worker_dag_list, critical_path, len(threads))
-                    # threads.append(0)
-                    t = threading.Thread(target=self._collect_rank_dag, args=(gpu_path, worker_dag_list, critical_path, len(threads)))
-                    t.start()
-                    threads.append(t)
-            for t in threads:
-                t.join()
+                    gpu_paths.append(os.path.join(worker_root, worker_dir))
+
+        ### Reuse cached local DAGs of unchanged ranks
+        dag_keys = [None] * len(gpu_paths)
+        stale_idxs = []
+        for index, gpu_path in enumerate(gpu_paths):
+            if self.rank_cache is not None:
+                dag_keys[index] = self._rank_dag_key(gpu_path)
+            cached = None if dag_keys[index] is None else \
+                self.rank_cache.load(self._rank_id(gpu_path), "dag", dag_keys[index])
+            if cached is None:
+                stale_idxs.append(index)
+            else:
+                worker_dag_list[index], critical_path[index] = cached
+        SingleLogger().info("Collect DAGs of {} rank(s), reuse cached DAGs of {} rank(s)".format(
+            len(stale_idxs), len(gpu_paths) - len(stale_idxs)))
+
+        if self.comm_backend == "NONE":
+            for index in stale_idxs:
+                self._collect_rank_dag(gpu_paths[index], worker_dag_list, critical_path, index)
+        else:
+            self._collect_rank_dags_parallel(gpu_paths, stale_idxs, worker_dag_list, critical_path)
+        for index in stale_idxs:
+            if dag_keys[index] is not None:
+                self.rank_cache.dump(self._rank_id(gpu_paths[index]), "dag", dag_keys[index],
+                    (worker_dag_list[index], critical_path[index]))
 
         ### Combine all worker_dag_list on one worker, build the dependency
         SingleLogger().info("Compose all {} local DFGs together ... ".format(len(worker_dag_list)))
@@ -1131,7 +1508,16 @@ class Collector(object):
         return self.traceM.get_iter_time()
 
     def init(self, force_=False):
-        trace_path = self.pm.search(FileName.TRACE)
+        if trace_store_exists(self.pm.path):
+            trace_path = os.path.join(self.pm.path, FileName.TRACE_STORE.value)
+            ### Traces collected with another window can not be reused
+            if trace_store_meta(self.pm.path).get("trace_window", TraceWindow().to_dict()) != self.trace_window.to_dict():
+                SingleLogger().info("The trace window changed, re-collect traces")
+                trace_path = None
+        elif self.trace_window.is_set():
+            trace_path = None
+        else:
+            trace_path = self.pm.search(FileName.TRACE)
 
         if self.comm_backend == "NCCL":
             nccl_graph_path = self.pm.search(FileName.NCCL_GRAPH)
@@ -1146,8 +1532,13 @@ class Collector(object):
 
         self.dag = wrap_read_gml(self.pm.search(FileName.DAG), self.para_dict, self.pretty)
 
-        trail_dag_path = self.pm.search(FileName.TRAIL_DAG)
-        if force_ or trace_path is None or (self.comm_backend == "NCCL" and nccl_graph_path is None) or trail_dag_path is None:
+        trail_dag_path = self._search_graph(FileName.TRAIL_DAG_STORE, FileName.TRAIL_DAG)
+        ### Re-collect if the source files of some ranks changed since the last collection
+        stale_ranks = self.stale_ranks() if self.rank_cache is not None and self.rank_cache.exists() else []
+        if len(stale_ranks) > 0:
+            SingleLogger().info("Source files of {} rank(s) changed: {}".format(len(stale_ranks), stale_ranks))
+        if force_ or trace_path is None or (self.comm_backend == "NCCL" and nccl_graph_path is None) \
+                or trail_dag_path is None or len(stale_ranks) > 0:
             self.collect_traces()
             iter_time, _ = self.iter_time()
             if self.comm_backend == "NCCL":
@@ -1155,14 +1546,16 @@ class Collector(object):
             self.collect_trial_dag()
             self.fine_tune_trace_dag()
             ### Asynchonously cache these info
-            self.traceM.dump(self.pm.path)
-            graph_thread = threading.Thread(target=nx.write_gml, 
-                args=(self.trail_dag, os.path.join(self.pm.path, FileName.TRAIL_DAG.value), lambda x: str(x)))
+            self.traceM.dump(self.pm.path, export_json=self.export_trace_json)
+            graph_thread = threading.Thread(target=dump_graph, 
+                args=(self.trail_dag, os.path.join(self.pm.path, FileName.TRAIL_DAG_STORE.value),
+                    os.path.join(self.pm.path, FileName.TRAIL_DAG.value) if self.export_graph_gml else None))
             graph_thread.start()
             if self.comm_backend == "NCCL":
                 self.nccl_graph.dump(os.path.join(self.pm.path, FileName.NCCL_GRAPH.value))
-            local_dfg_thread = threading.Thread(target=nx.write_gml, 
-                args=(self.dag, os.path.join(self.pm.path, FileName.LOCAL_DFG.value), lambda x: str(x)))
+            local_dfg_thread = threading.Thread(target=dump_graph, 
+                args=(self.dag, os.path.join(self.pm.path, FileName.LOCAL_DFG_STORE.value),
+                    os.path.join(self.pm.path, FileName.LOCAL_DFG.value) if self.export_graph_gml else None))
             local_dfg_thread.start()
         else:
             self.traceM = TraceManager()
@@ -1170,13 +1563,19 @@ class Collector(object):
             iter_time, _ = self.iter_time()
             if self.comm_backend == "NCCL":
                 self.nccl_graph.load(nccl_graph_path)
-            self.trail_dag = nx.read_gml(trail_dag_path)
-            try:
-                self.dag = nx.read_gml(self.pm.search(FileName.LOCAL_DFG))
-            except TypeError:
-                pass
+            self.trail_dag = read_graph(trail_dag_path)
+            local_dfg_path = self._search_graph(FileName.LOCAL_DFG_STORE, FileName.LOCAL_DFG)
+            if local_dfg_path is not None:
+                self.dag = read_graph(local_dfg_path)
 
         return iter_time
+
+    def _search_graph(self, store_name, gml_name):
+        ''' Return the path of the binary graph store, or the GML file for legacy trials '''
+        store_path = os.path.join(self.pm.path, store_name.value)
+        if graph_store_exists(store_path):
+            return store_path
+        return self.pm.search(gml_name)
         
     def all_prefix_list(self):
         ''' Return all prefixes under the dirctory.
@@ -1569,7 +1968,7 @@ class Collector(object):
                                         continue
                                     last_comm_event = self.traceM.traces[idx_list[self.traceM.opt_step]]
                                     gap = event["ts"] - (last_comm_event["ts"] + last_comm_event["dur"])
-                                    SingleLogger.info(bcolors.CYELLOWBG + "add {} gap to {}: {}".format(GAP_STR_COMM2OP, pred, gap))
+                                    SingleLogger().info(bcolors.CYELLOWBG + "add {} gap to {}: {}".format(GAP_STR_COMM2OP, pred, gap))
                                     self.trail_dag.nodes[node_][GAP_STR_COMM2OP] = gap
                                     break
 
@@ -2,6 +2,7 @@ import networkx as nx
 import random
 
 from ...trace_utils import _parse_tf_layer_names
+from ...graph_overlay import as_overlay_graph, JournaledDict, JournaledList, JournaledSet
 
 class PKGraphCycleError(Exception):
     pass
@@ -165,6 +166,7 @@ class PKGraph(object):
     directly apply modifications on the original DAG. All methods modify the
     state of PKGraph only.
     Works for networkx DiGraphs.
+    Modifications can be tried in an overlay, see `begin`, `commit` and `discard`.
     """
 
     def __init__(self, nx_graph=None, nx_graph_reference=None, _init_copy=False):
@@ -363,10 +365,30 @@ class PKGraph(object):
                 for node in component:
                     self.nodename2fusednode[node] = component_names[comp_idx]
 
+    def begin(self):
+        ''' Start an overlay, modifications of the internal graph, the topological
+        order and indexes are recorded until `commit` or `discard`,
+        refer to dpro/graph_overlay.py '''
+        self.nx_graph = as_overlay_graph(self.nx_graph)
+        journal = self.nx_graph.journal
+        if getattr(self.ord, "journal", None) is not journal:
+            self.nodename2idx = JournaledDict(journal, self.nodename2idx)
+            self.nodename2fusednode = JournaledDict(journal, self.nodename2fusednode)
+            self.ord = JournaledList(journal, self.ord)
+            self.free_indexes = JournaledSet(journal, self.free_indexes)
+        self.nx_graph.begin()
+
+    def commit(self):
+        self.nx_graph.commit()
+
+    def discard(self):
+        self.nx_graph.discard()
+
     def copy(self):
         new_instance = self.__class__(_init_copy=True)
         new_instance.nx_graph = self.nx_graph.copy()
-        new_instance.nx_graph_reference = self.nx_graph_reference.copy()
+        ### The reference graph is never modified, share it among copies
+        new_instance.nx_graph_reference = self.nx_graph_reference
         new_instance.nodename2idx = self.nodename2idx.copy()
         new_instance.ord = self.ord.copy()
         new_instance.free_indexes = self.free_indexes.copy()
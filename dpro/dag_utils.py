@@ -1,6 +1,7 @@
 from argparse import ArgumentError
 import os
 import re
+import numpy as np
 import networkx as nx
 import matplotlib.pyplot as plt
 
@@ -9,7 +10,8 @@ from .trace_utils import *
 try:
     from hvd.graph import *
 except:
-    pass
+    ### Imported as the `dpro` package
+    from .hvd.graph import *
 try:
     from bps_helper.graph import *
 except:
@@ -134,23 +136,85 @@ def cal_edge_cost(G):
         
 def dag_longest_path(G, pathM=None, weight='weight', default_weight=0, _debug_level=0):
     critical_path = nx.algorithms.dag.dag_longest_path(G, weight=weight, default_weight=default_weight)
+    len_list = [G[u][v].get(weight, default_weight) for (u, v) in nx.utils.pairwise(critical_path)]
+    len_list.append(0)
+    critical_path = list(zip(critical_path, len_list))
+    log_critical_path(critical_path, pathM, _debug_level)
+    return critical_path
+
+def log_critical_path(critical_path, pathM=None, _debug_level=0):
+    ''' Log a critical path in the format of `dag_longest_path`, i.e., a list of (node, length) '''
+    if _debug_level == 0:
+        return
     prefix = "Critical Path of " + (pathM.ret_id_in_trial() if pathM is not None else "none")
-    if _debug_level > 1:  
+    if _debug_level > 1:
         SingleLogger().info(prefix + " => ")
     path_length = 0
-    len_list = []
-    for (u, v) in nx.utils.pairwise(critical_path):
-        weight_ = G[u][v].get(weight, default_weight)
+    for u, weight_ in critical_path[:-1]:
         path_length += weight_
         if _debug_level > 1:
             SingleLogger().info("%-80s: %.3f/%.3f ms" % (u, weight_, path_length))
-        len_list.append(weight_)
-    len_list.append(0)
     # SingleLogger().info(prefix + str(critical_path) + " => " + prefix + "%12.4f ms" % path_length)
-    if _debug_level > 0:
-        SingleLogger().info("Length of the " + prefix + "%12.4f ms\n" % path_length)
+    SingleLogger().info("Length of the " + prefix + "%12.4f ms\n" % path_length)
+
+def encode_edges(edges):
+    ''' Encode an edge list as node names and an int32 array of shape (edge_num, 2) '''
+    node2id = {}
+    edge_array = np.empty((len(edges), 2), dtype=np.int32)
+    for idx, (u, v) in enumerate(edges):
+        edge_array[idx, 0] = node2id.setdefault(u, len(node2id))
+        edge_array[idx, 1] = node2id.setdefault(v, len(node2id))
+    return list(node2id.keys()), edge_array
 
-    return list(zip(critical_path, len_list))
+def decode_edges(names, edge_array):
+    return [(names[u], names[v]) for u, v in edge_array.tolist()]
+
+### Inputs shared by all ranks, set in each worker process by `init_rank_dag_worker`
+_RANK_DAG_SHARED = None
+
+def init_rank_dag_worker(shared, mem_limit=None):
+    ''' Initialize a worker of `build_rank_dag`
+    Parameters
+    ----------
+    shared: dict
+        The local DFG, NCCL/BytePS graph, para_dict and configurations
+    mem_limit: float
+        Maximum memory (in GB) a worker can allocate in addition to the memory
+        inherited from the parent process
+    '''
+    global _RANK_DAG_SHARED
+    _RANK_DAG_SHARED = shared
+    if mem_limit is not None:
+        import resource
+        with open("/proc/self/statm", 'r') as fp:
+            vm_size = int(fp.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+        limit = vm_size + int(mem_limit * 1024 ** 3)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def build_rank_dag(task):
+    ''' Build the local DAG of one rank in a worker process
+    Parameters
+    ----------
+    task: tuple
+        (index, gpu_path, traceM), where traceM only contains the statistic of this rank
+
+    Returns
+    -------
+    (index, (node names, edge array, critical path)) or (index, None) if
+    running out of memory
+    '''
+    index, gpu_path, traceM = task
+    shared = _RANK_DAG_SHARED
+    try:
+        dagmanager = DAGManager(gpu_path, traceM, shared["nccl_graph"], shared["byteps_graph"],
+            platform=shared["platform"],
+            update_barrier=shared["update_barrier"])
+        _, critical_path = dagmanager.gen_gpu_dag(shared["dag"],
+            _pretty=shared["pretty"], para_dict=shared["para_dict"])
+        names, edge_array = encode_edges(dagmanager.dag)
+    except MemoryError:
+        return index, None
+    return index, (names, edge_array, critical_path)
 
 def wrap_read_gml(gml_path, metadata, pretty=True):
     ''' Read raw DFG file
@@ -0,0 +1,679 @@
+''' Compact in-memory container of trace events
+
+EventList keeps events in a NumPy structured array (see EVENT_DTYPE) instead
+of a list of dicts. `name`, `pid`, `tid`, `cat`, `ph` and `args.name` are
+dictionary-encoded with a ValueDict, `args.step` and `args.cnt` are int64
+columns and all other keys of events (or of `args`) are kept in sparse side
+columns, i.e., dicts from rows to values. An event takes ~60 bytes plus its
+sparse keys, instead of ~1 KB of a dict with a nested `args` dict.
+
+Legacy code can still access events as dicts: indexing or iterating an
+EventList returns EventView, a MutableMapping backed by one row, and
+`event["args"]` returns an ArgsView. Views are positional, i.e., `sort`
+re-orders rows in place and views taken before it are invalid afterwards.
+
+`ts` and `dur` are stored as float64, integral values are returned as int,
+as parsed from JSON traces, so that formatting and comparing them is unchanged.
+Events given as dicts are copied, annotations made on the EventList (e.g.,
+`args.step` by TraceManager) are not written back to the source dicts.
+'''
+import copy
+import numpy as np
+from collections.abc import Mapping, MutableMapping
+
+from .trace_store import ValueDict, INT_NULL, CODE_NULL, EVENT_STR_KEYS, ARGS_INT_KEYS
+
+EVENT_DTYPE = np.dtype([
+    ("ts", np.float64),
+    ("dur", np.float64),
+    ("name", np.int32),
+    ("pid", np.int32),
+    ("tid", np.int32),
+    ("cat", np.int32),
+    ("ph", np.int32),
+    ("has_args", np.bool_),
+    ("args_name", np.int32),
+    ("args_step", np.int64),
+    ("args_cnt", np.int64)
+])
+
+### Float columns, NaN denotes a missing value
+EVENT_NUM_KEYS = ["ts", "dur"]
+### Columns of dictionary codes
+CODED_COLUMNS = EVENT_STR_KEYS + ["args_name"]
+### The order of keys when an event is converted to a dict
+EVENT_KEY_ORDER = ["name", "ts", "dur", "pid", "tid", "cat", "ph", "args"]
+
+_MISSING = object()
+_CODED_TYPES = (str, int, float)
+_NUM, _CODED, _ARGS = range(3)
+_KEY_KIND = dict([(key, _NUM) for key in EVENT_NUM_KEYS] +
+    [(key, _CODED) for key in EVENT_STR_KEYS] + [("args", _ARGS)])
+
+
+def _is_num(value):
+    return isinstance(value, (int, float, np.integer, np.floating)) \
+        and not isinstance(value, (bool, np.bool_))
+
+
+def _num_value(value):
+    ''' Return a float64 of the numeric columns as int if it is integral '''
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+def _num_column(col):
+    ''' Return a numeric column as an object array, see `_num_value`, NaN is kept '''
+    rst = col.astype(object)
+    integral = np.nonzero(np.floor(col) == col)[0]
+    rst[integral] = col[integral].astype(np.int64).tolist()
+    return rst
+
+
+def _is_int(value):
+    return isinstance(value, (int, np.integer)) and not isinstance(value, (bool, np.bool_))
+
+
+def _remap_rows(sparse, row_map):
+    ''' Move the rows of sparse columns, `row_map[old_row]` is the new row or -1 to drop it '''
+    for key in list(sparse.keys()):
+        old = sparse[key]
+        if len(old) == 0:
+            del sparse[key]
+            continue
+        new_rows = row_map[np.fromiter(old.keys(), dtype=np.int64, count=len(old))].tolist()
+        new = dict((row, value) for row, value in zip(new_rows, old.values()) if row >= 0)
+        if len(new) > 0:
+            sparse[key] = new
+        else:
+            del sparse[key]
+
+
+class EventList:
+    ''' A list of trace events backed by a structured array
+
+    `values` is the ValueDict of all coded columns, `sparse`/`sparse_args`
+    map keys of events/`args` without dedicated columns to {row: value}.
+    '''
+    def __init__(self, values=None, capacity=0):
+        self.values = ValueDict() if values is None else values
+        self._data = np.empty(capacity, dtype=EVENT_DTYPE)
+        self._size = 0
+        self._bind()
+        self.sparse = {}
+        self.sparse_args = {}
+
+    def _bind(self):
+        ### Cache field views, `self._cols[key][row]` is much faster than `self._data[row][key]`
+        self._cols = dict((key, self._data[key]) for key in EVENT_DTYPE.names)
+
+    def _reserve(self, size):
+        if size <= len(self._data):
+            return
+        data = np.empty(max(size, 2 * len(self._data), 1024), dtype=EVENT_DTYPE)
+        data[:self._size] = self._data[:self._size]
+        self._data = data
+        self._bind()
+
+    @property
+    def data(self):
+        return self._data[:self._size]
+
+    def column(self, key):
+        ''' Return the column `key` of EVENT_DTYPE, writes to it change the events '''
+        return self._cols[key][:self._size]
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        for row in range(self._size):
+            yield EventView(self, row)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return self.take(np.arange(self._size)[idx])
+        if idx < 0:
+            idx += self._size
+        if idx < 0 or idx >= self._size:
+            raise IndexError("EventList index out of range")
+        return EventView(self, idx)
+
+    def __repr__(self):
+        return "EventList({} events)".format(self._size)
+
+    def __getstate__(self):
+        return {
+            "values": self.values.values,
+            "data": self.data,
+            "sparse": self.sparse,
+            "sparse_args": self.sparse_args
+        }
+
+    def __setstate__(self, state):
+        self.values = ValueDict(state["values"])
+        self._data = np.array(state["data"], dtype=EVENT_DTYPE)
+        self._size = len(self._data)
+        self._bind()
+        self.sparse = state["sparse"]
+        self.sparse_args = state["sparse_args"]
+
+    ### ------------------------------------------------------------------
+    ### Construction
+    ### ------------------------------------------------------------------
+
+    @staticmethod
+    def from_dicts(events, values=None):
+        rst = EventList(values=values)
+        rst._data = np.array([rst._encode(row, event) for row, event in enumerate(events)],
+            dtype=EVENT_DTYPE).reshape(-1)
+        rst._size = len(rst._data)
+        rst._bind()
+        return rst
+
+    def _encode(self, row, event):
+        ''' Return the record of a dict event to be saved at `row`, keys without
+            dedicated columns are saved to the sparse columns directly
+        '''
+        encode = self.values.encode
+        ts = dur = np.nan
+        name = pid = tid = cat = ph = args_name = CODE_NULL
+        step = cnt = INT_NULL
+        has_args = False
+        for key, value in event.items():
+            kind = _KEY_KIND.get(key)
+            if kind == _NUM and _is_num(value):
+                if key == "ts":
+                    ts = value
+                else:
+                    dur = value
+            elif kind == _CODED and isinstance(value, _CODED_TYPES):
+                code = encode(value)
+                if key == "name":
+                    name = code
+                elif key == "pid":
+                    pid = code
+                elif key == "tid":
+                    tid = code
+                elif key == "cat":
+                    cat = code
+                else:
+                    ph = code
+            elif kind == _ARGS and isinstance(value, Mapping):
+                has_args = True
+                for arg_key, arg_value in value.items():
+                    if arg_key == "name" and isinstance(arg_value, _CODED_TYPES):
+                        args_name = encode(arg_value)
+                    elif arg_key == "step" and _is_int(arg_value) and arg_value != INT_NULL:
+                        step = arg_value
+                    elif arg_key == "cnt" and _is_int(arg_value) and arg_value != INT_NULL:
+                        cnt = arg_value
+                    else:
+                        self.sparse_args.setdefault(arg_key, {})[row] = arg_value
+            else:
+                self.sparse.setdefault(key, {})[row] = value
+        return (ts, dur, name, pid, tid, cat, ph, has_args, args_name, step, cnt)
+
+    @staticmethod
+    def from_store(store):
+        ''' Build events from the columns of a TraceStore '''
+        columns = store.columns
+        event_num = len(store)
+        events = EventList(values=ValueDict(list(store.values.values)), capacity=event_num)
+        data = events._data
+        for key in EVENT_NUM_KEYS + CODED_COLUMNS:
+            data[key] = columns[key]
+        for key in ARGS_INT_KEYS:
+            data["args_" + key] = columns["args_" + key]
+        data["has_args"] = columns["args_extra"] != CODE_NULL
+        events._size = event_num
+        for col, sparse in [("args_extra", events.sparse_args), ("extra", events.sparse)]:
+            codes = np.asarray(columns[col])
+            rows = np.nonzero(codes != CODE_NULL)[0]
+            order = rows[np.argsort(codes[rows], kind="stable")]
+            blob_codes, starts = np.unique(codes[order], return_index=True)
+            bounds = np.append(starts, len(order)).tolist()
+            for blob_idx, code in enumerate(blob_codes.tolist()):
+                blob = store._decode_blob(code)
+                _rows = order[bounds[blob_idx]:bounds[blob_idx+1]].tolist()
+                for key, value in blob.items():
+                    if isinstance(value, (list, dict)):
+                        sparse.setdefault(key, {}).update((row, copy.deepcopy(value)) for row in _rows)
+                    else:
+                        sparse.setdefault(key, {}).update((row, value) for row in _rows)
+        return events
+
+    def append(self, event):
+        row = self._size
+        self._reserve(row + 1)
+        self._data[row] = self._encode(row, event)
+        self._size += 1
+
+    def extend(self, events):
+        if not isinstance(events, EventList):
+            self._reserve(self._size + len(events))
+            for event in events:
+                self.append(event)
+            return
+        start, event_num = self._size, len(events)
+        self._reserve(start + event_num)
+        block = events.data.copy()
+        if events.values is not self.values:
+            ### The last entry maps CODE_NULL to itself
+            remap = np.array([self.values.encode(value) for value in events.values.values] + [CODE_NULL],
+                dtype=np.int32)
+            for key in CODED_COLUMNS:
+                block[key] = remap[block[key]]
+        self._data[start:start + event_num] = block
+        self._size += event_num
+        for src, dst in [(events.sparse, self.sparse), (events.sparse_args, self.sparse_args)]:
+            for key, rows in src.items():
+                dst.setdefault(key, {}).update((row + start, value) for row, value in rows.items())
+
+    def __iadd__(self, events):
+        self.extend(events)
+        return self
+
+    ### ------------------------------------------------------------------
+    ### Per-event access, used by EventView and ArgsView
+    ### ------------------------------------------------------------------
+
+    def _pop_sparse(self, sparse, key, row):
+        rows = sparse.get(key)
+        if rows is not None:
+            rows.pop(row, None)
+
+    def _get(self, row, key, default=_MISSING):
+        cols = self._cols
+        if key in EVENT_NUM_KEYS:
+            value = cols[key][row]
+            if value == value:
+                return _num_value(value)
+        elif key in EVENT_STR_KEYS:
+            code = cols[key][row]
+            if code != CODE_NULL:
+                return self.values.values[code]
+        elif key == "args":
+            if cols["has_args"][row]:
+                return ArgsView(self, row)
+        rows = self.sparse.get(key)
+        if rows is not None:
+            return rows.get(row, default)
+        return default
+
+    def _set(self, row, key, value):
+        cols = self._cols
+        if key in EVENT_NUM_KEYS and _is_num(value):
+            cols[key][row] = value
+        elif key in EVENT_STR_KEYS and isinstance(value, _CODED_TYPES):
+            cols[key][row] = self.values.encode(value)
+        elif key == "args" and isinstance(value, Mapping):
+            if isinstance(value, ArgsView):
+                value = value.to_dict()
+            self._clear_args(row)
+            cols["has_args"][row] = True
+            for arg_key, arg_value in value.items():
+                self._set_arg(row, arg_key, arg_value)
+        else:
+            self._del_column(row, key)
+            self.sparse.setdefault(key, {})[row] = value
+            return
+        self._pop_sparse(self.sparse, key, row)
+
+    def _del_column(self, row, key):
+        ''' Clear the dedicated column of `key`, return True if it was set '''
+        cols = self._cols
+        if key in EVENT_NUM_KEYS:
+            existed = cols[key][row] == cols[key][row]
+            cols[key][row] = np.nan
+        elif key in EVENT_STR_KEYS:
+            existed = cols[key][row] != CODE_NULL
+            cols[key][row] = CODE_NULL
+        elif key == "args":
+            existed = bool(cols["has_args"][row])
+            self._clear_args(row)
+            cols["has_args"][row] = False
+        else:
+            existed = False
+        return existed
+
+    def _del(self, row, key):
+        existed = self._del_column(row, key)
+        rows = self.sparse.get(key)
+        if rows is not None and row in rows:
+            del rows[row]
+            existed = True
+        if not existed:
+            raise KeyError(key)
+
+    def _keys(self, row):
+        keys = [key for key in EVENT_KEY_ORDER if self._get(row, key) is not _MISSING]
+        for key, rows in self.sparse.items():
+            if row in rows and key not in EVENT_KEY_ORDER:
+                keys.append(key)
+        return keys
+
+    def _clear_args(self, row):
+        cols = self._cols
+        cols["args_name"][row] = CODE_NULL
+        for key in ARGS_INT_KEYS:
+            cols["args_" + key][row] = INT_NULL
+        for rows in self.sparse_args.values():
+            rows.pop(row, None)
+
+    def _get_arg(self, row, key, default=_MISSING):
+        if key == "name":
+            code = self._cols["args_name"][row]
+            if code != CODE_NULL:
+                return self.values.values[code]
+        elif key in ARGS_INT_KEYS:
+            value = self._cols["args_" + key][row]
+            if value != INT_NULL:
+                return int(value)
+        rows = self.sparse_args.get(key)
+        if rows is not None:
+            return rows.get(row, default)
+        return default
+
+    def _set_arg(self, row, key, value):
+        if key == "name" and isinstance(value, _CODED_TYPES):
+            self._cols["args_name"][row] = self.values.encode(value)
+        elif key in ARGS_INT_KEYS and _is_int(value) and value != INT_NULL:
+            self._cols["args_" + key][row] = value
+        else:
+            self._del_arg_column(row, key)
+            self.sparse_args.setdefault(key, {})[row] = value
+            return
+        self._pop_sparse(self.sparse_args, key, row)
+
+    def _del_arg_column(self, row, key):
+        cols = self._cols
+        if key == "name":
+            existed = cols["args_name"][row] != CODE_NULL
+            cols["args_name"][row] = CODE_NULL
+        elif key in ARGS_INT_KEYS:
+            existed = cols["args_" + key][row] != INT_NULL
+            cols["args_" + key][row] = INT_NULL
+        else:
+            existed = False
+        return existed
+
+    def _del_arg(self, row, key):
+        existed = self._del_arg_column(row, key)
+        rows = self.sparse_args.get(key)
+        if rows is not None and row in rows:
+            del rows[row]
+            existed = True
+        if not existed:
+            raise KeyError(key)
+
+    def _arg_keys(self, row):
+        keys = [key for key in ["name"] + ARGS_INT_KEYS if self._get_arg(row, key) is not _MISSING]
+        for key, rows in self.sparse_args.items():
+            if row in rows and key not in keys:
+                keys.append(key)
+        return keys
+
+    def event_dict(self, row):
+        ''' Return the event at `row` as a new dict '''
+        event = {}
+        for key in self._keys(row):
+            value = self._get(row, key)
+            event[key] = value.to_dict() if isinstance(value, ArgsView) else value
+        return event
+
+    ### ------------------------------------------------------------------
+    ### Bulk operations
+    ### ------------------------------------------------------------------
+
+    def to_dicts(self):
+        ''' Materialize all events as a list of dicts '''
+        table = np.empty(len(self.values.values) + 1, dtype=object)
+        table[:-1] = self.values.values
+        table[-1] = _MISSING
+        lists = []
+        for key in EVENT_KEY_ORDER[:-1]:
+            if key in EVENT_NUM_KEYS:
+                col = _num_column(self.column(key))
+                col[np.isnan(self.column(key))] = _MISSING
+                lists.append(col.tolist())
+            else:
+                lists.append(table[self.column(key)].tolist())
+        args_lists = [table[self.column("args_name")].tolist()]
+        for arg_key in ARGS_INT_KEYS:
+            col = self.column("args_" + arg_key)
+            _col = col.astype(object)
+            _col[col == INT_NULL] = _MISSING
+            args_lists.append(_col.tolist())
+        keys = EVENT_KEY_ORDER[:-1]
+        arg_keys = ["name"] + ARGS_INT_KEYS
+        traces = []
+        for row_values, has_args, arg_values in zip(zip(*lists),
+                self.column("has_args").tolist(), zip(*args_lists)):
+            if _MISSING in row_values:
+                event = dict((key, value) for key, value in zip(keys, row_values) if value is not _MISSING)
+            else:
+                event = dict(zip(keys, row_values))
+            if has_args:
+                if _MISSING in arg_values:
+                    event["args"] = dict((key, value) for key, value in zip(arg_keys, arg_values)
+                        if value is not _MISSING)
+                else:
+                    event["args"] = dict(zip(arg_keys, arg_values))
+            traces.append(event)
+        for key, rows in self.sparse_args.items():
+            for row, value in rows.items():
+                traces[row].setdefault("args", {})[key] = value
+        for key, rows in self.sparse.items():
+            for row, value in rows.items():
+                traces[row][key] = value
+        return traces
+
+    def match(self, key, predicate):
+        ''' Return a bool mask of events whose coded column `key` satisfies
+            `predicate(value)`, the predicate is evaluated once per distinct value
+        '''
+        col = self.column(key)
+        table = np.zeros(len(self.values.values) + 1, dtype=bool)
+        for code in np.unique(col).tolist():
+            if code != CODE_NULL:
+                table[code] = bool(predicate(self.values.values[code]))
+        return table[col]
+
+    def isin(self, key, values):
+        ''' Return a bool mask of events whose coded column `key` is one of `values` '''
+        if isinstance(values, _CODED_TYPES):
+            values = [values]
+        codes = [self.values.lookup(value) for value in values]
+        return np.isin(self.column(key), [code for code in codes if code != CODE_NULL])
+
+    def filter(self, mask=None, **conditions):
+        ''' Return a new EventList of the events selected by the bool `mask` and
+            `key=value(s)` conditions on coded columns, e.g., `filter(cat="Comm")`
+        '''
+        if mask is None:
+            mask = np.ones(self._size, dtype=bool)
+        else:
+            mask = np.asarray(mask, dtype=bool).copy()
+        for key, values in conditions.items():
+            mask &= self.isin(key, values)
+        return self.take(np.nonzero(mask)[0])
+
+    def take(self, rows):
+        ''' Return a new EventList of the events at `rows`, sharing the value dictionary '''
+        rows = np.asarray(rows, dtype=np.int64)
+        rst = EventList(values=self.values)
+        rst._data = self.data[rows]
+        rst._size = len(rows)
+        rst._bind()
+        row_map = np.full(self._size, -1, dtype=np.int64)
+        row_map[rows] = np.arange(len(rows))
+        rst.sparse = dict((key, dict(_rows)) for key, _rows in self.sparse.items())
+        rst.sparse_args = dict((key, dict(_rows)) for key, _rows in self.sparse_args.items())
+        _remap_rows(rst.sparse, row_map)
+        _remap_rows(rst.sparse_args, row_map)
+        return rst
+
+    def _sort_key(self, key):
+        if key in EVENT_NUM_KEYS or key in ["args_step", "args_cnt"]:
+            return self.column(key)
+        ### Rank codes by their values, so that the order is the same as sorting the dicts
+        col = self.column(key)
+        codes = np.unique(col)
+        codes = codes[codes != CODE_NULL].tolist()
+        rank = np.full(len(self.values.values) + 1, -1, dtype=np.int64)
+        rank[sorted(codes, key=lambda code: self.values.values[code])] = np.arange(len(codes))
+        return rank[col]
+
+    def argsort(self, keys=("ts", "name")):
+        ''' Return the stable order of events sorted by `keys`, e.g., ("ts", "name") '''
+        return np.lexsort([self._sort_key(key) for key in reversed(keys)])
+
+    def sort(self, keys=("ts", "name")):
+        ''' Sort events by `keys` in place '''
+        order = self.argsort(keys)
+        self._data[:self._size] = self.data[order]
+        row_map = np.empty(self._size, dtype=np.int64)
+        row_map[order] = np.arange(self._size)
+        _remap_rows(self.sparse, row_map)
+        _remap_rows(self.sparse_args, row_map)
+
+    def sorted(self, keys=("ts", "name")):
+        ''' Return a new sorted EventList, the events of `self` are not re-ordered '''
+        return self.take(self.argsort(keys))
+
+    def shift_ts(self, bias, key="pid"):
+        ''' Add `bias` to the timestamps in place. `bias` is a number, or a dict/callable
+            mapping the value of the coded column `key` (e.g., the pid of hosts) to the bias
+        '''
+        ts = self.column("ts")
+        if not isinstance(bias, Mapping) and not callable(bias):
+            ts += bias
+            return
+        col = self.column(key)
+        offsets = np.zeros(len(self.values.values) + 1, dtype=np.float64)
+        for code in np.unique(col).tolist():
+            if code == CODE_NULL:
+                continue
+            value = self.values.values[code]
+            offsets[code] = bias.get(value, 0) if isinstance(bias, Mapping) else bias(value)
+        ts += offsets[col]
+
+    def set_args_column(self, key, rows, values):
+        ''' Set `args[key]` of the events at `rows`, `key` is one of ARGS_INT_KEYS '''
+        assert key in ARGS_INT_KEYS, key
+        self._cols["args_" + key][rows] = values
+        self._cols["has_args"][rows] = True
+        sparse = self.sparse_args.get(key)
+        if sparse:
+            for row in np.asarray(rows).tolist():
+                sparse.pop(row, None)
+
+
+class EventView(MutableMapping):
+    ''' Dict-like view of one event of an EventList '''
+    __slots__ = ("_events", "_row")
+
+    def __init__(self, events, row):
+        self._events = events
+        self._row = row
+
+    def __getitem__(self, key):
+        value = self._events._get(self._row, key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        value = self._events._get(self._row, key)
+        return default if value is _MISSING else value
+
+    def __contains__(self, key):
+        return self._events._get(self._row, key) is not _MISSING
+
+    def __setitem__(self, key, value):
+        self._events._set(self._row, key, value)
+
+    def __delitem__(self, key):
+        self._events._del(self._row, key)
+
+    def __iter__(self):
+        return iter(self._events._keys(self._row))
+
+    def __len__(self):
+        return len(self._events._keys(self._row))
+
+    def to_dict(self):
+        return self._events.event_dict(self._row)
+
+    ### Used by ujson to serialize views
+    toDict = to_dict
+
+    def copy(self):
+        return self.to_dict()
+
+    def __copy__(self):
+        return self.to_dict()
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(self.to_dict(), memo)
+
+    def __reduce__(self):
+        return (dict, (self.to_dict(),))
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+class ArgsView(MutableMapping):
+    ''' Dict-like view of `args` of one event of an EventList '''
+    __slots__ = ("_events", "_row")
+
+    def __init__(self, events, row):
+        self._events = events
+        self._row = row
+
+    def __getitem__(self, key):
+        value = self._events._get_arg(self._row, key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        value = self._events._get_arg(self._row, key)
+        return default if value is _MISSING else value
+
+    def __contains__(self, key):
+        return self._events._get_arg(self._row, key) is not _MISSING
+
+    def __setitem__(self, key, value):
+        self._events._set_arg(self._row, key, value)
+
+    def __delitem__(self, key):
+        self._events._del_arg(self._row, key)
+
+    def __iter__(self):
+        return iter(self._events._arg_keys(self._row))
+
+    def __len__(self):
+        return len(self._events._arg_keys(self._row))
+
+    def to_dict(self):
+        return dict((key, self._events._get_arg(self._row, key)) for key in self._events._arg_keys(self._row))
+
+    toDict = to_dict
+
+    def copy(self):
+        return self.to_dict()
+
+    def __copy__(self):
+        return self.to_dict()
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(self.to_dict(), memo)
+
+    def __reduce__(self):
+        return (dict, (self.to_dict(),))
+
+    def __repr__(self):
+        return repr(self.to_dict())
@@ -0,0 +1,233 @@
+''' Graphs whose modifications can be committed or discarded
+
+Optimizers apply a strategy to a graph, evaluate it and keep the modified graph
+only if the strategy is accepted, while most strategies are rejected and only
+touch a few nodes. Instead of copying the whole graph for each proposal,
+`OverlayDiGraph.begin` starts an overlay on top of the current graph: additions
+and removals of nodes and edges, and changes of graph, node and edge attributes
+are recorded, and then merged into the base graph by `commit`, or reverted by
+`discard`, both in time proportional to the number of changes.
+
+Changes are applied in place and the journal keeps the previous values, so
+reading an OverlayDiGraph, e.g., by the replayer, is as fast as reading a
+networkx DiGraph. The order of keys of a dict is saved before the first key is
+removed from it, so that `discard` also restores the iteration order of nodes
+and edges, which decides tie-breaking in the replayer and the optimizers.
+NOTE: attribute values are not copied, so mutating a value in place, e.g.,
+appending to a list attribute, is not recorded.
+'''
+import functools
+import networkx as nx
+
+_MISSING = object()
+### The key of journal records saving the order of keys of a dict
+_ORDER = object()
+
+class OverlayJournal:
+    ''' Previous values of entries changed in the overlay, as a list of
+    (container, key, previous value), or None if no overlay is started '''
+    __slots__ = ("records", "ordered")
+
+    def __init__(self):
+        self.records = None
+        ### ids of dicts whose order of keys has been saved in the overlay
+        self.ordered = set()
+
+    def start(self):
+        self.records = []
+        self.ordered = set()
+
+    def stop(self):
+        self.records = None
+        self.ordered = set()
+
+    def __reduce__(self):
+        ### An overlay in progress is not pickled
+        return (OverlayJournal, ())
+
+    def rollback(self):
+        for container, key, value in reversed(self.records):
+            if key is _ORDER:
+                items = [(_key, dict.__getitem__(container, _key)) for _key in value]
+                dict.clear(container)
+                dict.update(container, items)
+            elif isinstance(container, dict):
+                if value is _MISSING:
+                    dict.pop(container, key, None)
+                else:
+                    dict.__setitem__(container, key, value)
+            elif isinstance(container, set):
+                if value is _MISSING:
+                    set.discard(container, key)
+                else:
+                    set.add(container, key)
+            else:
+                list.__setitem__(container, key, value)
+        self.stop()
+
+class JournaledDict(dict):
+    ''' A dict recording the previous value of an entry in the journal before changing it '''
+    __slots__ = ("journal", )
+
+    def __init__(self, journal, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.journal = journal
+
+    def __reduce__(self):
+        return (self.__class__, (self.journal, dict(self)))
+
+    def _record(self, key):
+        if self.journal.records is not None:
+            self.journal.records.append((self, key, dict.get(self, key, _MISSING)))
+
+    def _record_order(self):
+        ''' Save the order of keys before removing a key for the first time in the overlay '''
+        if self.journal.records is not None and id(self) not in self.journal.ordered:
+            self.journal.ordered.add(id(self))
+            self.journal.records.append((self, _ORDER, list(dict.keys(self))))
+
+    def __setitem__(self, key, value):
+        self._record(key)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        if key in self:
+            self._record_order()
+        self._record(key)
+        dict.__delitem__(self, key)
+
+    def update(self, *args, **kwargs):
+        if self.journal.records is None:
+            dict.update(self, *args, **kwargs)
+            return
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return dict.__getitem__(self, key)
+
+    def pop(self, key, *args):
+        if key in self:
+            self._record_order()
+            self._record(key)
+        return dict.pop(self, key, *args)
+
+    def popitem(self):
+        if len(self) > 0:
+            self._record_order()
+        key, value = dict.popitem(self)
+        if self.journal.records is not None:
+            self.journal.records.append((self, key, value))
+        return key, value
+
+    def clear(self):
+        if self.journal.records is not None:
+            self._record_order()
+            self.journal.records.extend([(self, key, value) for key, value in self.items()])
+        dict.clear(self)
+
+class JournaledSet(set):
+    ''' A set recording added and removed elements in the journal '''
+    __slots__ = ("journal", )
+
+    def __init__(self, journal, *args):
+        set.__init__(self, *args)
+        self.journal = journal
+
+    def __reduce__(self):
+        return (self.__class__, (self.journal, set(self)))
+
+    def add(self, key):
+        if self.journal.records is not None and key not in self:
+            self.journal.records.append((self, key, _MISSING))
+        set.add(self, key)
+
+    def discard(self, key):
+        if self.journal.records is not None and key in self:
+            self.journal.records.append((self, key, key))
+        set.discard(self, key)
+
+    def remove(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.discard(key)
+
+    def pop(self):
+        key = set.pop(self)
+        if self.journal.records is not None:
+            self.journal.records.append((self, key, key))
+        return key
+
+class JournaledList(list):
+    ''' A list recording the previous value of an item in the journal before
+    changing it, NOTE that only item assignment is supported in the overlay '''
+    __slots__ = ("journal", )
+
+    def __init__(self, journal, *args):
+        list.__init__(self, *args)
+        self.journal = journal
+
+    def __reduce__(self):
+        return (self.__class__, (self.journal, list(self)))
+
+    def __setitem__(self, idx, value):
+        if self.journal.records is not None:
+            self.journal.records.append((self, idx, list.__getitem__(self, idx)))
+        list.__setitem__(self, idx, value)
+
+class OverlayDiGraph(nx.DiGraph):
+    ''' A networkx DiGraph supporting overlays, see `begin`, `commit` and `discard`
+
+    All dicts of the graph, i.e., graph, node and edge attributes and adjacency
+    dicts, are `JournaledDict`s sharing the journal of the graph. Copies and
+    subgraphs of an OverlayDiGraph are OverlayDiGraphs with their own journals
+    '''
+    def __init__(self, incoming_graph_data=None, **attr):
+        self.journal = OverlayJournal()
+        factory = functools.partial(JournaledDict, self.journal)
+        self.graph_attr_dict_factory = factory
+        self.node_dict_factory = factory
+        self.node_attr_dict_factory = factory
+        self.adjlist_outer_dict_factory = factory
+        self.adjlist_inner_dict_factory = factory
+        self.edge_attr_dict_factory = factory
+        super(OverlayDiGraph, self).__init__(incoming_graph_data, **attr)
+
+    @property
+    def in_overlay(self):
+        return self.journal.records is not None
+
+    def overlay_size(self):
+        ''' Return the number of changes recorded in the overlay '''
+        return 0 if self.journal.records is None else len(self.journal.records)
+
+    def begin(self):
+        ''' Start recording changes, overlays can not be nested '''
+        if self.in_overlay:
+            raise RuntimeError("An overlay has already been started")
+        self.journal.start()
+
+    def commit(self):
+        ''' Keep the changes made in the overlay '''
+        self.journal.stop()
+
+    def discard(self):
+        ''' Revert the changes made in the overlay '''
+        if self.in_overlay:
+            self.journal.rollback()
+            ### Results cached by networkx may be computed in the overlay
+            cache = getattr(self, "__networkx_cache__", None)
+            if cache:
+                cache.clear()
+
+def as_overlay_graph(graph):
+    ''' Return `graph` if it supports overlays, otherwise an OverlayDiGraph copy of it '''
+    if isinstance(graph, OverlayDiGraph):
+        return graph
+    return OverlayDiGraph(graph)
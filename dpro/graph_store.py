@@ -0,0 +1,274 @@
+''' Binary on-disk format of dependency graphs, e.g., trail_dag and local_dfg
+
+Adjacency is saved in the CSR format and node/edge attributes as typed
+columns, so that a graph can be memory-mapped and rebuilt without parsing
+text. The store layout is
+    <dir>/
+        meta.json           # version, graph attributes, attribute column types
+        names.json          # node names, node id -> name
+        indptr.npy          # CSR, successors of node i are indices[indptr[i]:indptr[i+1]]
+        indices.npy
+        node_<key>.npy      # node attribute columns, in the order of node ids
+        edge_<key>.npy      # edge attribute columns, in the order of `indices`
+        <col>.has.npy       # (Optional) mask of nodes/edges with the attribute
+        <col>.int.npy       # (Optional) mask of Python ints in a float column
+Attribute values are stored as int64, float64, codes of strings or JSON blobs.
+'''
+import os
+import shutil
+import ujson as json
+import numpy as np
+import networkx as nx
+
+GRAPH_STORE_VERSION = 1
+
+CODE_NULL = -1
+
+
+def graph_store_exists(path):
+    meta_path = os.path.join(path, "meta.json")
+    if not os.path.isfile(meta_path):
+        return False
+    with open(meta_path, 'r') as fp:
+        meta = json.load(fp)
+    return meta.get("version") == GRAPH_STORE_VERSION
+
+
+def _is_int(value):
+    return isinstance(value, (int, np.integer)) and not isinstance(value, (bool, np.bool_))
+
+
+def _is_float(value):
+    return isinstance(value, (float, np.floating))
+
+
+def _to_json(value):
+    try:
+        return json.dumps(value)
+    except (TypeError, OverflowError):
+        return json.dumps(str(value))
+
+
+def _encode_column(values, strings):
+    ''' Encode a list of attribute values, None denotes a missing value.
+        Return the column type and a dict of arrays
+    '''
+    present = [v for v in values if v is not None]
+    arrays = {}
+    if len(present) < len(values):
+        arrays["has"] = np.array([v is not None for v in values], dtype=bool)
+    if all(_is_int(v) for v in present):
+        col_type = "int"
+        arrays["data"] = np.array([0 if v is None else v for v in values], dtype=np.int64)
+    elif all(_is_int(v) or _is_float(v) for v in present):
+        col_type = "float"
+        arrays["data"] = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+        is_int = np.array([_is_int(v) for v in values], dtype=bool)
+        if is_int.any():
+            arrays["int"] = is_int
+    elif all(isinstance(v, str) for v in present):
+        col_type = "str"
+        arrays["data"] = np.array([CODE_NULL if v is None else strings.encode(v) for v in values], dtype=np.int32)
+    else:
+        col_type = "json"
+        arrays["data"] = np.array([CODE_NULL if v is None else strings.encode(_to_json(v))
+            for v in values], dtype=np.int32)
+    return col_type, arrays
+
+
+def _decode_column(col_type, arrays, strings):
+    ''' Return the list of attribute values, None denotes a missing value '''
+    data = arrays["data"]
+    if col_type == "int":
+        values = data.tolist()
+    elif col_type == "float":
+        values = data.tolist()
+        if "int" in arrays:
+            for idx in np.nonzero(arrays["int"])[0].tolist():
+                values[idx] = int(values[idx])
+    elif col_type == "str":
+        values = [strings[code] for code in data.tolist()]
+    else:
+        values = [json.loads(strings[code]) for code in data.tolist()]
+    if "has" in arrays:
+        for idx in np.nonzero(~np.asarray(arrays["has"]))[0].tolist():
+            values[idx] = None
+    return values
+
+
+class _StringTable:
+    def __init__(self, strings=None):
+        self.strings = [] if strings is None else strings
+        self.str2code = {}
+
+    def encode(self, value):
+        code = self.str2code.get(value)
+        if code is None:
+            code = self.str2code[value] = len(self.strings)
+            self.strings.append(value)
+        return code
+
+
+class GraphStore:
+    ''' A directed graph in the CSR format with typed attribute columns
+
+    `columns` maps column names to arrays (memory-mapped after `load`),
+    `meta["node_attrs"]`/`meta["edge_attrs"]` map attribute keys to column types.
+    '''
+    def __init__(self, names, columns, strings, meta):
+        self.names = names
+        self.columns = columns
+        self.strings = strings
+        self.meta = meta
+        self._name2id = None
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def edge_num(self):
+        return len(self.columns["indices"])
+
+    def node_id(self, name):
+        if self._name2id is None:
+            self._name2id = dict((name, idx) for idx, name in enumerate(self.names))
+        return self._name2id[name]
+
+    def successors(self, name):
+        idx = self.node_id(name)
+        indptr = self.columns["indptr"]
+        return [self.names[i] for i in self.columns["indices"][indptr[idx]:indptr[idx+1]].tolist()]
+
+    def _attr_arrays(self, prefix, key):
+        col = "{}_{}".format(prefix, key)
+        arrays = {"data": self.columns[col]}
+        for sub in ["has", "int"]:
+            if col + "." + sub in self.columns:
+                arrays[sub] = self.columns[col + "." + sub]
+        return arrays
+
+    def node_attr(self, key):
+        ''' Return the values of a node attribute, in the order of node ids '''
+        return _decode_column(self.meta["node_attrs"][key], self._attr_arrays("node", key), self.strings)
+
+    def edge_attr(self, key):
+        ''' Return the values of an edge attribute, in the CSR order '''
+        return _decode_column(self.meta["edge_attrs"][key], self._attr_arrays("edge", key), self.strings)
+
+    ### ------------------------------------------------------------------
+    ### Conversion
+    ### ------------------------------------------------------------------
+
+    @staticmethod
+    def from_networkx(graph):
+        if not isinstance(graph, nx.DiGraph) or graph.is_multigraph():
+            raise ValueError("Only nx.DiGraph is supported, got {}".format(type(graph)))
+        strings = _StringTable()
+        names = list(graph.nodes)
+        name2id = dict((name, idx) for idx, name in enumerate(names))
+        indptr = np.zeros(len(names) + 1, dtype=np.int64)
+        indices = []
+        edge_data = []
+        for idx, name in enumerate(names):
+            for succ, _dict in graph.adj[name].items():
+                indices.append(name2id[succ])
+                edge_data.append(_dict)
+            indptr[idx + 1] = len(indices)
+        columns = {"indptr": indptr, "indices": np.array(indices, dtype=np.int32)}
+        meta = {
+            "version": GRAPH_STORE_VERSION,
+            "graph": json.loads(_to_json(graph.graph)),
+            "node_attrs": GraphStore._encode_attrs(
+                "node", [graph.nodes[name] for name in names], columns, strings),
+            "edge_attrs": GraphStore._encode_attrs("edge", edge_data, columns, strings)
+        }
+        meta["columns"] = sorted(columns.keys())
+        return GraphStore(names, columns, strings.strings, meta)
+
+    @staticmethod
+    def _encode_attrs(prefix, data_list, columns, strings):
+        keys = {}
+        for _dict in data_list:
+            for key in _dict:
+                keys[key] = None
+        attrs = {}
+        for key in keys:
+            col_type, arrays = _encode_column([_dict.get(key) for _dict in data_list], strings)
+            col = "{}_{}".format(prefix, key)
+            columns[col] = arrays.pop("data")
+            for sub, array in arrays.items():
+                columns[col + "." + sub] = array
+            attrs[key] = col_type
+        return attrs
+
+    def to_networkx(self):
+        graph = nx.DiGraph()
+        graph.graph.update(self.meta["graph"])
+        node_attrs = dict((key, self.node_attr(key)) for key in self.meta["node_attrs"])
+        node_data = [{} for _ in self.names]
+        for key, values in node_attrs.items():
+            for _dict, value in zip(node_data, values):
+                if value is not None:
+                    _dict[key] = value
+        graph.add_nodes_from(zip(self.names, node_data))
+
+        indptr = self.columns["indptr"]
+        sources = np.repeat(np.arange(len(self.names)), np.diff(indptr)).tolist()
+        targets = self.columns["indices"].tolist()
+        edge_data = [{} for _ in targets]
+        for key in self.meta["edge_attrs"]:
+            for _dict, value in zip(edge_data, self.edge_attr(key)):
+                if value is not None:
+                    _dict[key] = value
+        graph.add_edges_from((self.names[u], self.names[v], _dict)
+            for u, v, _dict in zip(sources, targets, edge_data))
+        return graph
+
+    ### ------------------------------------------------------------------
+    ### Serialization
+    ### ------------------------------------------------------------------
+
+    def dump(self, path):
+        tmp_dir = path + ".tmp"
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        for key, column in self.columns.items():
+            np.save(os.path.join(tmp_dir, key + ".npy"), np.ascontiguousarray(column))
+        with open(os.path.join(tmp_dir, "names.json"), 'w') as fp:
+            json.dump({"names": self.names, "strings": self.strings}, fp)
+        ### meta.json is written at last, the store is invalid without it
+        with open(os.path.join(tmp_dir, "meta.json"), 'w') as fp:
+            json.dump(self.meta, fp)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(tmp_dir, path)
+
+    @staticmethod
+    def load(path, mmap=True):
+        with open(os.path.join(path, "meta.json"), 'r') as fp:
+            meta = json.load(fp)
+        if meta.get("version") != GRAPH_STORE_VERSION:
+            raise ValueError("Graph store version mismatch: {} vs {}".format(
+                meta.get("version"), GRAPH_STORE_VERSION))
+        with open(os.path.join(path, "names.json"), 'r') as fp:
+            names = json.load(fp)
+        columns = {}
+        for key in meta["columns"]:
+            columns[key] = np.load(os.path.join(path, key + ".npy"),
+                mmap_mode="r" if mmap else None)
+        return GraphStore(names["names"], columns, names["strings"], meta)
+
+
+def dump_graph(graph, path, gml_path=None):
+    ''' Dump a graph to the binary store at `path`, and also to GML if `gml_path` is given '''
+    GraphStore.from_networkx(graph).dump(path)
+    if gml_path is not None:
+        nx.write_gml(graph, gml_path, lambda x: str(x))
+
+
+def read_graph(path):
+    ''' Read a graph from the binary store or, for legacy trials, a GML file '''
+    if os.path.isdir(path):
+        return GraphStore.load(path).to_networkx()
+    return nx.read_gml(path)
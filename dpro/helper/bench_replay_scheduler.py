@@ -0,0 +1,148 @@
+''' Benchmark the heap-based scheduler of the Replayer against the list-based one
+    * Usage
+    python3 -m dpro.helper.bench_replay_scheduler --node_nums 10000,100000,1000000 --rank_num 64
+    Synthetic DAGs of `rank_num` ranks are generated, each rank runs FW/BW/UPDATE
+    ops of each layer and the gradients are synchronized in a ring with
+    Sync/SEND/RECV ops. Both schedulers must generate identical traces. The time
+    of a repeated replay, which reuses the compiled replay plan, is also reported.
+    Each scheduler is warmed up once, e.g., node names are interned by the first
+    replay, and the best of `repeat` replays is reported.
+'''
+import os
+import time
+import random
+import argparse
+import networkx as nx
+
+from dpro.logger_utils import SingleLogger
+from dpro.trace_utils import gen_long_name
+from dpro.replay import Replayer, ret_priority
+
+parser = argparse.ArgumentParser(description="Benchmark of the Replayer scheduler")
+parser.add_argument("--node_nums", type=str, default="10000,100000",
+    help="Approximate numbers of nodes of the DAGs, separated with comma")
+parser.add_argument("--rank_num", type=int, default=8, help="Number of ranks")
+parser.add_argument("--legacy_max_nodes", type=int, default=200000,
+    help="Do not run the list-based scheduler on larger DAGs, it takes too long")
+parser.add_argument("--repeat", type=int, default=3, help="Number of timed replays of each scheduler")
+parser.add_argument("--seed", type=int, default=0)
+
+
+class ListSchedulerReplayer(Replayer):
+    ''' The list-based scheduler before the heap-based one, only used as the baseline
+        * Ready queues are kept sorted with `insort_right`, O(n) per insertion
+        * Devices are sorted by the device time every time a node is popped
+    '''
+    def pop_one_node_exec(self, step_idx):
+        sorted_device = sorted(self.device_dict.values(), key=lambda x: x.device_time)
+        for device in sorted_device:
+            if len(device.queue) == 0:
+                continue
+            (n, t) = device.queue.pop(0)
+            if self.recd_topo_order:
+                self.topo_ord.append((n, t))
+            self.record_queue_status(t)
+            device.exct(n, t, step_idx)
+            return 0
+        return 1
+
+    def push_device(self, device):
+        pass
+
+    def insert_node_idx(self, idx, t):
+        n = self.plan.nodes[idx]
+        device = self.name2device(n)
+        self.insort_right(device.queue, (n, t), func=self._a_has_larger_prior)
+
+    def insort_right(self, a, x, lo=0, hi=None, func=None):
+        hi = len(a) if hi is None else hi
+        while lo < hi:
+            mid = (lo+hi)//2
+            if func(x, a[mid]):
+                hi = mid
+            else:
+                lo = mid+1
+        a.insert(lo, x)
+
+    def _a_has_larger_prior(self, _a, _b):
+        _ap = ret_priority(_a[0])
+        _bp = ret_priority(_b[0])
+        if _ap == _bp:
+            return _a[1] < _b[1]
+        else:
+            return _ap < _bp
+
+
+def gen_dag(node_num, rank_num, seed=0):
+    random.seed(seed)
+    layer_num = max(1, node_num // (6 * rank_num))
+    pids = ["host%d.rank%d" % (rank // 8, rank % 8) for rank in range(rank_num)]
+    dag = nx.DiGraph()
+
+    def add_node(pid, name, avg):
+        node = gen_long_name(pid, name)
+        dag.add_node(node, avg=avg)
+        return node
+
+    for rank, pid in enumerate(pids):
+        fw_nodes = [add_node(pid, "FW.layer%d" % l, random.uniform(0.01, 1)) for l in range(layer_num)]
+        bw_nodes = [add_node(pid, "BW.layer%d" % l, random.uniform(0.01, 2)) for l in range(layer_num)]
+        update_nodes = [add_node(pid, "UPDATE_.layer%d" % l, random.uniform(0.01, 0.2)) for l in range(layer_num)]
+        dag.add_edges_from(zip(fw_nodes[:-1], fw_nodes[1:]))
+        dag.add_edge(fw_nodes[-1], bw_nodes[-1])
+        dag.add_edges_from(zip(bw_nodes[1:], bw_nodes[:-1]))
+        for l in range(layer_num):
+            sync = add_node(pid, "Comm.layer%d.Sync" % l, random.uniform(0.01, 0.1))
+            send = add_node(pid, "Comm.layer%d.SEND" % l, random.uniform(0.05, 1))
+            dag.add_edge(bw_nodes[l], sync)
+            dag.add_edge(sync, send)
+    ### Ring synchronization, RECV of rank r + 1 depends on SEND of rank r
+    for rank, pid in enumerate(pids):
+        next_pid = pids[(rank + 1) % rank_num]
+        for l in range(layer_num):
+            recv = add_node(next_pid, "Comm.layer%d.RECV" % l, random.uniform(0.05, 1))
+            dag.add_edge(gen_long_name(pid, "Comm.layer%d.SEND" % l), recv)
+            dag.add_edge(recv, gen_long_name(next_pid, "UPDATE_.layer%d" % l))
+            dag.add_edge(gen_long_name(next_pid, "BW.layer%d" % l), gen_long_name(next_pid, "UPDATE_.layer%d" % l))
+    return dag
+
+
+def run(replayer_cls, dag, dump_path, repeat=1):
+    best = None
+    for _ in range(repeat + 1):
+        replayer = replayer_cls(dag=dag, _step_num=1, dump_path=dump_path, comm_backend="default", partial=True)
+        ts_ = time.time()
+        step_end_time = replayer.replay(_output=False)
+        dur = time.time() - ts_
+        if _ > 0:
+            best = dur if best is None else min(best, dur)
+    return best, dict(step_end_time), replayer.rst_traces
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    SingleLogger(os.path.abspath("."), "bench", "WARN")
+    for node_num in [int(n) for n in args.node_nums.split(",")]:
+        dag = gen_dag(node_num, args.rank_num, args.seed)
+        heap_time, heap_end, heap_traces = run(Replayer, dag, ".", args.repeat)
+        print("{} nodes, {} ranks, heap scheduler: {:.3f} s".format(
+            len(dag), args.rank_num, heap_time))
+        ### The replay plan is compiled once and reused by following replays
+        replayer = Replayer(dag=dag, _step_num=1, dump_path=".", comm_backend="default", partial=True)
+        replayer.replayAndDelay(None)
+        repeated_time = None
+        for _ in range(args.repeat):
+            ts_ = time.time()
+            replayer.replayAndDelay(None)
+            repeated_time = time.time() - ts_ if repeated_time is None else min(repeated_time, time.time() - ts_)
+        print("{} nodes, {} ranks, heap scheduler, repeated replay: {:.3f} s".format(
+            len(dag), args.rank_num, repeated_time))
+        assert replayer.rst_traces.to_dicts() == heap_traces.to_dicts(), "traces of repeated replays mismatch"
+        if len(dag) > args.legacy_max_nodes:
+            continue
+        list_time, list_end, list_traces = run(ListSchedulerReplayer, dag, ".", args.repeat)
+        print("{} nodes, {} ranks, list scheduler: {:.3f} s, speedup: {:.2f}x".format(
+            len(dag), args.rank_num, list_time, list_time / heap_time))
+        assert heap_end == list_end, "step end time mismatches"
+        assert heap_traces.to_dicts() == list_traces.to_dicts(), "traces mismatch"
+        print("Replayed traces are identical")
@@ -0,0 +1,342 @@
+''' Benchmark suite of trace collection, replay and strategy search over synthetic trials
+    * Usage
+    python3 -m dpro.helper.bench_suite --rank_nums 8,32 --layer_nums 50,200 --topologies ring,tree,ps --output bench.json
+    python3 -m dpro.helper.bench_suite --baseline last_bench.json --max_slowdown 1.2
+
+    For each combination of the rank number, layer number and topology, a trial is
+    generated with dpro/helper/synthetic_trial.py and the following stages are timed
+    * collect: build TraceManager statistic, the trail DAG with
+        `Collector.collect_trial_dag`, fine-tune it and dump traces/graphs. Ring only,
+        the synthetic generator only emits the NCCL metadata of ring trials, trail DAGs
+        of tree and ps trials are generated directly
+    * replay: `Replayer.replay` of `--step_num` steps
+    * replay_symmetric: the same replay with the rank symmetry, the error of the
+        iteration time against the full replay is also reported
+    * optimize: one search step as the optimizer does, i.e., select a candidate from
+        the critical path of the last evaluation, fuse two computation ops on all
+        ranks and evaluate the new DAG by a full replay
+    * optimize_incremental: the same step, evaluated by `Replayer.replay_incremental`
+    * check_incremental: apply `--check_fusion_num` random fusions one after another,
+        evaluate each DAG by `Replayer.replay_incremental` and by a full replay, the
+        step end time, traces and the execution graph must be identical. The suite
+        exits with an error if any of them mismatches
+    The wall time, the peak RSS of the process so far and events per second are
+    reported. Each trial is benchmarked in its own process so that peak RSS is not
+    affected by previous trials. The report is written as JSON, which can be given
+    to `--baseline` later to track regressions.
+'''
+import os
+import sys
+import time
+import platform
+import resource
+import argparse
+import random
+import tempfile
+import itertools
+import multiprocessing
+import ujson as json
+
+from dpro.logger_utils import SingleLogger
+from dpro.trace_utils import gen_long_name, parse_pid_from_name, parse_rawname, \
+    parse_cat_fine_grained, FileName, QueueType
+from dpro.graph_store import dump_graph
+from dpro.replay import Replayer
+from dpro.helper.synthetic_trial import SyntheticTrial
+
+BENCH_REPORT_VERSION = 1
+### Initialize the singleton as analyze.py does
+QueueType("NCCL")
+
+parser = argparse.ArgumentParser(description="Benchmark suite over synthetic trials")
+parser.add_argument("--rank_nums", type=str, default="8", help="Numbers of ranks, separated with comma")
+parser.add_argument("--layer_nums", type=str, default="50", help="Numbers of layers, separated with comma")
+parser.add_argument("--tensor_num", type=int, default=None, help="Number of tensors, default: 2 tensors per layer")
+parser.add_argument("--topologies", type=str, default="ring,tree,ps", help="Communication topologies, separated with comma")
+parser.add_argument("--fusion_num", type=int, default=1, help="Number of tensors fused into one group")
+parser.add_argument("--channel_num", type=int, default=1, help="Number of NCCL channels")
+parser.add_argument("--server_num", type=int, default=None, help="Number of parameter servers, default: one per host")
+parser.add_argument("--trace_step_num", type=int, default=3, help="Number of steps of the synthetic traces")
+parser.add_argument("--step_num", type=int, default=1, help="Number of steps to replay")
+parser.add_argument("--symmetry_rtol", type=float, default=0.05, help="Relative tolerance of equivalent ranks in the replay_symmetric stage")
+parser.add_argument("--check_fusion_num", type=int, default=5, help="Number of random fusions in the check_incremental stage")
+parser.add_argument("--dag_workers", type=int, default=1, help="Number of processes used to build local DAGs")
+parser.add_argument("--workspace", type=str, default=None, help="Directory to dump trials, default: a temporary directory")
+parser.add_argument("--output", type=str, default="bench_report.json", help="Path of the JSON report")
+parser.add_argument("--baseline", type=str, default=None, help="A previous JSON report to compare with")
+parser.add_argument("--max_slowdown", type=float, default=None,
+    help="Exit with an error if the wall time of any stage exceeds `max_slowdown` times that of the baseline")
+parser.add_argument("--seed", type=int, default=0)
+
+
+def peak_rss_mb():
+    ### ru_maxrss is in KB on Linux, in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024. ** 2 if sys.platform == "darwin" else 1024.)
+
+def stage_result(wall_time, event_num, **kwargs):
+    result = {
+        "wall_time": wall_time,
+        "peak_rss_mb": peak_rss_mb(),
+        "events": event_num,
+        "events_per_s": event_num / wall_time if wall_time > 0 else None
+    }
+    result.update(kwargs)
+    return result
+
+def fusion_candidate(dag, critical_path):
+    ''' Return the first two successive FW or BW ops on the critical path which can
+        be fused without introducing cycles, i.e., (u, v) where u only has the
+        successor v or v only has the predecessor u '''
+    for (u, _), (v, _) in zip(critical_path[:-1], critical_path[1:]):
+        if not dag.has_edge(u, v) or parse_pid_from_name(u) != parse_pid_from_name(v):
+            continue
+        cat = parse_cat_fine_grained(u)
+        if cat not in ("operator.FW", "operator.BW") or parse_cat_fine_grained(v) != cat:
+            continue
+        if dag.out_degree(u) == 1 or dag.in_degree(v) == 1:
+            return u, v
+    return None
+
+def random_fusion_candidate(dag, rng):
+    ''' Return random two successive FW or BW ops which can be fused, see `fusion_candidate` '''
+    candidates = []
+    for u, v in dag.edges:
+        cat = parse_cat_fine_grained(u)
+        if cat not in ("operator.FW", "operator.BW") or parse_cat_fine_grained(v) != cat \
+                or parse_pid_from_name(u) != parse_pid_from_name(v):
+            continue
+        if dag.out_degree(u) == 1 or dag.in_degree(v) == 1:
+            candidates.append((u, v))
+    return rng.choice(candidates) if len(candidates) > 0 else None
+
+def fuse_ops(dag, u, v):
+    ''' Fuse op `u` and its successor `v` of all ranks, return the new DAG '''
+    new_dag = dag.copy()
+    raw_u, raw_v = parse_rawname(u), parse_rawname(v)
+    pids = set([parse_pid_from_name(n) for n in dag.nodes])
+    for pid in sorted(pids):
+        _u, _v = gen_long_name(pid, raw_u), gen_long_name(pid, raw_v)
+        if _u not in new_dag or _v not in new_dag:
+            continue
+        fused = gen_long_name(pid, raw_u + "+" + raw_v)
+        ### Kernels are launched once for the fused op
+        new_dag.add_node(fused, avg=0.9 * (new_dag.nodes[_u]["avg"] + new_dag.nodes[_v]["avg"]))
+        new_dag.add_edges_from([(pred, fused) for pred in new_dag.predecessors(_u)])
+        new_dag.add_edges_from([(pred, fused) for pred in new_dag.predecessors(_v) if pred != _u])
+        new_dag.add_edges_from([(fused, succ) for succ in new_dag.successors(_u) if succ != _v])
+        new_dag.add_edges_from([(fused, succ) for succ in new_dag.successors(_v)])
+        new_dag.remove_nodes_from([_u, _v])
+    return new_dag
+
+def bench_collect(trial, trial_path, dag_workers):
+    clct_path = os.path.join(trial_path, "trial")
+    traces = trial.traces()
+    ts_ = time.time()
+    clct = trial.collector(clct_path, traces=traces, dag_workers=dag_workers)
+    clct.collect_trial_dag()
+    clct.fine_tune_trace_dag()
+    clct.traceM.dump(clct.pm.path)
+    dump_graph(clct.trail_dag, os.path.join(clct.pm.path, FileName.TRAIL_DAG_STORE.value))
+    dump_graph(clct.dag, os.path.join(clct.pm.path, FileName.LOCAL_DFG_STORE.value))
+    return clct, stage_result(time.time() - ts_, len(traces))
+
+def bench_optimize(dag, replayer_kwargs, incremental):
+    ''' One search step based on the evaluation of `dag` '''
+    if incremental:
+        replayer = Replayer(dag=dag, _step_num=1, incremental=True, **replayer_kwargs)
+        replayer.replay_incremental(dag, None, _output=False, verbose=False)
+    else:
+        replayer = Replayer(dag=dag, _step_num=1, **replayer_kwargs)
+        replayer.replayAndDelay(None, _output=False, verbose=False)
+    ts_ = time.time()
+    critical_path = replayer.exct_record.critical_path()
+    candidate = fusion_candidate(dag, critical_path)
+    if candidate is None:
+        return {"skipped": "no fusible ops on the critical path"}
+    new_dag = fuse_ops(dag, *candidate)
+    if incremental:
+        step_end_time = replayer.replay_incremental(new_dag, None, _output=False, verbose=False)
+    else:
+        replayer = Replayer(dag=new_dag, _step_num=1, **replayer_kwargs)
+        step_end_time = replayer.replayAndDelay(None, _output=False, verbose=False)
+    return stage_result(time.time() - ts_, len(replayer.rst_traces),
+        iter_time_ms=max(step_end_time.values()) / 1000.,
+        candidate=[parse_rawname(n) for n in candidate])
+
+def replay_outputs(replayer, step_end_time):
+    ''' Outputs of a replay which must not depend on how the DAG is replayed '''
+    return (dict(step_end_time), replayer.rst_traces.to_dicts(),
+        sorted((u, v, attrs.get("weight")) for u, v, attrs in replayer.exct_dag.edges(data=True)))
+
+def check_incremental(dag, replayer_kwargs, fusion_num, seed):
+    ''' Compare `Replayer.replay_incremental` with full replays on DAGs of random fusions '''
+    rng = random.Random(seed)
+    replayer = Replayer(dag=dag, _step_num=1, incremental=True, **replayer_kwargs)
+    replayer.replay_incremental(dag, None, _output=False, verbose=False)
+    incremental_time = full_time = 0
+    event_num = applied = 0
+    mismatches = []
+    for fusion_idx in range(fusion_num):
+        candidate = random_fusion_candidate(dag, rng)
+        if candidate is None:
+            break
+        applied += 1
+        dag = fuse_ops(dag, *candidate)
+        ts_ = time.time()
+        step_end_time = replayer.replay_incremental(dag, None, _output=False, verbose=False)
+        incremental_time += time.time() - ts_
+        event_num += len(replayer.rst_traces)
+        full_replayer = Replayer(dag=dag.copy(), _step_num=1, **replayer_kwargs)
+        ts_ = time.time()
+        full_step_end_time = full_replayer.replayAndDelay(None, _output=False, verbose=False)
+        full_time += time.time() - ts_
+        for name, rst, full_rst in zip(["step_end_time", "traces", "execution_graph"],
+                replay_outputs(replayer, step_end_time), replay_outputs(full_replayer, full_step_end_time)):
+            if rst != full_rst:
+                mismatches.append("fusion {} ({}): {}".format(fusion_idx, "+".join(parse_rawname(n) for n in candidate), name))
+    if len(mismatches) > 0:
+        SingleLogger().error("Incremental replay mismatches the full replay: {}".format(mismatches))
+    return stage_result(incremental_time, event_num, full_wall_time=full_time,
+        fusion_num=applied, mismatches=mismatches)
+
+def run_case(trial_kwargs, args, trial_path):
+    ''' Benchmark one trial, return a dict of results of each stage '''
+    trial = SyntheticTrial(**trial_kwargs)
+    stages = {}
+    if trial.topology == "ring":
+        clct, stages["collect"] = bench_collect(trial, trial_path, args.dag_workers)
+        dag = clct.trail_dag
+        replayer_kwargs = {"leaf_dirs": clct.all_prefix_list(), "dump_path": trial_path, "comm_backend": "NCCL"}
+    else:
+        stages["collect"] = {"skipped": "the synthetic generator only emits the NCCL metadata of ring trials"}
+        dag = trial.trail_dag()
+        replayer_kwargs = {"dump_path": trial_path, "comm_backend": "default"}
+
+    replayer = Replayer(dag=dag, _step_num=args.step_num, **replayer_kwargs)
+    ts_ = time.time()
+    step_end_time = replayer.replay(_output=False, verbose=False)
+    stages["replay"] = stage_result(time.time() - ts_, len(replayer.rst_traces),
+        iter_time_ms=max(step_end_time.values()) / 1000. / args.step_num)
+    del replayer
+
+    replayer = Replayer(dag=dag, _step_num=args.step_num, rank_symmetry=True,
+        symmetry_rtol=args.symmetry_rtol, **replayer_kwargs)
+    ts_ = time.time()
+    step_end_time = replayer.replay(_output=False, verbose=False)
+    stages["replay_symmetric"] = stage_result(time.time() - ts_, len(replayer.rst_traces),
+        iter_time_ms=max(step_end_time.values()) / 1000. / args.step_num,
+        class_num=len(replayer.symmetry.classes),
+        iter_time_error=abs(max(step_end_time.values()) / 1000. / args.step_num
+            - stages["replay"]["iter_time_ms"]) / stages["replay"]["iter_time_ms"])
+    del replayer
+
+    stages["optimize"] = bench_optimize(dag, replayer_kwargs, incremental=False)
+    stages["optimize_incremental"] = bench_optimize(dag, replayer_kwargs, incremental=True)
+    if stages["optimize"].get("iter_time_ms") != stages["optimize_incremental"].get("iter_time_ms"):
+        SingleLogger().error("Iteration time mismatches between full and incremental replay: {} vs {}".format(
+            stages["optimize"].get("iter_time_ms"), stages["optimize_incremental"].get("iter_time_ms")))
+    stages["check_incremental"] = check_incremental(dag, replayer_kwargs, args.check_fusion_num, args.seed)
+    return {"trial": trial.config(), "node_num": len(dag), "edge_num": dag.number_of_edges(), "stages": stages}
+
+def _run_case_in_process(conn, trial_kwargs, args, trial_path):
+    SingleLogger(trial_path, "bench", "ERROR")
+    conn.send(run_case(trial_kwargs, args, trial_path))
+    conn.close()
+
+def case_key(case):
+    return json.dumps(case["trial"], sort_keys=True)
+
+def case_label(case):
+    return "{} ranks, {} layers, {}".format(case["trial"]["rank_num"], case["trial"]["layer_num"], case["trial"]["topology"])
+
+def compare_with_baseline(report, baseline, max_slowdown=None):
+    ''' Print the wall time of each stage compared to the baseline, return False
+        if any stage slows down more than `max_slowdown` '''
+    base_cases = dict((case_key(case), case) for case in baseline["cases"])
+    passed = True
+    for case in report["cases"]:
+        base_case = base_cases.get(case_key(case))
+        if base_case is None:
+            continue
+        for stage, result in case["stages"].items():
+            base_result = base_case["stages"].get(stage, {})
+            if "wall_time" not in result or "wall_time" not in base_result:
+                continue
+            ratio = result["wall_time"] / base_result["wall_time"] if base_result["wall_time"] > 0 else float("inf")
+            flag = ""
+            if max_slowdown is not None and ratio > max_slowdown:
+                passed = False
+                flag = " <-- regression"
+            print("  {}, {}: {:.3f} s vs {:.3f} s ({:.2f}x){}".format(
+                case_label(case), stage, result["wall_time"], base_result["wall_time"], ratio, flag))
+    return passed
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    workspace = args.workspace or tempfile.mkdtemp(prefix="dpro_bench_")
+    SingleLogger(workspace, "bench", "ERROR")
+    report = {
+        "version": BENCH_REPORT_VERSION,
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "platform": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "node": platform.node(),
+            "cpu_count": os.cpu_count()
+        },
+        "args": vars(args),
+        "cases": []
+    }
+    for rank_num, layer_num, topology in itertools.product(
+            [int(n) for n in args.rank_nums.split(",")],
+            [int(n) for n in args.layer_nums.split(",")],
+            args.topologies.split(",")):
+        trial_kwargs = {
+            "rank_num": rank_num,
+            "layer_num": layer_num,
+            "tensor_num": args.tensor_num,
+            "topology": topology,
+            "fusion_num": args.fusion_num,
+            "channel_num": args.channel_num,
+            "server_num": args.server_num,
+            "step_num": args.trace_step_num,
+            "seed": args.seed
+        }
+        trial_path = os.path.join(workspace, "{}_{}ranks_{}layers".format(topology, rank_num, layer_num))
+        os.makedirs(trial_path, exist_ok=True)
+        recv_conn, send_conn = multiprocessing.Pipe(duplex=False)
+        p = multiprocessing.Process(target=_run_case_in_process, args=(send_conn, trial_kwargs, args, trial_path))
+        p.start()
+        send_conn.close()
+        try:
+            case = recv_conn.recv()
+        except EOFError:
+            raise RuntimeError("Fail to benchmark the trial {}, see logs under {}".format(trial_kwargs, trial_path))
+        p.join()
+        report["cases"].append(case)
+        print("{}: {} nodes".format(case_label(case), case["node_num"]))
+        for stage, result in case["stages"].items():
+            if "skipped" in result:
+                print("  {}: skipped, {}".format(stage, result["skipped"]))
+            else:
+                print("  {}: {:.3f} s, peak RSS {:.1f} MB, {:.0f} events/s".format(
+                    stage, result["wall_time"], result["peak_rss_mb"], result["events_per_s"] or 0))
+
+    with open(args.output, 'w') as fp:
+        json.dump(report, fp, indent=4)
+    print("Report is written to {}".format(args.output))
+
+    mismatched = [case_label(case) for case in report["cases"]
+        if len(case["stages"]["check_incremental"].get("mismatches", [])) > 0]
+    if len(mismatched) > 0:
+        print("Incremental replay mismatches the full replay: {}".format(", ".join(mismatched)))
+        sys.exit(1)
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as fp:
+            baseline = json.load(fp)
+        print("Compare with {} ({})".format(args.baseline, baseline.get("date")))
+        if not compare_with_baseline(report, baseline, args.max_slowdown):
+            sys.exit(1)
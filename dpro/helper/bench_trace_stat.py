@@ -0,0 +1,282 @@
+''' Benchmark TraceManager.ret_stat against the event-by-event implementation
+    * Usage
+    python3 -m dpro.helper.bench_trace_stat --event_num 10000000 --pid_num 64
+    Synthetic traces of `pid_num` ranks are generated, each rank runs FW/BW/UPDATE
+    ops and some Sync ops every step. Use `--skip_legacy` to only time `ret_stat`,
+    use `--event_list` to keep events in an EventList instead of a list of dicts
+'''
+import os
+import sys
+import time
+import copy
+import random
+import argparse
+
+from dpro.logger_utils import SingleLogger
+from dpro.trace_utils import TraceManager, DirLevel, CatName, MAX_CNT, \
+    parse_cat_fine_grained, parse_cat_from_name, is_standard_pid
+from dpro.event_list import EventList
+
+parser = argparse.ArgumentParser(description="Benchmark of TraceManager.ret_stat")
+parser.add_argument("--event_num", type=int, default=1000000, help="Approximate number of events")
+parser.add_argument("--pid_num", type=int, default=8, help="Number of ranks")
+parser.add_argument("--op_num", type=int, default=200, help="Number of FW ops per step")
+parser.add_argument("--skip_legacy", action="store_true", help="Do not run the event-by-event implementation")
+parser.add_argument("--event_list", action="store_true", help="Keep events in an EventList")
+parser.add_argument("--seed", type=int, default=0)
+
+def gen_traces(event_num, pid_num, op_num, seed=0):
+    random.seed(seed)
+    names = ["FW.op%d" % i for i in range(op_num)] + \
+        ["BW.op%d" % i for i in range(op_num)] + \
+        ["UPDATE_.op%d" % i for i in range(op_num // 4)]
+    step_num = max(2, event_num // (pid_num * (len(names) + op_num // 4)))
+    traces = []
+    for rank in range(pid_num):
+        pid = "host%d.rank%d" % (rank // 8, rank % 8)
+        ts = random.randint(0, 1000)
+        for step in range(step_num):
+            for idx, name in enumerate(names):
+                dur = random.randint(10, 500)
+                traces.append({"name": name, "ts": ts, "dur": dur, "pid": pid, "tid": "operator0",
+                    "cat": "operator", "ph": "X", "args": {"name": name}})
+                ts += dur + random.randint(0, 20)
+                if name.startswith("BW") and idx % 4 == 0:
+                    comm = "Comm.%d.Sync" % idx
+                    traces.append({"name": comm, "ts": ts, "dur": dur, "pid": pid, "tid": "comm",
+                        "cat": "Comm", "ph": "X", "args": {"name": comm}})
+            ts += 10000
+    return sorted(traces, key=lambda x: (x["ts"], x["name"]))
+
+def ret_stat_iterative(traceM):
+    """ The event-by-event implementation of `TraceManager.ret_stat`, used as the baseline
+        1. Basic Statistic;
+        2. add step field
+        3. iteration time
+    """
+    traceM.name2sta = {}
+    traceM.cat2sta = {}
+    prefix_dict = {}
+
+    ### Step 1: tranvers all traces
+    for event in traceM.traces:
+        if traceM._is_ignore_for_sta(event):
+            continue
+        prefix = event["pid"]
+        if prefix not in prefix_dict:
+            prefix_dict[prefix] = {
+                "cat_cnt": {"operator.FW": 0, "operator.BW": 0, "operator.UPDATE": 0},
+                "step_cnt": 0,
+                "time_base": None,
+
+                "trace_name_cursor": None,
+                "time_cursor": None,
+                "step_start_ts": None,
+                "fw_end": None,
+                "bw_start": None,
+                "bw_end": None,
+
+                ### used for calculating iteration time, and fw time
+                "cur_step": None,
+
+                "fw_multi_steps": [],
+                "bw_multi_steps": [],
+                "update_multi_steps": [],
+                "iter_multi_steps": [],                    
+            }
+        cat = parse_cat_fine_grained(event["name"])
+
+        ### statistic info
+        unique_name = traceM.ret_unique_name(event)
+        if unique_name in traceM.name2sta:
+            if MAX_CNT is not None and traceM.name2sta[unique_name]["cnt"] >= MAX_CNT:
+                event["args"]["cnt"] = -1
+                continue
+            traceM.name2sta[unique_name]["cnt"] += 1
+            traceM.name2sta[unique_name]["time"].append(event["dur"] / 1000.0)
+            traceM.name2sta[unique_name]["min_t"] = min(traceM.name2sta[unique_name]["min_t"], event["dur"] / 1000.0)
+            traceM.name2sta[unique_name]["max_t"] = max(traceM.name2sta[unique_name]["max_t"], event["dur"] / 1000.0)
+        else:
+            traceM.name2sta[unique_name] = {
+                "cnt": 1, 
+                "time": [event["dur"] / 1000.0], 
+                "min_t": event["dur"] / 1000.0, 
+                "max_t": event["dur"] / 1000.0,
+                "cat": cat,
+                "id": len(traceM.name2sta)
+                }
+        event["args"]["cnt"] = traceM.name2sta[unique_name]["cnt"] - 1
+
+        pid_info = prefix_dict[prefix]
+        if pid_info["time_base"] is None:
+            pid_info["time_base"] = event["ts"]
+        ### Add the `step` field
+        if "step" not in event["args"]:
+            ### TODO (huhanpeng): Can this adapt to MXNet
+            # if pid_info["time_cursor"] is None:
+            #     pass
+            # elif event["ts"] - pid_info["time_cursor"] - pid_info["time_base"] > ITER_GAP_LOWER_BOUND_US and \
+            #         cat in AS_START_CAT and \
+            #         pid_info["cat_cnt"]["operator.BW"] > 0 and \
+            #         pid_info["cat_cnt"]["operator.UPDATE"] > 0:
+            #     pid_info["step_cnt"] += 1
+
+            if "server_" in prefix:
+                ### For BytePS, Comm is not in the same pid as computation
+                event["args"]["step"] = -1
+                for ref_pid, ref_pid_info in prefix_dict.items():
+                    if "server_" not in ref_pid and "step_cnt" in ref_pid_info and ref_pid_info["step_cnt"] >= 0:
+                        event["args"]["step"] = ref_pid_info["step_cnt"]
+                        break
+            else:
+                event["args"]["step"] = pid_info["step_cnt"]
+        else:
+            ### For TensorFlow 2.4, step info is directly given the TF profiler
+            event["args"]["step"] = int(event["args"]["step"])
+            pid_info["step_cnt"] = event["args"]["step"]
+
+        ### Statistic time grouped by fine-grained cat
+        if parse_cat_from_name(event["name"]) in [CatName.OPERATOR.value,
+                                                    CatName.IO.value,
+                                                    CatName.PS_SERVER_OPERATOR.value]:
+            if cat not in pid_info["cat_cnt"]:
+                pid_info["cat_cnt"][cat] = 0
+            pid_info["cat_cnt"][cat] += event["dur"] / 1000.0
+        traceM.max_step = max(event["args"]["step"], traceM.max_step)
+
+        ### Calculate the iteration time
+        ### only check the iteration time when current node is FW/BW/UPDATE op
+        # * and for byteps traces, there exists pids in the form like server_3_t2....
+        #   do not need to calculate iteration time for those pids
+        if parse_cat_from_name(event["name"]) != CatName.OPERATOR.value or \
+                not is_standard_pid(prefix):
+            continue
+        if pid_info["cur_step"] is None:
+            ### initialization
+            pid_info["step_start_ts"] = event['ts'] - pid_info["time_base"]
+            pid_info["time_cursor"] = event['ts'] + event['dur'] - pid_info["time_base"]
+            pid_info["cur_step"] = event["args"]["step"]
+        elif pid_info["cur_step"] != event["args"]["step"]:
+            ### a new iteration
+            assert pid_info["step_start_ts"] is not None
+            if pid_info["cur_step"] == -1:
+                continue
+            assert event["args"]["step"] > pid_info["cur_step"], (event, pid_info)
+            pid_info["iter_multi_steps"].append((pid_info["time_cursor"] - pid_info["step_start_ts"]) / 1000.0)
+            try:
+                pid_info["fw_multi_steps"].append(pid_info["cat_cnt"]["operator.FW"])
+                pid_info["bw_multi_steps"].append(pid_info["cat_cnt"]["operator.BW"])
+                pid_info["update_multi_steps"].append(pid_info["cat_cnt"]["operator.UPDATE"])
+                pid_info["cat_cnt"]["operator.FW"] = pid_info["cat_cnt"]["operator.BW"] = pid_info["cat_cnt"]["operator.UPDATE"] = 0
+            except:
+                print(event, pid_info)
+                raise
+            assert pid_info["cur_step"] == len(pid_info["iter_multi_steps"]) - 1
+            SingleLogger().debug("%s - the %d th iteration: FW: %f, BW: %f, Iteration time: %f" % (prefix, len(pid_info["iter_multi_steps"]), pid_info["fw_multi_steps"][-1], pid_info["bw_multi_steps"][-1], pid_info["iter_multi_steps"][-1]))
+            pid_info["step_start_ts"] = event['ts'] - pid_info["time_base"]
+            pid_info["bw_start"] = None
+            pid_info["time_cursor"] = event['ts'] + event['dur'] - pid_info["time_base"]
+            pid_info["cur_step"] = event["args"]["step"]
+        else:
+            ### during an iteration
+            pid_info["time_cursor"] = event['ts'] + event['dur'] - pid_info["time_base"]
+
+            ### TODO (huhanpeng): change after fine-tune update
+            ### here we assume UPDATE is following the last BP op.
+            if "FW" in event["name"]:
+                if pid_info["step_start_ts"] is None:
+                    pid_info["step_start_ts"] = event['ts'] - pid_info["time_base"]
+                pid_info["fw_end"] = pid_info["time_cursor"]
+            if "BW" in event["name"]:
+                if pid_info["bw_start"] is None:
+                    pid_info["bw_start"] = event['ts'] - pid_info["time_base"]
+                pid_info["bw_end"] = pid_info["time_cursor"]
+
+        if "input_barrier" in unique_name:
+            pid_info["step_start_ts"] = None
+
+        if parse_cat_from_name(event["name"]) in [CatName.OPERATOR.value,
+                                                  CatName.IO.value,
+                                                  CatName.PS_SERVER_OPERATOR.value]:
+            pid_info["trace_name_cursor"] = event["name"]
+
+    traceM._stat_iter_time(prefix_dict)
+
+    ### Step 4: calculate the avg of each operator
+    for name, statistic in traceM.name2sta.items():
+        ### TODO (huhanpeng), var can be calculated directly with avg list
+        statistic["avg"] = sum(statistic["time"]) / statistic["cnt"]
+        statistic["median"] = sorted(statistic["time"])[int(statistic["cnt"]/2)]
+        statistic["var"] = 0.0
+
+        # assert statistic["time"] != 0
+        cat = parse_cat_fine_grained(name)
+        if cat in traceM.cat2sta:
+            if statistic["avg"] > traceM.cat2sta[cat]["max_t"]:
+                traceM.cat2sta[cat]["max_t"] = statistic["avg"]
+                traceM.cat2sta[cat]["max_name"] = name
+        else:
+            traceM.cat2sta[cat] = {"max_t": statistic["avg"], "max_name": name, "time": 0, "cnt": 0, "op_cnt":0}
+        traceM.cat2sta[cat]["time"] += sum(statistic["time"])
+        traceM.cat2sta[cat]["cnt"] += statistic["cnt"]
+        traceM.cat2sta[cat]["op_cnt"] += 1
+
+    for cat, statistic in traceM.cat2sta.items():
+        statistic["avg"] = statistic["time"] / statistic["cnt"]
+
+    ### Step 4: calculate the variance of each operator
+    for idx, event in enumerate(traceM.traces):
+        if traceM._is_ignore_for_sta(event):
+            continue
+        unique_name = traceM.ret_unique_name(event)
+        traceM.name2sta[unique_name]["var"] += pow(event["dur"] / 1000.0 - traceM.name2sta[unique_name]["avg"], 2)
+
+        ### record which steps this operator occurs in
+        if "step_ids" not in traceM.name2sta[unique_name]:
+            traceM.name2sta[unique_name]["step_ids"] = [None] * (traceM.max_step + 1)
+        traceM.name2sta[unique_name]["step_ids"][event["args"]["step"]] = idx
+
+    for name, statistic in traceM.name2sta.items():
+        statistic["var"] = statistic["var"] / float(statistic["cnt"])
+
+    traceM.all_prefix = list(prefix_dict.keys())
+
+def new_trace_manager(traces):
+    traceM = TraceManager()
+    traceM.traces = traces
+    traceM.dir_level = DirLevel.TRIAL
+    traceM.max_step = 0
+    traceM.opt_step = 0
+    traceM.iter_time = -1
+    return traceM
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    SingleLogger(os.path.abspath("."), "bench", "WARN")
+    traces = gen_traces(args.event_num, args.pid_num, args.op_num, args.seed)
+    print("Generate {} events of {} ranks".format(len(traces), args.pid_num))
+
+    legacy_traces = None if args.skip_legacy else copy.deepcopy(traces)
+    if args.event_list:
+        traces = EventList.from_dicts(traces)
+    traceM = new_trace_manager(traces)
+    ts_ = time.time()
+    traceM.ret_stat()
+    vec_time = time.time() - ts_
+    print("ret_stat: {:.3f} s".format(vec_time))
+    if args.skip_legacy:
+        sys.exit(0)
+
+    legacyM = new_trace_manager(legacy_traces)
+    ts_ = time.time()
+    ret_stat_iterative(legacyM)
+    legacy_time = time.time() - ts_
+    print("ret_stat_iterative: {:.3f} s, speedup: {:.2f}x".format(legacy_time, legacy_time / vec_time))
+
+    assert traceM.name2sta == legacyM.name2sta, "name2sta mismatches"
+    assert traceM.cat2sta == legacyM.cat2sta, "cat2sta mismatches"
+    assert (traceM.iter_time, traceM.opt_step, traceM.max_step) == \
+        (legacyM.iter_time, legacyM.opt_step, legacyM.max_step), "iteration time mismatches"
+    rst_traces = traceM.traces.to_dicts() if args.event_list else traceM.traces
+    assert rst_traces == legacyM.traces, "step/cnt fields mismatch"
+    print("name2sta, cat2sta, iteration time and events are identical")
@@ -0,0 +1,365 @@
+''' Synthetic trials, used to benchmark dPRO without real traces
+    * Usage
+    from dpro.helper.synthetic_trial import SyntheticTrial
+    trial = SyntheticTrial(rank_num=16, layer_num=50, tensor_num=100, topology="ring")
+    clct = trial.collector("/tmp/trial")    # ring only, inputs of the Collector
+    dag = trial.trail_dag()                 # tree/ps only, a trail DAG with `avg`
+
+    Each rank runs FW/BW ops of `layer_num` layers and one UPDATE op per tensor,
+    `tensor_num` gradients are fused into groups of `fusion_num` tensors and
+    synchronized with one of the following topologies
+    * ring: NCCL ring all-reduce, Sync -> QUEUE -> MEMCPY_IN_FUSION_BUFFER ->
+        2 * (rank_num - 1) steps of SEND/RECV -> MEMCPY_OUT_FUSION_BUFFER
+    * tree: NCCL tree all-reduce, gradients are reduced (RECV -> AGGR -> SEND) to
+        the root of the tree of each channel and then broadcast to the leaves
+    * ps: BytePS-like parameter servers, PUSH_REQ -> PUSH_RES -> PULL_REQ -> PULL_RES
+        on workers and COPY_FIRST -> SUM -> COPY_MERGED on `server_num` servers
+
+    Ring trials provide what the Collector parses from a trial directory, i.e., the
+    local DFG, the NCCL graph and per-rank traces, so that the trail DAG is built by
+    `Collector.collect_trial_dag`. Only the NCCL metadata of ring trials is emitted:
+    the chunk dependencies of the tree algorithm in `ncclGraph` are not implemented
+    yet and BytePS graphs are parsed from pcap/zmq/server logs, hence tree and ps
+    trials are generated as trail DAGs directly, using the same node names.
+'''
+import os
+import gzip
+import random
+import networkx as nx
+
+from dpro.trace_utils import gen_long_name, parse_cat_from_name, TraceManager, DirLevel, FileName
+from dpro.collect import Collector
+
+COMM_TOPOLOGIES = ["ring", "tree", "ps"]
+### Idle time between two steps of a rank, in ms, longer than ITER_GAP_LOWER_BOUND_US
+STEP_GAP_MS = 10
+### Latency of one SEND/RECV or PUSH/PULL, in ms
+COMM_LATENCY_MS = 0.01
+
+
+class SyntheticParaDict:
+    ''' Metadata of the synthetic model, used in place of ParameterDict '''
+    def __init__(self, tensor_num):
+        self.tensor_num = tensor_num
+
+    def parse_model_name(self):
+        return "synthetic"
+
+    def gradient_num(self):
+        return self.tensor_num
+
+    def tensor_id_to_tensor_name(self, tensor_id):
+        return str(tensor_id)
+
+
+class SyntheticTrial:
+    ''' A synthetic trial of `rank_num` ranks, see the module docstring
+
+    Parameters
+    ----------
+    tensor_num: int
+        Number of gradients, by default two tensors (weight and bias) per layer
+    bandwidth: float
+        Bandwidth of each link in GB/s, i.e., 1 MB takes 1 / bandwidth ms
+    step_num: int
+        Number of steps of the generated traces
+    '''
+    def __init__(self, rank_num=8, layer_num=50, tensor_num=None, topology="ring",
+            fusion_num=1, channel_num=1, slice_num=1, server_num=None,
+            gpus_per_host=8, bandwidth=10., step_num=3, seed=0):
+        if topology not in COMM_TOPOLOGIES:
+            raise ValueError("Invalid topology {}, only {} are supported".format(topology, COMM_TOPOLOGIES))
+        if rank_num < 2:
+            raise ValueError("At least 2 ranks are required, got {}".format(rank_num))
+        self.rank_num = rank_num
+        self.layer_num = layer_num
+        self.tensor_num = 2 * layer_num if tensor_num is None else tensor_num
+        self.topology = topology
+        self.channel_num = channel_num
+        self.slice_num = slice_num
+        self.server_num = max(1, rank_num // gpus_per_host) if server_num is None else server_num
+        self.gpus_per_host = gpus_per_host
+        self.bandwidth = bandwidth
+        self.step_num = step_num
+        self.rng = random.Random(seed)
+
+        self.pids = ["host%d.rank%d" % (rank // gpus_per_host, rank % gpus_per_host) for rank in range(rank_num)]
+        self.servers = ["server_%d" % server for server in range(self.server_num)]
+
+        ### Durations in ms, BW ops take about twice as long as FW ops
+        self.fw_time = [self.rng.uniform(0.05, 1.) for _ in range(layer_num)]
+        self.bw_time = [2 * t * self.rng.uniform(0.8, 1.2) for t in self.fw_time]
+        ### Tensor sizes in MB, tensors are assigned to layers in order
+        self.tensor2layer = [tensor * layer_num // self.tensor_num for tensor in range(self.tensor_num)]
+        self.tensor_size = [self.rng.lognormvariate(-1, 1.5) for _ in range(self.tensor_num)]
+        self.update_time = [0.01 + 0.02 * size for size in self.tensor_size]
+
+        ### Gradients are fused in the order they are ready, i.e., from the last layer
+        ready_order = sorted(range(self.tensor_num), key=lambda tensor: (-self.tensor2layer[tensor], tensor))
+        self.groups = [sorted(ready_order[i:i+fusion_num]) for i in range(0, self.tensor_num, fusion_num)]
+        self.group_names = ["+".join([str(tensor) for tensor in group]) for group in self.groups]
+
+    def config(self):
+        ''' Configurations to identify the trial in benchmark reports '''
+        return {
+            "rank_num": self.rank_num,
+            "layer_num": self.layer_num,
+            "tensor_num": self.tensor_num,
+            "topology": self.topology,
+            "group_num": len(self.groups),
+            "channel_num": self.channel_num,
+            "slice_num": self.slice_num,
+            "server_num": self.server_num if self.topology == "ps" else 0,
+            "step_num": self.step_num
+        }
+
+    def group_size(self, group_id):
+        return sum([self.tensor_size[tensor] for tensor in self.groups[group_id]])
+
+    def transfer_time(self, size):
+        return COMM_LATENCY_MS + size / self.bandwidth
+
+    def jitter(self, dur):
+        return dur * self.rng.uniform(0.9, 1.1)
+
+    ### Inputs of the Collector, ring only
+
+    def local_dfg(self):
+        ''' The local DFG shared by all ranks, as `wrap_read_gml` returns for TensorFlow '''
+        dfg = nx.DiGraph()
+        fw_nodes = ["FW.layer%d" % layer for layer in range(self.layer_num)]
+        bw_nodes = ["BW.layer%d" % layer for layer in range(self.layer_num)]
+        dfg.add_edges_from(zip(fw_nodes[:-1], fw_nodes[1:]))
+        dfg.add_edge(fw_nodes[-1], bw_nodes[-1])
+        dfg.add_edges_from(zip(bw_nodes[1:], bw_nodes[:-1]))
+        for tensor, layer in enumerate(self.tensor2layer):
+            dfg.add_edge(bw_nodes[layer], "Comm.%d" % tensor)
+            dfg.add_edge("Comm.%d" % tensor, "UPDATE_.tensor%d" % tensor)
+        return dfg
+
+    def init_nccl_graph(self, graph):
+        ''' Fill an empty ncclGraph as the Collector does with `nccl_rank_graph.json`
+            and comm_detail traces '''
+        for rank, pid in enumerate(self.pids):
+            prev_rank, next_rank = (rank - 1) % self.rank_num, (rank + 1) % self.rank_num
+            real_ring = dict((str(channel), "{}[0] -> {}[0] [receive] via NET/Socket/0,{}[0] -> {}[0] [send] via NET/Socket/0".format(
+                prev_rank, rank, rank, next_rank)) for channel in range(self.channel_num))
+            graph.parse_ring_topo(real_ring, map_to=pid)
+        graph.map_host_prefix_id(sorted(set([pid.split(".")[0] for pid in self.pids])))
+        graph.parse_traces(dict(("Comm." + grp_name, {
+                "chunkNum": 2 * (self.rank_num - 1),
+                "sliceNum": self.slice_num,
+                "channelNum": self.channel_num,
+                "loopNum": 1}) for grp_name in self.group_names))
+        ### Tensor fusion groups, which `init_nccl_fusion` parses from traces
+        tensor2grpID = [None] * self.tensor_num
+        for grp_id, group in enumerate(self.groups):
+            for tensor in group:
+                tensor2grpID[tensor] = grp_id
+        graph.nccl_fusion = {"grp_names": list(self.group_names), "tensor2grpID": tensor2grpID,
+            "grp_names_sync": list(self.group_names), "tensor2grpID_sync": list(tensor2grpID)}
+
+    def traces(self):
+        ''' Per-rank traces of `step_num` steps, in the format returned by `Collector.collect_traces` '''
+        if self.topology != "ring":
+            raise ValueError("Only traces of ring trials can be generated")
+        traces = []
+        def add_event(pid, name, ts, dur, tid, args=None):
+            _args = {"name": name, "step": step}
+            if args is not None:
+                _args.update(args)
+                _args["name"] = gen_long_name(None, name, suffix="%d_%d_%d_%d" % (
+                    args["loopId"], args["channelId"], args["chunkId"], args["sliceId"]))
+            traces.append({"name": name, "ts": ts * 1000, "dur": dur * 1000, "pid": pid, "tid": tid,
+                "cat": parse_cat_from_name(name), "ph": "X", "args": _args})
+            return ts + dur
+
+        ring_step_num = 2 * (self.rank_num - 1)
+        start = [self.rng.uniform(0, 1) for _ in self.pids]
+        for step in range(self.step_num):
+            for rank, pid in enumerate(self.pids):
+                ### Computation stream
+                ts = start[rank]
+                for layer in range(self.layer_num):
+                    ts = add_event(pid, "FW.layer%d" % layer, ts, self.jitter(self.fw_time[layer]), "operator")
+                bw_end = [None] * self.layer_num
+                for layer in reversed(range(self.layer_num)):
+                    ts = bw_end[layer] = add_event(pid, "BW.layer%d" % layer, ts, self.jitter(self.bw_time[layer]), "operator")
+                ### Communication stream, fused tensors are processed one group by one
+                comm_ts, ts_update = start[rank], ts
+                for grp_id, group in enumerate(self.groups):
+                    comm_ts = max(comm_ts, max([bw_end[self.tensor2layer[tensor]] for tensor in group]))
+                    ### The first Comm event of a step must be a node of the trail DAG, see
+                    #   `Collector.add_gap_to_nodes`, hence fused tensors are queued together
+                    comm_ts = add_event(pid, "Comm.%s.QUEUE" % self.group_names[grp_id], comm_ts, self.jitter(0.01), "Comm")
+                    for tensor in group:
+                        comm_ts = add_event(pid, "Comm.%d.MEMCPY_IN_FUSION_BUFFER" % tensor, comm_ts,
+                            self.jitter(0.005 * self.tensor_size[tensor]), "Comm")
+                    chunk_time = self.transfer_time(self.group_size(grp_id) / (self.rank_num * self.channel_num * self.slice_num))
+                    for chunk in range(ring_step_num):
+                        for _slice in range(self.slice_num):
+                            for channel in range(self.channel_num):
+                                args = {"loopId": 0, "channelId": channel, "chunkId": chunk, "sliceId": _slice}
+                                add_event(pid, "Comm.%s.RECV" % self.group_names[grp_id], comm_ts, self.jitter(chunk_time), "Comm.RECV", args)
+                                comm_ts = add_event(pid, "Comm.%s.SEND" % self.group_names[grp_id], comm_ts, self.jitter(chunk_time), "Comm.SEND", args)
+                    for tensor in group:
+                        comm_ts = add_event(pid, "Comm.%d.MEMCPY_OUT_FUSION_BUFFER" % tensor, comm_ts,
+                            self.jitter(0.005 * self.tensor_size[tensor]), "Comm")
+                        ts_update = add_event(pid, "UPDATE_.tensor%d" % tensor, max(ts_update, comm_ts),
+                            self.jitter(self.update_time[tensor]), "operator")
+                start[rank] = max(comm_ts, ts_update) + STEP_GAP_MS
+            ### Ranks start the next step together
+            start = [max(start)] * self.rank_num
+        return traces
+
+    def dump_dirs(self, root):
+        ''' Create the directory structure of a trial, <root>/<host>/<local rank>/,
+            trace files only contain metadata since traces are given by `traces` '''
+        for pid in self.pids:
+            host, rank = pid.split(".rank")
+            gpu_path = os.path.join(root, host, rank)
+            if not os.path.exists(gpu_path):
+                os.makedirs(gpu_path)
+            with gzip.open(os.path.join(gpu_path, FileName.COMP.value), 'wt') as fp:
+                fp.write('{"traceEvents": []}')
+
+    def collector(self, root, traces=None, dag_workers=1):
+        ''' Return a Collector of the trial dumped under `root`, whose local DFG, NCCL graph
+            and traces are set as `Collector.init` does before building the trail DAG.
+            `traces` are generated by `traces` if not given '''
+        if self.topology != "ring":
+            raise ValueError("The synthetic generator only emits the NCCL metadata of ring trials")
+        self.dump_dirs(root)
+        clct = Collector(root, comm_backend="NCCL", platform="TENSORFLOW", pretty=True,
+            rank_cache=False, dag_workers=dag_workers)
+        clct.para_dict = SyntheticParaDict(self.tensor_num)
+        clct.dag = self.local_dfg()
+        self.init_nccl_graph(clct.nccl_graph)
+        clct.traceM = TraceManager(self.traces() if traces is None else traces, DirLevel.TRIAL, check=True)
+        return clct
+
+    ### Trail DAGs of tree and ps trials
+
+    def trail_dag(self):
+        ''' Return the trail DAG, where the `avg` of each node is given in ms '''
+        if self.topology == "ring":
+            raise ValueError("The trail DAG of ring trials is built by the Collector, see `collector`")
+        dag = nx.DiGraph()
+        self._add_comp_nodes(dag)
+        for grp_id in range(len(self.groups)):
+            if self.topology == "tree":
+                self._add_tree_allreduce(dag, grp_id)
+            else:
+                self._add_push_pull(dag, grp_id)
+        return dag
+
+    def _add_node(self, dag, pid, name, avg, suffix=None):
+        node = gen_long_name(pid, name, suffix=suffix)
+        dag.add_node(node, avg=avg)
+        return node
+
+    def _add_comp_nodes(self, dag):
+        for pid in self.pids:
+            fw_nodes = [self._add_node(dag, pid, "FW.layer%d" % layer, self.fw_time[layer]) for layer in range(self.layer_num)]
+            bw_nodes = [self._add_node(dag, pid, "BW.layer%d" % layer, self.bw_time[layer]) for layer in range(self.layer_num)]
+            dag.add_edges_from(zip(fw_nodes[:-1], fw_nodes[1:]))
+            dag.add_edge(fw_nodes[-1], bw_nodes[-1])
+            dag.add_edges_from(zip(bw_nodes[1:], bw_nodes[:-1]))
+            for tensor in range(self.tensor_num):
+                self._add_node(dag, pid, "UPDATE_.tensor%d" % tensor, self.update_time[tensor])
+
+    def _bw_nodes_of(self, pid, grp_id):
+        return [gen_long_name(pid, "BW.layer%d" % layer)
+            for layer in sorted(set([self.tensor2layer[tensor] for tensor in self.groups[grp_id]]))]
+
+    def _update_nodes_of(self, pid, grp_id):
+        return [gen_long_name(pid, "UPDATE_.tensor%d" % tensor) for tensor in self.groups[grp_id]]
+
+    def _add_tree_allreduce(self, dag, grp_id):
+        ''' Reduce to the root of a binary tree and broadcast, the tree of channel c
+            is rooted at rank c, suffixes are `loopId_channelId_chunkId_sliceId_src_dst`
+        '''
+        u = "Comm." + self.group_names[grp_id]
+        size = self.group_size(grp_id)
+        chunk_time = self.transfer_time(size / self.channel_num)
+        syncs = []
+        memcpy_in = {}
+        memcpy_out = {}
+        for pid in self.pids:
+            sync = self._add_node(dag, pid, u + ".Sync", 0)
+            for bw_node in self._bw_nodes_of(pid, grp_id):
+                dag.add_edge(bw_node, sync)
+            syncs.append(sync)
+        for pid in self.pids:
+            queue = self._add_node(dag, pid, u + ".QUEUE", 0.01)
+            for sync in syncs:
+                dag.add_edge(sync, queue)
+            memcpy_in[pid] = self._add_node(dag, pid, u + ".MEMCPY_IN_FUSION_BUFFER", 0.005 * size)
+            dag.add_edge(queue, memcpy_in[pid])
+            memcpy_out[pid] = self._add_node(dag, pid, u + ".MEMCPY_OUT_FUSION_BUFFER", 0.005 * size)
+            for update_node in self._update_nodes_of(pid, grp_id):
+                dag.add_edge(memcpy_out[pid], update_node)
+
+        def comm_node(sub_op, rank, channel, src, dst, avg):
+            return self._add_node(dag, self.pids[rank], "%s.%s" % (u, sub_op), avg,
+                suffix="0_%d_0_0_%d_%d" % (channel, src, dst))
+
+        for channel in range(self.channel_num):
+            ### Ranks are re-numbered so that the root of channel `channel` is rank `channel`
+            order = [(channel + i) % self.rank_num for i in range(self.rank_num)]
+            parent = dict((order[i], order[(i - 1) // 2]) for i in range(1, self.rank_num))
+            childs = dict((rank, [order[j] for j in (2 * i + 1, 2 * i + 2) if j < self.rank_num])
+                for i, rank in enumerate(order))
+            for rank in order:
+                ### Up, reduce from the leaves to the root
+                up = memcpy_in[self.pids[rank]]
+                if len(childs[rank]) > 0:
+                    aggr = comm_node("AGGR", rank, channel, rank, 0, 0.001 * size)
+                    dag.add_edge(up, aggr)
+                    for child in childs[rank]:
+                        dag.add_edge(comm_node("RECV", rank, channel, child, rank, chunk_time), aggr)
+                    up = aggr
+                if rank in parent:
+                    send = comm_node("SEND", rank, channel, rank, parent[rank], chunk_time)
+                    dag.add_edge(up, send)
+                    dag.add_edge(send, comm_node("RECV", parent[rank], channel, rank, parent[rank], chunk_time))
+                    ### Down, broadcast from the root to the leaves
+                    down = comm_node("AGGR", rank, channel, rank, 1, 0.001 * size)
+                    dag.add_edge(comm_node("RECV", rank, channel, parent[rank], rank, chunk_time), down)
+                else:
+                    down = up
+                for child in childs[rank]:
+                    send = comm_node("SEND", rank, channel, rank, child, chunk_time)
+                    dag.add_edge(down, send)
+                    dag.add_edge(send, comm_node("RECV", child, channel, rank, child, chunk_time))
+                dag.add_edge(down, memcpy_out[self.pids[rank]])
+
+    def _add_push_pull(self, dag, grp_id):
+        ''' Push gradients to one server, which sums them up, and pull the merged ones back '''
+        u = "Comm." + self.group_names[grp_id]
+        size = self.group_size(grp_id)
+        server = self.servers[grp_id % self.server_num]
+        prev = self._add_node(dag, server, u + ".COPY_FIRST", 0.002 * size)
+        for rank, pid in enumerate(self.pids):
+            push_req = self._add_node(dag, pid, u + ".PUSH_REQ", self.transfer_time(size), suffix=server)
+            for bw_node in self._bw_nodes_of(pid, grp_id):
+                dag.add_edge(bw_node, push_req)
+            if rank == 0:
+                dag.add_edge(push_req, prev)
+            else:
+                _sum = self._add_node(dag, server, u + ".SUM", 0.004 * size, suffix=str(rank - 1))
+                dag.add_edge(prev, _sum)
+                dag.add_edge(push_req, _sum)
+                prev = _sum
+            push_res = self._add_node(dag, pid, u + ".PUSH_RES", COMM_LATENCY_MS, suffix=server)
+            pull_req = self._add_node(dag, pid, u + ".PULL_REQ", COMM_LATENCY_MS, suffix=server)
+            dag.add_edge(push_req, push_res)
+            dag.add_edge(push_res, pull_req)
+        copy_merged = self._add_node(dag, server, u + ".COPY_MERGED", 0.002 * size)
+        dag.add_edge(prev, copy_merged)
+        for pid in self.pids:
+            pull_res = self._add_node(dag, pid, u + ".PULL_RES", self.transfer_time(size), suffix=server)
+            dag.add_edge(gen_long_name(pid, u + ".PULL_REQ", suffix=server), pull_res)
+            dag.add_edge(copy_merged, pull_res)
+            for update_node in self._update_nodes_of(pid, grp_id):
+                dag.add_edge(pull_res, update_node)
@@ -398,6 +398,11 @@ class ncclGraph:
         return self.host_prefix2id[prefix]
 
     def dump(self, path_):
+        with open(path_, 'w') as fp:
+            fp.write(self.ret_state_str())
+
+    def ret_state_str(self):
+        ''' Return the string representation of the graph, used for dumping and fingerprinting '''
         str_ = "%d,%d,%d,%d\n"%(self.algo.value, self.rank_num, int(self.trace_parsed), self.nrank)
         str_ += str(self.graph) + "\n"
         str_ += str(self.raw_name2IDnum) + "\n"
@@ -407,8 +412,7 @@ class ncclGraph:
         str_ += str(self.host_id2prefix) + "\n"
         str_ += str(self.host_prefix2id) + "\n"
         str_ += str(self.nccl_fusion)
-        with open(path_, 'w') as fp:
-            fp.write(str_)
+        return str_
 
     def load(self, path_):
         with open(path_, 'r') as fp:
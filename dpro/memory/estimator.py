@@ -125,6 +125,19 @@ class MemoryEstimator:
             self._schedule = self._compose_operator_schedule(dag, param_dict)
         return self._simulate_memory_allocation(self._schedule)
 
+    @property
+    def state_key(self):
+        """The state the estimation depends on besides the graph, i.e., the
+        batch size and the operators whose outputs are recomputed
+
+        Returns:
+            [tuple]: hashable state of the estimator
+        """
+        if self._schedule is None:
+            return (self.batch_size, None)
+        return (self.batch_size, tuple(op.name for op in self._schedule.operators
+            if not op.requires_grad))
+
     @property
     def cached_memory_estimation(self):
         return self._cached_result
@@ -5,7 +5,8 @@ import numpy as np
 import pickle
 import ujson as json
 
-from ..replay import Replayer
+from ..replay import Replayer, ExecutionRecord
+from .eval_cache import EvaluationCache, CachedEvaluation, CriticalPathRecord, graph_fingerprint
 from ..trace_utils import *
 from ..dag_utils import *
 from ..base import bcolors
@@ -29,6 +30,9 @@ except:
 ROOT_PATH = os.path.join(
     args_.workspace if args_.workspace else args_.path, ".opt_ws")
 
+### Number of names `NAME_REGISTRY` may hold besides twice the names of the current graph
+NAME_REGISTRY_SLACK = 4096
+
 class CostModelManager:
     def __init__(self, opt):
         self.cost_model_list = []
@@ -128,6 +132,14 @@ class Optimizer:
         if self.comm_backend == "NCCL" and self.tsfs_pass is not None:
             self.tsfs_pass.enable_partition = False
 
+        ### Replayers keeping the schedule of the last evaluation, see `Replayer.replay_incremental`
+        self.incremental_replayers = {}
+        ### Results of evaluations without side effects, see `evaluate`
+        self.eval_cache = None
+        if args_.eval_cache_size > 0:
+            self.eval_cache = EvaluationCache(args_.eval_cache_size,
+                path=os.path.join(ROOT_PATH, "eval_cache.pickle") if args_.eval_cache_persist else None)
+
         self.base_cost, self.exct_dag, self.base_mem_usage = self.evaluate(
             self.dag, _path=os.path.join(ROOT_PATH, "searched_graph/base.json"))
 
@@ -210,29 +222,65 @@ class Optimizer:
 
         if self.tsfs_pass is not None and self.clct.byteps_graph is not None:
             self.clct.byteps_graph.grp_part_id2server = self.tsfs_pass.tsfs_state.grp_part_id2server
+
+        ### Evaluations without outputs are cached, keyed by the fingerprint of _dag
+        cache_key = None
+        if self.eval_cache is not None and _path is None and _crit_filename is None \
+                and name2mapping_fn is None and not visual_bw2comm:
+            cache_key = self.eval_cache_key(_dag, partial)
+            cached = self.eval_cache.get(cache_key, recd_topo_order)
+            if cached is not None:
+                exct_dag = CriticalPathRecord(cached.critical_path)
+                if recd_topo_order:
+                    return cached.iter_time, exct_dag, cached.mem_usage, cached.topo_order
+                return cached.iter_time, exct_dag, cached.mem_usage
+
         # t = time.time()
         ### input _dag is a dependency graph, using the replayer to get the simulated traces and execution graph
         ### Return the iteration time and the execution graph
         _output = False if _path is None else True
-        replayer = Replayer(dag=_dag, _step_num=1,
-                            leaf_dirs=self.clct.all_prefix_list(),
-                            dump_path=self.clct.pm.path,
-                            comm_backend=self.comm_backend,
-                            byteps_graph=self.clct.byteps_graph,
-                            infi_para_update=args_.update_infi_para,
-                            recd_topo_order=recd_topo_order,
-                            partial=partial,
-                            name2mapping_fn=name2mapping_fn
-                            )
-        step_end_time_ms = [t / 1000 for t in replayer.replayAndDelay(
-            None, _output=_output, _path=_path, verbose=False).values()]
+        if args_.incremental_replay and name2mapping_fn is None and self.comm_backend != "BYTEPS":
+            ### Only re-simulate the part of _dag changed since the last evaluation
+            replayer = self.incremental_replayers.get(partial)
+            if replayer is None:
+                replayer = Replayer(dag=_dag, _step_num=1,
+                                    leaf_dirs=self.clct.all_prefix_list(),
+                                    dump_path=self.clct.pm.path,
+                                    comm_backend=self.comm_backend,
+                                    byteps_graph=self.clct.byteps_graph,
+                                    infi_para_update=args_.update_infi_para,
+                                    partial=partial,
+                                    incremental=True,
+                                    rank_symmetry=args_.rank_symmetry,
+                                    symmetry_rtol=args_.symmetry_rtol
+                                    )
+                self.incremental_replayers[partial] = replayer
+            replayer.recd_topo_order = recd_topo_order
+            step_end_time_ms = [t / 1000 for t in replayer.replay_incremental(
+                _dag, None, _output=_output, _path=_path, verbose=False).values()]
+        else:
+            replayer = Replayer(dag=_dag, _step_num=1,
+                                leaf_dirs=self.clct.all_prefix_list(),
+                                dump_path=self.clct.pm.path,
+                                comm_backend=self.comm_backend,
+                                byteps_graph=self.clct.byteps_graph,
+                                infi_para_update=args_.update_infi_para,
+                                recd_topo_order=recd_topo_order,
+                                partial=partial,
+                                name2mapping_fn=name2mapping_fn,
+                                lean=(args_.lean_replay and not _output and _crit_filename is None and not visual_bw2comm),
+                                rank_symmetry=args_.rank_symmetry,
+                                symmetry_rtol=args_.symmetry_rtol
+                                )
+            step_end_time_ms = [t / 1000 for t in replayer.replayAndDelay(
+                None, _output=_output, _path=_path, verbose=False).values()]
         
         if visual_bw2comm:
             replayer.paint_bw_comm_depend()
         # print("Evaluate time {}".format(time.time() - t))
         if _crit_filename is not None:
             prefix, crit_file_name = os.path.split(_crit_filename)
-            critical_path = list(zip(*self.wrap_critical_path(replayer.exct_dag)))[0]
+            critical_path = list(zip(*self.wrap_critical_path(replayer.exct_record)))[0]
             replayer.dump_critical_path(crit_file_name, critical_path, prefix=prefix)
         
         estimated_memory_usage = self.memory_estimator.estimate(_dag, self.clct.para_dict)
@@ -243,11 +291,50 @@ class Optimizer:
         if self.clct.byteps_graph is not None:
             self.clct.byteps_graph.grp_part_id2server = None
 
+        ### The ExecutionRecord is returned instead of the execution graph,
+        #   critical paths are rebuilt from the binding predecessors of nodes
+        exct_dag = replayer.exct_record
+        if cache_key is not None:
+            self.eval_cache.put(cache_key, CachedEvaluation(max(step_end_time_ms),
+                exct_dag.critical_path(), estimated_memory_usage,
+                replayer.ret_topo_ord() if recd_topo_order else None))
         ### Whether to record the topological order
         if recd_topo_order:
-            return max(step_end_time_ms), replayer.exct_dag, estimated_memory_usage, replayer.ret_topo_ord()
+            return max(step_end_time_ms), exct_dag, estimated_memory_usage, replayer.ret_topo_ord()
         else:
-            return max(step_end_time_ms), replayer.exct_dag, estimated_memory_usage
+            return max(step_end_time_ms), exct_dag, estimated_memory_usage
+
+    def eval_cache_key(self, _dag, partial=False, tag="evaluate"):
+        ''' Besides _dag, evaluation results depend on the arguments of the replayer and
+        the mapping from tensor partitions to servers of BytePS, and the memory usage
+        depends on the batch size and the recomputation schedule of the memory
+        estimator, `tag` tells which method the result is cached for '''
+        context = (tag, self.comm_backend, partial, args_.update_infi_para, args_.rank_symmetry, args_.symmetry_rtol,
+            self.memory_estimator.state_key)
+        if self.clct.byteps_graph is not None:
+            context += (repr(self.clct.byteps_graph.grp_part_id2server), )
+        return graph_fingerprint(_dag, context)
+
+    def checkpoint_eval_cache(self, dump=True):
+        if self.eval_cache is not None:
+            SingleLogger().info(self.eval_cache.summary())
+            if dump:
+                self.eval_cache.dump()
+
+    def compact_name_registry(self, _dag):
+        ''' Names generated by rejected strategies are rarely used again, only keep
+        names of `_dag` in `NAME_REGISTRY` once the registry grows much larger than `_dag`,
+        so the cost of compaction is amortized over the names added since the last one '''
+        if len(NAME_REGISTRY) > 2 * len(_dag) + NAME_REGISTRY_SLACK:
+            NAME_REGISTRY.compact(_dag.nodes)
+
+    def checkpoint_passes(self):
+        ''' Checkpoint states of Graph Passes and the evaluation cache, which are
+        written with snapshots of the search, see dpro/optimizer/ckpt_journal.py '''
+        for _cost_model in self.cst_md_mng.cost_model_list:
+            _cost_model.checkpoint()
+        if self.eval_cache is not None:
+            self.eval_cache.dump()
 
     def candidate_selection(self, GS, topk=None, critical_path=None):
         ''' Select nodes on the critical path of the execution graph as the candidates
@@ -283,6 +370,8 @@ class Optimizer:
 
     def wrap_critical_path(self, _dag, verbose=False):
         # t = time.time()
+        if isinstance(_dag, (ExecutionRecord, CriticalPathRecord)):
+            return _dag.critical_path(_debug_level=(1 if verbose else 0))
         cal_edge_cost(_dag)
         ret = dag_longest_path(_dag, None, weight="cost", default_weight=0, _debug_level=(1 if verbose else 0))
         # print("critical path time {}".format(time.time() - t))
@@ -440,7 +529,7 @@ class Optimizer:
         for cm in self.cst_md_mng.cost_model_list:
             cm.flush(is_accept)
 
-    def pick_strategy(self, search_space, weights=None, invalid_strategies=None):
+    def pick_strategy(self, search_space, weights=None, invalid_strategies=None, rng=random):
         ### TODO (huhanpeng): need some priority/heuristic
         valid_search_space_idx = []
         valid_weights = []
@@ -457,23 +546,23 @@ class Optimizer:
         if not valid_search_space_idx:
             raise OptNoValidStrategyError
 
-        st_idx = self.select_one_stategy(valid_weights, valid_search_space_idx)
+        st_idx = self.select_one_stategy(valid_weights, valid_search_space_idx, rng=rng)
         st = search_space[st_idx]
         search_space.pop(st_idx)
         if weights:
             weights.pop(st_idx)
         return st
     
-    def select_one_stategy(self, valid_weights, valid_search_space_idx):
+    def select_one_stategy(self, valid_weights, valid_search_space_idx, rng=random):
         if not valid_weights:
-            st_idx = random.choice(valid_search_space_idx)
+            st_idx = rng.choice(valid_search_space_idx)
         else:
             valid_weights = np.array(valid_weights)
             valid_weights = valid_weights  / np.linalg.norm(valid_weights)
             # valid_weights = valid_weights - np.min(valid_weights)
             # valid_weights = valid_weights / np.sum(valid_weights)
             try:
-                st_idx = random.choices(valid_search_space_idx, weights=valid_weights, k=1)[0]
+                st_idx = rng.choices(valid_search_space_idx, weights=valid_weights, k=1)[0]
             except:
                 raise
                 ### Adapt to python <3.6
@@ -591,6 +680,12 @@ class Optimizer:
         else:
             sub_graph = _dag.subgraph(all_involved_nodes)
         sub_graph = _dag.subgraph(all_involved_nodes)
+        cache_key = None
+        if self.eval_cache is not None and dump_path is None:
+            cache_key = self.eval_cache_key(sub_graph, partial=True, tag="involved_nodes")
+            cached = self.eval_cache.get(cache_key)
+            if cached is not None:
+                return cached.iter_time
         replayer = Replayer(dag=sub_graph, _step_num=1,
                             leaf_dirs=self.clct.all_prefix_list(),
                             dump_path=self.clct.pm.path,
@@ -603,6 +698,9 @@ class Optimizer:
         step_end_time_list_in_us = replayer.replayAndDelay(
             None, _output=True if dump_path is not None else False,
             _path=dump_path, verbose=False)
+        if cache_key is not None:
+            self.eval_cache.put(cache_key, CachedEvaluation(
+                max(step_end_time_list_in_us.values()) / 1000, None, None))
         return max(step_end_time_list_in_us.values()) / 1000
 
     def estimate_time_related_to_comp(self, comp_ops, _dag, dump_path=None):
@@ -0,0 +1,131 @@
+''' Incremental checkpoints of the search process
+
+Instead of pickling the whole graph at every checkpoint, optimizers append a
+small record of the strategies applied since the last checkpoint and their
+scalar states, e.g., the step and the best cost, to an append-only journal.
+A compacted snapshot of the graph, the PKGraph and the states of Graph Passes
+is written every `snapshot_interval` records in a forked process, which shares
+the states with the optimizer by copy-on-write, so that the search does not
+wait for the I/O. Resuming from checkpoints loads the last snapshot and replays
+strategies in the journal records after it.
+'''
+import os
+import pickle
+import multiprocessing
+
+from ..logger_utils import SingleLogger
+
+CKPT_JOURNAL_VERSION = 1
+
+def write_snapshot(path, version, seq, state, write_fn):
+    with open(path + ".tmp", "wb") as f:
+        pickle.dump([version, seq, state], f)
+    os.replace(path + ".tmp", path)
+    if write_fn is not None:
+        write_fn()
+
+class CheckpointJournal:
+    ''' Snapshots and the journal of an optimizer in `ckpt_dir`
+
+    Parameters
+    ----------
+    ckpt_dir: str
+        The directory to store graph_snapshot.pickle and graph_journal.pickle
+    snapshot_interval: int
+        A snapshot is due once so many records have been appended since the last one
+    '''
+    def __init__(self, ckpt_dir, snapshot_interval):
+        self.snapshot_path = os.path.join(ckpt_dir, "graph_snapshot.pickle")
+        self.journal_path = os.path.join(ckpt_dir, "graph_journal.pickle")
+        self.snapshot_interval = snapshot_interval
+        ### Sequence number of the last record and of the last snapshot
+        self.seq = 0
+        self.snapshot_seq = 0
+        ### The process writing the snapshot, and the sequence number of the snapshot
+        self.writer = None
+        self.writer_seq = None
+
+    def reset(self):
+        ''' Remove checkpoints of the previous search '''
+        self.wait()
+        for path in [self.snapshot_path, self.journal_path]:
+            if os.path.isfile(path):
+                os.remove(path)
+        self.seq = self.snapshot_seq = 0
+
+    def load(self):
+        ''' Return the state of the last snapshot and records appended after it,
+        the state is None if there is no snapshot '''
+        state = None
+        if os.path.isfile(self.snapshot_path):
+            with open(self.snapshot_path, "rb") as f:
+                version, self.snapshot_seq, state = pickle.load(f)
+            if version != CKPT_JOURNAL_VERSION:
+                SingleLogger().warn("Ignore the checkpoint snapshot {} of version {}".format(self.snapshot_path, version))
+                return None, []
+        records = [record for record in self._read_journal() if record["seq"] > self.snapshot_seq]
+        self.seq = records[-1]["seq"] if len(records) > 0 else self.snapshot_seq
+        SingleLogger().info("Load the checkpoint snapshot of record {} and {} journal records after it".format(
+            self.snapshot_seq, len(records)))
+        return state, records
+
+    def _read_journal(self):
+        records = []
+        if not os.path.isfile(self.journal_path):
+            return records
+        with open(self.journal_path, "rb") as f:
+            while True:
+                try:
+                    records.append(pickle.load(f))
+                except EOFError:
+                    break
+                except pickle.UnpicklingError:
+                    ### The last record may be partially written
+                    SingleLogger().warn("Ignore the truncated record after record {} in {}".format(
+                        len(records), self.journal_path))
+                    break
+        return records
+
+    def append(self, record):
+        ''' Append a record, a dict, to the journal '''
+        self.seq += 1
+        record["seq"] = self.seq
+        with open(self.journal_path, "ab") as f:
+            pickle.dump(record, f)
+
+    def snapshot_due(self):
+        return self.seq - self.snapshot_seq >= self.snapshot_interval
+
+    def snapshot(self, state, write_fn=None):
+        ''' Write `state` as the snapshot of the current record in the background,
+        `write_fn` is called after the snapshot is written, e.g., to checkpoint
+        Graph Passes, whose states must be consistent with the snapshot '''
+        self.wait()
+        self.snapshot_seq = self.seq
+        if "fork" in multiprocessing.get_all_start_methods():
+            self.writer = multiprocessing.get_context("fork").Process(target=write_snapshot,
+                args=(self.snapshot_path, CKPT_JOURNAL_VERSION, self.seq, state, write_fn))
+            self.writer.start()
+            self.writer_seq = self.seq
+        else:
+            write_snapshot(self.snapshot_path, CKPT_JOURNAL_VERSION, self.seq, state, write_fn)
+            self._compact(self.seq)
+
+    def wait(self):
+        ''' Wait for the snapshot being written and drop records before it from the journal '''
+        if self.writer is None:
+            return
+        self.writer.join()
+        if self.writer.exitcode == 0:
+            self._compact(self.writer_seq)
+        else:
+            SingleLogger().error("Failed to write the checkpoint snapshot of record {}, exitcode {}".format(
+                self.writer_seq, self.writer.exitcode))
+        self.writer = self.writer_seq = None
+
+    def _compact(self, seq):
+        records = [record for record in self._read_journal() if record["seq"] > seq]
+        with open(self.journal_path + ".tmp", "wb") as f:
+            for record in records:
+                pickle.dump(record, f)
+        os.replace(self.journal_path + ".tmp", self.journal_path)
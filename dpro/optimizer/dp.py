@@ -7,8 +7,10 @@ import pickle
 from tqdm import tqdm
 
 from .base import Optimizer, args_, ROOT_PATH
+from .ckpt_journal import CheckpointJournal
 from ..logger_utils import SingleLogger
 from ..cost_model._xla.pk_graph import PKGraph, PKGraphCycleError
+from ..graph_overlay import as_overlay_graph
 from ..base import bcolors
 from ..trace_utils import gen_long_name, parse_allinfo_from_name, parse_cat_fine_grained, \
     parse_cat_from_name, parse_op_name, parse_pid_from_name, CatName, parse_rawname
@@ -216,7 +218,24 @@ class DPOptimizer(Optimizer):
     def comm_succs_of_comp_in_long_name(self, comp_op, _dag):
         return [n for n in _dag.successors(comp_op) if parse_cat_from_name(n) == CatName.COMM.value]
 
-    def search(self, graph_cache=None):
+    def replay_ckpt_record(self, G, PKG, record):
+        ''' Apply strategies of the DP step of a journal record, refer to `try_to_apply_opfs`,
+        `try_to_apply_tsfs` and `try_to_apply_ts_part` '''
+        for st in record["sts"]:
+            if st[0] == "+":
+                self.opfs_pass.apply(st, G, PKG)
+            elif st[0] == "++":
+                self.tsfs_pass.apply(st, G, PKG)
+            elif st[0] == "tspart":
+                self.tsfs_pass._tensor_partition(G, PKG, st[1], st[2])
+            else:
+                raise ValueError("Invalid strategy in the checkpoint journal: {}".format(st))
+        if self.tsfs_pass is not None:
+            self.tsfs_pass.update_tensor2server()
+        self.trajectory += record["sts"]
+        self.step = record["step"]
+
+    def search(self, ckpt_dir=None):
 
         SingleLogger().info(bcolors.CGREEN + "Start to search using DP" + bcolors.ENDC)
 
@@ -234,14 +253,18 @@ class DPOptimizer(Optimizer):
                 PKG = _PKG
             self.trajectory += _trajectory
 
-        ### load checkpoint
-        graph_cache = os.path.join(self.ckpt_dir, "graph_cache.pickle") if graph_cache is None else graph_cache
-        if args_.ckpt and graph_cache is not None and os.path.isfile(graph_cache):
+        ### load checkpoint, i.e., the last snapshot and strategies journaled after it
+        self.ckpt_journal = CheckpointJournal(self.ckpt_dir if ckpt_dir is None else ckpt_dir,
+            args_.ckpt_snapshot_interval)
+        state, records = self.ckpt_journal.load() if args_.ckpt else (None, [])
+        if state is not None:
             ### TODO (hhp): need to guarantee the consistence of checkpoints of both cost models and DFG states
+            #   Graph Passes are checkpointed with snapshots
             for _cost_model in self.cst_md_mng.cost_model_list:
                 _cost_model.load_ckpt()
-            with open(graph_cache, "rb") as f:
-                G, PKG, self.step, self.trajectory = pickle.load(f)
+            G, PKG, self.step, self.trajectory = state["G"], state["PKG"], state["step"], state["trajectory"]
+            for record in records:
+                self.replay_ckpt_record(G, PKG, record)
             SingleLogger().info("Loading checkpoint of step {}".format(self.step))
             self.cur_cost, self.exct_dag, self.mem_usage, self.topo_order = self.evaluate(
                 G, _path=os.path.join(ROOT_PATH, "searched_graph/init.json"),
@@ -258,6 +281,16 @@ class DPOptimizer(Optimizer):
             self.trajectory = []
             SingleLogger().info("No checkpoint found, search from scratch")
 
+        ### Strategies are tried in overlays of G and PKG instead of copies, see dpro/graph_overlay.py
+        G = as_overlay_graph(G)
+
+        ### Length of the trajectory at the last checkpoint
+        self.ckpt_traj_len = len(self.trajectory)
+        if state is None:
+            self.ckpt_journal.reset()
+            self.ckpt_journal.snapshot({"G": G, "PKG": PKG, "step": self.step, "trajectory": self.trajectory},
+                write_fn=self.checkpoint_passes)
+
         SingleLogger().info("="*20 + " Search Starts " + "="*20)
         SingleLogger().info(bcolors.CGREEN + "Start to search, the original iteration time is %f, init cost is %f" %
                             (self.base_cost, self.cur_cost) + bcolors.ENDC)
@@ -296,11 +329,15 @@ class DPOptimizer(Optimizer):
             with open(os.path.join(ROOT_PATH, "best_strategy.txt"), "w") as f:
                 json.dump({"best_strategy": self.trajectory}, f)
 
-            ### Save checkpoints by default
-            for _cost_model in self.cst_md_mng.cost_model_list:
-                _cost_model.checkpoint()
-            with open(graph_cache, "wb") as f:
-                pickle.dump([G, PKG, self.step, self.trajectory], f)
+            ### Save checkpoints by default, only strategies applied since the last checkpoint are
+            #   journaled, and snapshots are written periodically in the background
+            self.checkpoint_eval_cache(dump=False)
+            self.compact_name_registry(G)
+            self.ckpt_journal.append({"sts": self.trajectory[self.ckpt_traj_len:], "step": self.step})
+            self.ckpt_traj_len = len(self.trajectory)
+            if self.ckpt_journal.snapshot_due():
+                self.ckpt_journal.snapshot({"G": G, "PKG": PKG, "step": self.step, "trajectory": self.trajectory},
+                    write_fn=self.checkpoint_passes)
             
             if self.opfs_pass is not None:
                 self.opfs_pass._dump_cluster_mapping(
@@ -391,9 +428,10 @@ class DPOptimizer(Optimizer):
                     _pred = prev_node
                     t_null = self.estimate_time_related_to_comp([_pred, node_n], G_star)
 
-                    ### Try to apply tensor fusion and operator fusion
-                    G_prime = G_star.copy()
-                    PKG_prime = PKG_star.copy()
+                    ### Try to apply tensor fusion and operator fusion in an overlay of G_star
+                    G_star.begin()
+                    PKG_star.begin()
+                    G_prime, PKG_prime = G_star, PKG_star
                     old_tsfs_state = None
                     sts = []
                     opfs_succeed, nodes_introduced = self.try_to_apply_opfs(_pred, node_n, G_prime, PKG_prime, sts, verbose=False)
@@ -402,11 +440,13 @@ class DPOptimizer(Optimizer):
                         fused_comp_op = "+".join([gen_long_name(ref_pid, parse_rawname(long_name)) for long_name in _fused_comp_op.split("+")])
                         tensor_op_names = self.comm_succs_of_comp_in_op_name(fused_comp_op, G_prime)
                     else:
+                        G_star.discard()
+                        PKG_star.discard()
                         tensor_u = self.comm_succs_of_comp_in_op_name(prev_node, G_star)
                         tensor_v = self.comm_succs_of_comp_in_op_name(node_n, G_star)
                         tensor_op_names = tensor_u.union(tensor_v)
-                        G_prime = G_star.copy()
-                        PKG_prime = PKG_star.copy()
+                        G_star.begin()
+                        PKG_star.begin()
                     if len(tensor_op_names) > 1:
                         old_tsfs_state = self.tsfs_pass.tsfs_state.copy()
 
@@ -434,13 +474,15 @@ class DPOptimizer(Optimizer):
                         t_fuse = self.estimate_time_related_to_comp([prev_node, node_n], G_prime)
 
                     if t_fuse < t_null:
-                        G_star = G_prime
-                        PKG_star = PKG_prime
+                        G_star.commit()
+                        PKG_star.commit()
                         model_changed = True
                         applied_sts += sts
                         SingleLogger().info(bcolors.CYELLOW + "Fuse {} {} and {}".format(_pred[:60], node_n[:60], str(tensor_op_names)) + bcolors.ENDC)
                     else:
-                        ### Fusion is worse, retrieve the original tensor fusion pass state
+                        ### Fusion is worse, retrieve the original graph and tensor fusion pass state
+                        G_star.discard()
+                        PKG_star.discard()
                         if old_tsfs_state is not None:
                             self.tsfs_pass.tsfs_state = old_tsfs_state
                         fused_comp_op = None
@@ -619,4 +661,7 @@ class DPOptimizer(Optimizer):
             self.step += 1
 
         display_and_ckpt()
+        self.ckpt_journal.snapshot({"G": G, "PKG": PKG, "step": self.step, "trajectory": self.trajectory},
+            write_fn=self.checkpoint_passes)
+        self.ckpt_journal.wait()
 
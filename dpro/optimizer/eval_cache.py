@@ -0,0 +1,120 @@
+''' A bounded cache of evaluation results of the optimizer
+
+Optimizers keep evaluating equivalent graphs, e.g., MCMC re-proposes strategies
+rejected before, DP re-checks the same operator pairs, and different orders of
+strategies lead to the same fused DAG. Evaluation results are cached with the
+fingerprint of the graph as the key, which is decided by node names, durations,
+gaps and edges, so graphs with the same nodes and dependencies share one entry,
+no matter how they are generated.
+'''
+import os
+import pickle
+import hashlib
+import collections
+
+from ..logger_utils import SingleLogger
+
+EVAL_CACHE_VERSION = 1
+
+def graph_fingerprint(dag, context=None):
+    ''' Return a digest of the nodes, replay-related node attributes and
+    edges of `dag`, combined with `context`, e.g., arguments of the replayer '''
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr(context).encode())
+    for n in sorted(dag.nodes):
+        attrs = dag.nodes[n]
+        h.update(repr((n, attrs.get("avg", 0),
+            sorted([(key, value) for key, value in attrs.items() if "GAP" in key]))).encode())
+    for u, v in sorted(dag.edges):
+        h.update(repr((u, v)).encode())
+    return h.hexdigest()
+
+class CriticalPathRecord:
+    ''' Replaces the `ExecutionRecord` of a cached evaluation, only the critical path is kept '''
+    def __init__(self, critical_path):
+        self.path = critical_path
+
+    def critical_path(self, pathM=None, _debug_level=0):
+        return list(self.path)
+
+class CachedEvaluation:
+    def __init__(self, iter_time, critical_path, mem_usage, topo_order=None):
+        self.iter_time = iter_time
+        self.critical_path = critical_path
+        self.mem_usage = mem_usage
+        self.topo_order = topo_order
+
+class EvaluationCache:
+    ''' LRU cache from graph fingerprints to `CachedEvaluation`s
+
+    Parameters
+    ----------
+    capacity: int
+        The maximum number of entries, the least recently used one is evicted first
+    path: str
+        If given, entries are loaded from and dumped to this file, see `dump`
+    '''
+    def __init__(self, capacity, path=None):
+        self.capacity = capacity
+        self.path = path
+        self.entries = collections.OrderedDict()
+        self.hit = 0
+        self.miss = 0
+        ### (key, hit) of the last lookup, used to merge lookups made in other processes
+        self.last_lookup = None
+        if self.path is not None and os.path.isfile(self.path):
+            with open(self.path, "rb") as f:
+                version, entries = pickle.load(f)
+            if version == EVAL_CACHE_VERSION:
+                self.entries.update(entries)
+                self._evict()
+                SingleLogger().info("Load {} cached evaluations from {}".format(len(self.entries), self.path))
+            else:
+                SingleLogger().warn("Ignore evaluation cache {} of version {}".format(self.path, version))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, recd_topo_order=False):
+        ''' Return the cached evaluation of `key`, or None if it is not cached
+        or the topological order is required but not recorded '''
+        entry = self.entries.get(key)
+        if entry is None or (recd_topo_order and entry.topo_order is None):
+            self.miss += 1
+            self.last_lookup = (key, False)
+            return None
+        self.entries.move_to_end(key)
+        self.hit += 1
+        self.last_lookup = (key, True)
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        self._evict()
+
+    def _evict(self):
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def record(self, hit):
+        ''' Count a lookup made in another process '''
+        if hit:
+            self.hit += 1
+        else:
+            self.miss += 1
+
+    def hit_rate(self):
+        return self.hit / (self.hit + self.miss) if self.hit + self.miss > 0 else 0.
+
+    def summary(self):
+        return "Evaluation cache: {} hits in {} lookups ({:.2f} %), {}/{} entries".format(
+            self.hit, self.hit + self.miss, 100 * self.hit_rate(), len(self.entries), self.capacity)
+
+    def dump(self):
+        if self.path is None:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump([EVAL_CACHE_VERSION, list(self.entries.items())], f)
+        os.replace(tmp_path, self.path)
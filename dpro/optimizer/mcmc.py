@@ -5,15 +5,84 @@ import json
 import pickle
 import traceback
 import random
+import multiprocessing
+import numpy as np
 
 from .base import Optimizer, args_, ROOT_PATH
+from .ckpt_journal import CheckpointJournal
 from ..logger_utils import SingleLogger
 from ..cost_model._xla.pk_graph import PKGraph
+from ..graph_overlay import as_overlay_graph
 from ..base import bcolors
 from ..cost_model.base import OptApplyStrategyError, OptNoValidStrategyError, OptQueryCostModelError
 
 MCMC_BETA = args_.mcmc_beta
 
+### The optimizer and the graph shared by forked workers, see `SpeculativePool`
+_SPEC_STATE = None
+
+def init_speculative_worker(opt, G, PKG):
+    global _SPEC_STATE
+    _SPEC_STATE = (opt, G, PKG)
+
+def speculative_evaluate(task):
+    ''' Return the result of `MCMCOptimizer.evaluate_strategy` and the lookup
+    of the evaluation cache, (key, hit, entry), which is merged by the parent '''
+    draw_idx, strategy = task
+    opt, G, PKG = _SPEC_STATE
+    cache_lookup = None
+    if opt.eval_cache is not None:
+        opt.eval_cache.last_lookup = None
+    rst = opt.evaluate_strategy(G, PKG, strategy, draw_idx)
+    ### As the in-process evaluation, discard changes buffered by Graph Passes, so
+    #   that results do not depend on which tasks a worker ran before
+    opt.cost_model_flush(False)
+    opt.compact_name_registry(G)
+    if opt.eval_cache is not None and opt.eval_cache.last_lookup is not None:
+        key, hit = opt.eval_cache.last_lookup
+        cache_lookup = (key, hit, opt.eval_cache.entries.get(key))
+    return rst, cache_lookup
+
+class SpeculativePool:
+    ''' Evaluate strategies applied to the same graph in a pool of forked processes,
+    which share the optimizer and the graph with the parent by copy-on-write.
+    Changes of Graph Passes made by applying strategies are discarded
+    '''
+    def __init__(self, opt, G, PKG, workers):
+        self.opt = opt
+        self.G = G
+        self.PKG = PKG
+        self.pool = None
+        workers = min(workers, os.cpu_count() or 1)
+        if workers > 1 and "fork" in multiprocessing.get_all_start_methods():
+            self.pool = multiprocessing.get_context("fork").Pool(workers,
+                initializer=init_speculative_worker, initargs=(opt, G, PKG))
+
+    def map(self, tasks):
+        ''' tasks: a list of (draw index, strategy), return (status, result) of each task,
+        refer to `MCMCOptimizer.evaluate_strategy` '''
+        if self.pool is not None:
+            rst = []
+            for _rst, cache_lookup in self.pool.map(speculative_evaluate, tasks, chunksize=1):
+                if cache_lookup is not None:
+                    key, hit, entry = cache_lookup
+                    self.opt.eval_cache.record(hit)
+                    if entry is not None:
+                        self.opt.eval_cache.put(key, entry)
+                rst.append(_rst)
+            return rst
+        rst = []
+        for draw_idx, strategy in tasks:
+            rst.append(self.opt.evaluate_strategy(self.G, self.PKG, strategy, draw_idx))
+            self.opt.cost_model_flush(False)
+        return rst
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
 class MCMCOptimizer(Optimizer):
     ''' Markov Chain Monte Carlo algorithm'''
 
@@ -25,7 +94,89 @@ class MCMCOptimizer(Optimizer):
         else:
             self.heat_window_size = 5
 
-    def search(self, graph_cache=os.path.join(ROOT_PATH, "graph_cache.pickle")):
+        ### Random numbers of the i-th strategy drawn and of the accept test of the
+        #   i-th step are generated from the seed and i, see `seed_of`, so that the
+        #   chain does not depend on how many strategies are evaluated in parallel
+        self.seed = args_.search_seed if args_.search_seed is not None else random.randrange(2 ** 31)
+        self.draw_cnt = 0
+        SingleLogger().info("Search seed: {}".format(self.seed))
+
+    def seed_of(self, tag, idx):
+        return random.Random("{}:{}:{}".format(self.seed, tag, idx)).getrandbits(32)
+
+    def draw_strategy(self, search_space, weights, invalid_strategies):
+        ''' Pick the next strategy of the chain, return (draw index, strategy) '''
+        draw_idx = self.draw_cnt
+        strategy = self.pick_strategy(search_space, weights=weights, invalid_strategies=invalid_strategies,
+            rng=random.Random(self.seed_of("pick", draw_idx)))
+        self.draw_cnt += 1
+        return draw_idx, strategy
+
+    def apply_drawn_strategy(self, _dag, _pkg, strategy, draw_idx):
+        ''' Graph Passes may be random, apply the strategy with random states
+        decided by the draw index, so that it is applied identically in any process '''
+        seed = self.seed_of("apply", draw_idx)
+        random.seed(seed)
+        np.random.seed(seed)
+        return self.apply_strategies(_dag, _pkg, strategy)
+
+    def evaluate_strategy(self, G, PKG, strategy, draw_idx):
+        ''' Apply a strategy to overlays of G and PKG, evaluate it and discard the overlays
+
+        Returns
+        -------
+        (status, result), where status is one of "ok", "invalid" (causing a cycle)
+        and "query_error" (failed to query cost models); result is
+        (cost, execution record, memory usage, nodes introduced, nodes removed) if "ok"
+        '''
+        G.begin()
+        PKG.begin()
+        try:
+            nodes_introduced, nodes_removed = self.apply_drawn_strategy(G, PKG, strategy, draw_idx)
+            cost, exct_dag, mem_usage = self.evaluate(G)
+        except OptApplyStrategyError:
+            return "invalid", None
+        except OptQueryCostModelError:
+            return "query_error", None
+        finally:
+            G.discard()
+            PKG.discard()
+        return "ok", (cost, exct_dag, mem_usage, set(nodes_introduced), set(nodes_removed))
+
+    def speculate(self, spec_pool, search_space, weights, invalid_strategies, num):
+        ''' Draw at most `num` strategies from the search space and evaluate them in parallel,
+        return a list of (draw index, strategy, status, result) in the order of the chain '''
+        tasks = []
+        while len(tasks) < num and len(search_space) > 0:
+            try:
+                tasks.append(self.draw_strategy(search_space, weights, invalid_strategies))
+            except OptNoValidStrategyError:
+                break
+        if len(tasks) == 0:
+            return []
+        SingleLogger().debug("Evaluate {} strategies speculatively".format(len(tasks)))
+        return [(draw_idx, strategy, status, rst) for (draw_idx, strategy), (status, rst)
+            in zip(tasks, spec_pool.map(tasks))]
+
+    def ckpt_state(self, G, PKG):
+        ''' The state of the search written in checkpoint snapshots '''
+        return {"G": G, "PKG": PKG, "heat_window_size": self.heat_window_size,
+            "heat_history": self.heat_history, "best": (self.best_cost, self.best_strategy, self.best_step),
+            "step": self.step, "draw_cnt": self.draw_cnt, "seed": self.seed, "trajectory": self.trajectory}
+
+    def replay_ckpt_record(self, G, PKG, record):
+        ''' Apply strategies accepted in each step of a journal record, refer to `display_and_ckpt` '''
+        for strategies in record["steps"]:
+            for strategy, draw_idx in strategies:
+                self.apply_drawn_strategy(G, PKG, strategy, draw_idx)
+                self.trajectory.append(strategy)
+            self.cost_model_flush(True)
+        self.step = record["step"]
+        self.draw_cnt = record["draw_cnt"]
+        if record["best"] is not None:
+            self.best_cost, self.best_strategy, self.best_step = record["best"]
+
+    def search(self, ckpt_dir=ROOT_PATH):
         step_size = args_.step_size
         self.trajectory = []
         
@@ -42,14 +193,22 @@ class MCMCOptimizer(Optimizer):
             G = self.dag.copy()
             PKG = PKGraph(G)
 
-        ### load checkpoint
-        if args_.ckpt and graph_cache is not None and os.path.isfile(graph_cache):
+        ### load checkpoint, i.e., the last snapshot and strategies journaled after it
+        self.ckpt_journal = CheckpointJournal(ckpt_dir, args_.ckpt_snapshot_interval)
+        state, records = self.ckpt_journal.load() if args_.ckpt else (None, [])
+        if state is not None:
             ### TODO (hhp): need to guarantee the consistence of checkpoints of both cost models and DFG states
+            #   Graph Passes are checkpointed with snapshots
             for _cost_model in self.cst_md_mng.cost_model_list:
                 _cost_model.load_ckpt()
-            with open(graph_cache, "rb") as f:
-                G, PKG, self.heat_window_size, self.heat_history, self.best_cost, self.best_strategy, self.best_step, self.step, self.trajectory = pickle.load(f)
-            SingleLogger().info("Loading checkpoint of step {}".format(self.step))
+            G, PKG = state["G"], state["PKG"]
+            self.heat_window_size, self.heat_history = state["heat_window_size"], state["heat_history"]
+            self.best_cost, self.best_strategy, self.best_step = state["best"]
+            self.step, self.draw_cnt, self.seed = state["step"], state["draw_cnt"], state["seed"]
+            self.trajectory = state["trajectory"]
+            for record in records:
+                self.replay_ckpt_record(G, PKG, record)
+            SingleLogger().info("Loading checkpoint of step {}, search seed: {}".format(self.step, self.seed))
             self.cur_cost, self.exct_dag, self.mem_usage = self.evaluate(
                 G, _path=os.path.join(ROOT_PATH, "searched_graph/init.json"))
             self.cost_star = self.exct_dag_star = self.mem_usage_star = None
@@ -66,6 +225,16 @@ class MCMCOptimizer(Optimizer):
             self.trajectory = []
             SingleLogger().info("No checkpoint found, search from scratch")
 
+        ### Strategies are tried in overlays of G and PKG instead of copies, see dpro/graph_overlay.py
+        G = as_overlay_graph(G)
+
+        ### Steps accepted since the last checkpoint, each is a list of (strategy, draw index)
+        self.ckpt_steps = []
+        self.ckpt_best_step = self.best_step
+        if state is None:
+            self.ckpt_journal.reset()
+            self.ckpt_journal.snapshot(self.ckpt_state(G, PKG), write_fn=self.checkpoint_passes)
+
         SingleLogger().info("="*20 + " Search Starts " + "="*20)
         SingleLogger().info(bcolors.CGREEN + "Start to search, the original iteration time is %f, init cost is %f" %
                             (self.base_cost, self.cur_cost) + bcolors.ENDC)
@@ -91,12 +260,16 @@ class MCMCOptimizer(Optimizer):
                 json.dump({"best_strategy": self.best_strategy}, f)
 
             # if args_.ckpt:
-            ### Save checkpoints by default
-            for _cost_model in self.cst_md_mng.cost_model_list:
-                _cost_model.checkpoint()
-            with open(graph_cache, "wb") as f:
-                pickle.dump([G, PKG, self.heat_window_size, self.heat_history,
-                                self.best_cost, self.best_strategy, self.best_step, self.step, self.trajectory], f)
+            ### Save checkpoints by default, only steps accepted since the last checkpoint are
+            #   journaled, and snapshots are written periodically in the background
+            self.checkpoint_eval_cache(dump=False)
+            self.compact_name_registry(G)
+            self.ckpt_journal.append({"steps": self.ckpt_steps, "step": self.step, "draw_cnt": self.draw_cnt,
+                "best": None if self.best_step == self.ckpt_best_step else (self.best_cost, self.best_strategy, self.best_step)})
+            self.ckpt_steps = []
+            self.ckpt_best_step = self.best_step
+            if self.ckpt_journal.snapshot_due():
+                self.ckpt_journal.snapshot(self.ckpt_state(G, PKG), write_fn=self.checkpoint_passes)
 
         '''
         ### Test some strategies
@@ -114,20 +287,64 @@ class MCMCOptimizer(Optimizer):
         raise
         '''
         
+        speculation = args_.mcmc_speculation
+        if speculation > 1 and step_size > 1:
+            SingleLogger().warn("Speculative evaluation only supports a step size of 1, disable it")
+            speculation = 1
+        ### Speculative results not consumed yet, in the order of the chain, and the pool
+        #   evaluating strategies applied to the current G
+        pending = []
+        spec_pool = None
+
         while True:
             invalid_strategies = set()
-            while len(search_space) > 0:
-                G_star = G.copy()
-                PKG_star = PKG.copy()
+            while len(search_space) > 0 or len(pending) > 0:
                 successful_strategies = 0
                 strategy_history_in_step = []
+                draws_in_step = []
                 strategy_introduced_nodes = set()
                 strategy_removed_nodes = set()
+                if speculation > 1:
+                    ### Consume results of strategies evaluated in parallel one by one, as if
+                    #   they were evaluated sequentially, G_star is only generated if needed
+                    if len(pending) == 0:
+                        if spec_pool is None:
+                            spec_pool = SpeculativePool(self, G, PKG, speculation)
+                        pending = self.speculate(spec_pool, search_space, weights, invalid_strategies, speculation)
+                        if len(pending) == 0:
+                            SingleLogger().info(bcolors.CBLUE + "Search space exhausted." + bcolors.ENDC)
+                            search_space, weights = [], []
+                            break
+                    draw_idx, strategy, status, rst = pending.pop(0)
+                    if status == "invalid":
+                        SingleLogger().warn("Strategy invalid (will cause a cycle in the DAG).")
+                        invalid_strategies.add(strategy)
+                        continue
+                    elif status == "query_error":
+                        SingleLogger().warn("Strategy invalid (failed to query cost model).")
+                        continue
+                    self.step += 1
+                    G_star = PKG_star = None
+                    successful_strategies = step_size
+                    strategy_history_in_step.append(strategy)
+                    draws_in_step.append(draw_idx)
+                    self.cost_star, self.exct_dag_star, self.mem_usage_star, \
+                        strategy_introduced_nodes, strategy_removed_nodes = rst
+                    invalid_strategies = set()
+                    msg = bcolors.CBLUE + "Step: {} - ".format(
+                        self.step) + "Strategy ({}, {}, {}) successfully applied.".format(*strategy)
+                    if len(msg) > 200:
+                        msg = msg[:200] + "... successfully applied."
+                    SingleLogger().info(msg + bcolors.ENDC)
+                else:
+                    G.begin()
+                    PKG.begin()
+                    G_star, PKG_star = G, PKG
                 while successful_strategies < step_size:
                     
                     ### 1. Pick strategies
                     try:
-                        strategy = self.pick_strategy(search_space, weights=weights, invalid_strategies=invalid_strategies)
+                        draw_idx, strategy = self.draw_strategy(search_space, weights, invalid_strategies)
                         msg = bcolors.CBLUE + "Picked strategy ({}, {}, {}).".format(*strategy)
                         if len(msg) > 200:
                             msg = msg[:200] + "..."
@@ -148,7 +365,7 @@ class MCMCOptimizer(Optimizer):
                     strategies = [strategy]
                     for st in strategies:
                         try:
-                            _nodes_introduced, _nodes_removed = self.apply_strategies(G_star, PKG_star, st)
+                            _nodes_introduced, _nodes_removed = self.apply_drawn_strategy(G_star, PKG_star, st, draw_idx)
                             nodes_introduced += _nodes_introduced
                             nodes_removed += _nodes_removed
                         except OptApplyStrategyError:
@@ -167,6 +384,7 @@ class MCMCOptimizer(Optimizer):
                         continue
                     successful_strategies += 1
                     strategy_history_in_step += strategies
+                    draws_in_step += [draw_idx] * len(strategies)
                     strategy_introduced_nodes.update(nodes_introduced)
                     strategy_removed_nodes.update(nodes_removed)
 
@@ -216,17 +434,34 @@ class MCMCOptimizer(Optimizer):
                 else:    
                     is_accept = self.accept_or_not(self.cur_cost, self.cost_star)
 
-                ### update Graph Pass internal states
+                if G_star is None and (is_accept or self.step % 100 == 0):
+                    ### Apply the speculative strategy again in this process to update Graph Pass internal states
+                    G.begin()
+                    PKG.begin()
+                    G_star, PKG_star = G, PKG
+                    self.apply_drawn_strategy(G_star, PKG_star, strategy, draw_idx)
+                    if self.step % 100 == 0:
+                        self.evaluate(G_star,
+                            _path=os.path.join(ROOT_PATH, "searched_graph/{}.json".format(self.step)),
+                            _crit_filename=os.path.join(ROOT_PATH, "searched_graph/{}_crit.json".format(self.step)))
+
+                ### update Graph Pass internal states and keep or revert the overlays of G and PKG
                 self.cost_model_flush(is_accept)
+                if G_star is not None:
+                    if is_accept:
+                        G.commit()
+                        PKG.commit()
+                    else:
+                        G.discard()
+                        PKG.discard()
                 ### update heat history 
                 self.update_fusion_heat_history(is_accept, strategy_removed_nodes, 
                     strategy_introduced_nodes, fusion=(strategy[0]!="-"))
 
                 if is_accept:
                     invalid_strategies = set()
-                    G = G_star
-                    PKG = PKG_star
                     self.trajectory += strategy_history_in_step
+                    self.ckpt_steps.append(list(zip(strategy_history_in_step, draws_in_step)))
                     self.cur_cost = self.cost_star
                     self.exct_dag = self.exct_dag_star
                     self.mem_usage = self.mem_usage_star
@@ -246,6 +481,13 @@ class MCMCOptimizer(Optimizer):
                         self.evaluate(G, 
                             _path=os.path.join(ROOT_PATH, "best.json".format(self.step)),
                             _crit_filename=os.path.join(ROOT_PATH, "best_crit.json".format(self.step)))
+                    if spec_pool is not None:
+                        ### Strategies drawn after the accepted one are evaluated on the previous G,
+                        #   discard them and draw again from the new search space
+                        self.draw_cnt = draw_idx + 1
+                        pending = []
+                        spec_pool.close()
+                        spec_pool = None
                     ### Init the new search space
                     candidates, _ = self.candidate_selection(
                         G, topk=None, critical_path=self.wrap_critical_path(self.exct_dag))
@@ -264,7 +506,11 @@ class MCMCOptimizer(Optimizer):
                 if len(search_space) == 0:
                     break
 
+        if spec_pool is not None:
+            spec_pool.close()
         display_and_ckpt()
+        self.ckpt_journal.snapshot(self.ckpt_state(G, PKG), write_fn=self.checkpoint_passes)
+        self.ckpt_journal.wait()
     
     def accept_or_not(self, cost, new_cost):
         # prob = min(1, (math.exp(beta * (cost - new_cost))))
@@ -280,7 +526,7 @@ class MCMCOptimizer(Optimizer):
             return True
         else:
             # prob = math.exp(MCMC_BETA * (cost - new_cost))
-            r = random.random()
+            r = random.Random(self.seed_of("accept", self.step)).random()
             if r < prob:
                 SingleLogger().info(
                     bcolors.CGREEN + "Accept a worse action with random value: {:.5f} < {:.5f} ".format(r, prob) + bcolors.ENDC)
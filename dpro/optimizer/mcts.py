@@ -1,13 +1,24 @@
+import os
 import sys
 import math
+import time
+import json
+import random
+import multiprocessing
+import concurrent.futures
+import numpy as np
 from enum import Enum
 
-from .base import Optimizer, GraphState, args_
+from .base import Optimizer, args_, ROOT_PATH
 from ..logger_utils import SingleLogger
+from ..cost_model._xla.pk_graph import PKGraph
+from ..cost_model.base import OptApplyStrategyError, OptQueryCostModelError
+from ..graph_overlay import OverlayDiGraph
 
 MAX_LOOP = 1000
 MAX_TREE_DEPTH = 1000
 UCB_GAMMA = args_.ucb_gamma
+VIRTUAL_LOSS = args_.virtual_loss
 
 class GraphExpand(Enum):
     NOT = 0
@@ -30,6 +41,9 @@ class GraphState:
         self.strategy = None
         self.iter_time = None
 
+        ### Number of rollouts in flight passing this state, see `MCTSOptimizer.best_UCB`
+        self.virtual_loss = 0
+
     def update_expand_state(self):
         if self.childs is None:
             self.state = GraphExpand.NOT
@@ -40,6 +54,53 @@ class GraphState:
         else:
             self.state = GraphExpand.PARTIAL
 
+### The optimizer shared by forked workers, see `RolloutPool`
+_ROLLOUT_OPT = None
+
+def init_rollout_worker(opt):
+    global _ROLLOUT_OPT
+    _ROLLOUT_OPT = opt
+
+def rollout_in_worker(task):
+    strategy, rollout_idx = task
+    return _ROLLOUT_OPT.rollout(strategy, rollout_idx)
+
+class RolloutPool:
+    ''' Run rollouts in a pool of forked processes, which share the optimizer and
+    the original graph with the parent by copy-on-write. With one worker,
+    rollouts are run in this process when the results are waited for
+    '''
+    def __init__(self, opt, workers):
+        self.opt = opt
+        self.executor = None
+        self.tasks = {}
+        self.futures = {}
+        workers = min(workers, os.cpu_count() or 1)
+        if workers > 1 and "fork" in multiprocessing.get_all_start_methods():
+            self.executor = concurrent.futures.ProcessPoolExecutor(workers,
+                mp_context=multiprocessing.get_context("fork"),
+                initializer=init_rollout_worker, initargs=(opt, ))
+
+    def submit(self, key, strategy, rollout_idx):
+        if self.executor is None:
+            self.tasks[key] = (strategy, rollout_idx)
+        else:
+            self.futures[self.executor.submit(rollout_in_worker, (strategy, rollout_idx))] = key
+
+    def wait(self):
+        ''' Block until some rollouts finish, return a list of (key, result) '''
+        if self.executor is None:
+            key, (strategy, rollout_idx) = self.tasks.popitem()
+            return [(key, self.opt.rollout(strategy, rollout_idx))]
+        done, _ = concurrent.futures.wait(list(self.futures.keys()),
+            return_when=concurrent.futures.FIRST_COMPLETED)
+        return [(self.futures.pop(future), future.result()) for future in done]
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
 class MCTSOptimizer(Optimizer):
     ''' Monte Carlo Tree Search '''
 
@@ -53,42 +114,184 @@ class MCTSOptimizer(Optimizer):
             raise ValueError(
                 "UCB type should be MAX or AVG, but {} is given.".format(self.ucb_type))
         self.no_mutation = args_.no_mutation
+        self.workers = args_.mcts_workers if args_.mcts_workers > 0 else (os.cpu_count() or 1)
+        self.time_budget = args_.mcts_time_budget
+        self.start_time = None
+        self.seed = args_.search_seed if args_.search_seed is not None else random.randrange(2 ** 31)
+        SingleLogger().info("Search seed: {}".format(self.seed))
+
+        ### Strategies of each state are applied to overlays of the original graph
+        self.G = OverlayDiGraph(self.dag)
+        self.PKG = PKGraph(self.G)
 
     def search(self):
+        ''' Tree-parallel MCTS, up to `self.workers` rollouts run concurrently. A state
+        is selected, expanded and its rollout is submitted as long as there are idle
+        workers, and the statistics are merged back into the tree once a rollout finishes
+        '''
+        self.start_time = time.time()
         ### Initialize the root graph state
         self.GS_root = GraphState(depth=0)
         self.GS_root.strategy = []
+        self.GS_root.iter_time, space, weights = self.evaluate_state([])
+        self.GS_root.space = [[action, 0] for action in space]
+        self.update_opt_GS(self.GS_root.strategy, self.GS_root.iter_time)
 
-        while self.check_loop_time() and self.check_loop_num():
-            GS = self.tree_policy(self.GS_root)
-            reward = self.default_policy(GS)
-            SingleLogger().info("Speedup to the origin %6.4f %%" % (100 * reward))
-            self.backpropagation(GS, reward)
-            if args_.ucb_visual:
-                self.visualize_tree()
-            self.show_opt_strategies()
+        pool = RolloutPool(self, self.workers)
+        ### Leaf states of rollouts in flight
+        pending = {}
+        rollout_cnt = 0
+        SingleLogger().info("Start MCTS with {} worker(s), time budget: {} s".format(self.workers, self.time_budget))
+        while True:
+            while len(pending) < self.workers and self.check_loop_time() and self.check_loop_num():
+                GS = self.tree_policy(self.GS_root)
+                if GS is None:
+                    ### All selected paths end in states being evaluated
+                    self.loop_cnt -= 1
+                    break
+                if GS.space is not None and self.terminal(GS):
+                    ### Terminal states are not evaluated again
+                    self.backpropagation(GS, self.reward_of(GS.iter_time))
+                    continue
+                self.add_virtual_loss(GS, 1)
+                pending[rollout_cnt] = GS
+                pool.submit(rollout_cnt, GS.strategy, rollout_cnt)
+                rollout_cnt += 1
+            if len(pending) == 0:
+                break
+            for rollout_idx, (iter_time, space, weights, reward, best) in pool.wait():
+                GS = pending.pop(rollout_idx)
+                self.add_virtual_loss(GS, -1)
+                GS.iter_time = iter_time
+                GS.space = [[action, 0] for action in space]
+                self.update_opt_GS(*best)
+                SingleLogger().info("Speedup to the origin %6.4f %%" % (100 * reward))
+                self.backpropagation(GS, reward)
+                self.display()
+        pool.close()
+        self.checkpoint_eval_cache()
         return
 
-    def visualize_tree(self):
+    def reward_of(self, iter_time):
+        ### Invalid states make no speedup
+        return 0 if iter_time is None else (self.base_cost - iter_time) / self.base_cost
+
+    def evaluate_state(self, strategy):
+        ''' Apply `strategy` to overlays of the original graph and evaluate it
+
+        Returns
+        -------
+        (iteration time, search space, weights) of the resulting graph, the iteration
+        time is None and the search space is empty if the strategy is invalid
+        '''
+        self.G.begin()
+        self.PKG.begin()
+        try:
+            return self.extend_state(strategy, strategy)
+        finally:
+            self.G.discard()
+            self.PKG.discard()
+            self.cost_model_flush(False)
+
+    def extend_state(self, new_strategies, strategy):
+        ''' Apply `new_strategies` to the opened overlays, which already hold the
+        rest of `strategy`, and evaluate the resulting graph, refer to `evaluate_state` '''
+        try:
+            self.apply_strategies(self.G, self.PKG, new_strategies)
+            iter_time, exct_dag, self.mem_usage = self.evaluate(self.G)
+            candidates, _ = self.candidate_selection(
+                self.G, topk=None, critical_path=self.wrap_critical_path(exct_dag))
+            space, weights = self.init_search_space(candidates, self.G, self.PKG)
+        except (OptApplyStrategyError, OptQueryCostModelError):
+            SingleLogger().warn("Strategy invalid: {}".format(str(strategy)[:200]))
+            return None, [], []
+        return iter_time, space, weights
+
+    def rollout(self, strategy, rollout_idx):
+        ''' Evaluate the state reached by `strategy` and randomly apply more strategies
+        until a terminal state, refer to `default_policy`
+
+        Returns
+        -------
+        (iteration time, search space, weights) of the state, the reward of the rollout
+        and (strategy, iteration time) of the best state found in the rollout
+        '''
+        rng = random.Random("{}:rollout:{}".format(self.seed, rollout_idx))
+        ### Graph Passes may be random
+        random.seed(rng.getrandbits(32))
+        np.random.seed(rng.getrandbits(32))
+        ### One overlay is kept for the whole rollout, each step only applies the
+        #   newly picked strategy, and all of them are discarded at the end
+        self.G.begin()
+        self.PKG.begin()
+        try:
+            iter_time, space, weights = self.extend_state(strategy, strategy)
+            best = (strategy, iter_time)
+            cost, _space, _weights = iter_time, list(space), list(weights)
+            if not self.no_mutation:
+                while len(_space) > 0 and len(strategy) < MAX_TREE_DEPTH:
+                    st = self.pick_strategy(_space, weights=_weights, rng=rng)
+                    strategy = strategy + [st]
+                    _cost, _space, _weights = self.extend_state([st], strategy)
+                    if _cost is None:
+                        break
+                    cost = _cost
+                    if best[1] is None or cost < best[1]:
+                        best = (strategy, cost)
+        finally:
+            self.G.discard()
+            self.PKG.discard()
+            self.cost_model_flush(False)
+        SingleLogger().debug("Evaluate the strategy %s" % (str(strategy)))
+        self.compact_name_registry(self.G)
+        return iter_time, space, weights, self.reward_of(cost), best
+
+    def add_virtual_loss(self, GS, num):
+        while GS is not None:
+            GS.virtual_loss += num
+            GS = GS.parent
+
+    def update_opt_GS(self, strategy, iter_time):
+        if iter_time is not None and (self.opt_GS is None or iter_time < self.opt_GS.iter_time):
+            self.opt_GS = GraphState(depth=len(strategy))
+            self.opt_GS.strategy = strategy
+            self.opt_GS.iter_time = iter_time
+            self.opt_GS.quality = self.reward_of(iter_time)
+
+    def display(self):
+        self.show_opt_strategies()
+        with open(os.path.join(ROOT_PATH, "search_trajectory.txt"), "a") as f:
+            f.write(str(time.time()) + ": {},{}".format(self.loop_cnt, 100 * self.opt_GS.quality) + "\n")
+        with open(os.path.join(ROOT_PATH, "best_strategy.txt"), "w") as f:
+            json.dump({"best_strategy": self.opt_GS.strategy}, f)
+        if args_.ucb_visual:
+            ### Rewrite the whole tree atomically, so that it can be watched during the search
+            tree_path = os.path.join(ROOT_PATH, "mcts_tree.txt")
+            with open(tree_path + ".tmp", "w") as f:
+                self.visualize_tree(f)
+            os.replace(tree_path + ".tmp", tree_path)
+
+    def visualize_tree(self, f=sys.stdout):
         def iter_print(GS, cnt):
             ### `cnt` is used to decide how many parent branches to print for current nodes
             LENOFNODE = 11
             LENOFARROW = 5
-            node_string = "  %5.4f %% " % (
-                GS.quality * 100) if GS.quality >= 0 else " -%5.4f %% " % (-GS.quality * 100)
-            sys.stdout.write(node_string)
+            ### Show the average reward for AVG UCB, where `quality` is the sum of rewards
+            quality = GS.quality / GS.visit_cnt if self.ucb_type == "AVG" else GS.quality
+            node_string = " {:>7.3f} % ".format(100 * quality)[:LENOFNODE]
+            f.write(node_string)
             assert len(node_string) == LENOFNODE
             if GS.childs is None:
                 return
             for idx, child in enumerate(GS.childs):
                 if idx > 0:
-                    sys.stdout.write("\n{}".format(" "*(LENOFNODE + LENOFARROW//2)))
-                    sys.stdout.write("{}".format(" "*((LENOFNODE + LENOFARROW) * (GS.depth - cnt))))
-                    sys.stdout.write("{}".format(("|" + " " * (LENOFNODE + LENOFARROW - 1))*(cnt)))
-                    sys.stdout.write("{}".format("|" if idx < (len(GS.childs) - 1) else "\\"))
-                    sys.stdout.write("{}".format("-"*(LENOFARROW - LENOFARROW//2 - 1)))
+                    f.write("\n{}".format(" "*(LENOFNODE + LENOFARROW//2)))
+                    f.write("{}".format(" "*((LENOFNODE + LENOFARROW) * (GS.depth - cnt))))
+                    f.write("{}".format(("|" + " " * (LENOFNODE + LENOFARROW - 1))*(cnt)))
+                    f.write("{}".format("|" if idx < (len(GS.childs) - 1) else "\\"))
+                    f.write("{}".format("-"*(LENOFARROW - LENOFARROW//2 - 1)))
                 else:
-                    sys.stdout.write("{}".format('-'*LENOFARROW))
+                    f.write("{}".format('-'*LENOFARROW))
                 if idx < (len(GS.childs) - 1):
                     next_cnt = cnt + 1
                 else:
@@ -96,7 +299,7 @@ class MCTSOptimizer(Optimizer):
                 iter_print(child, next_cnt)
 
         iter_print(self.GS_root, 0)
-        sys.stdout.write("\n")
+        f.write("\n")
 
     def show_opt_strategies(self):
         SingleLogger().info("Best speedup: %d th layer, speed up to the origin: %6.4f %%" %
@@ -110,28 +313,19 @@ class MCTSOptimizer(Optimizer):
             return True  # continue
 
     def check_loop_time(self):
-        return True  # continue
+        if self.time_budget is None or time.time() - self.start_time < self.time_budget:
+            return True  # continue
+        else:
+            return False  # End
 
     def tree_policy(self, GS):
-        while self.fully_expanded(GS):
+        ''' Return the state to roll out, or None if the selected state is being evaluated '''
+        while GS.space is not None and self.fully_expanded(GS):
             GS = self.best_UCB(GS)
+        if GS.space is None:
+            return None
         return self.expansion(GS)
 
-    def default_policy(self, GS):
-        if not self.no_mutation:
-            while not self.terminal(GS):
-                action = self.pick_strategy(GS.space)[0]
-                GS_c = GraphState(depth=(GS.depth+1))
-                GS_c.strategy = GS.strategy.copy()
-                GS_c.strategy.append(action)
-                GS = GS_c
-        ### Evaluate the final graph
-        if GS.iter_time is None:
-            self.check_search_space(GS)
-        cost = GS.iter_time
-        SingleLogger().debug("Evaluate the strategy %s" % (str(GS.strategy)))
-        return (self.base_cost - cost)/self.base_cost
-
     def backpropagation(self, GS, reward):
         if self.ucb_type == "MAX":
             GS.quality = max(reward, GS.quality)
@@ -144,14 +338,16 @@ class MCTSOptimizer(Optimizer):
             self.backpropagation(GS.parent, reward)
 
     def best_UCB(self, GS):
+        ### Each rollout in flight counts as a visit with a loss of VIRTUAL_LOSS,
+        #   so that concurrent rollouts spread over different branches
         GS_opt = c_opt = None
         for GS_c in GS.childs:
+            visit_cnt = GS_c.visit_cnt + GS_c.virtual_loss
+            explore = UCB_GAMMA * math.sqrt((2 * math.log(GS.visit_cnt + GS.virtual_loss)) / visit_cnt)
             if self.ucb_type == "MAX":
-                c = GS_c.quality + UCB_GAMMA * \
-                    math.sqrt((2 * math.log(GS.visit_cnt)) / GS_c.visit_cnt)
+                c = GS_c.quality - VIRTUAL_LOSS * GS_c.virtual_loss + explore
             elif self.ucb_type == "AVG":
-                c = GS_c.quality / GS_c.visit_cnt + UCB_GAMMA * \
-                    math.sqrt((2 * math.log(GS.visit_cnt)) / GS_c.visit_cnt)
+                c = (GS_c.quality - VIRTUAL_LOSS * GS_c.virtual_loss) / visit_cnt + explore
             else:
                 raise RuntimeError("Invalid UCB_type")
             if GS_opt is None or c > c_opt:
@@ -199,16 +395,9 @@ class MCTSOptimizer(Optimizer):
                 return GS.space[idx][0]
         return None
 
-    def check_search_space(self, GS):
-        ### TODO (huhanpeng): we can do some pruning here
-        if GS.space is None:
-            candidates, new_dag = self.candidate_selection(GS, topk=None)
-            search_space, _ = self.init_search_space(candidates, new_dag)
-            # The integer value is used as a counter
-            GS.space = [[action, 0] for action in search_space]
-
     def terminal(self, GS):
-        self.check_search_space(GS)
+        ### The search space of a state is known after its rollout, where the
+        #   integer value is used as a counter, see `pick_unvisited`
         if GS.depth > MAX_TREE_DEPTH or len(GS.space) == 0:
             return True
         else:
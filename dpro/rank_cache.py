@@ -0,0 +1,124 @@
+''' Per-rank cache of collected artifacts
+
+Parsed traces and local DAG edges of each rank are cached under
+    <trial>/.rank_cache/<worker_dir>/<gpu_dir>/<kind>.pickle
+keyed by the fingerprint of the rank's source files (mtime, size and
+content digest) and the collection configuration, so that only ranks whose
+inputs changed are re-collected.
+'''
+import os
+import pickle
+import hashlib
+import ujson as json
+
+from .logger_utils import SingleLogger
+
+RANK_CACHE_VERSION = 1
+RANK_CACHE_DIR = ".rank_cache"
+HASH_CHUNK_SIZE = 16 * 1024 * 1024
+
+def file_digest(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as fp:
+        while True:
+            chunk = fp.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            md5.update(chunk)
+    return md5.hexdigest()
+
+def file_fingerprint(path, prev=None):
+    ''' Return [mtime_ns, size, digest] of a file. The digest in `prev` is
+        reused if the mtime and the size are unchanged
+    '''
+    stat = os.stat(path)
+    if prev is not None and prev[0] == stat.st_mtime_ns and prev[1] == stat.st_size:
+        return prev
+    return [stat.st_mtime_ns, stat.st_size, file_digest(path)]
+
+def digest_of(obj):
+    return hashlib.md5(json.dumps(obj, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class RankCache:
+    def __init__(self, trial_path):
+        self.trial_path = trial_path
+        self.root = os.path.join(trial_path, RANK_CACHE_DIR)
+        ### rank_id --> fingerprints of source files
+        self.fingerprints = {}
+
+    def _rank_dir(self, rank_id):
+        return os.path.join(self.root, rank_id)
+
+    def _load_fingerprint(self, rank_id):
+        path = os.path.join(self._rank_dir(rank_id), "fingerprint.json")
+        if not os.path.isfile(path):
+            return {}
+        with open(path, 'r') as fp:
+            return json.load(fp)
+
+    def fingerprint(self, rank_id, gpu_path, extra_files=None):
+        ''' Fingerprint all files under the rank directory (and `extra_files`,
+            e.g., trial-level metadata), hidden files are ignored
+        '''
+        if rank_id in self.fingerprints:
+            return self.fingerprints[rank_id]
+        prev = self._load_fingerprint(rank_id)
+        paths = [os.path.join(gpu_path, _f) for _f in sorted(os.listdir(gpu_path))
+            if not _f.startswith(".") and os.path.isfile(os.path.join(gpu_path, _f))]
+        if extra_files is not None:
+            paths += [_f for _f in extra_files if _f is not None]
+        rst = {}
+        for path in paths:
+            ### Use relative paths so that the cache is still valid after moving the trial
+            rel_path = os.path.relpath(path, self.trial_path)
+            rst[rel_path] = file_fingerprint(path, prev.get(rel_path))
+        self.fingerprints[rank_id] = rst
+        return rst
+
+    def key(self, rank_id, gpu_path, config, extra_files=None):
+        ### mtime is only used to skip hashing, touching a file does not invalidate the cache
+        files = dict((path, fp[1:]) for path, fp in self.fingerprint(rank_id, gpu_path, extra_files).items())
+        return digest_of({
+            "version": RANK_CACHE_VERSION,
+            "files": files,
+            "config": config})
+
+    def _read_key(self, rank_id, kind):
+        path = os.path.join(self._rank_dir(rank_id), kind + ".key")
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'r') as fp:
+            return fp.read().strip()
+
+    def is_valid(self, rank_id, kind, key):
+        return self._read_key(rank_id, kind) == key
+
+    def load(self, rank_id, kind, key):
+        if not self.is_valid(rank_id, kind, key):
+            return None
+        path = os.path.join(self._rank_dir(rank_id), kind + ".pickle")
+        try:
+            with open(path, 'rb') as fp:
+                return pickle.load(fp)
+        except Exception as e:
+            SingleLogger().warn("Fail to load rank cache {}: {}".format(path, e))
+            return None
+
+    def dump(self, rank_id, kind, key, data):
+        rank_dir = self._rank_dir(rank_id)
+        os.makedirs(rank_dir, exist_ok=True)
+        ### Invalidate the old data first, the key is written after the data
+        key_path = os.path.join(rank_dir, kind + ".key")
+        if os.path.exists(key_path):
+            os.remove(key_path)
+        with open(os.path.join(rank_dir, kind + ".pickle"), 'wb') as fp:
+            pickle.dump(data, fp)
+        with open(key_path, 'w') as fp:
+            fp.write(key)
+        if rank_id in self.fingerprints:
+            with open(os.path.join(rank_dir, "fingerprint.json"), 'w') as fp:
+                json.dump(self.fingerprints[rank_id], fp)
+
+    def exists(self):
+        return os.path.isdir(self.root)
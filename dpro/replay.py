@@ -3,11 +3,19 @@ import ujson as json
 import networkx as nx
 import time
 import collections
+import copy
+import hashlib
+import heapq
+import itertools
+import multiprocessing
 import re
+import numpy as np
 from tqdm import tqdm
 
-from .dag_utils import QueueType
+from .dag_utils import QueueType, log_critical_path
 from .trace_utils import *
+from .event_list import EventList
+from .trace_writer import open_trace_writer, trace_filename
 from .logger_utils import SingleLogger
 from .debug_utils import DebugRecorder
 from .bps_helper.graph import PS_COMP_OPS_SETS, PS_COMM_OPS_SETS
@@ -21,7 +29,8 @@ comm_op_types = []
 try:
     from hvd.graph import *
 except:
-    pass
+    ### Imported as the `dpro` package
+    from .hvd.graph import *
 
 try:
     from bps_helper.graph import *
@@ -59,6 +68,244 @@ def ret_priority(n_):
 def _repr_of_tensor(tensor_name):
     return min([int(tensor_id) for tensor_id in tensor_name.split("+")])
 
+class ReplayPlan:
+    ''' Static information of a DAG used by replaying, resolved once per DAG
+
+    Nodes are indexed by their order in `dag.nodes`. Per-node information is
+    kept in arrays: the device index (`Device.order`), the static priority,
+    the base duration (`avg`, in ms), the summed intra-device gap, and the
+    successors in the CSR format, i.e., successors of node i are
+    `succ_idx[succ_ptr[i]:succ_ptr[i+1]]`. Python-list mirrors of the arrays
+    are used in the hot loop of replaying.
+
+    The plan is re-compiled once the DAG is modified, see `Replayer.compile`
+    '''
+    def __init__(self, replayer, prev=None):
+        ''' If `prev` is given, the information decided only by node names,
+        e.g., devices and priorities, is reused for nodes in the previous plan
+        '''
+        dag = replayer.dag
+        self.nodes = list(dag.nodes)
+        self.name2idx = dict((n, idx) for idx, n in enumerate(self.nodes))
+
+        if prev is None:
+            self.static_info = [self.gen_static_info(replayer, n) for n in self.nodes]
+        else:
+            self.static_info = [prev.static_info[prev.name2idx[n]] if n in prev.name2idx
+                else self.gen_static_info(replayer, n) for n in self.nodes]
+        (self.devices, priority, self.pid, self.cat, self.event_info, self.fine_cat,
+            self.is_send, self.is_recv, self.is_sync) = [list(info) for info in zip(*self.static_info)] \
+                if len(self.nodes) > 0 else [[] for _ in range(9)]
+
+        node_attrs = [attrs for _, attrs in dag.nodes(data=True)]
+        self.device_idx = np.array([device.order for device in self.devices], dtype=np.int32)
+        self.priority = np.array(priority, dtype=np.int32)
+        self.avg = np.array([attrs.get("avg", 0) for attrs in node_attrs], dtype=np.float64)
+        self.gap = np.array([ReplayPlan.intra_device_gap(attrs) for attrs in node_attrs], dtype=np.float64)
+        if replayer.comm_backend == "BYTEPS":
+            self.in_degree = [replayer.map_in_degree(n) for n in self.nodes]
+        else:
+            self.in_degree = [degree for _, degree in dag.in_degree()]
+
+        succ_ptr, succ_idx = [0], []
+        name2idx = self.name2idx
+        for _, nbrs in dag.adjacency():
+            succ_idx += [name2idx[succ] for succ in nbrs]
+            succ_ptr.append(len(succ_idx))
+        self.succ_ptr = np.array(succ_ptr, dtype=np.int64)
+        self.succ_idx = np.array(succ_idx, dtype=np.int64)
+        self.signature = ReplayPlan.signature_of(dag)
+
+        ### Gaps between two nodes on different devices
+        self.op2comm_gap = [attrs.get(GAP_STR_OP2COMM) for attrs in node_attrs]
+        self.internode_gap = [attrs.get(GAP_STR_INTERNODE) for attrs in node_attrs]
+
+        self.roots = [idx for idx, degree in enumerate(self.in_degree) if degree == 0]
+        self.priority_list = priority
+        self.avg_list = self.avg.tolist()
+        self.gap_list = self.gap.tolist()
+        self.succs = [succ_idx[succ_ptr[idx]:succ_ptr[idx+1]] for idx in range(len(self.nodes))]
+
+    @staticmethod
+    def gen_static_info(replayer, n):
+        ''' Information decided by the node name: device, priority, pid, cat,
+        info of the generated event, fine-grained cat and whether it is a SEND/RECV/Sync node '''
+        return (replayer.name2device(n), ret_priority(n), parse_pid_from_name(n), parse_cat_from_name(n),
+            None if n == "END" else replayer.event_info_of(n),
+            None if n == "END" else parse_cat_fine_grained(n),
+            "SEND" in n, "RECV" in n, "Sync" in n)
+
+    def diff(self, other):
+        ''' Return names of nodes replayed differently with the two plans, i.e.,
+        nodes only in one plan, and nodes whose durations, gaps, in-degrees or
+        successors are changed
+        '''
+        dirty = set(self.name2idx.keys() ^ other.name2idx.keys())
+        ### Indexes of common nodes in the two plans
+        prev_idx = np.array([self.name2idx.get(n, -1) for n in other.nodes], dtype=np.int64)
+        idx = np.flatnonzero(prev_idx >= 0)
+        prev_idx = prev_idx[idx]
+        changed = (other.avg[idx] != self.avg[prev_idx]) | (other.gap[idx] != self.gap[prev_idx]) | \
+            (np.array(other.in_degree)[idx] != np.array(self.in_degree, dtype=np.int64)[prev_idx])
+
+        ### Compare successors, which must be the same nodes in the same order
+        other_degree = np.diff(other.succ_ptr)[idx]
+        changed |= other_degree != np.diff(self.succ_ptr)[prev_idx]
+        prev2other = np.full(len(self.nodes), -1, dtype=np.int64)
+        prev2other[prev_idx] = idx
+        same_degree = np.flatnonzero(~changed)
+        owner = np.repeat(same_degree, other_degree[same_degree])
+        offset = np.arange(len(owner)) - np.repeat(
+            np.cumsum(other_degree[same_degree]) - other_degree[same_degree], other_degree[same_degree])
+        mismatch = other.succ_idx[other.succ_ptr[idx[owner]] + offset] != \
+            prev2other[self.succ_idx[self.succ_ptr[prev_idx[owner]] + offset]]
+        changed[owner[mismatch]] = True
+
+        for i in np.flatnonzero(~changed).tolist():
+            if other.op2comm_gap[idx[i]] != self.op2comm_gap[prev_idx[i]] or \
+                    other.internode_gap[idx[i]] != self.internode_gap[prev_idx[i]]:
+                changed[i] = True
+        dirty.update(other.nodes[i] for i in idx[changed].tolist())
+        return dirty
+
+    def __len__(self):
+        return len(self.nodes)
+
+    @staticmethod
+    def signature_of(dag):
+        ''' Digest of what a plan reads from `dag`: node names in order, node attributes,
+        e.g., durations and gaps, and successors. It is one pass over nodes and edges
+        without resolving devices or priorities, much cheaper than compiling a plan.
+        A blake2b digest is used instead of `hash`, whose values collide easily,
+        e.g., hash(-1) == hash(-2), and a collision would reuse a stale plan '''
+        h = hashlib.blake2b(digest_size=16)
+        ### reprs of the views are built from the underlying dicts in order, which
+        #   is several times faster than iterating over nodes and edges in Python
+        h.update(repr(dag.nodes(data=True)).encode())
+        h.update(repr(dag.adj).encode())
+        return h.hexdigest()
+
+    @staticmethod
+    def intra_device_gap(node_dict):
+        ### e.g. "operatorGAPoperator", the gap between two nodes on the same device
+        gap = 0
+        for key, value in node_dict.items():
+            if "GAP" in key:
+                key_s = key.split("GAP")
+                ### TODO (huhanpeng): does this fit to the BytePS or use intra-gap instead
+                if key_s[0] == key_s[1]:
+                    gap += value
+        return gap
+
+### Ranks whose durations and gaps differ less than this absolute tolerance (in us) are equivalent
+SYMMETRY_ATOL_US = 1
+
+class RankSymmetry:
+    ''' Equivalence classes of ranks in a data-parallel DAG
+
+    Two ranks are equivalent if their computation nodes (all nodes except
+    communication nodes, server ops and END) have the same names after the pid,
+    the same dependencies among them and durations and gaps within the relative
+    tolerance `rtol`, see `RankSymmetry.close`. Since the `avg` and gap attributes
+    are taken from the trace statistics, ranks with near-identical statistics
+    fall into one class, whose first rank is the representative.
+
+    The reduced DAG keeps the computation nodes of representatives only, while
+    communication nodes of all ranks are kept. Dependencies between a member's
+    computation nodes and communication nodes are re-directed to the
+    corresponding nodes of its representative, e.g., BW -> Comm edges of all
+    members of a class start from the BW node of the representative, and the
+    UPDATE node of the representative waits for communication of all members.
+    '''
+    def __init__(self, dag, rtol=0.05):
+        self.dag = dag
+        self.rtol = rtol
+        rank2nodes = collections.defaultdict(list)
+        for n in dag.nodes:
+            if RankSymmetry.is_rank_node(n):
+                rank2nodes[parse_pid_from_name(n)].append(n)
+
+        ### Group ranks by the structure of computation nodes first,
+        #   then compare durations and gaps with the representative of each class
+        structure2classes = {}
+        self.classes = []
+        for pid in sorted(rank2nodes.keys()):
+            nodes = sorted(rank2nodes[pid], key=RankSymmetry.local_name)
+            structure, values = self._signature(nodes)
+            classes = structure2classes.setdefault(structure, [])
+            for rep_values, members in classes:
+                if RankSymmetry.close(values, rep_values, rtol):
+                    members.append(pid)
+                    break
+            else:
+                classes.append((values, [pid]))
+                self.classes.append(classes[-1][1])
+
+        self.rep_of = dict((pid, members[0]) for members in self.classes for pid in members)
+        self.reduced_dag = self._reduce()
+
+    @staticmethod
+    def close(values, rep_values, rtol):
+        ''' The summed difference of durations and gaps bounds the difference of the
+        time a rank spends on computation, so it is compared with the total time '''
+        return np.abs(values - rep_values).sum() <= rtol * np.abs(rep_values).sum() + SYMMETRY_ATOL_US
+
+    @staticmethod
+    def is_rank_node(n):
+        return n != "END" and parse_cat_from_name(n) not in \
+            [CatName.COMM.value, CatName.PS_SERVER_OPERATOR.value]
+
+    @staticmethod
+    def local_name(n):
+        ### The node name without pids, fused nodes contain multiple pids
+        return "+".join([parse_rawname(_n) for _n in n.split("+")])
+
+    def _signature(self, nodes):
+        ''' Return the structure, i.e., names and local dependencies, and the vector
+        of durations of computation nodes of one rank followed by the total gaps
+        (in us) used by replaying. Gaps of single nodes are not compared, since how
+        gaps are distributed among nodes is much more noisy than durations
+        '''
+        names, edges, durations = [], [], []
+        gaps = np.zeros(3)
+        for n in nodes:
+            attrs = self.dag.nodes[n]
+            names.append(RankSymmetry.local_name(n))
+            durations.append(1000 * attrs.get("avg", 0))
+            gaps += [ReplayPlan.intra_device_gap(attrs),
+                attrs.get(GAP_STR_OP2COMM) or 0, attrs.get(GAP_STR_INTERNODE) or 0]
+            edges += [(RankSymmetry.local_name(n), RankSymmetry.local_name(succ))
+                for succ in self.dag.successors(n) if RankSymmetry.is_rank_node(succ)]
+        return (tuple(names), tuple(sorted(edges))), np.concatenate([durations, gaps])
+
+    def rep_node(self, n):
+        ''' Map a computation node to the corresponding node of its representative '''
+        if not RankSymmetry.is_rank_node(n):
+            return n
+        return "+".join([gen_long_name(self.rep_of[parse_pid_from_name(_n)], parse_rawname(_n))
+            for _n in n.split("+")])
+
+    def _reduce(self):
+        reduced_dag = nx.DiGraph()
+        for n, attrs in self.dag.nodes(data=True):
+            if self.rep_node(n) == n:
+                reduced_dag.add_node(n, **attrs)
+        for u, v, attrs in self.dag.edges(data=True):
+            _u, _v = self.rep_node(u), self.rep_node(v)
+            if _u != _v and not reduced_dag.has_edge(_u, _v):
+                reduced_dag.add_edge(_u, _v, **attrs)
+        return reduced_dag
+
+    def is_reduced(self, n):
+        ''' Return True if node `n` is removed in the reduced DAG '''
+        return self.rep_node(n) != n
+
+    def expand_step_end_time(self, step_end_time):
+        ''' Members of a class end the step at the same time as its representative '''
+        for pid, rep in self.rep_of.items():
+            if pid != rep:
+                step_end_time[pid] = step_end_time[rep]
+
 class Device:
     def __init__(self, device_name, _replayer, 
             infi_para=False,
@@ -76,8 +323,12 @@ class Device:
         self.prev_name_dur = None
         self.comm_backend = comm_backend
 
-        ### nodes to be executed, in a **partial order**
+        ### nodes to be executed, a heap of (priority, ready time, seq, name)
         self.queue = []
+        ### The order of creation, used to break ties of device time
+        self.order = None
+        ### The device time of the valid entry of this device in the global heap, see `Replayer.push_device`
+        self.heap_time = None
 
         self.full_trace = full_trace
 
@@ -85,6 +336,28 @@ class Device:
         self.device_time = self.init_device_time
         self.prev_name_dur = None
         self.queue = []
+        self.heap_time = None
+
+    def state(self):
+        ''' Return the state of this device, where nodes are referred to by names '''
+        nodes = self.replayer.plan.nodes
+        return (self.device_time, self.prev_name_dur,
+            [(priority, t, seq, nodes[idx]) for priority, t, seq, idx in self.queue])
+
+    def load_state(self, state):
+        ''' Restore the state returned by `state` with the current replay plan '''
+        name2idx = self.replayer.plan.name2idx
+        self.device_time, self.prev_name_dur, queue = state[:3]
+        self.heap_time = None
+        ### The order of items is kept, so the queue is still a heap
+        self.queue = [(priority, t, seq, name2idx[n]) for priority, t, seq, n in queue]
+
+    @staticmethod
+    def state_key(state):
+        ''' Comparable form of a state, sequence numbers only decide the order of queued nodes '''
+        device_time, prev_name_dur, queue = state[:3]
+        return (device_time, prev_name_dur,
+            [(priority, t, n) for priority, t, _, n in sorted(queue)]) + tuple(state[3:])
 
     def real_start_t(self, _last_end_time):
         return max(_last_end_time, self.device_time)
@@ -110,34 +383,41 @@ class Device:
 
         if name == "END":
             #! No event is generated, but has successors
+            self.record_start(self.replayer.plan.name2idx[name], _last_end_time, start_t, 0)
             self.mark_as_exct(name, start_t, start_t)
             return
 
         ### Really start to execute
-        avg = self.replayer.dag.nodes[name]["avg"]
-        if "+" in name and "Comm" not in name:
-            pid, _, cat, suffix = parse_allinfo_from_name(name.split("+")[0])
-            raw_name = "+".join([parse_allinfo_from_name(_name)[1] for _name in name.split("+")])
-        else:
-            pid, raw_name, cat, suffix = parse_allinfo_from_name(name)
+        plan = self.replayer.plan
+        idx = plan.name2idx[name]
+        avg = plan.avg_list[idx]
         delay, ratio = self.get_delay_para(name)
         duration = (1000.0 * max(avg + delay, 0)) * ratio
         if self.comm_backend == "BYTEPS" and "UPDATE_CAL" in name:
             duration = 0
-        
+
+        self.record_start(idx, _last_end_time, start_t, duration)
+        if self.replayer.lean:
+            ### Neither the execution graph nor traces are generated
+            self.prev_name_dur = (name, duration, start_t)
+            self.mark_as_exct(name, start_t, start_t + duration)
+            self.replayer.step_end_time[plan.pid[idx]] = start_t + duration
+            return
+
+        event_name, pid, cat = plan.event_info[idx]
         ### Construct execution graphs
         ### 1. Add new edges according to the execution order
+        #   the edge is ignored if it already exists, see `Replayer.exct_dag`
         if not self.infi_para and self.prev_name_dur is not None and \
-            (self.prev_name_dur[0], name) not in self.replayer.exct_dag.edges and \
             not ("BW" in self.prev_name_dur[0] and "UPDATE_" in name):
-            self.replayer.exct_dag.add_edge(self.prev_name_dur[0], name, weight=(
-                (start_t - self.prev_name_dur[2]) / 1000.0))
+            self.replayer.exct_edges.append((self.prev_name_dur[0], name,
+                (start_t - self.prev_name_dur[2]) / 1000.0, False))
                     
         if duration == 0 and not self.full_trace:
             self.prev_name_dur = (name, 0, start_t)
         else:
             event = {
-                        "name": raw_name if self.replayer.name2mapping_fn is None else self.replayer.name2mapping_fn(raw_name),
+                        "name": event_name,
                         "ts": start_t,
                         "dur": duration,
                         "pid": pid,
@@ -160,28 +440,33 @@ class Device:
             # ### 2. Update edge weight
             # for next_ in self.replayer.exct_dag.successors(name):
             # 	self.replayer.exct_dag.edges[name, next_]["weight"] = duration / 1000.0
-            self.replayer.rst_traces.append(event)
+            self.replayer.emit_event(event)
         # DebugRecorder().debug_event_start()
 
         self.mark_as_exct(name, start_t, start_t + duration)
         # DebugRecorder().debug_event_end(name, self.device_name, "mark_as_exct")
-        pid = parse_pid_from_name(name)
-        self.replayer.step_end_time[pid] = start_t + duration
+        self.replayer.step_end_time[plan.pid[idx]] = start_t + duration
         #! TODO: for debug
         # DebugRecorder().debug_event_end(name, self.device_name, "exct")
     
+    def record_start(self, idx, _last_end_time, start_t, duration):
+        ''' Record the start/end time of a node and its binding predecessor, i.e.,
+        the previous node on this device if the node waits for the device,
+        otherwise the dependency ready last, see `ExecutionRecord`
+        '''
+        replayer = self.replayer
+        if start_t > _last_end_time and self.prev_name_dur is not None:
+            replayer.crit_pred[idx] = replayer.plan.name2idx[self.prev_name_dur[0]]
+        else:
+            replayer.crit_pred[idx] = replayer.dep_pred[idx]
+        replayer.start_time[idx] = start_t
+        replayer.end_time[idx] = start_t + duration
+
     def _update_device_time(self, name, _end_time):
-        ### Apply the gap between two nodes
-        gap = 0
-        for key, value in self.replayer.dag.nodes[name].items():
-            if "GAP" in key:
-                ### e.g. "gap.operator.operator"
-                key_s = key.split("GAP")
-                ### TODO (huhanpeng): does this fit to the BytePS or use intra-gap instead
-                if key_s[0] == key_s[1]:
-                    gap += value
-                    if gap > 1000:
-                        SingleLogger().debug("Large GAP detected: {}, key = {}, gap = {}".format(name, key, value))
+        ### Apply the gap between two nodes, i.e., the sum of intra-device gaps of this node
+        gap = self.replayer.plan.gap_list[self.replayer.plan.name2idx[name]]
+        if gap > 1000:
+            SingleLogger().debug("Large GAP detected: {}, gap = {}".format(name, gap))
         if gap < 0:
             raise RuntimeError(
                 "Negative GAP detected: {}, gap = {}".format(name, gap))
@@ -192,46 +477,50 @@ class Device:
     def mark_as_exct(self, name, _start_t, _end_time):
         ''' Mark that the op has been executed '''
         self._update_device_time(name, _end_time)
-        self.replayer.node_status.pop(name)
-        this_cat = parse_cat_from_name(name)
-        for _succ in self.replayer.dag.successors(name):
-            next_cat = parse_cat_from_name(_succ)
-            if _succ in self.replayer.node_status:
-                _status = self.replayer.node_status[_succ]
-                ### Calculate the ready time
-                if self.comm_backend == "NCCL" and ("SEND" in name and "RECV" in _succ):
-                    ### For Send->Recv edge, there exist some overlap
-                    ### TODO (huhanpeng): how do decide the end time of the RECV event
-                    SingleLogger().warn("SEND and RECV should overlap to each other")
-                    avg = self.replayer.dag.nodes[_succ]["avg"]
-                    gap = 0
-                    _status["ready"] = (_end_time + gap) if _status["ready"] is None \
-                        else max(_end_time + gap, _status["ready"])
-                elif self.comm_backend == "default" and ("SEND" in name and "RECV" in _succ):
-                    ### For Send->Recv edge, there exist some overlap
-                    ### TODO (huhanpeng): how do decide the end time of the RECV event
-                    avg = self.replayer.dag.nodes[_succ]["avg"]
-                    gap = 0
-                    _status["ready"] = (_start_t + gap) if _status["ready"] is None \
-                        else max(_start_t + gap, _status["ready"])
-                else:
-                    ## For BYTEPS and Horovod, Only apply BW->Comm gaps
-                    ## Other gaps should be considered with the device time.
-                    gap = 0
-                    if GAP_STR_OP2COMM in self.replayer.dag.nodes[name] and next_cat == CatName.COMM.value \
-                         and (this_cat == CatName.OPERATOR.value or "Sync" in name):
-                        gap += self.replayer.dag.nodes[name][GAP_STR_OP2COMM]
-                        if self.replayer.dag.nodes[name][GAP_STR_OP2COMM] > 10000:
-                            SingleLogger().debug("Large OP2COMM gap detected, {} -> {},  gap: {}".format(name, _succ, self.replayer.dag.nodes[name][GAP_STR_OP2COMM]))
-                    _status["ready"] = (_end_time + gap) if _status["ready"] is None else max(_end_time + gap, _status["ready"])
-
-                ### Whether the dependency has met
-                _status["in_degree"] -= 1
-                # self.replayer.debuger.mark_as_exct(name, _succ)
-                if _status["in_degree"] == 0:
-                    if _status["ready"] is None:
-                        raise RuntimeError("{}\'s ready time is not decided".format(_succ))
-                    self.replayer.insert_next_node(_succ, _status["ready"])
+        replayer = self.replayer
+        plan = replayer.plan
+        idx = plan.name2idx[name]
+        replayer.executed[idx] = 1
+        this_cat = plan.cat[idx]
+        ### For BYTEPS and Horovod, Only apply BW->Comm gaps
+        #   Other gaps should be considered with the device time.
+        op2comm_gap = plan.op2comm_gap[idx] if (this_cat == CatName.OPERATOR.value or plan.is_sync[idx]) else None
+        if op2comm_gap is not None and op2comm_gap > 10000:
+            SingleLogger().debug("Large OP2COMM gap detected, {},  gap: {}".format(name, op2comm_gap))
+        is_send = plan.is_send[idx]
+        ready, in_degree, dep_pred = replayer.ready, replayer.in_degree, replayer.dep_pred
+        node_step = replayer.node_step
+        for succ in plan.succs[idx]:
+            ### When steps are pipelined, `succ` may be still in the previous step, see `replay_steady`
+            deferred = node_step is not None and node_step[succ] != node_step[idx]
+            if replayer.executed[succ] and not deferred:
+                continue
+            ### Calculate the ready time
+            if self.comm_backend == "NCCL" and is_send and plan.is_recv[succ]:
+                ### For Send->Recv edge, there exist some overlap
+                ### TODO (huhanpeng): how do decide the end time of the RECV event
+                SingleLogger().warn("SEND and RECV should overlap to each other")
+                _ready = _end_time
+            elif self.comm_backend == "default" and is_send and plan.is_recv[succ]:
+                ### For Send->Recv edge, there exist some overlap
+                ### TODO (huhanpeng): how do decide the end time of the RECV event
+                _ready = _start_t
+            elif op2comm_gap is not None and plan.cat[succ] == CatName.COMM.value:
+                _ready = _end_time + op2comm_gap
+            else:
+                _ready = _end_time + 0
+            if deferred:
+                replayer.deferred[(plan.pid[succ], node_step[idx])].append((succ, _ready, idx))
+                continue
+            if ready[succ] is None or _ready > ready[succ]:
+                ready[succ] = _ready
+                dep_pred[succ] = idx
+
+            ### Whether the dependency has met
+            in_degree[succ] -= 1
+            # self.replayer.debuger.mark_as_exct(name, _succ)
+            if in_degree[succ] == 0:
+                replayer.insert_node_idx(succ, ready[succ])
         # self.replayer.debuger.show_staue()
 
     def get_delay_para(self, name_):
@@ -239,7 +528,7 @@ class Device:
         delay = 0
         ratio = 1.0
         if self.replayer.delay_dict is not None:
-            cat = parse_cat_fine_grained(name_)
+            cat = self.replayer.plan.fine_cat[self.replayer.plan.name2idx[name_]]
             if name_ in self.replayer.delay_dict:
                 delay = self.replayer.delay_dict[name_]["delay"]
                 ratio = self.replayer.delay_dict[name_]["ratio"]
@@ -275,6 +564,14 @@ class CommKernelDevice(Device):
     def release_lock(self):
         self.lock = None
 
+    def state(self):
+        return super().state() + (self.lock, list(self.blocked))
+
+    def load_state(self, state):
+        super().load_state(state)
+        self.lock, blocked = state[3:]
+        self.blocked = list(blocked)
+
     def exct(self, name, _last_end_time, step_idx):
         if self.acquire_lock(name):
             super().exct(name, _last_end_time, step_idx)
@@ -317,32 +614,130 @@ class PSCommDevice(Device):
     def mark_as_exct(self, name, _start_t, _end_time):
         next_name = self.op_counter.get_next_op(name)
         self._update_device_time(name, _end_time)
-        self.replayer.node_status.pop(name)
+        replayer = self.replayer
+        plan = replayer.plan
+        idx = plan.name2idx[name]
+        replayer.executed[idx] = 1
 
-        this_cat = parse_cat_from_name(name)
-        actual_successors = list(self.replayer.dag.successors(name))
+        this_cat = plan.cat[idx]
+        actual_successors = list(plan.succs[idx])
         if next_name is not None:
-            assert next_name in self.replayer.dag.nodes()
-            actual_successors.append(next_name)
+            assert next_name in plan.name2idx
+            actual_successors.append(plan.name2idx[next_name])
             # add an edge from this name to next_name in exct dag
-            self.replayer.exct_dag.add_edge(name, next_name, weight=((_end_time - _start_t) / 1000.0))
-
-        for _succ in actual_successors:
-            next_cat = parse_cat_from_name(_succ)
-            if _succ in self.replayer.node_status:
-                _status = self.replayer.node_status[_succ]
-                _status["in_degree"] -= 1
-                # add GAPs
-                gap = 0
-                if GAP_STR_INTERNODE in self.replayer.dag.nodes[name] and \
-                        this_cat == CatName.COMM.value and \
-                        next_cat == CatName.COMM.value:
-                    gap += self.replayer.dag.nodes[name][GAP_STR_INTERNODE]
-                # gap = 0
-                _status["ready"] = (_end_time + gap) if _status["ready"] is None else max(_end_time + gap, _status["ready"])
-
-                if _status["in_degree"] == 0:
-                    self.replayer.insert_next_node(_succ, _status["ready"])
+            replayer.exct_edges.append((name, next_name, (_end_time - _start_t) / 1000.0, True))
+
+        internode_gap = plan.internode_gap[idx] if this_cat == CatName.COMM.value else None
+        ready, in_degree, dep_pred = replayer.ready, replayer.in_degree, replayer.dep_pred
+        for succ in actual_successors:
+            if replayer.executed[succ]:
+                continue
+            in_degree[succ] -= 1
+            # add GAPs
+            gap = 0
+            if internode_gap is not None and plan.cat[succ] == CatName.COMM.value:
+                gap += internode_gap
+            # gap = 0
+            if ready[succ] is None or _end_time + gap > ready[succ]:
+                ready[succ] = _end_time + gap
+                dep_pred[succ] = idx
+
+            if in_degree[succ] == 0:
+                replayer.insert_node_idx(succ, ready[succ])
+
+class ExecutionRecord:
+    ''' The start/end time of each replayed node and its binding predecessor,
+    i.e., the one deciding its start time, see `Device.record_start`. Critical
+    paths are rebuilt from it without the execution graph
+    '''
+    def __init__(self, nodes, start_time, crit_pred, end_time):
+        self.nodes = nodes
+        self.start_time = start_time
+        self.crit_pred = crit_pred
+        self.end_time = end_time
+        ### The node finishing last, nodes not executed have an end time of -inf
+        self.last_node = int(np.argmax(end_time)) if len(end_time) > 0 else -1
+
+    def critical_path(self, pathM=None, _debug_level=0):
+        ''' Follow the binding predecessors from the node finishing last, return
+        the critical path in the format of `dag_longest_path`, where the length
+        of a node is the time (in ms) until its successor on the path starts
+        '''
+        path = []
+        visited = set()
+        idx = self.last_node
+        while idx >= 0 and idx not in visited:
+            visited.add(idx)
+            path.append(idx)
+            idx = self.crit_pred[idx]
+        path.reverse()
+        len_list = [(self.start_time[v] - self.start_time[u]) / 1000.0 for u, v in zip(path[:-1], path[1:])]
+        critical_path = list(zip([self.nodes[idx] for idx in path], len_list + [0]))
+        log_critical_path(critical_path, pathM, _debug_level)
+        return critical_path
+
+class ReplayCheckpoint:
+    ''' State of a replay after `pos` nodes are popped, nodes are referred to by names '''
+    def __init__(self, pos, remaining, trace_num, edge_num, next_seq,
+            devices, frontier, step_end_time, updated_pids):
+        self.pos = pos
+        ### Number of nodes that have not been executed
+        self.remaining = remaining
+        self.trace_num = trace_num
+        self.edge_num = edge_num
+        self.next_seq = next_seq
+        ### device name --> device state, see `Device.state`
+        self.devices = devices
+        ### node name --> (in-degree, ready time, name of the dependency ready last)
+        #   of nodes not executed but with a ready time
+        self.frontier = frontier
+        self.step_end_time = step_end_time
+        ### pids whose step end time is updated since the previous checkpoint
+        self.updated_pids = updated_pids
+
+    def blocked_names(self):
+        ''' Nodes which have been popped but are blocked, see `CommKernelDevice` '''
+        return [n for state in self.devices.values() if len(state) > 3 for n, _ in state[4]]
+
+class ReplaySchedule:
+    ''' Record of one replay, used by `Replayer.replay_incremental` to
+    re-simulate only the part affected by modifications of the DAG
+    '''
+    def __init__(self, plan, delay_dict):
+        self.plan = plan
+        self.delay_dict = copy.deepcopy(delay_dict)
+        ### Indexes of popped nodes and their ready time, in the popped order
+        self.pops = []
+        self.pop_t = []
+        self.checkpoints = []
+        self.traces = None
+        self.edges = None
+        ### `crit_pred`, `start_time` and `end_time` of the replayer
+        self.record = None
+        self.step_end_time = None
+        ### pids whose step end time is updated after the last checkpoint
+        self.updated_pids = set()
+
+### The replayer shared by all workers of `replay_one_scenario`
+_BATCH_REPLAYER = None
+
+def init_batch_replay_worker(replayer):
+    global _BATCH_REPLAYER
+    _BATCH_REPLAYER = replayer
+
+def replay_one_scenario(task):
+    ''' Replay with one delay scenario in a worker process
+    Parameters
+    ----------
+    task: tuple
+        (index, delay_dict, critical_path), return the critical path if `critical_path` is True
+
+    Returns
+    -------
+    (index, (step_end_time, critical path or None))
+    '''
+    index, delay_dict, critical_path = task
+    return index, _BATCH_REPLAYER._replay_scenario(delay_dict, critical_path)
 
 class Replayer:
     def __init__(self, 
@@ -357,7 +752,25 @@ class Replayer:
             recd_topo_order=False,
             partial=False,
             name2mapping_fn=None,
-            full_trace=False):
+            full_trace=False,
+            incremental=False,
+            lean=False,
+            stream_traces=False,
+            trace_format="json",
+            rank_symmetry=False,
+            symmetry_rtol=0.05):
+        ### If `rank_symmetry` is True, only one representative of each class of
+        #   equivalent ranks is simulated, see `RankSymmetry`, and `self.dag` is
+        #   the reduced DAG, while `self.full_dag` is the input DAG
+        self.full_dag = dag
+        self.symmetry_rtol = symmetry_rtol
+        self.symmetry = None
+        if rank_symmetry:
+            self.symmetry = RankSymmetry(dag, rtol=symmetry_rtol)
+            dag = self.symmetry.reduced_dag
+            SingleLogger().info("Rank symmetry: {} ranks in {} classes, replay {}/{} nodes".format(
+                len(self.symmetry.rep_of), len(self.symmetry.classes),
+                dag.number_of_nodes(), self.full_dag.number_of_nodes()))
         self.dag = dag
         self.infi_para_update = infi_para_update
         # self.preprocess_dag()
@@ -371,10 +784,46 @@ class Replayer:
         self.logger.warn("'self.leaf_dirs' will be deprecated.")
         ### Delay information, the unit of 'delay' field should be ms
         self.delay_dict = None
-        ### maintain node status
-        self.node_status = {}
+        ### Static information of self.dag used by replaying, see `compile`
+        self.plan = None
+        ### maintain node status, indexed by the node index in self.plan
+        self.in_degree = []
+        self.ready = []
+        self.executed = bytearray()
+        ### The last dependency making a node ready, indexed by the node index
+        self.dep_pred = []
+        ### The binding predecessor, start and end time of each node, see `Device.record_start`
+        self.crit_pred = []
+        self.start_time = []
+        self.end_time = []
+        ### Built after each replay, used to get the critical path
+        self.exct_record = None
+        ### The step each node is in and dependencies of nodes in the following steps,
+        #   only used when consecutive steps are pipelined, see `replay_steady`
+        self.node_step = None
+        self.deferred = None
+
+        ### In the lean mode, only the iteration time and `self.exct_record`
+        #   are generated, without traces or the execution graph
+        self.lean = lean
         self.device_dict = {}
+        ### Devices in the order of creation
+        self.device_list = []
         self.queue_status = None
+        ### Sequence numbers of inserted nodes, nodes with the same priority
+        #   and ready time are executed in the order of insertion
+        self.insert_seq = itertools.count()
+
+        ### If True, record the schedule of `replayAndDelay`, see `replay_incremental`
+        self.incremental = incremental
+        self.schedule = None
+        self.checkpoint_interval = None
+
+        ### If True, traces to output are written to disk while replaying,
+        #   instead of being kept in self.rst_traces, see `output_traces`
+        self.stream_traces = stream_traces
+        self.trace_format = trace_format
+        self.trace_writer = None
 
         self.reset_replayer()
         if self.comm_backend == "BYTEPS":
@@ -383,6 +832,7 @@ class Replayer:
         self.show_queue = show_queue
         self.show_queue = True
         if not self.show_queue:	
+            ### A heap of (priority, ready time, seq, node index)
             self.queue = []
         
         ### Decide whether to record the topological order
@@ -419,59 +869,92 @@ class Replayer:
             for node in update_nodes:
                 self.dag.add_edge("BW_BARRIER", node, avg=0)
 
+    def map_in_degree(self, n):
+        if self.comm_backend == "BYTEPS":
+            if self.byteps_graph.is_server_comp(n):
+                return self.dag.in_degree(n) + 1
+        return self.dag.in_degree(n)
+
+    def event_info_of(self, n):
+        ''' Return the name, pid and cat of the event generated by node `n` '''
+        if "+" in n and "Comm" not in n:
+            pid, _, cat, _ = NAME_REGISTRY.allinfo_of(n.split("+")[0])
+            raw_name = "+".join([NAME_REGISTRY.allinfo_of(_name)[1] for _name in n.split("+")])
+        else:
+            pid, raw_name, cat, _ = NAME_REGISTRY.allinfo_of(n)
+        if self.name2mapping_fn is not None:
+            raw_name = self.name2mapping_fn(raw_name)
+        return raw_name, pid, cat
+
+    def compile(self):
+        ''' Resolve devices, priorities, durations, gaps and successors of
+        nodes in self.dag once, the plan is reused by following replays
+        until the DAG changes, see `ReplayPlan.signature_of`. Information
+        decided by node names is reused when the plan is re-compiled.
+        '''
+        if self.plan is None or self.plan.signature != ReplayPlan.signature_of(self.dag):
+            self.plan = ReplayPlan(self, prev=self.plan)
+        return self.plan
+
+    def invalidate_plan(self):
+        self.plan = None
+
     def pre_prepare(self):
         ''' Initialize nodes that need to be replayed first
         '''
-        def map_in_degree(n):
-            if self.comm_backend == "BYTEPS":
-                if self.byteps_graph.is_server_comp(n):
-                    return self.dag.in_degree(n) + 1
-            return self.dag.in_degree(n)
-
-        self.node_status = []
-        for n in self.dag.nodes():
-            self.node_status.append((n, {"in_degree": map_in_degree(n), "ready": None}))
-            if self.show_queue:
-                ### if we want to show queue statuts, need to initialize the device list first
-                self.name2device(n)
-        self.node_status = dict(self.node_status)
+        plan = self.compile()
+        self.in_degree = list(plan.in_degree)
+        self.ready = [None] * len(plan)
+        self.executed = bytearray(len(plan))
+        self.dep_pred = [-1] * len(plan)
+        self.crit_pred = [-1] * len(plan)
+        self.start_time = [None] * len(plan)
+        self.end_time = [-np.inf] * len(plan)
 
         ### prepare nodes to be executed on each device
-        for n, _status in self.node_status.items():
-            if _status["in_degree"] == 0:
-                if not self.allow_comm_init_frontier and not self.partial and CatName.COMM.value in n:
-                    if input("Invalid nodes {} with in_degree=0, Continue: (Y/n)".format(n)).lower() in ["", "y", "yes"]:
-                        self.allow_comm_init_frontier = True
-                    else:
-                        exit(1)
-                pid = parse_pid_from_name(n)
-                _last_end = self.step_end_time[pid] if _status["ready"] is None else _status["ready"]
-                self.insert_next_node(n, _last_end)
+        for idx in plan.roots:
+            n = plan.nodes[idx]
+            if not self.allow_comm_init_frontier and not self.partial and CatName.COMM.value in n:
+                if input("Invalid nodes {} with in_degree=0, Continue: (Y/n)".format(n)).lower() in ["", "y", "yes"]:
+                    self.allow_comm_init_frontier = True
+                else:
+                    exit(1)
+            self.insert_node_idx(idx, self.step_end_time[plan.pid[idx]])
     
-    def replay_one_iter(self, step_idx):
+    def replay_one_iter(self, step_idx, schedule=None):
         self.debuger = ReplayDebuger(self)
         # self.debuger.monitor_node()
         self.pre_prepare()
-        while True:
-            if self.pop_one_node_exec(step_idx) == 1:
-                break
+        if schedule is not None:
+            self._run_recorded(step_idx, schedule, set())
+        else:
+            while True:
+                if self.pop_one_node_exec(step_idx) == 1:
+                    break
         # DebugRecorder().dump_traces(".")
+        if self.symmetry is not None:
+            self.symmetry.expand_step_end_time(self.step_end_time)
+        self.exct_record = ExecutionRecord(self.plan.nodes, self.start_time, self.crit_pred, self.end_time)
         
         self.replay_done = True
 
     def pop_one_node_exec(self, step_idx):
         if self.show_queue:
-            sorted_device = sorted(self.device_dict.values(), key=lambda x: x.device_time)
-            for device in sorted_device:
-                if len(device.queue) == 0:
-                    continue
-                (n, t) = device.queue.pop(0)
-                if self.recd_topo_order:
-                    self.topo_ord.append((n, t))
+            ### Run the first node of the device with the earliest device time,
+            #   ties are broken by the order of creation
+            device = self.pop_ready_device()
+            if device is None:
+                return 1  ### no operators to execute
+            _, t, _, idx = heapq.heappop(device.queue)
+            n = self.plan.nodes[idx]
+            if self.recd_topo_order:
+                self.topo_ord.append((n, t))
+            if self.full_trace:
                 self.record_queue_status(t)
-                device.exct(n, t, step_idx)
-                return 0
-            return 1  ### no operators to execute
+            device.exct(n, t, step_idx)
+            ### The device time has changed
+            self.push_device(device)
+            return 0
         else:
             if len(self.queue) == 0:
                 return 1
@@ -481,13 +964,38 @@ class Replayer:
             # if len(bw_ops) > 1:
             #     print(bw_ops)
 
-            (n, t) = self.queue.pop(0)
+            _, t, _, idx = heapq.heappop(self.queue)
+            n = self.plan.nodes[idx]
             if self.recd_topo_order:
                 self.topo_ord.append((n, t))
-            device = self.name2device(n)
+            device = self.plan.devices[idx]
             device.exct(n, t, step_idx)
             return 0
 
+    def push_device(self, device):
+        ''' Add a device with pending nodes to the global heap of devices.
+
+        The heap is keyed by (device time, order of creation). Entries are
+        invalidated lazily: an entry is stale if its device time is not the
+        current one or the device has no pending nodes. A device has at most
+        one valid entry, e.g., nodes inserted to a device while it runs a node
+        do not add another entry.
+        '''
+        if len(device.queue) > 0 and device.heap_time != device.device_time:
+            device.heap_time = device.device_time
+            heapq.heappush(self.device_heap, (device.device_time, device.order))
+
+    def pop_ready_device(self):
+        ''' Pop the device with pending nodes and the earliest device time '''
+        while len(self.device_heap) > 0:
+            device_time, order = heapq.heappop(self.device_heap)
+            device = self.device_list[order]
+            if device_time == device.heap_time:
+                device.heap_time = None
+                if len(device.queue) > 0 and device_time == device.device_time:
+                    return device
+        return None
+
     def record_queue_status(self, cur_time):
         if self.queue_status is None:
             self.queue_status = {"names": list(self.device_dict.keys()), 'data': []}
@@ -495,6 +1003,8 @@ class Replayer:
 
     def replay(self, _output=True, verbose=True):
         self.reset_replayer()
+        if _output:
+            self.open_trace_stream()
         _ts = time.time()
         for step_idx in range(self.step_num):
             self.replay_one_iter(step_idx)
@@ -503,49 +1013,570 @@ class Replayer:
             self.output_traces(verbose=verbose)
         return self.step_end_time
         
+    def replay_steady(self, max_step_num=20, tol=0.01, _output=False, verbose=True):
+        ''' Replay consecutive steps until the steady state
+
+        Steps are pipelined over the node status of one plan: once all nodes of
+        a pid finish step s, the status of these nodes is reset in place and the
+        pid starts step s + 1 at its step end time, while other pids may be still
+        in step s. Dependencies on nodes still in the previous step are deferred
+        until these nodes enter the step. The steady state is reached at step s
+        if the iteration time and the offset of the end time of each device to
+        the end of the step both change less than `tol` times the iteration
+        time compared to step s - 1, then no more steps are started.
+        BytePS replays steps one by one without pipelining, since the server
+        op counter only holds the state of one step.
+
+        Returns
+        -------
+        A dict of whether the steady state is reached, the steady-state
+        iteration time (in ms), the number and duration (in ms) of warm-up steps,
+        i.e., steps before the two steady steps, and iteration times of all steps
+        '''
+        self.reset_replayer()
+        if _output:
+            self.open_trace_stream()
+        _ts = time.time()
+        self.delay_dict = None
+        self.debuger = ReplayDebuger(self)
+        self.pre_prepare()
+        plan = self.plan
+        device_num = len(self.device_list)
+        ### The end time of each device in each step
+        step_device_end = collections.defaultdict(lambda: np.full(device_num, -np.inf))
+        iter_end, offsets, steady_step = [], [], None
+
+        def step_done(step):
+            nonlocal steady_step
+            device_end = step_device_end.pop(step)
+            iter_end.append(device_end.max())
+            offsets.append(np.where(np.isinf(device_end), 0, device_end - iter_end[-1]))
+            if step > 0 and steady_step is None:
+                iter_time = iter_end[-1] - iter_end[-2]
+                prev_iter_time = iter_end[-2] - (iter_end[-3] if step > 1 else 0)
+                if abs(iter_time - prev_iter_time) <= tol * iter_time and \
+                        np.abs(offsets[-1] - offsets[-2]).max() <= tol * iter_time:
+                    steady_step = step
+
+        if self.comm_backend == "BYTEPS":
+            for step in range(max_step_num):
+                if step > 0:
+                    self.pre_prepare()
+                while self.pop_one_node_exec(step) == 0:
+                    pass
+                np.maximum.at(step_device_end[step], plan.device_idx, self.end_time)
+                step_done(step)
+                if steady_step is not None:
+                    break
+        else:
+            self.node_step = [0] * len(plan)
+            self.deferred = collections.defaultdict(list)
+            pid2nodes = collections.defaultdict(list)
+            for idx, pid in enumerate(plan.pid):
+                pid2nodes[pid].append(idx)
+            roots = set(plan.roots)
+            pid2roots = dict((pid, [idx for idx in nodes if idx in roots]) for pid, nodes in pid2nodes.items())
+            pid_step = dict((pid, 0) for pid in pid2nodes)
+            remaining = dict((pid, len(nodes)) for pid, nodes in pid2nodes.items())
+            ### The number of pids not finishing each step
+            pid_left = collections.defaultdict(lambda: len(pid2nodes))
+            last_step = max_step_num - 1
+            while True:
+                device = self.pop_ready_device()
+                if device is None:
+                    break
+                _, t, _, idx = heapq.heappop(device.queue)
+                step = self.node_step[idx]
+                device.exct(plan.nodes[idx], t, step)
+                self.push_device(device)
+                if not self.executed[idx]:
+                    ### Blocked by the device
+                    continue
+                if self.end_time[idx] > step_device_end[step][plan.device_idx[idx]]:
+                    step_device_end[step][plan.device_idx[idx]] = self.end_time[idx]
+                pid = plan.pid[idx]
+                remaining[pid] -= 1
+                if remaining[pid] > 0:
+                    continue
+                pid_left[step] -= 1
+                if pid_left[step] == 0:
+                    step_done(step)
+                    if steady_step is not None:
+                        ### Finish steps already started
+                        last_step = min(last_step, max(pid_step.values()))
+                if step < last_step:
+                    pid_step[pid] = step + 1
+                    remaining[pid] = len(pid2nodes[pid])
+                    self.start_pid_step(pid, step + 1, pid2nodes[pid], pid2roots[pid])
+
+        if self.symmetry is not None:
+            self.symmetry.expand_step_end_time(self.step_end_time)
+        self.exct_record = ExecutionRecord(plan.nodes, self.start_time, self.crit_pred, self.end_time)
+        self.replay_done = True
+
+        if len(iter_end) == 0:
+            raise RuntimeError("No step is finished, some nodes are never executed")
+        iter_times = [float(end - (iter_end[i - 1] if i > 0 else 0)) / 1000. for i, end in enumerate(iter_end)]
+        rst = {
+            "steady": steady_step is not None,
+            "step_num": len(iter_end),
+            "iter_times": iter_times,
+        }
+        if steady_step is not None:
+            rst["iter_time"] = iter_times[steady_step]
+            rst["warmup_step_num"] = steady_step - 1
+            rst["warmup_time"] = float(iter_end[steady_step - 2]) / 1000. if steady_step > 1 else 0.
+            self.logger.info("Steady state after {} warm-up steps ({:.3f} ms), iteration time {:.3f} ms, "
+                "take {:.3f} s to replay {} steps".format(rst["warmup_step_num"], rst["warmup_time"],
+                rst["iter_time"], time.time() - _ts, len(iter_end)))
+        else:
+            rst["iter_time"] = iter_times[-1]
+            self.logger.warn("No steady state in {} steps, the iteration time of the last step "
+                "is {:.3f} ms".format(len(iter_end), rst["iter_time"]))
+        if _output:
+            self.output_traces(verbose=verbose)
+        return rst
+
+    def start_pid_step(self, pid, step, nodes, roots):
+        ''' Reset the status of nodes of `pid` in place to start `step`, i.e., resolve
+        dependencies deferred to this step and insert root nodes at the step end time
+        '''
+        plan = self.plan
+        in_degree, ready, dep_pred = self.in_degree, self.ready, self.dep_pred
+        for idx in nodes:
+            in_degree[idx] = plan.in_degree[idx]
+            ready[idx] = None
+            self.executed[idx] = 0
+            dep_pred[idx] = -1
+            self.node_step[idx] = step
+        for succ, _ready, pred in self.deferred.pop((pid, step), []):
+            if ready[succ] is None or _ready > ready[succ]:
+                ready[succ] = _ready
+                dep_pred[succ] = pred
+            in_degree[succ] -= 1
+            if in_degree[succ] == 0:
+                self.insert_node_idx(succ, ready[succ])
+        for idx in roots:
+            self.insert_node_idx(idx, self.step_end_time[pid])
+
     def replayAndDelay(self, delay_dict_, _output=False, _path=None, verbose=True):
+        if self.symmetry is not None and delay_dict_ is not None:
+            reduced = [n for n in delay_dict_ if n in self.full_dag and self.symmetry.is_reduced(n)]
+            if len(reduced) > 0:
+                SingleLogger().warn("Delays of {} nodes of non-representative ranks are ignored "
+                    "with the rank symmetry, e.g., {}".format(len(reduced), reduced[0]))
         self.reset_replayer()
         self.delay_dict = delay_dict_
-        self.replay_one_iter(0)
+        if _output:
+            self.open_trace_stream(_path)
+        if self.incremental and not self.lean:
+            schedule = ReplaySchedule(self.compile(), delay_dict_)
+            self.replay_one_iter(0, schedule)
+        else:
+            self.replay_one_iter(0)
+        if _output:
+            self.output_traces(_path=_path, verbose=verbose)
+        return self.step_end_time
+
+    def replay_batch(self, delay_dicts, workers=1, critical_path=False):
+        ''' Replay the DAG once for each delay scenario
+
+        The replay plan is compiled once and shared by all scenarios. If
+        `workers` > 1, scenarios are replayed by a pool of forked processes,
+        which inherit the compiled replayer without copying it.
+
+        Parameters
+        ----------
+        delay_dicts: list
+            A list of delay dicts, refer to `replayAndDelay`
+        workers: int
+            The number of processes, None means the number of CPUs
+        critical_path: bool
+            If True, also return the critical path of each scenario
+
+        Returns
+        -------
+        A list of (step_end_time, critical path or None), one per scenario,
+        where critical paths are in the format of `dag_longest_path`
+        '''
+        self.compile()
+        workers = min(len(delay_dicts), workers or os.cpu_count() or 1)
+        if workers <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+            return [self._replay_scenario(delay_dict, critical_path) for delay_dict in delay_dicts]
+
+        rst = [None] * len(delay_dicts)
+        tasks = [(index, delay_dict, critical_path) for index, delay_dict in enumerate(delay_dicts)]
+        SingleLogger().info("Replay {} scenarios with {} processes".format(len(tasks), workers))
+        with multiprocessing.get_context("fork").Pool(workers,
+                initializer=init_batch_replay_worker, initargs=(self,)) as p:
+            for index, scenario_rst in p.imap_unordered(replay_one_scenario, tasks,
+                    chunksize=max(1, len(tasks) // (4 * workers))):
+                rst[index] = scenario_rst
+        return rst
+
+    def _replay_scenario(self, delay_dict, critical_path=False):
+        step_end_time = dict(self.replayAndDelay(delay_dict, _output=False))
+        if not critical_path:
+            return step_end_time, None
+        return step_end_time, self.exct_record.critical_path()
+
+    def replay_incremental(self, dag=None, delay_dict=None, _output=False, _path=None, verbose=True):
+        ''' Replay `dag` (default: self.dag, which may be modified in place) based
+        on the schedule of the last replay, equal to `replayAndDelay`
+
+        Nodes are only re-simulated from the last checkpoint before the first
+        node affected by the modification, i.e., a modified node or one of its
+        predecessors, and the simulation stops once the states of all devices and
+        nodes converge to a checkpoint of the last schedule, the rest of which
+        is reused. Fall back to a full replay if there is no schedule, the
+        delay dict changes, or a modified node has no predecessors.
+
+        Returns
+        -------
+        step_end_time, refer to `replayAndDelay`
+        '''
+        self.incremental = True
+        if self.symmetry is not None:
+            ### The DAG is reduced again, no schedule of the previous reduced DAG is reused
+            self.set_rank_symmetry(self.full_dag if dag is None else dag)
+            return self.replayAndDelay(delay_dict, _output=_output, _path=_path, verbose=verbose)
+        if self.lean:
+            ### The lean mode does not generate traces to reuse
+            return self.replayAndDelay(delay_dict, _output=_output, _path=_path, verbose=verbose)
+        base = self.schedule
+        if dag is not None:
+            self.dag = dag
+        ### The DAG may be modified in place, so always re-compile the plan
+        self.plan = ReplayPlan(self, prev=None if base is None else base.plan)
+        ckpt, info = (None, None) if base is None or self.comm_backend == "BYTEPS" \
+            or base.delay_dict != delay_dict else self._restart_point(base)
+        if ckpt is None:
+            return self.replayAndDelay(delay_dict, _output=_output, _path=_path, verbose=verbose)
+
+        self.reset_replayer()
+        self.delay_dict = delay_dict
+        self.debuger = ReplayDebuger(self)
+        schedule = ReplaySchedule(self.plan, delay_dict)
+        frontier = self._restore(ckpt, base, schedule, info)
+        SingleLogger().debug("Incremental replay: restart from {}/{} popped nodes".format(
+            ckpt.pos, len(base.pops)))
+        self._run_recorded(0, schedule, frontier, base, info)
+        self.exct_record = ExecutionRecord(self.plan.nodes, self.start_time, self.crit_pred, self.end_time)
+        self.replay_done = True
         if _output:
             self.output_traces(_path=_path, verbose=verbose)
         return self.step_end_time
 
+    def set_rank_symmetry(self, dag):
+        ''' Re-detect classes of equivalent ranks of `dag` and replay the reduced DAG '''
+        self.full_dag = dag
+        self.symmetry = RankSymmetry(dag, rtol=self.symmetry_rtol)
+        self.dag = self.symmetry.reduced_dag
+        self.invalidate_plan()
+
+    def symmetry_error(self, delay_dict=None):
+        ''' Report the approximation error of the rank symmetry, i.e., compare the
+        end time of each rank replayed with the reduced DAG and with the full DAG
+
+        Returns
+        -------
+        A dict of the number of ranks and classes, the number of nodes, the
+        iteration time (in ms, the maximum end time over ranks) and the wall time
+        of replaying (in s) of the reduced and the full DAG, and the maximum
+        relative error of the end time of a rank
+        '''
+        if self.symmetry is None:
+            raise ValueError("The rank symmetry is not enabled")
+        rst = {}
+        for key, rank_symmetry in [("reduced", True), ("full", False)]:
+            ### Replay in the lean mode by new replayers, leaving states of this one unchanged
+            replayer = Replayer(dag=self.full_dag, _step_num=self.step_num,
+                dump_path=self.dump_path, comm_backend=self.comm_backend,
+                byteps_graph=self.byteps_graph, infi_para_update=self.infi_para_update,
+                partial=self.partial, lean=True,
+                rank_symmetry=rank_symmetry, symmetry_rtol=self.symmetry_rtol)
+            replayer.allow_comm_init_frontier = self.allow_comm_init_frontier
+            _ts = time.time()
+            if delay_dict is None:
+                step_end_time = dict(replayer.replay(_output=False, verbose=False))
+            else:
+                step_end_time = dict(replayer.replayAndDelay(delay_dict, _output=False, verbose=False))
+            rst[key] = {
+                "node_num": replayer.dag.number_of_nodes(),
+                "iter_time": max(step_end_time.values()) / 1000.,
+                "wall_time": time.time() - _ts,
+                "step_end_time": step_end_time
+            }
+        errors = [abs(t - rst["full"]["step_end_time"][pid]) / rst["full"]["step_end_time"][pid]
+            for pid, t in rst["reduced"]["step_end_time"].items() if rst["full"]["step_end_time"].get(pid, 0) > 0]
+        report = {
+            "rank_num": len(self.symmetry.rep_of),
+            "class_num": len(self.symmetry.classes),
+            "iter_time_error": abs(rst["reduced"]["iter_time"] - rst["full"]["iter_time"]) / rst["full"]["iter_time"],
+            "max_rank_error": max(errors) if len(errors) > 0 else 0.
+        }
+        for key in ["reduced", "full"]:
+            rst[key].pop("step_end_time")
+            report[key] = rst[key]
+        return report
+
+    def _restart_point(self, base):
+        ''' Decide the checkpoint of `base` to restart from '''
+        prev_plan, plan = base.plan, self.plan
+        dirty = prev_plan.diff(plan)
+        dirty_new = [plan.name2idx[n] for n in dirty if n in plan.name2idx]
+        dirty_prev = [prev_plan.name2idx[n] for n in dirty if n in prev_plan.name2idx]
+        ### Roots are queued before any node is popped
+        if any(plan.in_degree[idx] == 0 for idx in dirty_new) or \
+                any(prev_plan.in_degree[idx] == 0 for idx in dirty_prev):
+            return None, None
+
+        pops = np.array(base.pops, dtype=np.int64)
+        prev_dirty = np.zeros(len(prev_plan), dtype=bool)
+        prev_dirty[dirty_prev] = True
+        ### The first popped node which is dirty or a predecessor of a dirty node
+        affected = prev_dirty.copy()
+        owner = np.repeat(np.arange(len(prev_plan)), np.diff(prev_plan.succ_ptr))
+        affected[owner[prev_dirty[prev_plan.succ_idx]]] = True
+        hits = np.flatnonzero(affected[pops])
+        restart = hits[0] if len(hits) > 0 else len(pops)
+        ckpt = None
+        for c in base.checkpoints:
+            if c.pos > restart:
+                break
+            ckpt = c
+        if ckpt is None:
+            return None, None
+
+        ### Candidate checkpoints to converge to, all dirty nodes must have been executed
+        dirty_pos = np.flatnonzero(prev_dirty[pops])
+        last_dirty = max(dirty_pos[-1] if len(dirty_pos) > 0 else -1, ckpt.pos)
+        remaining2ckpt = {}
+        for c in base.checkpoints:
+            if c.pos > last_dirty:
+                remaining2ckpt.setdefault(c.remaining, c)
+        old2new = np.array([plan.name2idx.get(n, -1) for n in prev_plan.nodes], dtype=np.int64)
+        info = {
+            "pops": old2new[pops] if len(pops) > 0 else pops,
+            "old2new": old2new,
+            "dirty": set(dirty_new),
+            "added": [plan.name2idx[n] for n in dirty if n not in prev_plan.name2idx],
+            "remaining2ckpt": remaining2ckpt
+        }
+        return ckpt, info
+
+    def _restore(self, ckpt, base, schedule, info):
+        ''' Restore the state at the checkpoint `ckpt` of `base` with the current plan,
+        return indexes of nodes in the frontier '''
+        plan = self.plan
+        name2idx = plan.name2idx
+        self.in_degree = list(plan.in_degree)
+        self.ready = [None] * len(plan)
+        self.executed = bytearray(len(plan))
+        self.dep_pred = [-1] * len(plan)
+        self.crit_pred = [-1] * len(plan)
+        self.start_time = [None] * len(plan)
+        self.end_time = [-np.inf] * len(plan)
+        base_pops = info["pops"][:ckpt.pos]
+        np.frombuffer(self.executed, dtype=np.uint8)[base_pops] = 1
+        self._copy_record(base, 0, ckpt.pos, info)
+        for n in ckpt.blocked_names():
+            self.executed[name2idx[n]] = 0
+        frontier = set()
+        for n, (in_degree, ready, dep_pred) in ckpt.frontier.items():
+            idx = name2idx[n]
+            self.in_degree[idx] = in_degree
+            self.ready[idx] = ready
+            self.dep_pred[idx] = -1 if dep_pred is None else name2idx.get(dep_pred, -1)
+            frontier.add(idx)
+        for device in self.device_list:
+            state = ckpt.devices.get(device.device_name)
+            if state is None:
+                device.reset()
+            else:
+                device.load_state(state)
+            self.push_device(device)
+        self.insert_seq = itertools.count(ckpt.next_seq)
+        self.step_end_time = collections.defaultdict(float, ckpt.step_end_time)
+        self.rst_traces = base.traces[:ckpt.trace_num]
+        self.emit_event = self.rst_traces.append
+        self.exct_edges = base.edges[:ckpt.edge_num]
+        schedule.pops = base_pops.tolist()
+        schedule.pop_t = base.pop_t[:ckpt.pos]
+        schedule.checkpoints = [c for c in base.checkpoints if c.pos <= ckpt.pos]
+        return frontier
+
+    def _run_recorded(self, step_idx, schedule, frontier, base=None, info=None):
+        ''' Run nodes as `pop_one_node_exec` and record the schedule, take a
+        checkpoint every `checkpoint_interval` popped nodes. If `base` is
+        given, stop once the replay converges to a checkpoint of `base`.
+
+        `frontier` is the indexes of nodes that may be not executed but have a ready time
+        '''
+        plan = self.plan
+        nodes, succs, pids = plan.nodes, plan.succs, plan.pid
+        end_idx = plan.name2idx.get("END")
+        executed = self.executed
+        interval = self.checkpoint_interval or max(256, len(plan) // 16)
+        n_executed = sum(executed)
+        touched = set()
+        updated_pids = set()
+        pops, pop_t = schedule.pops, schedule.pop_t
+        next_ckpt = len(pops) + interval
+        if base is not None:
+            pending = len([idx for idx in info["dirty"] if not executed[idx]])
+        while True:
+            device = self.pop_ready_device()
+            if device is None:
+                break
+            _, t, _, idx = heapq.heappop(device.queue)
+            pops.append(idx)
+            pop_t.append(t)
+            if self.full_trace:
+                self.record_queue_status(t)
+            device.exct(nodes[idx], t, step_idx)
+            self.push_device(device)
+            if not executed[idx]:
+                ### blocked
+                continue
+            n_executed += 1
+            touched.update(succs[idx])
+            if idx != end_idx:
+                updated_pids.add(pids[idx])
+
+            if len(pops) >= next_ckpt:
+                frontier = self._update_frontier(frontier, touched)
+                touched = set()
+                self._checkpoint(schedule, frontier, len(plan) - n_executed, updated_pids)
+                updated_pids = set()
+                next_ckpt = len(pops) + interval
+
+            if base is not None:
+                if idx in info["dirty"]:
+                    pending -= 1
+                ckpt = info["remaining2ckpt"].pop(len(plan) - n_executed, None) if pending == 0 else None
+                if ckpt is not None:
+                    frontier = self._update_frontier(frontier, touched)
+                    touched = set()
+                    if self._converged(ckpt, frontier, info):
+                        SingleLogger().debug("Incremental replay: converge at {}/{} popped nodes".format(
+                            ckpt.pos, len(base.pops)))
+                        updated_pids = self._splice(schedule, base, ckpt, info, updated_pids)
+                        break
+
+        schedule.updated_pids = updated_pids
+        schedule.traces = self.rst_traces
+        schedule.edges = self.exct_edges
+        schedule.record = (self.crit_pred, self.start_time, self.end_time)
+        schedule.step_end_time = dict(self.step_end_time)
+        self.schedule = schedule
+        if self.recd_topo_order:
+            self.topo_ord = [(nodes[idx], t) for idx, t in zip(pops, pop_t)]
+
+    def _update_frontier(self, frontier, touched):
+        executed, ready = self.executed, self.ready
+        return set(idx for idx in itertools.chain(frontier, touched)
+            if not executed[idx] and ready[idx] is not None)
+
+    def _checkpoint(self, schedule, frontier, remaining, updated_pids):
+        nodes = self.plan.nodes
+        next_seq = next(self.insert_seq)
+        self.insert_seq = itertools.count(next_seq)
+        schedule.checkpoints.append(ReplayCheckpoint(
+            len(schedule.pops), remaining, len(self.rst_traces), len(self.exct_edges), next_seq,
+            dict((device.device_name, device.state()) for device in self.device_list),
+            dict((nodes[idx], self._frontier_state(idx)) for idx in frontier),
+            dict(self.step_end_time), updated_pids))
+
+    def _frontier_state(self, idx):
+        dep_pred = self.dep_pred[idx]
+        return (self.in_degree[idx], self.ready[idx], None if dep_pred < 0 else self.plan.nodes[dep_pred])
+
+    def _copy_record(self, base, start, end, info):
+        ''' Copy the binding predecessors, start and end time of nodes popped
+        in [start, end) by `base`, which are the same in this replay '''
+        crit_pred, start_time, end_time = base.record
+        old2new = info["old2new"]
+        for old, new in zip(base.pops[start:end], info["pops"][start:end].tolist()):
+            if new < 0:
+                continue
+            pred = crit_pred[old]
+            self.crit_pred[new] = int(old2new[pred]) if pred >= 0 else -1
+            self.start_time[new] = start_time[old]
+            self.end_time[new] = end_time[old]
+
+    def _converged(self, ckpt, frontier, info):
+        ''' Whether the current state is the same as that at the checkpoint `ckpt` '''
+        nodes = self.plan.nodes
+        if len(frontier) != len(ckpt.frontier) or any(
+                ckpt.frontier.get(nodes[idx]) != self._frontier_state(idx) for idx in frontier):
+            return False
+        for device in self.device_list:
+            state = ckpt.devices.get(device.device_name)
+            if state is None:
+                if len(device.queue) > 0 or device.prev_name_dur is not None \
+                        or device.device_time != device.init_device_time:
+                    return False
+            elif Device.state_key(device.state()) != Device.state_key(state):
+                return False
+        executed = np.zeros(len(nodes), dtype=bool)
+        base_pops = info["pops"][:ckpt.pos]
+        executed[base_pops[base_pops >= 0]] = True
+        executed[info["added"]] = True
+        for n in ckpt.blocked_names():
+            executed[self.plan.name2idx[n]] = False
+        return np.array_equal(executed, np.frombuffer(self.executed, dtype=np.uint8).astype(bool))
+
+    def _splice(self, schedule, base, ckpt, info, updated_pids):
+        ''' Reuse the schedule of `base` after the checkpoint `ckpt`, return
+        pids whose step end time is updated after the last checkpoint '''
+        pos, trace_num, edge_num = len(schedule.pops), len(self.rst_traces), len(self.exct_edges)
+        step_end_time = dict(self.step_end_time)
+        suffix = info["pops"][ckpt.pos:]
+        schedule.pops += suffix.tolist()
+        schedule.pop_t += base.pop_t[ckpt.pos:]
+        np.frombuffer(self.executed, dtype=np.uint8)[suffix] = 1
+        self._copy_record(base, ckpt.pos, len(base.pops), info)
+        self.rst_traces.extend(base.traces[ckpt.trace_num:])
+        self.exct_edges += base.edges[ckpt.edge_num:]
+
+        ### Step end time of pids updated after `ckpt` are decided by `base`
+        changed = set()
+        for c in base.checkpoints:
+            if c.pos <= ckpt.pos:
+                continue
+            changed |= c.updated_pids
+            step_end_time_c = dict(step_end_time)
+            step_end_time_c.update((pid, c.step_end_time[pid]) for pid in changed)
+            schedule.checkpoints.append(ReplayCheckpoint(
+                c.pos - ckpt.pos + pos, c.remaining, c.trace_num - ckpt.trace_num + trace_num,
+                c.edge_num - ckpt.edge_num + edge_num, c.next_seq, c.devices, c.frontier,
+                step_end_time_c, updated_pids | c.updated_pids))
+            updated_pids = set()
+        changed |= base.updated_pids
+        for pid in changed:
+            self.step_end_time[pid] = base.step_end_time[pid]
+        return updated_pids | base.updated_pids
+
     def insert_next_node(self, n, t):
         ''' This is acutally equal to a scheduler of an **Engine**
         n: node string
         t: start time of this node, do NOT take the device time into consideration
         '''
+        self.insert_node_idx(self.plan.name2idx[n], t)
+
+    def insert_node_idx(self, idx, t):
+        ''' Insert the node indexed by `idx` in self.plan, refer to `insert_next_node` '''
+        ### Nodes with higher priority (smaller rank) go first, then those ready earlier,
+        #   then those inserted earlier
+        item = (self.plan.priority_list[idx], t, next(self.insert_seq), idx)
         if self.show_queue:
-            device = self.name2device(n)
-            # just to substitute func to compare their ranks.
-            self.insort_right(device.queue, (n, t), func=self._a_has_larger_prior)
+            device = self.plan.devices[idx]
+            heapq.heappush(device.queue, item)
+            if len(device.queue) == 1:
+                self.push_device(device)
         else:
-            self.insort_right(self.queue, (n, t), func=self._a_has_larger_prior)
-
-    def insort_right(self, a, x, lo=0, hi=None, func=None):
-        """Insert item x in list a, and keep it sorted assuming a is sorted.
-        If x is already in a, insert it to the right of the rightmost x.
-        Optional args lo (default 0) and hi (default len(a)) bound the
-        slice of a to be searched.
-        """
-        def fun_cmp(x1, x2):
-            if func is None:
-                return x1 < x2
-            else:
-                return func(x1, x2)
-
-        if lo < 0:
-            raise ValueError('lo must be non-negative')
-        if hi is None:
-            hi = len(a)
-        while lo < hi:
-            mid = (lo+hi)//2
-            if fun_cmp(x, a[mid]):
-                hi = mid
-            else:
-                lo = mid+1
-        a.insert(lo, x)
+            heapq.heappush(self.queue, item)
 
     def relabel_map(self, name):
         if "Comm." not in name:
@@ -561,8 +1592,8 @@ class Replayer:
         return re.sub("server_\d+", "server_{}".format(server_id), name)
 
     def name2device(self, n):
-        pid = parse_pid_from_name(n)
-        cat = parse_cat_from_name(n)
+        pid = NAME_REGISTRY.pid_of(n)
+        cat = NAME_REGISTRY.cat_of(n)
         if cat == "Comm":
             if self.comm_backend == "BYTEPS":
                 if self.byteps_graph.grp_part_id2server is not None:
@@ -609,26 +1640,11 @@ class Replayer:
                     device_id, infi_para=True)
             else:
                 self.device_dict[device_id] = self.create_device(device_id)
+            self.device_dict[device_id].order = len(self.device_list)
+            self.device_list.append(self.device_dict[device_id])
 
         return self.device_dict[device_id]		
     
-    def _a_has_larger_prior(self, _a, _b):
-        # if "Comm" in _a[0] and "Comm" in _b[0] and self.name2device(_a[0]) == self.name2device(_b[0]):
-        #     tensor_a = parse_op_name(_a[0])
-        #     tensor_b = parse_op_name(_b[0])
-        #     if tensor_a == tensor_b:
-        #         return _a[1] < _b[1]
-        #     else:  
-        #         return _repr_of_tensor(tensor_a) > _repr_of_tensor(tensor_b)
-                
-        _ap = ret_priority(_a[0])
-        _bp = ret_priority(_b[0])
-        if _ap == _bp:
-            ### The same priority, compare the start time		
-            return _a[1] < _b[1]
-        else:
-            return _ap < _bp
-
     def create_device(self, device_name, infi_para=False):
         # if device_name.startswith("traces_0."):
         #     init_device_time = 11.5
@@ -665,16 +1681,45 @@ class Replayer:
     def reset_replayer(self):
         # self.step_end_time = dict([(_d, 0.0) for _d in self.leaf_dirs])
         self.step_end_time = collections.defaultdict(float)
-        self.rst_traces = []
+        self.rst_traces = EventList()
+        if self.trace_writer is not None:
+            ### Discard the traces of the unfinished replay
+            self.trace_writer.close()
+            self.trace_writer = None
+        ### Generated events are passed to `emit_event`
+        self.emit_event = self.rst_traces.append
         ### Reset all devices
         for _, device_ in self.device_dict.items():
             device_.reset()
+        ### Heap of (device time, order) of devices with pending nodes, see `push_device`
+        self.device_heap = []
 
-        ### Ininitalize the execution graph as the depdency graph
-        self.exct_dag = self.dag.copy()
+        ### Edges added to the execution graph, see `exct_dag`
+        self.exct_edges = []
+        self._exct_dag = None
+        self.schedule = None
 
         self.topo_ord = []
         self.replay_done = False
+        self.node_step = None
+        self.deferred = None
+
+    @property
+    def exct_dag(self):
+        ''' The execution graph, i.e., the dependency graph with edges between
+        consecutive nodes on each device, built from `self.dag` on the first access
+        after replaying. Each edge in `self.exct_edges` is (u, v, weight, overwrite),
+        where an edge that already exists is only updated if `overwrite` is True
+        '''
+        if self.lean:
+            raise ValueError("The execution graph is not generated in the lean mode, use `exct_record` instead")
+        if self._exct_dag is None:
+            exct_dag = self.dag.copy()
+            for u, v, weight, overwrite in self.exct_edges:
+                if overwrite or not exct_dag.has_edge(u, v):
+                    exct_dag.add_edge(u, v, weight=weight)
+            self._exct_dag = exct_dag
+        return self._exct_dag
 
     def dump_critical_path(self, file, critical_path, prefix=None):
         if prefix is None:
@@ -738,20 +1783,36 @@ class Replayer:
         with open(_path, 'w') as f:
             json.dump(final_trace, f)
 
+    def trace_path(self, _path=None):
+        if _path is not None:
+            return _path
+        return os.path.join(self.dump_path, trace_filename("synthetic", self.trace_format))
+
+    def open_trace_stream(self, _path=None):
+        ''' Write traces generated by the following replay to disk directly,
+        if `self.stream_traces` is set. Events with dependency info or used
+        by incremental replays are always kept in self.rst_traces
+        '''
+        if not self.stream_traces or self.lean or self.incremental:
+            return
+        self.trace_writer = open_trace_writer(self.trace_path(_path),
+            trace_format=None if _path is not None else self.trace_format)
+        self.emit_event = self.trace_writer.write
+
     def output_traces(self, _path=None, verbose=True):
         #! Output the synthetic traces.
-        rst = {
-            "traceEvents": [],
-            "displayTimeUnit": "ms"
-        }
-        for trace in self.rst_traces:
-            rst["traceEvents"].append(trace)
+        if self.trace_writer is not None:
+            writer = self.trace_writer
+            self.trace_writer = None
+            self.emit_event = self.rst_traces.append
+        else:
+            writer = open_trace_writer(self.trace_path(_path),
+                trace_format=None if _path is not None else self.trace_format)
+            writer.write_events(self.rst_traces)
+        writer.close()
         if verbose:
-            TraceManager(self.rst_traces, DirLevel.TRIAL).get_iter_time()
-        filename = os.path.join(self.dump_path,
-                    "synthetic.json") if _path is None else _path
-        with open(filename, 'w') as f:
-            json.dump(rst, f)
+            ### Accumulated while writing, traces are not re-sorted
+            writer.stat.summary()
         if self.full_trace:
             with open(os.path.join(self.dump_path, 'queue_status.json'), 'w') as f:
                 json.dump(self.queue_status, f, indent=4)
@@ -827,6 +1888,7 @@ class Replayer:
                 continue
             nx.set_node_attributes(_dag, {node_: self.dag.nodes[node_]})
         self.dag = _dag
+        self.invalidate_plan()
 
 class ReplayDebuger:
     def __init__(self, replayer):
@@ -0,0 +1,399 @@
+''' Columnar on-disk store for the combined traces of a trial.
+
+Each field of the trace events is saved as a NumPy `.npy` column, so that
+the store can be memory-mapped without parsing. Strings (and other JSON
+scalars, e.g., `tid`) are dictionary-encoded: columns only keep integer
+codes into a shared value dictionary. The store layout is
+    <dir>/.trace_store/
+        meta.json       # version, trace-level statistic, cat2sta
+        dict.json       # value dictionary, code -> value
+        <column>.npy    # event columns, in the order of TraceManager.traces
+        sta_<col>.npy   # name2sta columns, in the order of name2sta
+        idx_<col>.npy   # per-unique-name index (CSR) into the event columns
+        lidx_<col>.npy  # TraceIndex of TraceManager, per long name (CSR)
+Event columns (EVENT_COLUMN_DTYPES) alone are also written by
+trace_writer.ColumnarTraceWriter and loaded with `TraceStore.load_dir`.
+'''
+import os
+import shutil
+import ujson as json
+import numpy as np
+
+TRACE_STORE_VERSION = 1
+
+### Sentinel used for missing integer fields, e.g., `args.step` of instant events
+INT_NULL = np.iinfo(np.int64).min
+### Code of missing dictionary-encoded fields
+CODE_NULL = -1
+
+### Top-level event keys stored as dedicated columns
+EVENT_STR_KEYS = ["name", "pid", "tid", "cat", "ph"]
+### `args` keys stored as dedicated columns
+ARGS_INT_KEYS = ["step", "cnt"]
+### name2sta keys stored as dedicated columns
+STA_NUM_KEYS = ["cnt", "min_t", "max_t", "avg", "median", "var", "id"]
+STA_KEYS = set(STA_NUM_KEYS + ["cat", "time", "step_ids"])
+### Columns of event fields, `args_extra`/`extra` are codes of JSON blobs of the other keys
+EVENT_COLUMN_DTYPES = dict([("ts", np.float64), ("dur", np.float64), ("args_name", np.int32),
+    ("args_extra", np.int32), ("extra", np.int32)] + [(key, np.int32) for key in EVENT_STR_KEYS] +
+    [("args_" + key, np.int64) for key in ARGS_INT_KEYS])
+
+
+class ValueDict:
+    ''' Dictionary encoder of JSON scalars '''
+    def __init__(self, values=None):
+        self.values = [] if values is None else values
+        self.value2code = None
+
+    def encode(self, value):
+        if self.value2code is None:
+            self.value2code = dict(((v.__class__, v), code) for code, v in enumerate(self.values))
+        key = (value.__class__, value)
+        code = self.value2code.get(key)
+        if code is None:
+            code = len(self.values)
+            self.values.append(value)
+            self.value2code[key] = code
+        return code
+
+    def lookup(self, value):
+        ''' Return the code of `value`, or CODE_NULL if `value` is not encoded '''
+        if self.value2code is None:
+            self.value2code = dict(((v.__class__, v), code) for code, v in enumerate(self.values))
+        return self.value2code.get((value.__class__, value), CODE_NULL)
+
+    def decode(self, code):
+        return None if code == CODE_NULL else self.values[code]
+
+
+def _to_builtin(value):
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    if isinstance(value, dict):
+        return dict((k, _to_builtin(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_to_builtin(v) for v in value]
+    return value
+
+
+def trace_store_path(dir_):
+    return os.path.join(dir_, ".trace_store")
+
+
+def trace_store_meta(dir_):
+    ''' Return meta.json of the store, or None if it does not exist '''
+    meta_path = os.path.join(trace_store_path(dir_), "meta.json")
+    if not os.path.isfile(meta_path):
+        return None
+    with open(meta_path, 'r') as fp:
+        return json.load(fp)
+
+
+def trace_store_exists(dir_):
+    meta = trace_store_meta(dir_)
+    return meta is not None and meta.get("version") == TRACE_STORE_VERSION
+
+
+class TraceStore:
+    ''' Events and statistic of a TraceManager in the columnar format
+
+    `columns` maps column names to 1-D arrays (or memory-mapped arrays
+    after `load`); `values` is the ValueDict shared by all coded columns.
+    '''
+    def __init__(self, columns, values, meta):
+        self.columns = columns
+        self.values = values
+        self.meta = meta
+        self._blob_cache = {}
+
+    def __len__(self):
+        return len(self.columns["ts"])
+
+    ### ------------------------------------------------------------------
+    ### Encoding
+    ### ------------------------------------------------------------------
+
+    @staticmethod
+    def from_trace_manager(traceM):
+        from .event_list import EventList
+        traces = traceM.traces
+        event_num = len(traces)
+        if isinstance(traces, EventList):
+            values, columns = TraceStore._encode_events(traceM, traces)
+        else:
+            values, columns = TraceStore._encode_dicts(traceM, traces)
+
+        ### Per-unique-name index: the event indexes of each unique name,
+        #   ordered by their positions in the traces
+        valid = np.nonzero(columns["uname"] != CODE_NULL)[0]
+        order = valid[np.argsort(columns["uname"][valid], kind="stable")]
+        codes, starts = np.unique(columns["uname"][order], return_index=True)
+        columns["idx_code"] = codes.astype(np.int32)
+        columns["idx_ptr"] = np.append(starts, len(order)).astype(np.int64)
+        columns["idx_order"] = order.astype(np.int64)
+        columns.update(traceM.index.to_columns(values))
+
+        name2sta_extra = TraceStore._encode_name2sta(traceM.name2sta, columns, values)
+
+        meta = {
+            "version": TRACE_STORE_VERSION,
+            "event_num": event_num,
+            "dir_level": traceM.dir_level.value,
+            "max_step": int(traceM.max_step),
+            "opt_step": int(traceM.opt_step),
+            "iter_time": float(traceM.iter_time),
+            "all_prefix": traceM.all_prefix,
+            "cat2sta": _to_builtin(traceM.cat2sta),
+            "trace_window": traceM.trace_window,
+            "name2sta_extra": name2sta_extra,
+            "columns": sorted(columns.keys())
+        }
+        return TraceStore(columns, values, meta)
+
+    @staticmethod
+    def _encode_dicts(traceM, traces):
+        values = ValueDict()
+        event_num = len(traces)
+        columns = {
+            "ts": np.empty(event_num, dtype=np.float64),
+            "dur": np.full(event_num, np.nan, dtype=np.float64),
+            "args_name": np.full(event_num, CODE_NULL, dtype=np.int32),
+            "args_extra": np.full(event_num, CODE_NULL, dtype=np.int32),
+            "extra": np.full(event_num, CODE_NULL, dtype=np.int32),
+            "uname": np.full(event_num, CODE_NULL, dtype=np.int32),
+        }
+        for key in EVENT_STR_KEYS:
+            columns[key] = np.full(event_num, CODE_NULL, dtype=np.int32)
+        for key in ARGS_INT_KEYS:
+            columns["args_" + key] = np.full(event_num, INT_NULL, dtype=np.int64)
+
+        for idx, event in enumerate(traces):
+            extra = None
+            for key, value in event.items():
+                if key == "ts":
+                    columns["ts"][idx] = value
+                elif key == "dur" and isinstance(value, (int, float)):
+                    columns["dur"][idx] = value
+                elif key in EVENT_STR_KEYS and value is not None:
+                    columns[key][idx] = values.encode(value)
+                elif key == "args" and isinstance(value, dict):
+                    args_extra = {}
+                    for arg_key, arg_value in value.items():
+                        if arg_key == "name" and isinstance(arg_value, str):
+                            columns["args_name"][idx] = values.encode(arg_value)
+                        elif arg_key in ARGS_INT_KEYS and isinstance(arg_value, int) \
+                                and not isinstance(arg_value, bool):
+                            columns["args_" + arg_key][idx] = arg_value
+                        else:
+                            args_extra[arg_key] = arg_value
+                    columns["args_extra"][idx] = values.encode(
+                        json.dumps(_to_builtin(args_extra), sort_keys=True))
+                else:
+                    if extra is None:
+                        extra = {}
+                    extra[key] = value
+            if extra is not None:
+                columns["extra"][idx] = values.encode(json.dumps(_to_builtin(extra), sort_keys=True))
+            if not traceM._is_ignore_for_sta(event):
+                columns["uname"][idx] = values.encode(traceM.ret_unique_name(event))
+        return values, columns
+
+    @staticmethod
+    def _encode_events(traceM, events):
+        ''' Encode an EventList, its columns and value dictionary are reused '''
+        values = ValueDict(list(events.values.values))
+        columns = TraceStore.event_columns(events, values)
+        columns["uname"] = np.full(len(events), CODE_NULL, dtype=np.int32)
+        rows, group, first_rows = traceM._unique_name_groups(events)
+        uname_codes = np.array([values.encode(traceM.ret_unique_name(events[row]))
+            for row in first_rows.tolist()], dtype=np.int32)
+        columns["uname"][rows] = uname_codes[group]
+        return values, columns
+
+    @staticmethod
+    def event_columns(events, values):
+        ''' Return EVENT_COLUMN_DTYPES columns of an EventList whose codes are in `values`,
+            keys of events without dedicated columns are encoded to `values` as JSON blobs
+        '''
+        event_num = len(events)
+        columns = {}
+        for key in ["ts", "dur", "args_name"] + EVENT_STR_KEYS:
+            columns[key] = events.column(key).copy()
+        for key in ARGS_INT_KEYS:
+            columns["args_" + key] = events.column("args_" + key).copy()
+        for col, sparse, has_col in [("args_extra", events.sparse_args, events.column("has_args")),
+                ("extra", events.sparse, None)]:
+            blobs = {}
+            for key, rows in sparse.items():
+                for row, value in rows.items():
+                    blobs.setdefault(row, {})[key] = value
+            if has_col is None:
+                columns[col] = np.full(event_num, CODE_NULL, dtype=np.int32)
+            else:
+                columns[col] = np.where(has_col, values.encode(json.dumps({})), CODE_NULL).astype(np.int32)
+            for row, blob in blobs.items():
+                columns[col][row] = values.encode(json.dumps(_to_builtin(blob), sort_keys=True))
+        return columns
+
+    @staticmethod
+    def _encode_name2sta(name2sta, columns, values):
+        ''' Store entries of name2sta with the standard keys as columns,
+            the others are returned and saved as JSON
+        '''
+        name2sta_extra = {}
+        entries = []
+        for name, statistic in name2sta.items():
+            if STA_KEYS.issubset(statistic.keys()):
+                entries.append((name, statistic))
+            else:
+                name2sta_extra[name] = _to_builtin(statistic)
+        columns["sta_name"] = np.array([values.encode(name) for name, _ in entries], dtype=np.int32)
+        columns["sta_cat"] = np.array([values.encode(sta["cat"]) for _, sta in entries], dtype=np.int32)
+        for key in STA_NUM_KEYS:
+            columns["sta_" + key] = np.array([sta[key] for _, sta in entries], dtype=np.float64)
+        columns["sta_time"] = np.array(
+            [t for _, sta in entries for t in sta["time"]], dtype=np.float64)
+        columns["sta_time_ptr"] = np.cumsum(
+            [0] + [len(sta["time"]) for _, sta in entries], dtype=np.int64)
+        step_num = max([len(sta["step_ids"]) for _, sta in entries], default=0)
+        step_ids = np.full((len(entries), step_num), -1, dtype=np.int64)
+        for row, (_, sta) in enumerate(entries):
+            for col, trace_idx in enumerate(sta["step_ids"]):
+                if trace_idx is not None:
+                    step_ids[row, col] = trace_idx
+        columns["sta_step_ids"] = step_ids
+        columns["sta_step_len"] = np.array([len(sta["step_ids"]) for _, sta in entries], dtype=np.int64)
+        ### Keep extra keys, e.g., those added by the Collector
+        for name, sta in entries:
+            extra = dict((k, v) for k, v in sta.items() if k not in STA_KEYS)
+            if len(extra) > 0:
+                name2sta_extra.setdefault("__extra_keys__", {})[name] = _to_builtin(extra)
+        return name2sta_extra
+
+    ### ------------------------------------------------------------------
+    ### Serialization
+    ### ------------------------------------------------------------------
+
+    def dump(self, dir_):
+        store_dir = trace_store_path(dir_)
+        tmp_dir = store_dir + ".tmp"
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        for key, column in self.columns.items():
+            np.save(os.path.join(tmp_dir, key + ".npy"), np.ascontiguousarray(column))
+        with open(os.path.join(tmp_dir, "dict.json"), 'w') as fp:
+            json.dump(self.values.values, fp)
+        ### meta.json is written at last, the store is invalid without it
+        with open(os.path.join(tmp_dir, "meta.json"), 'w') as fp:
+            json.dump(self.meta, fp)
+        if os.path.exists(store_dir):
+            shutil.rmtree(store_dir)
+        os.rename(tmp_dir, store_dir)
+
+    @staticmethod
+    def load(dir_, mmap=True):
+        return TraceStore.load_dir(trace_store_path(dir_), mmap=mmap)
+
+    @staticmethod
+    def load_dir(store_dir, mmap=True):
+        ''' Load the store in `store_dir`, e.g., `<dir>/.trace_store` '''
+        with open(os.path.join(store_dir, "meta.json"), 'r') as fp:
+            meta = json.load(fp)
+        if meta.get("version") != TRACE_STORE_VERSION:
+            raise ValueError("Trace store version mismatch: {} vs {}".format(
+                meta.get("version"), TRACE_STORE_VERSION))
+        with open(os.path.join(store_dir, "dict.json"), 'r') as fp:
+            values = ValueDict(json.load(fp))
+        columns = {}
+        for key in meta["columns"]:
+            columns[key] = np.load(os.path.join(store_dir, key + ".npy"),
+                mmap_mode="r" if mmap else None)
+        return TraceStore(columns, values, meta)
+
+    ### ------------------------------------------------------------------
+    ### Decoding
+    ### ------------------------------------------------------------------
+
+    def _decode_blob(self, code):
+        if code not in self._blob_cache:
+            self._blob_cache[code] = json.loads(self.values.values[code])
+        return self._blob_cache[code]
+
+    def to_traces(self):
+        ''' Materialize the columns as a list of event dicts '''
+        decode = self.values.values
+        cols = dict((key, self.columns[key].tolist()) for key in
+            ["ts", "dur", "args_name", "args_extra", "extra"] + EVENT_STR_KEYS +
+            ["args_" + key for key in ARGS_INT_KEYS])
+        traces = []
+        for idx in range(len(self)):
+            event = {}
+            for key in EVENT_STR_KEYS:
+                code = cols[key][idx]
+                if code != CODE_NULL:
+                    event[key] = decode[code]
+            event["ts"] = cols["ts"][idx]
+            dur = cols["dur"][idx]
+            if dur == dur:
+                event["dur"] = dur
+            code = cols["args_extra"][idx]
+            if code != CODE_NULL:
+                args = dict(self._decode_blob(code))
+                code = cols["args_name"][idx]
+                if code != CODE_NULL:
+                    args["name"] = decode[code]
+                for key in ARGS_INT_KEYS:
+                    value = cols["args_" + key][idx]
+                    if value != INT_NULL:
+                        args[key] = value
+                event["args"] = args
+            code = cols["extra"][idx]
+            if code != CODE_NULL:
+                event.update(self._decode_blob(code))
+            traces.append(event)
+        return traces
+
+    def to_name2sta(self):
+        name2sta = {}
+        names = self.columns["sta_name"].tolist()
+        cats = self.columns["sta_cat"].tolist()
+        nums = dict((key, self.columns["sta_" + key].tolist()) for key in STA_NUM_KEYS)
+        time_all = self.columns["sta_time"].tolist()
+        time_ptr = self.columns["sta_time_ptr"].tolist()
+        step_ids = self.columns["sta_step_ids"]
+        step_len = self.columns["sta_step_len"].tolist()
+        for row, code in enumerate(names):
+            statistic = {
+                "cnt": int(nums["cnt"][row]),
+                "time": time_all[time_ptr[row]:time_ptr[row+1]],
+                "min_t": nums["min_t"][row],
+                "max_t": nums["max_t"][row],
+                "cat": self.values.decode(cats[row]),
+                "id": int(nums["id"][row]),
+                "avg": nums["avg"][row],
+                "median": nums["median"][row],
+                "var": nums["var"][row],
+                "step_ids": [None if i < 0 else i for i in step_ids[row, :step_len[row]].tolist()]
+            }
+            name2sta[self.values.decode(code)] = statistic
+        extra_keys = self.meta["name2sta_extra"].get("__extra_keys__", {})
+        for name, extra in extra_keys.items():
+            name2sta[name].update(extra)
+        for name, statistic in self.meta["name2sta_extra"].items():
+            if name != "__extra_keys__":
+                name2sta[name] = statistic
+        return name2sta
+
+    def indices_of(self, unique_name):
+        ''' Return the indexes of events whose unique name is `unique_name` '''
+        code = self.values.lookup(unique_name)
+        if code == CODE_NULL:
+            return np.empty(0, dtype=np.int64)
+        pos = np.searchsorted(self.columns["idx_code"], code)
+        if pos >= len(self.columns["idx_code"]) or self.columns["idx_code"][pos] != code:
+            return np.empty(0, dtype=np.int64)
+        return self.columns["idx_order"][
+            self.columns["idx_ptr"][pos]:self.columns["idx_ptr"][pos+1]]
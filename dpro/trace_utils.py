@@ -1,14 +1,22 @@
 import os
+import io
+import gzip
 import ujson as json
+from json import JSONDecoder, JSONDecodeError
 import random
 import math
 import xlsxwriter
 import threading
+import operator
+import itertools
+from functools import reduce
 from enum import Enum
 import numpy as np
 
 from .logger_utils import Singleton, SingleLogger
 from .base import bcolors
+from .trace_store import TraceStore, trace_store_exists, trace_store_meta, CODE_NULL
+from .event_list import EventList
 
 QUEUETYPE = {
     "NCCL": {
@@ -51,16 +59,20 @@ class DirLevel(Enum):
 
 class FileName(Enum):
     # Overall profiling/analysis results
-    TRACE="bps_trace_final.json"
-    STATISTIC="statistic.txt"
-    TRAIL_DAG="trail_dag.gml"
-    LOCAL_DFG="local_dfg.gml" # single-worker DFG
+    TRACE_STORE=".trace_store" # columnar traces and statistic, see trace_store.py
+    TRACE="bps_trace_final.json" # (Optional) JSON export
+    STATISTIC="statistic.txt" # (Optional) JSON export
+    TRAIL_DAG_STORE=".trail_dag" # binary graph, see graph_store.py
+    LOCAL_DFG_STORE=".local_dfg" # single-worker DFG, binary graph
+    TRAIL_DAG="trail_dag.gml" # (Optional) GML export
+    LOCAL_DFG="local_dfg.gml" # (Optional) GML export
 
     # Per rank
     METADATA="metadata.json"
     IO="io.json" # (Optional)
     DAG="dag.gml"
     COMP = "trace.json.gz"
+    COMP_ZST = "trace.json.zst" # zstd compressed computation traces, read if COMP does not exist
 
     ## Communication-related
     COMM="comm.json"
@@ -120,6 +132,110 @@ def read_traces(traces_path):
         raise ValueError("The output file not follow the stardard chrome tracing format!: " + traces_path)
     return traces
 
+### Size of the decompressed text read each time when streaming trace files
+TRACE_READ_CHUNK_SIZE = 4 * 1024 * 1024
+
+def _open_trace_file(traces_path):
+    if traces_path.endswith(".gz"):
+        return gzip.open(traces_path, 'rt')
+    elif traces_path.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("Package zstandard is required to read {}".format(traces_path))
+        return io.TextIOWrapper(
+            zstandard.ZstdDecompressor().stream_reader(open(traces_path, 'rb'), closefd=True),
+            encoding="utf-8")
+    else:
+        return open(traces_path, 'r')
+
+_JSON_WS = " \t\n\r"
+
+class _TraceTextReader:
+    ''' A window of the decompressed text of a trace file, which is extended
+    chunk by chunk when a JSON value is truncated by the end of the window '''
+    def __init__(self, fp, traces_path, chunk_size):
+        self.fp = fp
+        self.traces_path = traces_path
+        self.chunk_size = chunk_size
+        self.decoder = JSONDecoder()
+        self.buf = fp.read(chunk_size)
+        self.pos = 0
+        ### Offset of `buf[0]` in the decompressed text
+        self.offset = 0
+
+    def _read_more(self):
+        more = self.fp.read(self.chunk_size)
+        if not more:
+            return False
+        self.offset += self.pos
+        self.buf = self.buf[self.pos:] + more
+        self.pos = 0
+        return True
+
+    def skip(self, chars):
+        ''' Skip characters in `chars`, return the next character, or None at EOF '''
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in chars:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._read_more():
+                return None
+
+    def _is_truncated(self, err):
+        ### A value cut by the end of the window fails either at the end of
+        # the window, e.g., `Expecting value`, or because its last string is unterminated
+        return err.pos + 8 >= len(self.buf) or err.msg.startswith("Unterminated string")
+
+    def decode(self):
+        ''' Decode the JSON value at the current position '''
+        while True:
+            try:
+                value, self.pos = self.decoder.raw_decode(self.buf, self.pos)
+                return value
+            except JSONDecodeError as err:
+                if not self._is_truncated(err):
+                    raise ValueError("Malformed JSON at offset {} of {}: {}".format(
+                        self.offset + err.pos, self.traces_path, err.msg))
+                if not self._read_more():
+                    raise ValueError("Unexpected EOF at offset {} of {}: {}".format(
+                        self.offset + err.pos, self.traces_path, err.msg))
+
+def iter_trace_events(traces_path, chunk_size=TRACE_READ_CHUNK_SIZE):
+    ''' Incrementally parse a chrome-tracing file (optionally gzip/zstd compressed)
+    and yield its events one by one. Only one chunk of the decompressed text is
+    kept in memory, so memory usage is bounded by the events retained by the caller.
+    '''
+    with _open_trace_file(traces_path) as fp:
+        reader = _TraceTextReader(fp, traces_path, chunk_size)
+        char = reader.skip(_JSON_WS)
+        if char == "{":
+            ### Locate the event list, i.e., the value of the top-level key `traceEvents`,
+            # values of other keys are decoded and dropped
+            reader.pos += 1
+            while True:
+                if reader.skip(_JSON_WS + ",") != '"':
+                    raise ValueError("No traceEvents found in " + traces_path)
+                key = reader.decode()
+                if reader.skip(_JSON_WS + ":") is None:
+                    raise ValueError("Unexpected EOF in " + traces_path)
+                if key == "traceEvents":
+                    break
+                reader.decode()
+            char = reader.skip(_JSON_WS)
+        if char != "[":
+            raise ValueError("The output file not follow the stardard chrome tracing format!: " + traces_path)
+        reader.pos += 1
+
+        while True:
+            char = reader.skip(_JSON_WS + ",")
+            if char == "]":
+                return
+            if char is None:
+                raise ValueError("Unexpected EOF in " + traces_path)
+            yield reader.decode()
+
 def first_valid_dir(_path):
     for _dir in os.listdir(_path):
         if _dir.startswith('.'):
@@ -131,6 +247,9 @@ def formal_dpro_rawname(_name):
     return _name.replace(".", "_")
 
 def gen_long_name(prefix, raw_name, suffix=None):
+    return NAME_REGISTRY.gen_name(prefix, raw_name, suffix)
+
+def _gen_long_name(prefix, raw_name, suffix=None):
     if prefix is None:
         pre = ""
     else:
@@ -163,8 +282,7 @@ def _parse_long_name(long_name):
     return pid, std_name, op_name, sub_op, suffix
 
 def parse_op_name(name):
-    pid, std_name, op_name, sub_op, suffix = _parse_long_name(name)
-    return op_name
+    return NAME_REGISTRY.op_name_of(name)
 
 def parse_rawname(name):
     if DEL not in name:
@@ -173,14 +291,16 @@ def parse_rawname(name):
         return name.split(DEL)[1]
 
 def parse_pid_from_name(name):
+    return NAME_REGISTRY.pid_of(name)
+
+def _parse_pid_from_name(name):
     if "+" in name and "Comm" not in name:
         name = name.split("+")[0]
     pid, std_name, op_name, sub_op, suffix = _parse_long_name(name)
     return "none" if pid is None else pid
 
 def parse_suffix_from_name(name):
-    pid, std_name, op_name, sub_op, suffix = _parse_long_name(name)
-    return suffix
+    return NAME_REGISTRY.suffix_of(name)
 
 def _parse_tf_layer_names(name):
     raise NotImplementedError("Move to tf directory")
@@ -346,6 +466,9 @@ def _map_tf_op2layer(local_dfg, model_name,
     return op2layer, layer2ops
 
 def parse_cat_from_name(name):
+    return NAME_REGISTRY.cat_of(name)
+
+def _parse_cat_from_name(name):
     if "I/O" in name:
         return CatName.IO.value
     elif "COPY_FIRST" in name or "SUM" in name or "COPY_MERGED" in name:
@@ -360,14 +483,10 @@ def parse_cat_from_name(name):
         raise ValueError("Can not decide the cat of %s" % name)
 
 def parse_allinfo_from_name(name):
-    pid, std_name, op_name, sub_op, suffix = _parse_long_name(name)
-    pid = "none" if pid is None else pid
-    cat = parse_cat_from_name(std_name)
-    return pid, std_name, cat, suffix
+    return NAME_REGISTRY.allinfo_of(name)
 
 def parse_allinfo_from_name_v2(name):
-    pid, std_name, op_name, sub_op, suffix = _parse_long_name(name)
-    return op_name, sub_op, suffix
+    return NAME_REGISTRY.allinfo_v2_of(name)
 
 ### CATs that will be affected if we change the GPU/CPU rate
 COMP_CAT = ["operator.FW", "operator.BW", "operator.UPDATE",
@@ -377,6 +496,9 @@ COMP_CAT = ["operator.FW", "operator.BW", "operator.UPDATE",
 COMM_CAT = ["Comm.SEND", "Comm.RECV", "Comm.PUSH_REQ",
             "Comm.PUSH_RES", "Comm.PULL_REQ", "Comm.PULL_RES"]
 def parse_cat_fine_grained(name_):
+    return NAME_REGISTRY.fine_cat_of(name_)
+
+def _parse_cat_fine_grained(name_):
     ### PS communication traces
     if "COPY_FIRST" in name_ or "SUM" in name_ or "COPY_MERGED" in name_:
         return "ServerOp"
@@ -423,6 +545,187 @@ def parse_cat_fine_grained(name_):
 
     return ret_cat
 
+class _ParseFailure:
+    __slots__ = ("error",)
+
+    def __init__(self, error):
+        self.error = error
+
+### Maximum number of names kept by `NAME_REGISTRY`, see `NameRegistry`
+NAME_REGISTRY_CAPACITY = 1 << 20
+
+class _NameTable:
+    ''' Names interned by a `NameRegistry` and their parsed fields, indexed by IDs '''
+    COLUMNS = ["long_names", "pids", "node_pids", "std_names", "op_names",
+        "sub_ops", "suffixes", "cats", "std_cats", "fine_cats"]
+
+    def __init__(self):
+        self.name2id = {}
+        ### (prefix, raw_name, suffix) --> ID
+        self.component2id = {}
+        self.long_names = []
+        ### pid parsed from the long name, `none` if there is no pid
+        self.pids = []
+        ### pid returned by `parse_pid_from_name`, fused names are handled
+        self.node_pids = []
+        self.std_names = []
+        self.op_names = []
+        self.sub_ops = []
+        self.suffixes = []
+        ### category of the long name and of its standard name
+        self.cats = []
+        self.std_cats = []
+        self.fine_cats = []
+
+    def __len__(self):
+        return len(self.long_names)
+
+class NameRegistry:
+    ''' Assign each long name, e.g., `host0.rank1->BW.foo~>suffix`, a dense integer ID.
+
+        A name is parsed only once when it is interned, its pid, standard (raw) name,
+        op name, sub op, suffix, category and fine-grained category are stored in
+        parallel arrays indexed by the ID, so hot paths of the replayer, the collector
+        and the graph passes do not re-split strings. `parse_*_from_name` and
+        `gen_long_name` are served by the global `NAME_REGISTRY`.
+
+        The registry is a cache of parsed names: optimizers generate new fused or
+        partitioned names for every proposal, so they call `compact` to only keep
+        names still in use, and all names are dropped once `capacity` is reached.
+        Errors raised when parsing a field are recorded and re-raised when that field
+        is accessed, so the string APIs behave the same as before.
+        NOTE: IDs are only meaningful inside one process, and only until the
+        registry is cleared or compacted.
+    '''
+    def __init__(self, capacity=None):
+        self.lock = threading.Lock()
+        self.capacity = capacity
+        self.clear()
+
+    def clear(self):
+        ### The table is replaced instead of being emptied, lookups in progress
+        # in other threads keep using the old one
+        self.table = _NameTable()
+
+    def compact(self, keep):
+        ''' Drop names not in `keep`, parsed fields of the kept names are reused '''
+        old_table = self.table
+        table = _NameTable()
+        for name in keep:
+            name_id = old_table.name2id.get(name)
+            if name_id is None or name in table.name2id:
+                continue
+            table.name2id[name] = len(table.long_names)
+            for column in _NameTable.COLUMNS:
+                getattr(table, column).append(getattr(old_table, column)[name_id])
+        self.table = table
+        SingleLogger().debug("Compact the name registry from {} to {} names".format(len(old_table), len(table)))
+
+    def __len__(self):
+        return len(self.table)
+
+    def __contains__(self, name):
+        return name in self.table.name2id
+
+    @staticmethod
+    def _try(func, *args):
+        try:
+            return func(*args)
+        except Exception as e:
+            return _ParseFailure(e)
+
+    def _add(self, table, name):
+        parsed = self._try(_parse_long_name, name)
+        if parsed.__class__ is _ParseFailure:
+            pid = std_name = op_name = sub_op = suffix = std_cat = parsed
+        else:
+            pid, std_name, op_name, sub_op, suffix = parsed
+            pid = "none" if pid is None else pid
+            std_cat = self._try(_parse_cat_from_name, std_name)
+        with self.lock:
+            if name in table.name2id:
+                return table.name2id[name]
+            name_id = len(table.long_names)
+            table.long_names.append(name)
+            table.pids.append(pid)
+            table.node_pids.append(self._try(_parse_pid_from_name, name))
+            table.std_names.append(std_name)
+            table.op_names.append(op_name)
+            table.sub_ops.append(sub_op)
+            table.suffixes.append(suffix)
+            table.cats.append(self._try(_parse_cat_from_name, name))
+            table.std_cats.append(std_cat)
+            table.fine_cats.append(self._try(_parse_cat_fine_grained, name))
+            table.name2id[name] = name_id
+        return name_id
+
+    def _lookup(self, name):
+        ''' Return the current table and the ID of `name` in it '''
+        table = self.table
+        name_id = table.name2id.get(name)
+        if name_id is None:
+            if self.capacity is not None and len(table) >= self.capacity:
+                SingleLogger().debug("The name registry reaches its capacity {}, clear it".format(self.capacity))
+                self.clear()
+                table = self.table
+            name_id = self._add(table, name)
+        return table, name_id
+
+    def intern(self, name):
+        return self._lookup(name)[1]
+
+    def gen_id(self, prefix, raw_name, suffix=None):
+        return self.intern(self.gen_name(prefix, raw_name, suffix))
+
+    def gen_name(self, prefix, raw_name, suffix=None):
+        table = self.table
+        key = (prefix, raw_name, suffix)
+        name_id = table.component2id.get(key)
+        if name_id is None:
+            table, name_id = self._lookup(_gen_long_name(prefix, raw_name, suffix))
+            table.component2id[key] = name_id
+        return table.long_names[name_id]
+
+    def name_of(self, name_id):
+        return self.table.long_names[name_id]
+
+    @staticmethod
+    def field(column, name_id):
+        value = column[name_id]
+        if value.__class__ is _ParseFailure:
+            raise value.error.with_traceback(None)
+        return value
+
+    def pid_of(self, name):
+        table, name_id = self._lookup(name)
+        return self.field(table.node_pids, name_id)
+
+    def op_name_of(self, name):
+        table, name_id = self._lookup(name)
+        return self.field(table.op_names, name_id)
+
+    def suffix_of(self, name):
+        table, name_id = self._lookup(name)
+        return self.field(table.suffixes, name_id)
+
+    def cat_of(self, name):
+        table, name_id = self._lookup(name)
+        return self.field(table.cats, name_id)
+
+    def fine_cat_of(self, name):
+        table, name_id = self._lookup(name)
+        return self.field(table.fine_cats, name_id)
+
+    def allinfo_of(self, name):
+        table, name_id = self._lookup(name)
+        std_name = self.field(table.std_names, name_id)
+        return table.pids[name_id], std_name, self.field(table.std_cats, name_id), table.suffixes[name_id]
+
+    def allinfo_v2_of(self, name):
+        table, name_id = self._lookup(name)
+        return self.field(table.op_names, name_id), table.sub_ops[name_id], table.suffixes[name_id]
+
+NAME_REGISTRY = NameRegistry(NAME_REGISTRY_CAPACITY)
 
 def parse_special_from_name(name):
     '''Sometimes we need some special information from the name, e.g., if it's Negotiate...
@@ -451,12 +754,314 @@ def gen_pid_name(comm_backend, worker_dir, gpu_id):
 def is_standard_pid(pid):
     return pid.startswith("host") or pid.startswith("traces_") or pid.startswith("default")
 
+def summarize_iter_time(pid2steps):
+    ''' Log the per-pid FW/BW/UPDATE time and return (iteration time, opt_step)
+
+    Parameters
+    ----
+    pid2steps: dict
+        Map standard pids to dicts of `iter_multi_steps`, `fw_multi_steps`,
+        `bw_multi_steps` and `update_multi_steps`, i.e., lists of the
+        iteration time and the FW/BW/UPDATE time of each step in ms
+    '''
+    iter_list_all = []
+    step_num_upper = None
+    for prefix in sorted(pid2steps.keys()):
+        pid_info = pid2steps[prefix]
+        ### Statistic the iteration time
+        iter_time_multi_steps = np.array(pid_info["iter_multi_steps"])
+        iter_time_avg, iter_time_std = np.average(iter_time_multi_steps), np.std(iter_time_multi_steps)
+        SingleLogger().debug("<%s> average iter time %f (\u00B1 %f): %s" % (
+            prefix, iter_time_avg, iter_time_std, str(pid_info["iter_multi_steps"])))
+
+        fw_time = sum(pid_info["fw_multi_steps"]) / float(len(pid_info["fw_multi_steps"]))
+        bw_time = sum(pid_info["bw_multi_steps"]) / float(len(pid_info["bw_multi_steps"]))
+        update_time = sum(pid_info["update_multi_steps"]) / float(len(pid_info["update_multi_steps"]))
+        iter_list_all.append(pid_info["iter_multi_steps"])
+        SingleLogger().info("<%s> fw : %f + bw: %f + update: %f -> time/it = %f (\u00B1 %f) ms" % (prefix,
+                fw_time, bw_time, update_time, iter_time_avg, iter_time_std))
+
+        if step_num_upper is None or len(pid_info["iter_multi_steps"]) < step_num_upper:
+            ### Different GPUs may have different number of steps, find the smallest one as the step_num_upper
+            step_num_upper = len(pid_info["iter_multi_steps"])
+
+    ### Step 3: calculate the average iteration time
+    # * iter_list_all, shape = (n_GPUs, n_steps) ==> (n_steps)
+    iter_list_all = [_list[:step_num_upper] for _list in iter_list_all]
+    iter_list_all = np.average(np.array(iter_list_all), axis=0)
+    iter_time = np.average(iter_list_all)
+    _std = np.std(iter_list_all)
+    STD_CHECK_THESHOLD = 0.1
+    if _std / iter_time > STD_CHECK_THESHOLD:
+        SingleLogger().info(
+            "Std.dev is large compared to Ave. ({:.3f}/{:.3f}), take the median as the iteration time".format(_std, iter_time))
+        iter_time = np.median(iter_list_all)
+        _std = np.std(iter_list_all[1:])
+    opt_step = np.argmin(np.abs(iter_list_all - iter_time))
+    SingleLogger().info("<Overall> step %d is the one closest to average %f (\u00B1 %f) ms - %s" %
+                        (opt_step, iter_time, _std, iter_list_all))
+    return iter_time, opt_step
+
+### Placeholder of events without the explicit `step` field
+STEP_NULL = np.iinfo(np.int64).min
+
+def _forward_fill(values, mask, default):
+    ''' Fill each position with the last value where `mask` is True, or `default` '''
+    last = np.where(mask, np.arange(len(values)), -1)
+    np.maximum.accumulate(last, out=last)
+    return np.where(last >= 0, values[np.maximum(last, 0)], default)
+
+class TraceIndex:
+    ''' Index from the long name of events, i.e., `pid->args.name`, and from
+        (long name, step) to the offsets of events in TraceManager.traces.
+
+        Offsets of all keys are kept in one CSR layout: the offsets of the key with
+        code `c` are `order[ptr[c]:ptr[c+1]]` in the ascending order and their steps
+        are `steps[ptr[c]:ptr[c+1]]`. Events added later are kept in `pending` and
+        merged into the CSR arrays in batches. Instant events are not indexed.
+    '''
+    def __init__(self, name2code, ptr, order, steps):
+        self.name2code = name2code
+        self.ptr = ptr
+        self.order = order
+        self.steps = steps
+        self._steps_sorted = None
+        ### code --> [offsets], [steps] of events added after the CSR arrays are built
+        self.pending = {}
+        self.pending_num = 0
+
+    def __len__(self):
+        return len(self.order) + self.pending_num
+
+    def __contains__(self, long_name):
+        return long_name in self.name2code
+
+    @staticmethod
+    def _event_key(event):
+        if event["ph"].lower() == "i":
+            return None, STEP_NULL
+        args = event.get("args")
+        if args is None or "name" not in args:
+            return None, STEP_NULL
+        step = args.get("step")
+        return (event["pid"], args["name"]), step if isinstance(step, int) else STEP_NULL
+
+    @staticmethod
+    def _from_codes(name2code, codes, offsets, steps):
+        order = np.lexsort((offsets, codes))
+        ptr = np.searchsorted(codes[order], np.arange(len(name2code) + 1)).astype(np.int64)
+        return TraceIndex(name2code, ptr, offsets[order], steps[order])
+
+    @staticmethod
+    def build(traces):
+        if isinstance(traces, EventList) and not traces.sparse_args.get("name"):
+            return TraceIndex._build_events(traces)
+        key2code = {}
+        codes = np.empty(len(traces), dtype=np.int64)
+        steps = np.empty(len(traces), dtype=np.int64)
+        for idx, event in enumerate(traces):
+            key, steps[idx] = TraceIndex._event_key(event)
+            if key is None:
+                codes[idx] = -1
+                continue
+            code = key2code.get(key)
+            if code is None:
+                code = key2code[key] = len(key2code)
+            codes[idx] = code
+        name2code = dict((gen_long_name(pid, name), code) for (pid, name), code in key2code.items())
+        offsets = np.nonzero(codes >= 0)[0]
+        return TraceIndex._from_codes(name2code, codes[offsets], offsets, steps[offsets])
+
+    @staticmethod
+    def _build_events(events):
+        ''' `build` of an EventList, read from its columns '''
+        valid = events.column("has_args") & (events.column("args_name") != CODE_NULL) & \
+            ~events.match("ph", lambda ph: ph.lower() == "i")
+        offsets = np.nonzero(valid)[0]
+        pid = events.column("pid")[offsets].astype(np.int64)
+        name = events.column("args_name")[offsets].astype(np.int64)
+        ### Code keys in the order of their first occurrence, the same as `build`
+        pair = pid * (len(events.values.values) + 1) + name
+        uniq, first_pos, inverse = np.unique(pair, return_index=True, return_inverse=True)
+        rank = np.empty(len(uniq), dtype=np.int64)
+        rank[np.argsort(first_pos)] = np.arange(len(uniq))
+        codes = rank[inverse.reshape(-1)]
+        name2code = {}
+        decode = events.values.values
+        for pos in np.sort(first_pos).tolist():
+            name2code[gen_long_name(decode[pid[pos]], decode[name[pos]])] = len(name2code)
+        ### `args.step` is INT_NULL if missing, which equals STEP_NULL
+        steps = events.column("args_step")[offsets]
+        return TraceIndex._from_codes(name2code, codes, offsets, steps)
+
+    def add(self, offset, event):
+        key, step = TraceIndex._event_key(event)
+        if key is None:
+            return
+        long_name = gen_long_name(*key)
+        code = self.name2code.get(long_name)
+        if code is None:
+            code = self.name2code[long_name] = len(self.name2code)
+        offsets, steps = self.pending.setdefault(code, ([], []))
+        offsets.append(offset)
+        steps.append(step)
+        self.pending_num += 1
+        if self.pending_num > max(1024, len(self.order) // 8):
+            self.merge()
+
+    def merge(self):
+        if self.pending_num == 0:
+            return
+        code_num = len(self.ptr) - 1
+        codes = [np.repeat(np.arange(code_num), np.diff(self.ptr))]
+        offsets, steps = [np.asarray(self.order)], [np.asarray(self.steps)]
+        for code, (_offsets, _steps) in self.pending.items():
+            codes.append(np.full(len(_offsets), code, dtype=np.int64))
+            offsets.append(np.array(_offsets, dtype=np.int64))
+            steps.append(np.array(_steps, dtype=np.int64))
+        merged = TraceIndex._from_codes(self.name2code,
+            np.concatenate(codes), np.concatenate(offsets), np.concatenate(steps))
+        self.ptr, self.order, self.steps = merged.ptr, merged.order, merged.steps
+        self._steps_sorted = None
+        self.pending = {}
+        self.pending_num = 0
+
+    def _slice(self, code):
+        if code + 1 >= len(self.ptr):
+            return 0, 0
+        return self.ptr[code], self.ptr[code + 1]
+
+    def lookup(self, long_name):
+        ''' Return the offsets of events named `long_name`, in the ascending order '''
+        code = self.name2code.get(long_name)
+        if code is None:
+            return np.empty(0, dtype=np.int64)
+        start, end = self._slice(code)
+        if code in self.pending:
+            return np.append(self.order[start:end], self.pending[code][0]).astype(np.int64)
+        return self.order[start:end]
+
+    def lookup_step(self, long_name, step):
+        ''' Return the offsets of events named `long_name` in the step `step` '''
+        code = self.name2code.get(long_name)
+        if code is None:
+            return np.empty(0, dtype=np.int64)
+        start, end = self._slice(code)
+        if self._steps_sorted is None:
+            ### Steps of each key are sorted unless explicit steps are not monotonic
+            descending = np.nonzero(np.diff(self.steps) < 0)[0] + 1
+            group = np.searchsorted(self.ptr, descending, side="right") - 1
+            self._steps_sorted = np.ones(len(self.ptr) - 1, dtype=bool)
+            self._steps_sorted[group[descending != self.ptr[group]]] = False
+        steps = self.steps[start:end]
+        if end > start and self._steps_sorted[code]:
+            lo, hi = np.searchsorted(steps, [step, step + 1])
+            rst = self.order[start + lo:start + hi]
+        else:
+            rst = self.order[start:end][steps == step]
+        if code in self.pending:
+            offsets, steps = self.pending[code]
+            rst = np.append(rst, [o for o, s in zip(offsets, steps) if s == step]).astype(np.int64)
+        return rst
+
+    def search(self, long_name, start_idx=0):
+        ''' Return the first offset >= `start_idx` of events named `long_name`, or None '''
+        offsets = self.lookup(long_name)
+        pos = np.searchsorted(offsets, start_idx)
+        return None if pos >= len(offsets) else int(offsets[pos])
+
+    def to_columns(self, values):
+        self.merge()
+        code2name = sorted(self.name2code.items(), key=lambda x: x[1])
+        return {
+            "lidx_name": np.array([values.encode(name) for name, _ in code2name], dtype=np.int32),
+            "lidx_ptr": np.asarray(self.ptr, dtype=np.int64),
+            "lidx_order": np.asarray(self.order, dtype=np.int64),
+            "lidx_step": np.asarray(self.steps, dtype=np.int64)}
+
+    @staticmethod
+    def from_columns(columns, values):
+        name2code = dict((values.decode(name), code)
+            for code, name in enumerate(columns["lidx_name"].tolist()))
+        return TraceIndex(name2code, columns["lidx_ptr"], columns["lidx_order"], columns["lidx_step"])
+
+class _StatKeyTable:
+    ''' Unique names, pids and names of events coded in the order of their first
+        occurrence, used by the vectorized `TraceManager.ret_stat`
+    '''
+    CNT_CATS = ["operator.FW", "operator.BW", "operator.UPDATE"]
+
+    def __init__(self, traceM):
+        self.traceM = traceM
+        self.pid2code, self.name2code = {}, {}
+        self.pids, self.unames, self.uname2pid, self.uname2name = [], [], [], []
+        self.name_cat, self.name_is_op, self.name_is_fw, self.name_is_bw, self.name_cnt_key = [], [], [], [], []
+        self.uname_is_barrier = []
+
+    def add(self, event):
+        ''' Add the unique name of `event`, which must be a new one, return its code '''
+        prefix, name = event["pid"], event["name"]
+        if prefix not in self.pid2code:
+            self.pid2code[prefix] = len(self.pids)
+            self.pids.append(prefix)
+        if name not in self.name2code:
+            self.name2code[name] = len(self.name_cat)
+            cat = parse_cat_fine_grained(name)
+            coarse_cat = parse_cat_from_name(name)
+            self.name_cat.append(cat)
+            self.name_is_op.append(coarse_cat == CatName.OPERATOR.value)
+            self.name_is_fw.append("FW" in name)
+            self.name_is_bw.append("BW" in name)
+            ### Used to accumulate FW/BW/UPDATE time of each step
+            self.name_cnt_key.append(self.CNT_CATS.index(cat) if cat in self.CNT_CATS and coarse_cat in [
+                CatName.OPERATOR.value, CatName.IO.value, CatName.PS_SERVER_OPERATOR.value] else -1)
+        code = len(self.unames)
+        unique_name = self.traceM.ret_unique_name(event)
+        self.unames.append(unique_name)
+        self.uname2pid.append(self.pid2code[prefix])
+        self.uname2name.append(self.name2code[name])
+        self.uname_is_barrier.append("input_barrier" in unique_name)
+        return code
+
+    def columns(self, trace_idx, ts, dur, uname, step):
+        return {
+            "trace_idx": trace_idx,
+            "ts": ts,
+            "dur": dur,
+            "pid": np.array(self.uname2pid, dtype=np.int64)[uname],
+            "uname": uname,
+            "name": np.array(self.uname2name, dtype=np.int64)[uname],
+            "step": step,
+            "pids": self.pids,
+            "unames": self.unames,
+            "uname2name": self.uname2name,
+            "uname_is_barrier": np.array(self.uname_is_barrier, dtype=bool),
+            "name_cat": self.name_cat,
+            "name_is_op": np.array(self.name_is_op, dtype=bool),
+            "name_is_fw": np.array(self.name_is_fw, dtype=bool),
+            "name_is_bw": np.array(self.name_is_bw, dtype=bool),
+            "name_cnt_key": np.array(self.name_cnt_key, dtype=np.int64)
+        }
+
 class TraceManager:
     def __init__(self, traces=None, dir_level=None, check=False):
+        ### Columnar store, events are materialized from it lazily
+        self.store = None
+        self._traces = None
+        ### Name-to-event index, see TraceIndex
+        self._index = None
+        ### The window of steps/time used to collect traces, see collect.TraceWindow
+        self.trace_window = None
         if traces is None:
             return
-        self.traces = self.check_traces(traces) if check else traces
-        self.traces = sorted(self.traces, key=lambda x: (x["ts"], x["name"]), reverse=False)
+        traces = self.check_traces(traces) if check else traces
+        if isinstance(traces, EventList):
+            ### Do not re-order the events of the caller, e.g., Replayer.rst_traces
+            self.traces = traces.sorted(("ts", "name"))
+        else:
+            ### Dicts are copied, `args.step`/`args.cnt` are only annotated to `self.traces`
+            self.traces = EventList.from_dicts(traces)
+            self.traces.sort(("ts", "name"))
         
         self.dir_level = dir_level
         self.max_step = 0
@@ -468,12 +1073,75 @@ class TraceManager:
         self.all_prefix = None
         self.ret_stat()
 
-    def dump(self, dir_):
-        trace_thread = threading.Thread(target=self._dump, args=(dir_,))
+    @property
+    def traces(self):
+        if self._traces is None and self.store is not None:
+            self._traces = EventList.from_store(self.store)
+        return self._traces
+
+    @traces.setter
+    def traces(self, traces):
+        self._traces = traces
+        self._index = None
+
+    @property
+    def index(self):
+        if self._index is None:
+            if self.store is not None and "lidx_ptr" in self.store.columns:
+                self._index = TraceIndex.from_columns(self.store.columns, self.store.values)
+            else:
+                self._index = TraceIndex.build(self.traces)
+        return self._index
+
+    def add_traces(self, events):
+        ''' Append events and index them, the statistic is not updated until `ret_stat` '''
+        traces = self.traces
+        index = self.index
+        for event in events:
+            index.add(len(traces), event)
+            traces.append(event)
+
+    def rank_slice(self, pid):
+        ''' Return a TraceManager without events, which only keeps the statistic of `pid`.
+            It is enough to build the local DAG of one rank and cheap to send to other processes
+        '''
+        traceM = TraceManager()
+        traceM.traces = []
+        traceM.dir_level = self.dir_level
+        traceM.max_step = self.max_step
+        traceM.opt_step = self.opt_step
+        traceM.iter_time = self.iter_time
+        traceM.all_prefix = self.all_prefix
+        traceM.cat2sta = self.cat2sta
+        prefix = pid + DEL
+        traceM.name2sta = dict((name, statistic) for name, statistic in self.name2sta.items()
+            if name.startswith(prefix))
+        return traceM
+
+    def shift_ts(self, bias_of):
+        ''' Shift the timestamp of each event by `bias_of(event)` in place.
+            Offsets of events do not change, so the index is still valid.
+        '''
+        for event in self.traces:
+            event["ts"] += bias_of(event)
+
+    def dump(self, dir_, export_json=False):
+        trace_thread = threading.Thread(target=self._dump, args=(dir_, export_json))
         trace_thread.start()
 
-    def _dump(self, dir_):
-        rst_traces = sorted(self.traces, key=lambda x: (x["pid"], x["tid"]))
+    def _dump(self, dir_, export_json=False):
+        TraceStore.from_trace_manager(self).dump(dir_)
+        if export_json:
+            self.export2json(dir_)
+
+    def export2json(self, dir_):
+        ''' Export traces to bps_trace_final.json and statistic results to statistic.txt,
+            which are only used for visualization and the legacy tools
+        '''
+        if isinstance(self.traces, EventList):
+            rst_traces = self.traces.sorted(("pid", "tid")).to_dicts()
+        else:
+            rst_traces = sorted(self.traces, key=lambda x: (x["pid"], x["tid"]))
         with open(os.path.join(dir_, FileName.TRACE.value), 'w') as f:
             json.dump({"traceEvents": rst_traces, "all_prefix": self.all_prefix}, f)
         str_ = "%d,%d,%d,%f\n"%(self.dir_level.value, self.max_step, self.opt_step, self.iter_time)
@@ -483,11 +1151,27 @@ class TraceManager:
             fp.write(str_)
 
     def load(self, dir_):
+        if trace_store_exists(dir_):
+            self.store = TraceStore.load(dir_)
+            self._traces = None
+            self._index = None
+            meta = self.store.meta
+            self.dir_level = DirLevel(meta["dir_level"])
+            self.max_step = meta["max_step"]
+            self.opt_step = meta["opt_step"]
+            self.iter_time = meta["iter_time"]
+            self.all_prefix = meta["all_prefix"]
+            self.name2sta = self.store.to_name2sta()
+            self.cat2sta = meta["cat2sta"]
+            self.trace_window = meta.get("trace_window")
+            return
+
+        ### Legacy format
         with open(os.path.join(dir_, FileName.TRACE.value), 'r') as fp:
             _info = json.load(fp)
-        self.traces = _info["traceEvents"]
+        self.traces = EventList.from_dicts(_info["traceEvents"])
         self.all_prefix = _info["all_prefix"]
-        self.traces = sorted(self.traces, key=lambda x: (x["ts"], x["name"]), reverse=False)
+        self.traces.sort(("ts", "name"))
         with open(os.path.join(dir_, FileName.STATISTIC.value), 'r') as fp:
             str_ = fp.read().split("\n")
 
@@ -501,7 +1185,13 @@ class TraceManager:
         self.cat2sta = eval(str_[2])
 
     def check_traces(self, traces):
-        for trace in traces:
+        if isinstance(traces, EventList):
+            ### Only events without the name/ts columns may miss them
+            suspects = np.nonzero((traces.column("name") == CODE_NULL) | np.isnan(traces.column("ts")))[0]
+            traces_to_check = [traces[row] for row in suspects.tolist()]
+        else:
+            traces_to_check = traces
+        for trace in traces_to_check:
             if trace.get("name", None) is None or trace.get("ts", None) is None:
                 print(trace)
                 raise RuntimeError("Check trace failed.")
@@ -523,159 +1213,328 @@ class TraceManager:
         return gen_long_name(event["pid"], event["name"], suffix=suffix)
 
     def ret_stat(self, cal_median=False):
+        self._ret_stat(cal_median)
+        ### Steps are (re-)assigned, re-build the name-to-event index
+        self._index = TraceIndex.build(self.traces)
+
+    def _ret_stat(self, cal_median=False):
         """ 1. Basic Statistic;
             2. add step field
             3. iteration time
+
+            Statistic is calculated over the columns of events, grouped by the
+            unique names/pids with sorting, `np.searchsorted` and `np.*.reduceat`.
         """
-        self.name2sta = {}
-        self.cat2sta = {}
-        prefix_dict = {}
-        
-        ### Step 1: tranvers all traces
-        for event in self.traces:
-            if self._is_ignore_for_sta(event):
-                continue
-            prefix = event["pid"]
-            if prefix not in prefix_dict:
-                prefix_dict[prefix] = {
-                    "cat_cnt": {"operator.FW": 0, "operator.BW": 0, "operator.UPDATE": 0},
-                    "step_cnt": 0,
-                    "time_base": None,
-
-                    "trace_name_cursor": None,
-                    "time_cursor": None,
-                    "step_start_ts": None,
-                    "fw_end": None,
-                    "bw_start": None,
-                    "bw_end": None,
-
-                    ### used for calculating iteration time, and fw time
-                    "cur_step": None,
-
-                    "fw_multi_steps": [],
-                    "bw_multi_steps": [],
-                    "update_multi_steps": [],
-                    "iter_multi_steps": [],                    
-                }
-            cat = parse_cat_fine_grained(event["name"])
-
-            ### statistic info
-            unique_name = self.ret_unique_name(event)
-            if unique_name in self.name2sta:
-                if MAX_CNT is not None and self.name2sta[unique_name]["cnt"] >= MAX_CNT:
-                    event["args"]["cnt"] = -1
+        cols = self._stat_columns()
+        if MAX_CNT is not None:
+            cols = self._cap_stat_columns(cols)
+
+        trace_idx = cols["trace_idx"]
+        event_num = len(trace_idx)
+        pid_code, uname_code = cols["pid"], cols["uname"]
+        dur_ms = cols["dur"] / 1000.0
+
+        ### Step 1: assign the `step` field
+        #   For pids with explicit steps (e.g., given by the TF profiler), forward fill the step;
+        #   server pids of BytePS use the step of the first non-server pid.
+        pid_order = np.argsort(pid_code, kind="stable")
+        pid_bounds = np.searchsorted(pid_code[pid_order], np.arange(len(cols["pids"]) + 1))
+        has_step = cols["step"] != STEP_NULL
+        steps = np.zeros(event_num, dtype=np.int64)
+        ref_pid = None
+        for pid, prefix in enumerate(cols["pids"]):
+            if "server_" not in prefix:
+                ref_pid = pid
+                break
+        for pid, prefix in enumerate(cols["pids"]):
+            pos = pid_order[pid_bounds[pid]:pid_bounds[pid+1]]
+            if "server_" in prefix:
+                if ref_pid is None:
+                    steps[pos] = -1
                     continue
-                self.name2sta[unique_name]["cnt"] += 1
-                self.name2sta[unique_name]["time"].append(event["dur"] / 1000.0)
-                self.name2sta[unique_name]["min_t"] = min(self.name2sta[unique_name]["min_t"], event["dur"] / 1000.0)
-                self.name2sta[unique_name]["max_t"] = max(self.name2sta[unique_name]["max_t"], event["dur"] / 1000.0)
+                ref_pos = pid_order[pid_bounds[ref_pid]:pid_bounds[ref_pid+1]]
+                ref_step_pos = ref_pos[has_step[ref_pos]]
+                prev = np.searchsorted(ref_step_pos, pos, side="right") - 1
+                steps[pos] = np.where(prev >= 0,
+                    cols["step"][ref_step_pos[np.maximum(prev, 0)]] if len(ref_step_pos) > 0 else 0, 0)
+                steps[pos[pos < ref_pos[0]]] = -1
+                steps[pos[has_step[pos]]] = cols["step"][pos[has_step[pos]]]
             else:
-                self.name2sta[unique_name] = {
-                    "cnt": 1, 
-                    "time": [event["dur"] / 1000.0], 
-                    "min_t": event["dur"] / 1000.0, 
-                    "max_t": event["dur"] / 1000.0,
-                    "cat": cat,
-                    "id": len(self.name2sta)
-                    }
-            event["args"]["cnt"] = self.name2sta[unique_name]["cnt"] - 1
+                steps[pos] = _forward_fill(cols["step"][pos], has_step[pos], 0)
+        self.max_step = max(self.max_step, int(steps.max())) if event_num > 0 else self.max_step
+
+        ### Per unique name group-by, names are coded in the order of their first occurrence
+        uname_order = np.argsort(uname_code, kind="stable")
+        uname_num = len(cols["unames"])
+        uname_bounds = np.searchsorted(uname_code[uname_order], np.arange(uname_num + 1))
+        cnt = np.diff(uname_bounds)
+        event_cnt = np.empty(event_num, dtype=np.int64)
+        event_cnt[uname_order] = np.arange(event_num) - np.repeat(uname_bounds[:-1], cnt)
+
+        ### Write back the `step` and `cnt` fields
+        traces = self.traces
+        if isinstance(traces, EventList):
+            traces.set_args_column("step", trace_idx, steps)
+            traces.set_args_column("cnt", trace_idx, event_cnt)
+        else:
+            for idx, step, _cnt in zip(trace_idx.tolist(), steps.tolist(), event_cnt.tolist()):
+                args = traces[idx]["args"]
+                args["step"] = step
+                args["cnt"] = _cnt
 
-            pid_info = prefix_dict[prefix]
-            if pid_info["time_base"] is None:
-                pid_info["time_base"] = event["ts"]
-            ### Add the `step` field
-            if "step" not in event["args"]:
-                ### TODO (huhanpeng): Can this adapt to MXNet
-                # if pid_info["time_cursor"] is None:
-                #     pass
-                # elif event["ts"] - pid_info["time_cursor"] - pid_info["time_base"] > ITER_GAP_LOWER_BOUND_US and \
-                #         cat in AS_START_CAT and \
-                #         pid_info["cat_cnt"]["operator.BW"] > 0 and \
-                #         pid_info["cat_cnt"]["operator.UPDATE"] > 0:
-                #     pid_info["step_cnt"] += 1
-                
-                if "server_" in prefix:
-                    ### For BytePS, Comm is not in the same pid as computation
-                    event["args"]["step"] = -1
-                    for ref_pid, ref_pid_info in prefix_dict.items():
-                        if "server_" not in ref_pid and "step_cnt" in ref_pid_info and ref_pid_info["step_cnt"] >= 0:
-                            event["args"]["step"] = ref_pid_info["step_cnt"]
-                            break
-                else:
-                    event["args"]["step"] = pid_info["step_cnt"]
+        ### Step 2: iteration time of each pid
+        prefix_dict = {}
+        for pid, prefix in enumerate(cols["pids"]):
+            pos = pid_order[pid_bounds[pid]:pid_bounds[pid+1]]
+            prefix_dict[prefix] = self._stat_pid_iterations(prefix, pos, steps, cols)
+        self._stat_iter_time(prefix_dict)
+
+        ### Step 3: basic statistic of each operator
+        # * NOTE: use python's sum to keep the same precision as the event-by-event implementation
+        time_sorted = dur_ms[uname_order]
+        time_list = time_sorted.tolist()
+        min_t = np.minimum.reduceat(time_sorted, uname_bounds[:-1]).tolist() if event_num > 0 else []
+        max_t = np.maximum.reduceat(time_sorted, uname_bounds[:-1]).tolist() if event_num > 0 else []
+        median_t = dur_ms[np.lexsort((dur_ms, uname_code))][uname_bounds[:-1] + cnt // 2].tolist()
+        avg_rep = np.empty(uname_num, dtype=np.float64)
+        time_sum = []
+        self.name2sta = {}
+        bounds = uname_bounds.tolist()
+        for code, unique_name in enumerate(cols["unames"]):
+            _time = time_list[bounds[code]:bounds[code+1]]
+            time_sum.append(sum(_time))
+            avg_rep[code] = time_sum[-1] / len(_time)
+            self.name2sta[unique_name] = {
+                "cnt": len(_time),
+                "time": _time,
+                "min_t": min_t[code],
+                "max_t": max_t[code],
+                "cat": cols["name_cat"][cols["uname2name"][code]],
+                "id": code,
+                "avg": time_sum[-1] / len(_time),
+                "median": median_t[code],
+                "var": 0.0
+            }
+        ### NOTE: `pow` may differ from `x * x` in the last bit, keep it for consistency
+        sq_dev = list(map(pow, (time_sorted - np.repeat(avg_rep, cnt)).tolist(), itertools.repeat(2)))
+
+        ### record which steps this operator occurs in, the last one wins
+        step_ids = np.full((uname_num, self.max_step + 1), -1, dtype=np.int64)
+        np.maximum.at(step_ids, (uname_code, steps), trace_idx)
+        step_ids = step_ids.tolist()
+
+        self.cat2sta = {}
+        for code, (name, statistic) in enumerate(self.name2sta.items()):
+            statistic["var"] = reduce(operator.add, sq_dev[bounds[code]:bounds[code+1]], 0.0) / float(statistic["cnt"])
+            statistic["step_ids"] = [None if _idx < 0 else _idx for _idx in step_ids[code]]
+            cat = parse_cat_fine_grained(name)
+            if cat in self.cat2sta:
+                if statistic["avg"] > self.cat2sta[cat]["max_t"]:
+                    self.cat2sta[cat]["max_t"] = statistic["avg"]
+                    self.cat2sta[cat]["max_name"] = name
             else:
-                ### For TensorFlow 2.4, step info is directly given the TF profiler
-                event["args"]["step"] = int(event["args"]["step"])
-                pid_info["step_cnt"] = event["args"]["step"]
-
-            ### Statistic time grouped by fine-grained cat
-            if parse_cat_from_name(event["name"]) in [CatName.OPERATOR.value,
-                                                        CatName.IO.value,
-                                                        CatName.PS_SERVER_OPERATOR.value]:
-                if cat not in pid_info["cat_cnt"]:
-                    pid_info["cat_cnt"][cat] = 0
-                pid_info["cat_cnt"][cat] += event["dur"] / 1000.0
-            self.max_step = max(event["args"]["step"], self.max_step)
-
-            ### Calculate the iteration time
-            ### only check the iteration time when current node is FW/BW/UPDATE op
-            # * and for byteps traces, there exists pids in the form like server_3_t2....
-            #   do not need to calculate iteration time for those pids
-            if parse_cat_from_name(event["name"]) != CatName.OPERATOR.value or \
-                    not is_standard_pid(prefix):
+                self.cat2sta[cat] = {"max_t": statistic["avg"], "max_name": name, "time": 0, "cnt": 0, "op_cnt":0}
+            self.cat2sta[cat]["time"] += time_sum[code]
+            self.cat2sta[cat]["cnt"] += statistic["cnt"]
+            self.cat2sta[cat]["op_cnt"] += 1
+
+        for cat, statistic in self.cat2sta.items():
+            statistic["avg"] = statistic["time"] / statistic["cnt"]
+
+        self.all_prefix = list(prefix_dict.keys())
+
+    def _stat_columns(self):
+        ''' Extract the columns used for statistic, events ignored for statistic are skipped.
+        '''
+        if isinstance(self.traces, EventList) and not self.traces.sparse_args.get("step"):
+            return self._stat_columns_events(self.traces)
+        table = _StatKeyTable(self)
+        key2code = {}
+        trace_idx, ts, dur, uname_l, step_l = [], [], [], [], []
+        for idx, event in enumerate(self.traces):
+            ### Inline `_is_ignore_for_sta`
+            if event["ph"].lower() == "i" or event["cat"] == "debug":
                 continue
-            if pid_info["cur_step"] is None:
-                ### initialization
-                pid_info["step_start_ts"] = event['ts'] - pid_info["time_base"]
-                pid_info["time_cursor"] = event['ts'] + event['dur'] - pid_info["time_base"]
-                pid_info["cur_step"] = event["args"]["step"]
-            elif pid_info["cur_step"] != event["args"]["step"]:
-                ### a new iteration
-                assert pid_info["step_start_ts"] is not None
-                if pid_info["cur_step"] == -1:
+            args = event["args"]
+            key = (event["pid"], event["name"], (args["loopId"], args["channelId"], args["chunkId"], args["sliceId"])
+                if "chunkId" in args else None)
+            code = key2code.get(key)
+            if code is None:
+                code = key2code[key] = table.add(event)
+            step = args.get("step")
+            step = STEP_NULL if step is None else int(step)
+            trace_idx.append(idx)
+            ts.append(event["ts"])
+            dur.append(event["dur"])
+            uname_l.append(code)
+            step_l.append(step)
+        return table.columns(np.array(trace_idx, dtype=np.int64), np.array(ts, dtype=np.float64),
+            np.array(dur, dtype=np.float64), np.array(uname_l, dtype=np.int64), np.array(step_l, dtype=np.int64))
+
+    def _stat_columns_events(self, events):
+        ''' `_stat_columns` of an EventList, read from its columns '''
+        rows, group, first_rows = self._unique_name_groups(events)
+        table = _StatKeyTable(self)
+        for row in first_rows.tolist():
+            table.add(events[row])
+        ### `args.step` is INT_NULL if missing, which equals STEP_NULL
+        step = events.column("args_step")[rows]
+        return table.columns(rows, events.column("ts")[rows], events.column("dur")[rows], group, step)
+
+    def _cap_stat_columns(self, cols):
+        ''' Only keep the first MAX_CNT events of each unique name for statistic,
+            the `cnt` field of the other events is set to -1
+        '''
+        uname_code = cols["uname"]
+        order = np.argsort(uname_code, kind="stable")
+        bounds = np.searchsorted(uname_code[order], np.arange(len(cols["unames"]) + 1))
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order)) - np.repeat(bounds[:-1], np.diff(bounds))
+        capped = rank >= MAX_CNT
+        if not np.any(capped):
+            return cols
+        capped_idx = cols["trace_idx"][capped]
+        if isinstance(self.traces, EventList):
+            self.traces.set_args_column("cnt", capped_idx, np.full(len(capped_idx), -1, dtype=np.int64))
+        else:
+            for idx in capped_idx.tolist():
+                self.traces[idx]["args"]["cnt"] = -1
+        cols = dict(cols)
+        for key in ["trace_idx", "ts", "dur", "pid", "uname", "name", "step"]:
+            cols[key] = cols[key][~capped]
+        return cols
+
+    def _unique_name_groups(self, events):
+        ''' Group the events of an EventList by their unique names, see `ret_unique_name`,
+            events ignored for statistic are skipped.
+
+            Return `rows`, the rows of the other events, `group`, the group of each row where
+            groups are coded in the order of their first occurrence, and `first_rows`,
+            the first row of each group
+        '''
+        ignore = events.match("ph", lambda ph: ph.lower() == "i") | events.match("cat", lambda cat: cat == "debug")
+        rows = np.nonzero(~ignore)[0]
+        ### Detailed NCCL events with the same name are distinguished by their chunks
+        chunk = np.full(len(rows), -1, dtype=np.int64)
+        chunk_rows = events.sparse_args.get("chunkId")
+        if chunk_rows:
+            pos = np.full(len(events), -1, dtype=np.int64)
+            pos[rows] = np.arange(len(rows))
+            key2code = {}
+            for row in chunk_rows.keys():
+                if pos[row] < 0:
                     continue
-                assert event["args"]["step"] > pid_info["cur_step"], (event, pid_info)
-                pid_info["iter_multi_steps"].append((pid_info["time_cursor"] - pid_info["step_start_ts"]) / 1000.0)
-                try:
-                    pid_info["fw_multi_steps"].append(pid_info["cat_cnt"]["operator.FW"])
-                    pid_info["bw_multi_steps"].append(pid_info["cat_cnt"]["operator.BW"])
-                    pid_info["update_multi_steps"].append(pid_info["cat_cnt"]["operator.UPDATE"])
-                    pid_info["cat_cnt"]["operator.FW"] = pid_info["cat_cnt"]["operator.BW"] = pid_info["cat_cnt"]["operator.UPDATE"] = 0
-                except:
-                    print(event, pid_info)
-                    raise
-                assert pid_info["cur_step"] == len(pid_info["iter_multi_steps"]) - 1
-                SingleLogger().debug("%s - the %d th iteration: FW: %f, BW: %f, Iteration time: %f" % (prefix, len(pid_info["iter_multi_steps"]), pid_info["fw_multi_steps"][-1], pid_info["bw_multi_steps"][-1], pid_info["iter_multi_steps"][-1]))
-                pid_info["step_start_ts"] = event['ts'] - pid_info["time_base"]
-                pid_info["bw_start"] = None
-                pid_info["time_cursor"] = event['ts'] + event['dur'] - pid_info["time_base"]
-                pid_info["cur_step"] = event["args"]["step"]
+                args = events[row]["args"]
+                key = (args["loopId"], args["channelId"], args["chunkId"], args["sliceId"])
+                chunk[pos[row]] = key2code.setdefault(key, len(key2code))
+        pid, name = events.column("pid")[rows], events.column("name")[rows]
+        order = np.lexsort((chunk, name, pid))
+        is_start = np.ones(len(rows), dtype=bool)
+        if len(rows) > 1:
+            is_start[1:] = (np.diff(pid[order]) != 0) | (np.diff(name[order]) != 0) | (np.diff(chunk[order]) != 0)
+        sorted_group = np.cumsum(is_start) - 1
+        ### lexsort is stable, so the first position of each group is its first occurrence
+        first_pos = order[is_start]
+        relabel = np.empty(len(first_pos), dtype=np.int64)
+        relabel[np.argsort(first_pos)] = np.arange(len(first_pos))
+        group = np.empty(len(rows), dtype=np.int64)
+        group[order] = relabel[sorted_group]
+        return rows, group, rows[np.sort(first_pos)]
+
+    def _stat_pid_iterations(self, prefix, pos, steps, cols):
+        ''' Calculate the iteration time of one pid, `pos` are the positions of its events
+            in `cols`, return the per-pid info used by `_stat_iter_time`
+        '''
+        pid_info = {
+            "cat_cnt": {"operator.FW": 0, "operator.BW": 0, "operator.UPDATE": 0},
+            "time_cursor": None,
+            "step_start_ts": None,
+            "fw_end": None,
+            "bw_start": None,
+            "bw_end": None,
+            "fw_multi_steps": [],
+            "bw_multi_steps": [],
+            "update_multi_steps": [],
+            "iter_multi_steps": [],
+        }
+        if not is_standard_pid(prefix) or len(pos) == 0:
+            return pid_info
+        ts = cols["ts"][pos]
+        end = ts + cols["dur"][pos]
+        name_code = cols["name"][pos]
+        time_base = ts[0]
+
+        ### Only FW/BW/UPDATE ops are used to decide iteration boundaries,
+        # ops with a negative step do not belong to any iteration
+        op_pos = np.nonzero(cols["name_is_op"][name_code] & (steps[pos] >= 0))[0]
+        if len(op_pos) == 0:
+            return pid_info
+        op_steps = steps[pos[op_pos]]
+        run_starts = np.concatenate(([0], np.nonzero(np.diff(op_steps))[0] + 1))
+        run_ends = np.append(run_starts[1:], len(op_pos))
+        run_steps = op_steps[run_starts]
+        if len(run_steps) > 1:
+            assert np.all(run_steps == np.arange(len(run_steps))), (prefix, run_steps)
+
+        ### The first op of each step does not update fw_end, bw_start and bw_end
+        not_first = np.ones(len(op_pos), dtype=bool)
+        not_first[run_starts] = False
+        fw_pos = np.nonzero(cols["name_is_fw"][name_code[op_pos]] & not_first)[0]
+        bw_pos = np.nonzero(cols["name_is_bw"][name_code[op_pos]] & not_first)[0]
+        barrier_pos = np.nonzero(cols["uname_is_barrier"][cols["uname"][pos[op_pos]]])[0]
+
+        def _end_rel(_op_idx):
+            return float(end[op_pos[_op_idx]] - time_base)
+
+        def _ts_rel(_op_idx):
+            return float(ts[op_pos[_op_idx]] - time_base)
+
+        time_cursor, step_start_ts = [], []
+        for run_start, run_end in zip(run_starts.tolist(), run_ends.tolist()):
+            time_cursor.append(_end_rel(run_end - 1))
+            ### `input_barrier` resets the start of a step to the following FW op
+            k = np.searchsorted(barrier_pos, run_end) - 1
+            if k >= 0 and barrier_pos[k] >= run_start:
+                j = np.searchsorted(fw_pos, barrier_pos[k], side="right")
+                step_start_ts.append(_ts_rel(fw_pos[j]) if j < len(fw_pos) and fw_pos[j] < run_end else None)
             else:
-                ### during an iteration
-                pid_info["time_cursor"] = event['ts'] + event['dur'] - pid_info["time_base"]
-
-                ### TODO (huhanpeng): change after fine-tune update
-                ### here we assume UPDATE is following the last BP op.
-                if "FW" in event["name"]:
-                    if pid_info["step_start_ts"] is None:
-                        pid_info["step_start_ts"] = event['ts'] - pid_info["time_base"]
-                    pid_info["fw_end"] = pid_info["time_cursor"]
-                if "BW" in event["name"]:
-                    if pid_info["bw_start"] is None:
-                        pid_info["bw_start"] = event['ts'] - pid_info["time_base"]
-                    pid_info["bw_end"] = pid_info["time_cursor"]
-            
-            if "input_barrier" in unique_name:
-                pid_info["step_start_ts"] = None
-            
-            if parse_cat_from_name(event["name"]) in [CatName.OPERATOR.value,
-                                                      CatName.IO.value,
-                                                      CatName.PS_SERVER_OPERATOR.value]:
-                pid_info["trace_name_cursor"] = event["name"]
-
-        ### Step 2: calculate the iteration time of each iteration
-        iter_list_all = []
-        step_num_upper = None
+                step_start_ts.append(_ts_rel(run_start))
+
+        ### FW/BW/UPDATE time of each step, accumulated until the first op of the next step
+        cnt_key = cols["name_cnt_key"][name_code]
+        seg_bounds = np.concatenate(([0], op_pos[run_starts[1:]] + 1, [len(pos)]))
+        cat_time = []
+        for key in range(3):
+            _time = np.concatenate(([0.], np.cumsum(np.where(cnt_key == key, cols["dur"][pos] / 1000.0, 0.))))
+            cat_time.append((_time[seg_bounds[1:]] - _time[seg_bounds[:-1]]).tolist())
+
+        for run in range(len(run_starts) - 1):
+            assert step_start_ts[run] is not None
+            pid_info["iter_multi_steps"].append((time_cursor[run] - step_start_ts[run]) / 1000.0)
+            pid_info["fw_multi_steps"].append(cat_time[0][run])
+            pid_info["bw_multi_steps"].append(cat_time[1][run])
+            pid_info["update_multi_steps"].append(cat_time[2][run])
+
+        pid_info["time_cursor"] = time_cursor[-1]
+        pid_info["step_start_ts"] = step_start_ts[-1]
+        pid_info["cat_cnt"] = {
+            "operator.FW": cat_time[0][-1],
+            "operator.BW": cat_time[1][-1],
+            "operator.UPDATE": cat_time[2][-1]}
+        if len(fw_pos) > 0:
+            pid_info["fw_end"] = _end_rel(fw_pos[-1])
+        if len(bw_pos) > 0:
+            pid_info["bw_end"] = _end_rel(bw_pos[-1])
+        last_bw_pos = bw_pos[bw_pos >= run_starts[-1]]
+        if len(last_bw_pos) > 0:
+            pid_info["bw_start"] = _ts_rel(last_bw_pos[0])
+        return pid_info
+
+    def _stat_iter_time(self, prefix_dict):
+        ''' Calculate the overall iteration time and `opt_step` based on the
+            per-pid info of each iteration'''
+        ### Step 2: close the last iteration of each pid
+        pid2steps = {}
         for prefix in sorted(prefix_dict.keys()):
             if not is_standard_pid(prefix):
                 continue
@@ -698,85 +1557,9 @@ class TraceManager:
                 pid_info["update_multi_steps"].append(pid_info["cat_cnt"]["operator.UPDATE"])
                 pid_info["cat_cnt"]["operator.FW"] = pid_info["cat_cnt"]["operator.BW"] = pid_info["cat_cnt"]["operator.UPDATE"] = 0
                 SingleLogger().debug("%s - the %d th iteration: FW:%f, BW: %f, Iteration time: %f" % (prefix, len(pid_info["iter_multi_steps"]), pid_info["fw_multi_steps"][-1], pid_info["bw_multi_steps"][-1], pid_info["iter_multi_steps"][-1]))
+            pid2steps[prefix] = pid_info
 
-            ### Statistic the iteration time
-            iter_time_multi_steps = np.array(pid_info["iter_multi_steps"])
-            iter_time_avg, iter_time_std = np.average(iter_time_multi_steps), np.std(iter_time_multi_steps)
-            SingleLogger().debug("<%s> average iter time %f (\u00B1 %f): %s" % (
-                prefix, iter_time_avg, iter_time_std, str(pid_info["iter_multi_steps"])))
-
-            fw_time = sum(pid_info["fw_multi_steps"]) / float(len(pid_info["fw_multi_steps"]))
-            bw_time = sum(pid_info["bw_multi_steps"]) / float(len(pid_info["bw_multi_steps"]))
-            update_time = sum(pid_info["update_multi_steps"]) / float(len(pid_info["update_multi_steps"]))
-            iter_list_all.append(pid_info["iter_multi_steps"])
-            SingleLogger().info("<%s> fw : %f + bw: %f + update: %f -> time/it = %f (\u00B1 %f) ms" % (prefix,
-                    fw_time, bw_time, update_time, iter_time_avg, iter_time_std))
-            
-            if step_num_upper is None or len(pid_info["iter_multi_steps"]) < step_num_upper:
-                ### Different GPUs may have different number of steps, find the smallest one as the step_num_upper
-                step_num_upper = len(pid_info["iter_multi_steps"])
-    
-        ### Step 3: calculate the average iteration time
-        # * iter_list_all, shape = (n_GPUs, n_steps) ==> (n_steps)
-        iter_list_all = [_list[:step_num_upper] for _list in iter_list_all]
-        iter_list_all = np.average(np.array(iter_list_all), axis=0)
-        self.iter_time = np.average(iter_list_all)
-        _std = np.std(iter_list_all)
-        STD_CHECK_THESHOLD = 0.1
-        if _std / self.iter_time > STD_CHECK_THESHOLD:
-            SingleLogger().info(
-                "Std.dev is large compared to Ave. ({:.3f}/{:.3f}), take the median as the iteration time".format(_std, self.iter_time))
-            self.iter_time = np.average(iter_list_all[1:])
-
-            self.iter_time = np.median(iter_list_all)
-
-            _std = np.std(iter_list_all[1:])
-            self.opt_step = np.argmin(np.abs(iter_list_all - self.iter_time))
-            SingleLogger().info("<Overall> step %d is the one closest to average %f (\u00B1 %f) ms - %s" %
-                                (self.opt_step, self.iter_time, _std, iter_list_all))
-        else:
-            self.opt_step = np.argmin(np.abs(iter_list_all - self.iter_time))
-            SingleLogger().info("<Overall> step %d is the one closest to average %f (\u00B1 %f) ms - %s" %
-                                (self.opt_step, self.iter_time, _std, iter_list_all))
-
-        ### Step 4: calculate the avg of each operator
-        for name, statistic in self.name2sta.items():
-            ### TODO (huhanpeng), var can be calculated directly with avg list
-            statistic["avg"] = sum(statistic["time"]) / statistic["cnt"]
-            statistic["median"] = sorted(statistic["time"])[int(statistic["cnt"]/2)]
-            statistic["var"] = 0.0
-
-            # assert statistic["time"] != 0
-            cat = parse_cat_fine_grained(name)
-            if cat in self.cat2sta:
-                if statistic["avg"] > self.cat2sta[cat]["max_t"]:
-                    self.cat2sta[cat]["max_t"] = statistic["avg"]
-                    self.cat2sta[cat]["max_name"] = name
-            else:
-                self.cat2sta[cat] = {"max_t": statistic["avg"], "max_name": name, "time": 0, "cnt": 0, "op_cnt":0}
-            self.cat2sta[cat]["time"] += sum(statistic["time"])
-            self.cat2sta[cat]["cnt"] += statistic["cnt"]
-            self.cat2sta[cat]["op_cnt"] += 1
-
-        for cat, statistic in self.cat2sta.items():
-            statistic["avg"] = statistic["time"] / statistic["cnt"]
-
-        ### Step 4: calculate the variance of each operator
-        for idx, event in enumerate(self.traces):
-            if self._is_ignore_for_sta(event):
-                continue
-            unique_name = self.ret_unique_name(event)
-            self.name2sta[unique_name]["var"] += pow(event["dur"] / 1000.0 - self.name2sta[unique_name]["avg"], 2)
-            
-            ### record which steps this operator occurs in
-            if "step_ids" not in self.name2sta[unique_name]:
-                self.name2sta[unique_name]["step_ids"] = [None] * (self.max_step + 1)
-            self.name2sta[unique_name]["step_ids"][event["args"]["step"]] = idx
-
-        for name, statistic in self.name2sta.items():
-            statistic["var"] = statistic["var"] / float(statistic["cnt"])
-        
-        self.all_prefix = list(prefix_dict.keys())
+        self.iter_time, self.opt_step = summarize_iter_time(pid2steps)
 
     def print_stat(self, sort=True, line_num=None):
         if sort:
@@ -880,14 +1663,17 @@ class TraceManager:
         workbook.close()
 
     def search_by_long_name(self, longname, start_idx=0):
-        for idx in range(start_idx, len(self.traces)):
-            ### ignore instance events
-            if self.traces[idx]["ph"].lower() == "i":
-                continue
-            std_name = gen_long_name(self.traces[idx]["pid"], self.traces[idx]["args"]["name"])
-            if std_name == longname:
-                return idx, self.traces[idx]
-        return None, None
+        ### Instance events are not indexed
+        idx = self.index.search(longname, start_idx)
+        if idx is None:
+            return None, None
+        return idx, self.traces[idx]
+
+    def lookup_events(self, longname, step=None):
+        ''' Return the indexes of events named `longname` (in step `step` if given) '''
+        if step is None:
+            return self.index.lookup(longname).tolist()
+        return self.index.lookup_step(longname, step).tolist()
 
     def get_iter_time(self):
         ''' print the iteration time and computation time
@@ -904,13 +1690,15 @@ class TraceManager:
         '''
         return self.iter_time, self.opt_step
 
-    def map_name2idxlist(self, name):
+    def map_name2idxlist(self, name=None):
         ''' map the trace name to the list of indexes in the traces
         Returns
         -------
-        A list of indexs, some elements may be None 
-
+        A list of indexs, some elements may be None.
+        If `name` is None, return the mapping of all names
         '''
+        if name is None:
+            return dict((_name, statistic["step_ids"]) for _name, statistic in self.name2sta.items())
         assert self.has_prefix(name) or name == "END", name
         if name not in self.name2sta:
             return None
@@ -983,7 +1771,7 @@ class PathManager:
         def recur_look_up(_d):
             root, dirs, files = list(os.walk(_d))[0]
             
-            if FileName.COMP.value in files:
+            if FileName.COMP.value in files or FileName.COMP_ZST.value in files:
                 return 0
             else:
                 target_dir = None
@@ -1003,7 +1791,16 @@ class PathManager:
     def search_comm(self):
         return self.search(FileName.COMM.value)
 
-    def search(self, target):
+    def search_comp(self):
+        ''' Search the computation traces, gzip or zstd compressed '''
+        comp_path = self.search(FileName.COMP, warn=False)
+        if comp_path is None:
+            comp_path = self.search(FileName.COMP_ZST, warn=False)
+        if comp_path is None:
+            SingleLogger().warn("Fail to find %s in path %s" % (FileName.COMP.value, self.path))
+        return comp_path
+
+    def search(self, target, warn=True):
         ''' Search the target file, if not exit, return None '''
         if isinstance(target, Enum):
             target = target.value
@@ -1024,7 +1821,8 @@ class PathManager:
                         gpu_root, gpu_dirs, gpu_files = list(os.walk(os.path.join(worker_root, worker_dir)))[0]
                         if target in gpu_files:
                             return os.path.join(gpu_root, target)
-        SingleLogger().warn("Fail to find %s in path %s" % (str(target), self.path))
+        if warn:
+            SingleLogger().warn("Fail to find %s in path %s" % (str(target), self.path))
         return
 
     def ret_prefix(self):
@@ -0,0 +1,271 @@
+''' Streaming writers of trace events, used by the Replayer
+
+Events are written to disk in chunks of `flush_size` events while they are
+generated, instead of keeping all of them in memory until the end. Three
+backends are supported
+    * json: a chrome-tracing file {"traceEvents": [...], "displayTimeUnit": "ms"}
+    * json.gz: the same file, gzip-compressed
+    * columnar: a directory of event columns in the layout of TraceStore
+        <dir>/
+            meta.json       # version, number of events, columns
+            dict.json       # value dictionary of coded columns, code -> value
+            <column>.npy    # columns of EVENT_COLUMN_DTYPES, see trace_store.py
+      columns are appended chunk by chunk and get their `.npy` headers when the
+      writer is closed, use `load_columnar_traces` to read it back as an EventList.
+
+Writers also accumulate the iteration time of each pid on the fly, see
+IterTimeStat, so that the output is never re-sorted for statistic.
+'''
+import os
+import gzip
+import shutil
+import ujson as json
+import numpy as np
+
+from .trace_utils import parse_cat_from_name, parse_cat_fine_grained, \
+    is_standard_pid, summarize_iter_time, CatName
+from .event_list import EventList
+from .trace_store import ValueDict, TraceStore, TRACE_STORE_VERSION, EVENT_COLUMN_DTYPES
+
+DEFAULT_FLUSH_SIZE = 8192
+TRACE_FORMATS = ["json", "json.gz", "columnar"]
+
+### Fine-grained cats whose time is reported, see `TraceManager._stat_iter_time`
+_STAT_CATS = ("operator.FW", "operator.BW", "operator.UPDATE")
+_TIMED_CATS = (CatName.OPERATOR.value, CatName.IO.value, CatName.PS_SERVER_OPERATOR.value)
+
+
+class IterTimeStat:
+    ''' Accumulate the iteration time of each (pid, step) from a stream of events
+
+    Events can come in any order. As TraceManager does, an iteration of a pid
+    starts at the first operator event and ends at the end of the last started
+    one, and the time of FW/BW/UPDATE ops is summed by fine-grained cats.
+    The step of an event is `args.step` if given, otherwise `args.cnt`, i.e.,
+    the step index of replayed events.
+    '''
+    def __init__(self):
+        ### (pid, step) -> [first start, last start, end of the last started op, FW, BW, UPDATE]
+        self.steps = {}
+        ### name -> (cat, fine-grained cat)
+        self._cat_cache = {}
+        self.event_num = 0
+
+    def cats_of(self, name):
+        cats = self._cat_cache.get(name)
+        if cats is None:
+            cats = self._cat_cache[name] = (parse_cat_from_name(name), parse_cat_fine_grained(name))
+        return cats
+
+    def add(self, event):
+        if event.get("ph", "X").lower() == "i" or event.get("cat") == "debug":
+            return
+        self.event_num += 1
+        pid = event["pid"]
+        cat, fine_cat = self.cats_of(event["name"])
+        if cat not in _TIMED_CATS or not is_standard_pid(pid):
+            return
+        args = event.get("args", {})
+        step = args.get("step", args.get("cnt", 0))
+        ts, dur = event["ts"], event["dur"]
+        info = self.steps.get((pid, step))
+        if info is None:
+            info = self.steps[(pid, step)] = [None, None, None, 0., 0., 0.]
+        if fine_cat in _STAT_CATS:
+            info[3 + _STAT_CATS.index(fine_cat)] += dur / 1000.0
+        if cat != CatName.OPERATOR.value:
+            return
+        if info[0] is None or ts < info[0]:
+            info[0] = ts
+        if info[1] is None or ts >= info[1]:
+            info[1] = ts
+            info[2] = ts + dur
+
+    def summary(self):
+        ''' Log the per-pid statistic and return (iteration time, opt_step),
+            or (None, None) if no operator events are written '''
+        pid2steps = {}
+        for (pid, _), (start, _, end, fw, bw, update) in sorted(self.steps.items()):
+            if start is None:
+                continue
+            pid_info = pid2steps.setdefault(pid, {"iter_multi_steps": [],
+                "fw_multi_steps": [], "bw_multi_steps": [], "update_multi_steps": []})
+            pid_info["iter_multi_steps"].append((end - start) / 1000.0)
+            pid_info["fw_multi_steps"].append(fw)
+            pid_info["bw_multi_steps"].append(bw)
+            pid_info["update_multi_steps"].append(update)
+        if len(pid2steps) == 0:
+            return None, None
+        return summarize_iter_time(pid2steps)
+
+
+class TraceWriter:
+    ''' Base class of trace writers, subclasses implement `_flush` and `_close`
+
+    Events are buffered and flushed every `flush_size` events.
+    '''
+    def __init__(self, path, flush_size=DEFAULT_FLUSH_SIZE):
+        self.path = path
+        self.flush_size = flush_size
+        self.stat = IterTimeStat()
+        self.event_num = 0
+        self.closed = False
+        self._buffer = []
+
+    def write(self, event):
+        self.stat.add(event)
+        self._buffer.append(event)
+        self.event_num += 1
+        if len(self._buffer) >= self.flush_size:
+            self.flush()
+
+    def write_events(self, events):
+        ''' Write a list of dict events or an EventList '''
+        if isinstance(events, EventList):
+            for start in range(0, len(events), self.flush_size):
+                for event in events.take(np.arange(start, min(start + self.flush_size, len(events)))).to_dicts():
+                    self.write(event)
+        else:
+            for event in events:
+                self.write(event)
+
+    def flush(self):
+        if len(self._buffer) > 0:
+            self._flush(self._buffer)
+            self._buffer = []
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        self._close()
+        self.closed = True
+
+    def _flush(self, events):
+        raise NotImplementedError()
+
+    def _close(self):
+        raise NotImplementedError()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class JSONTraceWriter(TraceWriter):
+    ''' Write events in the chrome-tracing format '''
+    def __init__(self, path, flush_size=DEFAULT_FLUSH_SIZE):
+        super().__init__(path, flush_size=flush_size)
+        self.fp = self._open(path)
+        self.fp.write('{"traceEvents":[')
+        self._first = True
+
+    def _open(self, path):
+        return open(path, 'w')
+
+    def _flush(self, events):
+        chunk = ",".join([json.dumps(event) for event in events])
+        if not self._first:
+            chunk = "," + chunk
+        self.fp.write(chunk)
+        self._first = False
+
+    def _close(self):
+        self.fp.write('],"displayTimeUnit":"ms"}')
+        self.fp.close()
+
+
+class GzipJSONTraceWriter(JSONTraceWriter):
+    ''' Write events in the chrome-tracing format, compressed with gzip '''
+    def _open(self, path):
+        return gzip.open(path, 'wt')
+
+
+class ColumnarTraceWriter(TraceWriter):
+    ''' Write events as TraceStore columns, see the module docstring
+
+    Columns are written to `<path>.tmp` and renamed to `path` when the writer
+    is closed, i.e., an existing store is never left half-written.
+    '''
+    def __init__(self, path, flush_size=DEFAULT_FLUSH_SIZE):
+        super().__init__(path, flush_size=flush_size)
+        self.tmp_dir = path + ".tmp"
+        if os.path.exists(self.tmp_dir):
+            shutil.rmtree(self.tmp_dir)
+        os.makedirs(self.tmp_dir)
+        self.values = ValueDict()
+        ### Raw column data without `.npy` headers, the number of rows is unknown until closed
+        self.fps = dict((key, open(os.path.join(self.tmp_dir, key + ".bin"), 'wb'))
+            for key in EVENT_COLUMN_DTYPES)
+        self.row_num = 0
+
+    def _flush(self, events):
+        chunk = EventList(values=self.values, capacity=len(events))
+        for event in events:
+            chunk.append(event)
+        columns = TraceStore.event_columns(chunk, self.values)
+        for key, fp in self.fps.items():
+            fp.write(np.ascontiguousarray(columns[key], dtype=EVENT_COLUMN_DTYPES[key]).tobytes())
+        self.row_num += len(chunk)
+
+    def _close(self):
+        for key, fp in self.fps.items():
+            fp.close()
+            bin_path = os.path.join(self.tmp_dir, key + ".bin")
+            with open(os.path.join(self.tmp_dir, key + ".npy"), 'wb') as fp, open(bin_path, 'rb') as src:
+                np.lib.format.write_array_header_1_0(fp, {
+                    "descr": np.lib.format.dtype_to_descr(np.dtype(EVENT_COLUMN_DTYPES[key])),
+                    "fortran_order": False,
+                    "shape": (self.row_num,)})
+                shutil.copyfileobj(src, fp)
+            os.remove(bin_path)
+        with open(os.path.join(self.tmp_dir, "dict.json"), 'w') as fp:
+            json.dump(self.values.values, fp)
+        ### meta.json is written at last, the store is invalid without it
+        with open(os.path.join(self.tmp_dir, "meta.json"), 'w') as fp:
+            json.dump({
+                "version": TRACE_STORE_VERSION,
+                "event_num": self.row_num,
+                "columns": list(EVENT_COLUMN_DTYPES.keys())
+            }, fp)
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.rename(self.tmp_dir, self.path)
+
+
+def load_columnar_traces(path, mmap=False):
+    ''' Load events written by ColumnarTraceWriter, or the events of a TraceStore
+        directory, e.g., `<trial>/.trace_store`, as an EventList '''
+    return EventList.from_store(TraceStore.load_dir(path, mmap=mmap))
+
+
+def trace_format_of(path):
+    ''' Infer the trace format from the file name '''
+    if path.endswith(".gz"):
+        return "json.gz"
+    elif path.endswith(".json"):
+        return "json"
+    else:
+        return "columnar"
+
+
+def trace_filename(prefix, trace_format):
+    ''' The default file name of traces in the format `trace_format` '''
+    if trace_format == "columnar":
+        return prefix + "_traces"
+    return prefix + "." + trace_format
+
+
+def open_trace_writer(path, trace_format=None, flush_size=DEFAULT_FLUSH_SIZE):
+    if trace_format is None:
+        trace_format = trace_format_of(path)
+    if trace_format == "json":
+        return JSONTraceWriter(path, flush_size=flush_size)
+    elif trace_format == "json.gz":
+        return GzipJSONTraceWriter(path, flush_size=flush_size)
+    elif trace_format == "columnar":
+        return ColumnarTraceWriter(path, flush_size=flush_size)
+    else:
+        raise ValueError("Invalid trace format {}, only {} are supported".format(trace_format, TRACE_FORMATS))